@@ -0,0 +1,42 @@
+"""add image blobs table
+
+Revision ID: 3b8e51f07c2d
+Revises: 7a91c3e5d8b4
+Create Date: 2026-10-17 17:05:41.902318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b8e51f07c2d'
+down_revision: Union[str, Sequence[str], None] = '7a91c3e5d8b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('image_blobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('storage_key', sa.String(), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('content_type', sa.String(), nullable=True),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('storage_key')
+    )
+    op.create_index(op.f('ix_image_blobs_id'), 'image_blobs', ['id'], unique=False)
+    op.create_index(op.f('ix_image_blobs_sha256'), 'image_blobs', ['sha256'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_image_blobs_sha256'), table_name='image_blobs')
+    op.drop_index(op.f('ix_image_blobs_id'), table_name='image_blobs')
+    op.drop_table('image_blobs')
@@ -0,0 +1,30 @@
+"""add image variants
+
+Revision ID: 5c2f9a7e4b18
+Revises: 3b8e51f07c2d
+Create Date: 2026-10-17 18:12:09.531746
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c2f9a7e4b18'
+down_revision: Union[str, Sequence[str], None] = '3b8e51f07c2d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('agent_images', sa.Column('variants', sa.JSON(), nullable=True))
+    op.add_column('messages', sa.Column('variants', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('messages', 'variants')
+    op.drop_column('agent_images', 'variants')
@@ -0,0 +1,28 @@
+"""add log to image jobs
+
+Revision ID: 7a91c3e5d8b4
+Revises: 0d4e7f9b2a63
+Create Date: 2026-10-17 16:32:05.418273
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7a91c3e5d8b4'
+down_revision: Union[str, Sequence[str], None] = '0d4e7f9b2a63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('image_jobs', sa.Column('log', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('image_jobs', 'log')
@@ -0,0 +1,32 @@
+"""add rolling summary columns to chats
+
+Revision ID: a7d2e5c8b913
+Revises: 3f9c1d2e7a41
+Create Date: 2026-10-17 11:03:48.215907
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7d2e5c8b913'
+down_revision: Union[str, Sequence[str], None] = '3f9c1d2e7a41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('chats', sa.Column('summary', sa.Text(), nullable=True))
+    op.add_column('chats', sa.Column('summary_message_id', sa.Integer(), nullable=True))
+    op.add_column('chats', sa.Column('summary_updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('chats', 'summary_updated_at')
+    op.drop_column('chats', 'summary_message_id')
+    op.drop_column('chats', 'summary')
@@ -0,0 +1,28 @@
+"""add revision to agents
+
+Revision ID: c41b8e09d6f2
+Revises: a7d2e5c8b913
+Create Date: 2026-10-17 11:41:09.573320
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41b8e09d6f2'
+down_revision: Union[str, Sequence[str], None] = 'a7d2e5c8b913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('agents', sa.Column('revision', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('agents', 'revision')
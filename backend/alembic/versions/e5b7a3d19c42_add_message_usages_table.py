@@ -0,0 +1,59 @@
+"""add message usages table
+
+Revision ID: e5b7a3d19c42
+Revises: c41b8e09d6f2
+Create Date: 2026-10-17 13:02:44.118205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b7a3d19c42'
+down_revision: Union[str, Sequence[str], None] = 'c41b8e09d6f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('message_usages',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('message_id', sa.Integer(), nullable=False),
+    sa.Column('chat_id', sa.Integer(), nullable=False),
+    sa.Column('agent_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('provider', sa.String(), nullable=True),
+    sa.Column('model', sa.String(), nullable=True),
+    sa.Column('prompt_tokens', sa.Integer(), nullable=False),
+    sa.Column('completion_tokens', sa.Integer(), nullable=False),
+    sa.Column('total_tokens', sa.Integer(), nullable=False),
+    sa.Column('usage_estimated', sa.Boolean(), nullable=False),
+    sa.Column('context_ms', sa.Integer(), nullable=True),
+    sa.Column('prompt_ms', sa.Integer(), nullable=True),
+    sa.Column('llm_ms', sa.Integer(), nullable=True),
+    sa.Column('first_token_ms', sa.Integer(), nullable=True),
+    sa.Column('image_ms', sa.Integer(), nullable=True),
+    sa.Column('total_ms', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['agent_id'], ['agents.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['chat_id'], ['chats.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('message_id')
+    )
+    op.create_index(op.f('ix_message_usages_id'), 'message_usages', ['id'], unique=False)
+    op.create_index('ix_message_usages_agent_id_created_at', 'message_usages', ['agent_id', 'created_at'], unique=False)
+    op.create_index('ix_message_usages_user_id_created_at', 'message_usages', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_message_usages_user_id_created_at', table_name='message_usages')
+    op.drop_index('ix_message_usages_agent_id_created_at', table_name='message_usages')
+    op.drop_index(op.f('ix_message_usages_id'), table_name='message_usages')
+    op.drop_table('message_usages')
@@ -0,0 +1,28 @@
+"""add image status to messages
+
+Revision ID: f2c6d8a41e05
+Revises: e5b7a3d19c42
+Create Date: 2026-10-17 14:26:51.402937
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2c6d8a41e05'
+down_revision: Union[str, Sequence[str], None] = 'e5b7a3d19c42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('messages', sa.Column('image_status', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('messages', 'image_status')
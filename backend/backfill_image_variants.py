@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""縮小版（WebP）とぼかしプレースホルダーがない既存の画像に作成するスクリプト
+
+新しく保存した画像はアプリケーションのワーカーが処理するため、
+導入前の画像や、依頼があふれて処理されなかった画像に使う。
+"""
+
+import argparse
+import asyncio
+import logging
+
+import crud
+from services.image_storage import ImageStore
+from services.image_variants import ImageVariantWorker
+
+
+def reset_unfinished(db, include_failed: bool = False) -> int:
+    """処理中のまま止まった（と失敗した）記録を未作成に戻し、件数を返す"""
+    count = 0
+    for kind, model in crud.IMAGE_VARIANT_MODELS.items():
+        for row in db.query(model).filter(model.variants.isnot(None)).all():
+            variants = row.variants or {}
+            if variants.get("status") == "processing" or (include_failed and "error" in variants):
+                crud.set_image_variants(db, kind, row.id, None)
+                count += 1
+    return count
+
+
+async def run(batch_size: int, limit, reset: bool, retry_failed: bool) -> None:
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        if reset or retry_failed:
+            print(f"reset={reset_unfinished(db, include_failed=retry_failed)}")
+        worker = ImageVariantWorker(ImageStore.from_env())
+        done = await worker.backfill(db, batch_size=batch_size, limit=limit)
+        print(f"processed={done} failed={worker.failed}")
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create WebP variants for existing agent and chat images")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=None, help="処理する画像の上限")
+    parser.add_argument("--reset-processing", action="store_true", help="処理中のまま止まった画像をやり直す")
+    parser.add_argument("--retry-failed", action="store_true", help="失敗した画像もやり直す")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(args.batch_size, args.limit, args.reset_processing, args.retry_failed))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
+from sqlalchemy import Integer, and_, cast, func, null, or_
 from sqlalchemy.orm import Session, joinedload
-from typing import List, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from datetime import date, datetime, timedelta
 import models, schemas
 from auth import get_password_hash
 
@@ -109,6 +111,8 @@ def update_agent(db: Session, agent_id: int, agent: schemas.AgentUpdate, user_id
             tones = db.query(models.Tone).filter(models.Tone.id.in_(tone_ids)).all() if tone_ids else []
             db_agent.tones = tones
         
+        # 描画済みのペルソナ部分のキャッシュを無効化する
+        db_agent.revision = (db_agent.revision or 0) + 1
         db.commit()
         db.refresh(db_agent)
     return db_agent
@@ -176,6 +180,12 @@ def create_agent_image(db: Session, agent_id: int, image_url: str, is_primary: b
     db.refresh(db_image)
     return db_image
 
+def is_agent_image_url_in_use(db: Session, agent_id: int, image_url: str) -> bool:
+    """エージェントの画像（ギャラリーを含む）がそのURLを参照しているかを返します。"""
+    return db.query(models.AgentImage.id).filter(
+        models.AgentImage.agent_id == agent_id, models.AgentImage.image_url == image_url
+    ).first() is not None
+
 def get_agent_images(db: Session, agent_id: int):
     return db.query(models.AgentImage).filter(
         models.AgentImage.agent_id == agent_id
@@ -257,6 +267,26 @@ def get_chat(db: Session, chat_id: int, user_id: int) -> Optional[models.Chat]:
 def get_chats_by_agent_id(db: Session, agent_id: int, user_id: int, skip: int = 0, limit: int = 100) -> List[models.Chat]:
     return db.query(models.Chat).filter(models.Chat.agent_id == agent_id, models.Chat.user_id == user_id).offset(skip).limit(limit).all()
 
+def get_chat_summary(db: Session, chat_id: int) -> Tuple[Optional[str], Optional[int]]:
+    """チャットの要約と、要約に含めた最後のメッセージIDを取得します。"""
+    row = (
+        db.query(models.Chat.summary, models.Chat.summary_message_id)
+        .filter(models.Chat.id == chat_id)
+        .first()
+    )
+    return (row[0], row[1]) if row else (None, None)
+
+def update_chat_summary(db: Session, chat_id: int, summary: str, summary_message_id: int) -> Optional[models.Chat]:
+    """チャットの要約と、要約に含めた最後のメッセージIDを更新します。"""
+    db_chat = db.query(models.Chat).filter(models.Chat.id == chat_id).first()
+    if db_chat:
+        db_chat.summary = summary
+        db_chat.summary_message_id = summary_message_id
+        db_chat.summary_updated_at = datetime.utcnow()
+        db.commit()
+        db.refresh(db_chat)
+    return db_chat
+
 def delete_chat(db: Session, chat_id: int, user_id: int) -> bool:
     db_chat = get_chat(db, chat_id, user_id)
     if db_chat:
@@ -265,18 +295,53 @@ def delete_chat(db: Session, chat_id: int, user_id: int) -> bool:
         return True
     return False
 
-def create_message(db: Session, message: schemas.MessageCreate, chat_id: int, sender: str, image_url: Optional[str] = None):
-    db_message = models.Message(content=message.content, chat_id=chat_id, sender=sender, image_url=image_url)
+def create_message(db: Session, message: schemas.MessageCreate, chat_id: int, sender: str, image_url: Optional[str] = None, image_status: Optional[str] = None):
+    db_message = models.Message(content=message.content, chat_id=chat_id, sender=sender, image_url=image_url, image_status=image_status)
     db.add(db_message)
     db.commit()
     db.refresh(db_message)
     return db_message
 
 def get_messages(db: Session, chat_id: int, skip: int = 0, limit: int = 100) -> List[models.Message]:
-    return db.query(models.Message).filter(models.Message.chat_id == chat_id).offset(skip).limit(limit).all()
+    return db.query(models.Message).filter(models.Message.chat_id == chat_id).order_by(models.Message.id).offset(skip).limit(limit).all()
+
+def get_recent_messages(db: Session, chat_id: int, limit: int = 20, before_id: Optional[int] = None) -> List[models.Message]:
+    """新しい順にメッセージを取得します（before_idより前のページを辿れます）。"""
+    query = db.query(models.Message).filter(models.Message.chat_id == chat_id)
+    if before_id is not None:
+        query = query.filter(models.Message.id < before_id)
+    return query.order_by(models.Message.id.desc()).limit(limit).all()
+
+def get_messages_after(db: Session, chat_id: int, after_id: Optional[int] = None, limit: int = 100) -> List[models.Message]:
+    """after_idより後のメッセージを古い順に取得します。"""
+    query = db.query(models.Message).filter(models.Message.chat_id == chat_id)
+    if after_id is not None:
+        query = query.filter(models.Message.id > after_id)
+    return query.order_by(models.Message.id).limit(limit).all()
+
+def count_messages_after(db: Session, chat_id: int, after_id: Optional[int] = None) -> int:
+    query = db.query(models.Message).filter(models.Message.chat_id == chat_id)
+    if after_id is not None:
+        query = query.filter(models.Message.id > after_id)
+    return query.count()
+
 def get_message(db: Session, message_id: int) -> Optional[models.Message]:
     return db.query(models.Message).filter(models.Message.id == message_id).first()
 
+def get_chat_message(db: Session, chat_id: int, message_id: int) -> Optional[models.Message]:
+    return db.query(models.Message).filter(models.Message.id == message_id, models.Message.chat_id == chat_id).first()
+
+def update_message_image(db: Session, message_id: int, image_url: Optional[str], image_status: str) -> Optional[models.Message]:
+    """応答の送信後に生成した画像のURLと状態をメッセージに反映します。"""
+    db_message = get_message(db, message_id)
+    if db_message:
+        if image_url:
+            db_message.image_url = image_url
+        db_message.image_status = image_status
+        db.commit()
+        db.refresh(db_message)
+    return db_message
+
 # Tag-related CRUD operations
 def get_personalities(db: Session) -> List[models.Personality]:
     return db.query(models.Personality).all()
@@ -293,4 +358,461 @@ def create_image_generation_log(db: Session, log: schemas.ImageGenerationLogCrea
     db.add(db_log)
     db.commit()
     db.refresh(db_log)
-    return db_log
\ No newline at end of file
+    return db_log
+
+
+def create_message_usage(
+    db: Session,
+    message: models.Message,
+    agent_id: int,
+    user_id: int,
+    metadata: Dict[str, Any],
+) -> models.MessageUsage:
+    """AIメッセージのトークン使用量と処理段階ごとの所要時間を保存します。"""
+    usage = metadata.get("usage") or {}
+    timings = metadata.get("timings") or {}
+    db_usage = models.MessageUsage(
+        message_id=message.id,
+        chat_id=message.chat_id,
+        agent_id=agent_id,
+        user_id=user_id,
+        provider=metadata.get("provider"),
+        model=metadata.get("model"),
+        prompt_tokens=usage.get("prompt_tokens") or 0,
+        completion_tokens=usage.get("completion_tokens") or 0,
+        total_tokens=usage.get("total_tokens") or 0,
+        usage_estimated=bool(usage.get("estimated")),
+        context_ms=timings.get("context"),
+        prompt_ms=timings.get("prompt"),
+        llm_ms=timings.get("llm"),
+        first_token_ms=timings.get("first_token"),
+        image_ms=timings.get("image"),
+        total_ms=timings.get("total"),
+    )
+    db.add(db_usage)
+    db.commit()
+    db.refresh(db_usage)
+    return db_usage
+
+
+def get_usage_summary(
+    db: Session,
+    user_id: Optional[int] = None,
+    group_by: str = "day",
+    agent_id: Optional[int] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+) -> List[Dict[str, Any]]:
+    """
+    トークン使用量と所要時間をエージェント・ユーザー・日付ごとに集計します。
+
+    Args:
+        user_id: 対象ユーザー（Noneの場合は全ユーザー）
+        group_by: "agent" / "user" / "day" のいずれか
+        start, end: 集計対象の期間（両端を含む日付）
+    """
+    group_columns = {
+        "agent": models.MessageUsage.agent_id,
+        "user": models.MessageUsage.user_id,
+        "day": func.date(models.MessageUsage.created_at),
+    }
+    if group_by not in group_columns:
+        raise ValueError(f"Unknown group_by: {group_by}")
+    key = group_columns[group_by].label("key")
+
+    query = db.query(
+        key,
+        func.count(models.MessageUsage.id).label("messages"),
+        func.sum(models.MessageUsage.prompt_tokens).label("prompt_tokens"),
+        func.sum(models.MessageUsage.completion_tokens).label("completion_tokens"),
+        func.sum(models.MessageUsage.total_tokens).label("total_tokens"),
+        func.sum(cast(models.MessageUsage.usage_estimated, Integer)).label("estimated_messages"),
+        func.avg(models.MessageUsage.llm_ms).label("avg_llm_ms"),
+        func.avg(models.MessageUsage.first_token_ms).label("avg_first_token_ms"),
+        func.avg(models.MessageUsage.total_ms).label("avg_total_ms"),
+    )
+    if user_id is not None:
+        query = query.filter(models.MessageUsage.user_id == user_id)
+    if agent_id is not None:
+        query = query.filter(models.MessageUsage.agent_id == agent_id)
+    if start is not None:
+        query = query.filter(models.MessageUsage.created_at >= datetime.combine(start, datetime.min.time()))
+    if end is not None:
+        query = query.filter(models.MessageUsage.created_at < datetime.combine(end, datetime.max.time()))
+
+    return [
+        {
+            "key": str(row.key),
+            "messages": row.messages,
+            "prompt_tokens": row.prompt_tokens or 0,
+            "completion_tokens": row.completion_tokens or 0,
+            "total_tokens": row.total_tokens or 0,
+            "estimated_messages": row.estimated_messages or 0,
+            "avg_llm_ms": round(row.avg_llm_ms) if row.avg_llm_ms is not None else None,
+            "avg_first_token_ms": round(row.avg_first_token_ms) if row.avg_first_token_ms is not None else None,
+            "avg_total_ms": round(row.avg_total_ms) if row.avg_total_ms is not None else None,
+        }
+        for row in query.group_by(key).order_by(key).all()
+    ]
+
+
+def get_image_blob(db: Session, sha256: str) -> Optional[models.ImageBlob]:
+    return db.query(models.ImageBlob).filter(models.ImageBlob.sha256 == sha256).first()
+
+def get_image_blob_by_key(db: Session, storage_key: str) -> Optional[models.ImageBlob]:
+    return db.query(models.ImageBlob).filter(models.ImageBlob.storage_key == storage_key).first()
+
+def create_image_blob(
+    db: Session, sha256: str, storage_key: str, size: int, content_type: Optional[str] = None
+) -> models.ImageBlob:
+    """保存した画像ファイルを参照数1で登録します。"""
+    db_blob = models.ImageBlob(
+        sha256=sha256, storage_key=storage_key, size=size, content_type=content_type, ref_count=1
+    )
+    db.add(db_blob)
+    db.commit()
+    db.refresh(db_blob)
+    return db_blob
+
+def add_image_blob_ref(db: Session, sha256: str) -> bool:
+    """登録済みの画像ファイルの参照数を1増やします（未登録の場合はFalse）。"""
+    updated = db.query(models.ImageBlob).filter(models.ImageBlob.sha256 == sha256).update(
+        {models.ImageBlob.ref_count: models.ImageBlob.ref_count + 1}, synchronize_session=False
+    )
+    db.commit()
+    return updated > 0
+
+def release_image_blob_ref(db: Session, storage_key: str) -> Optional[bool]:
+    """
+    画像ファイルの参照数を1減らします。
+
+    参照数が0になっても登録とファイルは残し、削除はGC（ImageGarbageCollector）に任せます。
+    ここで削除すると、削除の直後に同じ内容が保存された場合に新しい登録のファイルを消してしまうためです。
+
+    Returns:
+        参照がなくなった場合はTrue、まだ参照が残る場合はFalse、未登録の場合はNone
+    """
+    updated = db.query(models.ImageBlob).filter(
+        models.ImageBlob.storage_key == storage_key, models.ImageBlob.ref_count > 0
+    ).update({models.ImageBlob.ref_count: models.ImageBlob.ref_count - 1}, synchronize_session=False)
+    db.commit()
+    blob = get_image_blob_by_key(db, storage_key)
+    if blob is None:
+        return None
+    return updated > 0 and blob.ref_count <= 0
+
+def get_image_blobs_after(db: Session, after_id: int, limit: int = 500) -> List[models.ImageBlob]:
+    """IDが after_id より大きい登録済みの画像ファイルをID順に取得します。"""
+    return db.query(models.ImageBlob).filter(models.ImageBlob.id > after_id).order_by(models.ImageBlob.id).limit(limit).all()
+
+def get_registered_image_blob_keys(db: Session, storage_keys: List[str]) -> set:
+    """指定したキーのうち image_blobs に登録されているものを取得します。"""
+    if not storage_keys:
+        return set()
+    rows = db.query(models.ImageBlob.storage_key).filter(models.ImageBlob.storage_key.in_(storage_keys)).all()
+    return {row.storage_key for row in rows}
+
+def delete_image_blob_if_unchanged(
+    db: Session, storage_key: str, ref_count: int, delete_file: Optional[Callable[[str], None]] = None
+) -> bool:
+    """
+    参照数が読み取り時から変わっていない場合だけ画像ファイルの登録を削除します。
+
+    delete_file はその行をロック（SELECT ... FOR UPDATE）したまま呼ぶため、同じ内容の保存
+    （add_image_blob_ref の UPDATE）は削除の完了を待ってから、新しいファイルとして登録し直します。
+    """
+    db_blob = db.query(models.ImageBlob).filter(
+        models.ImageBlob.storage_key == storage_key, models.ImageBlob.ref_count == ref_count
+    ).with_for_update().first()
+    if db_blob is None:
+        db.commit()
+        return False
+    try:
+        if delete_file is not None:
+            delete_file(storage_key)
+    except Exception:
+        db.rollback()
+        raise
+    db.delete(db_blob)
+    db.commit()
+    return True
+
+def iter_referenced_image_urls(db: Session, batch_size: int = 1000) -> Iterator[str]:
+    """エージェント・ギャラリー・メッセージ（縮小版を含む）・生成ログ・ジョブが参照する画像URLを順に返します。"""
+    columns = [
+        (models.Agent, models.Agent.image_url),
+        (models.AgentImage, models.AgentImage.image_url),
+        (models.Message, models.Message.image_url),
+        (models.ImageGenerationLog, models.ImageGenerationLog.image_url),
+        (models.ImageJob, models.ImageJob.result_url),
+    ]
+    for model, column in columns:
+        for (url,) in db.query(column).filter(column.isnot(None)).yield_per(batch_size):
+            yield url
+    for model in (models.AgentImage, models.Message):
+        for (variants,) in db.query(model.variants).filter(model.variants.isnot(None)).yield_per(batch_size):
+            for url in ((variants or {}).get("srcset") or {}).values():
+                yield url
+
+# 縮小版を記録する画像の種類とモデル
+IMAGE_VARIANT_MODELS = {
+    "agent_image": models.AgentImage,
+    "message": models.Message,
+}
+
+def claim_image_variants(db: Session, kind: str, row_id: int) -> Optional[str]:
+    """
+    縮小版がまだない画像を処理中にし、画像のURLを返します。
+    他で処理中・処理済みの場合や画像がない場合はNoneを返します。
+    """
+    model = IMAGE_VARIANT_MODELS[kind]
+    row = db.query(model).filter(model.id == row_id).first()
+    if row is None or not row.image_url:
+        return None
+    claimed = db.query(model).filter(model.id == row_id, model.variants.is_(None)).update(
+        {model.variants: {"status": "processing"}}, synchronize_session=False
+    )
+    db.commit()
+    return row.image_url if claimed else None
+
+def set_image_variants(db: Session, kind: str, row_id: int, variants: Optional[Dict[str, Any]]) -> None:
+    """画像の縮小版を記録します（Noneで未作成に戻す）。"""
+    model = IMAGE_VARIANT_MODELS[kind]
+    db.query(model).filter(model.id == row_id).update(
+        {model.variants: variants if variants is not None else null()}, synchronize_session=False
+    )
+    db.commit()
+
+def get_image_ids_without_variants(db: Session, kind: str, limit: int = 100) -> List[int]:
+    """縮小版がまだない画像のIDを古い順に取得します。"""
+    model = IMAGE_VARIANT_MODELS[kind]
+    rows = db.query(model.id).filter(
+        model.image_url.isnot(None), model.variants.is_(None)
+    ).order_by(model.id).limit(limit).all()
+    return [row.id for row in rows]
+
+def create_image_job(
+    db: Session,
+    kind: str,
+    agent_id: int,
+    user_id: int,
+    payload: Dict[str, Any],
+    chat_id: Optional[int] = None,
+    message_id: Optional[int] = None,
+    priority: int = 0,
+    max_attempts: int = 2,
+) -> models.ImageJob:
+    """画像生成ジョブを待ち行列に登録します。"""
+    db_job = models.ImageJob(
+        kind=kind,
+        status="queued",
+        priority=priority,
+        agent_id=agent_id,
+        user_id=user_id,
+        chat_id=chat_id,
+        message_id=message_id,
+        payload=payload,
+        max_attempts=max_attempts,
+        available_at=datetime.utcnow(),
+    )
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+def get_image_job(db: Session, job_id: int) -> Optional[models.ImageJob]:
+    return db.query(models.ImageJob).filter(models.ImageJob.id == job_id).first()
+
+def claim_image_job(db: Session, worker_id: str) -> Optional[models.ImageJob]:
+    """
+    待ち行列の先頭のジョブを取り出して実行中にします。
+
+    PostgreSQLでは SELECT ... FOR UPDATE SKIP LOCKED により、
+    複数のワーカー（別プロセスを含む）が同じジョブを取り出さないようにします。
+    """
+    now = datetime.utcnow()
+    db_job = (
+        db.query(models.ImageJob)
+        .filter(models.ImageJob.status == "queued", models.ImageJob.available_at <= now)
+        .order_by(models.ImageJob.priority.desc(), models.ImageJob.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .first()
+    )
+    if db_job is None:
+        db.commit()
+        return None
+    db_job.status = "running"
+    db_job.attempts += 1
+    db_job.worker_id = worker_id
+    db_job.started_at = now
+    db_job.heartbeat_at = now
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+def heartbeat_image_job(db: Session, job_id: int) -> None:
+    """実行中のジョブの生存時刻を更新します。"""
+    db.query(models.ImageJob).filter(
+        models.ImageJob.id == job_id, models.ImageJob.status.in_(["running", "cancelling"])
+    ).update({models.ImageJob.heartbeat_at: datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+
+def get_image_job_status(db: Session, job_id: int) -> Optional[str]:
+    """ジョブの現在のステータスを取得します。"""
+    row = db.query(models.ImageJob.status).filter(models.ImageJob.id == job_id).first()
+    return row.status if row else None
+
+def finish_image_job(
+    db: Session,
+    job_id: int,
+    status: str,
+    result_url: Optional[str] = None,
+    result_seed: Optional[int] = None,
+    error: Optional[str] = None,
+) -> Optional[models.ImageJob]:
+    """ジョブを完了・失敗・キャンセルのいずれかで終了します。"""
+    db_job = get_image_job(db, job_id)
+    if db_job:
+        db_job.status = status
+        db_job.result_url = result_url
+        db_job.result_seed = result_seed
+        db_job.error = error
+        db_job.finished_at = datetime.utcnow()
+        db.commit()
+        db.refresh(db_job)
+    return db_job
+
+def retry_image_job(db: Session, job_id: int, error: str, delay_seconds: float) -> Optional[models.ImageJob]:
+    """失敗したジョブを、待ち時間をおいて再び待ち行列に戻します。"""
+    db_job = get_image_job(db, job_id)
+    if db_job:
+        db_job.status = "queued"
+        db_job.error = error
+        db_job.worker_id = None
+        db_job.available_at = datetime.utcnow() + timedelta(seconds=delay_seconds)
+        db.commit()
+        db.refresh(db_job)
+    return db_job
+
+def cancel_image_job(db: Session, job_id: int) -> bool:
+    """まだ実行されていないジョブを取り消します。"""
+    cancelled = db.query(models.ImageJob).filter(
+        models.ImageJob.id == job_id, models.ImageJob.status == "queued"
+    ).update(
+        {models.ImageJob.status: "cancelled", models.ImageJob.finished_at: datetime.utcnow()},
+        synchronize_session=False,
+    )
+    db.commit()
+    return cancelled > 0
+
+def request_image_job_cancel(db: Session, job_id: int) -> bool:
+    """実行中のジョブの取り消しを、処理しているワーカーに依頼します。"""
+    requested = db.query(models.ImageJob).filter(
+        models.ImageJob.id == job_id, models.ImageJob.status == "running"
+    ).update({models.ImageJob.status: "cancelling"}, synchronize_session=False)
+    db.commit()
+    return requested > 0
+
+def get_active_image_jobs(
+    db: Session, kind: str, agent_id: int, chat_id: Optional[int] = None
+) -> List[models.ImageJob]:
+    """同じ種類・エージェント（・チャット）の待機中と実行中のジョブを取得します。"""
+    query = db.query(models.ImageJob).filter(
+        models.ImageJob.kind == kind,
+        models.ImageJob.agent_id == agent_id,
+        models.ImageJob.status.in_(["queued", "running"]),
+    )
+    if chat_id is not None:
+        query = query.filter(models.ImageJob.chat_id == chat_id)
+    return query.order_by(models.ImageJob.id).all()
+
+def requeue_stale_image_jobs(db: Session, stale_before: datetime) -> int:
+    """
+    生存時刻が途絶えた実行中のジョブ（ワーカーのプロセスが落ちたもの）を待ち行列に戻します。
+
+    試行回数を使い切ったジョブは失敗にします。
+    """
+    stale_jobs = (
+        db.query(models.ImageJob)
+        .filter(models.ImageJob.status.in_(["running", "cancelling"]), models.ImageJob.heartbeat_at < stale_before)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for db_job in stale_jobs:
+        db_job.worker_id = None
+        if db_job.status == "cancelling":
+            # 取り消しを依頼されていたジョブはやり直さない
+            db_job.status = "cancelled"
+            db_job.error = "Cancelled"
+            db_job.finished_at = datetime.utcnow()
+        elif db_job.attempts >= db_job.max_attempts:
+            db_job.status = "failed"
+            db_job.error = "Worker stopped while generating the image"
+            db_job.finished_at = datetime.utcnow()
+        else:
+            db_job.status = "queued"
+            db_job.available_at = datetime.utcnow()
+    db.commit()
+    return len(stale_jobs)
+
+def save_image_job_log(db: Session, job_id: int, log: Dict[str, Any]) -> None:
+    """ジョブの生成ログを書き出します。"""
+    db.query(models.ImageJob).filter(models.ImageJob.id == job_id).update(
+        {models.ImageJob.log: log}, synchronize_session=False
+    )
+    db.commit()
+
+def get_recent_image_jobs(
+    db: Session, agent_id: int, limit: int = 10, kind: Optional[str] = None
+) -> List[models.ImageJob]:
+    """エージェントの画像生成ジョブを新しい順に取得します。"""
+    query = db.query(models.ImageJob).filter(models.ImageJob.agent_id == agent_id)
+    if kind:
+        query = query.filter(models.ImageJob.kind == kind)
+    return query.order_by(models.ImageJob.id.desc()).limit(limit).all()
+
+def get_image_job_queue_position(db: Session, job: models.ImageJob) -> int:
+    """待機中のジョブが待ち行列の何番目かを取得します（先頭が1）。"""
+    ahead = db.query(func.count(models.ImageJob.id)).filter(
+        models.ImageJob.status == "queued",
+        or_(
+            models.ImageJob.priority > job.priority,
+            and_(models.ImageJob.priority == job.priority, models.ImageJob.id < job.id),
+        ),
+    ).scalar()
+    return ahead + 1
+
+def get_queued_image_jobs(db: Session, limit: int = 50) -> List[models.ImageJob]:
+    """待機中のジョブを取り出される順に取得します。"""
+    return (
+        db.query(models.ImageJob)
+        .filter(models.ImageJob.status == "queued")
+        .order_by(models.ImageJob.priority.desc(), models.ImageJob.id)
+        .limit(limit)
+        .all()
+    )
+
+def count_image_jobs_by_status(db: Session) -> Dict[str, int]:
+    """ステータスごとのジョブ数を取得します。"""
+    rows = db.query(models.ImageJob.status, func.count(models.ImageJob.id)).group_by(models.ImageJob.status).all()
+    return {status: count for status, count in rows}
+
+def update_pending_reply_image(
+    db: Session, chat_id: int, after_message_id: int, image_url: Optional[str], image_status: str
+) -> Optional[models.Message]:
+    """ユーザー発話への返信（画像待ちのAIメッセージ）に生成結果を反映します。"""
+    db_message = (
+        db.query(models.Message)
+        .filter(
+            models.Message.chat_id == chat_id,
+            models.Message.id > after_message_id,
+            models.Message.sender == "ai",
+            models.Message.image_status == "pending",
+        )
+        .order_by(models.Message.id)
+        .first()
+    )
+    if db_message:
+        return update_message_image(db, db_message.id, image_url=image_url, image_status=image_status)
+    return None
@@ -1,17 +1,21 @@
-import os
 import logging
+from functools import lru_cache
 from fastapi import Depends, Request, WebSocket
+from starlette.requests import HTTPConnection
 from services.llm_service import LLMService
 from services.feedback_service import FeedbackService
 from services.prompt_builder import PromptBuilder
 from services.prompt_template_engine import PromptTemplateEngine
 from services.llm_clients.base import LLMClientInterface
-from services.llm_clients.gemini_client import GeminiClient
+from services.llm_clients.registry import LLMClientRegistry
 from services.error_handler import ErrorHandler
 from services.image_request_detector import ImageRequestDetector
 from services.image_prompt_analyzer import ImagePromptAnalyzer
 from services.image_generation_service import ImageGenerationService
 from services.r18_content_analyzer import R18ContentAnalyzer
+from services.conversation_summarizer import ConversationSummarizer
+from services.event_bus import EventBus
+from services.image_jobs import ImageJobTracker
 
 # Logging configuration
 logging.basicConfig(level=logging.INFO)
@@ -24,17 +28,26 @@ def get_error_handler():
 def get_r18_content_analyzer():
     return R18ContentAnalyzer()
 
+@lru_cache
 def get_prompt_template_engine():
+    # Jinja環境（コンパイル済みテンプレートのキャッシュ）をプロセス内で共有する
     return PromptTemplateEngine()
 
+@lru_cache
 def get_prompt_builder(template_engine: PromptTemplateEngine = Depends(get_prompt_template_engine)):
+    # 描画済みのペルソナ部分のキャッシュをプロセス内で共有する
     return PromptBuilder(template_engine)
 
-def get_llm_client() -> LLMClientInterface:
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        raise ValueError("GOOGLE_API_KEY environment variable not set")
-    return GeminiClient(api_key=api_key)
+def get_llm_client_registry(connection: HTTPConnection) -> LLMClientRegistry:
+    # main.pyの起動時に生成されたレジストリを共有する
+    registry = getattr(connection.app.state, "llm_client_registry", None)
+    if registry is None:
+        registry = LLMClientRegistry()
+        connection.app.state.llm_client_registry = registry
+    return registry
+
+def get_llm_client(registry: LLMClientRegistry = Depends(get_llm_client_registry)) -> LLMClientInterface:
+    return registry.get()
 
 def get_image_request_detector():
     return ImageRequestDetector()
@@ -98,4 +111,19 @@ def get_feedback_service(
     llm_client: LLMClientInterface = Depends(get_llm_client),
     error_handler: ErrorHandler = Depends(get_error_handler)
 ):
-    return FeedbackService(prompt_builder, llm_client, error_handler)
\ No newline at end of file
+    return FeedbackService(prompt_builder, llm_client, error_handler)
+
+def get_conversation_summarizer(
+    prompt_builder: PromptBuilder = Depends(get_prompt_builder),
+    llm_client: LLMClientInterface = Depends(get_llm_client)
+):
+    return ConversationSummarizer(prompt_builder, llm_client)
+
+@lru_cache
+def get_event_bus() -> EventBus:
+    # WebSocketの購読者と画像生成ジョブでプロセス内のイベントバスを共有する
+    return EventBus()
+
+@lru_cache
+def get_image_job_tracker(event_bus: EventBus = Depends(get_event_bus)) -> ImageJobTracker:
+    return ImageJobTracker(event_bus)
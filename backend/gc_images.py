@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""どこからも参照されていない画像ファイルを削除するスクリプト
+
+アプリケーションも定期的に実行するが、--dry-run で削除対象を確認したいときなどに使う。
+"""
+
+import argparse
+import json
+import logging
+
+from services.image_gc import ImageGarbageCollector
+from services.image_storage import ImageStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete image files that nothing references anymore")
+    parser.add_argument("--dry-run", action="store_true", help="削除せずに対象を報告するだけにする")
+    parser.add_argument("--grace-period", type=float, default=None, help="これより新しいファイルは削除しない（秒）")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    collector = ImageGarbageCollector(ImageStore.from_env(), grace_period=args.grace_period, batch_pause=0)
+    report = collector.collect(dry_run=args.dry_run)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,20 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from routers import auth, agents, chat, tags
+from routers import auth, agents, chat, tags, system, usage
 import os
 from database import get_db
 from sqlalchemy.orm import Session
 from fastapi import Depends
 from services.llm_service import LLMService
 from services.image_generation_service import ImageGenerationService
-from dependencies import get_llm_service, get_ws_llm_service
+from services.image_job_queue import ImageJobQueue
+from services.image_io import shutdown_image_io_executor
+from services.image_variants import ImageVariantWorker
+from services.image_gc import ImageGarbageCollector
+from services.llm_clients.registry import LLMClientRegistry
+from services.cassette import close_cassette
+from dependencies import get_llm_service, get_ws_llm_service, get_event_bus
 import logging
 import json
 
@@ -25,6 +31,45 @@ async def startup_event():
         r18_mode_image=app.state.r18_mode_image
     )
 
+    # 画像生成はDB上の待ち行列を経由し、ワーカー数で同時生成数を制限する
+    app.state.image_job_queue = ImageJobQueue(
+        app.state.image_generation_service, event_bus=get_event_bus()
+    )
+    app.state.image_generation_service.job_queue = app.state.image_job_queue
+    await app.state.image_job_queue.start()
+
+    # 保存した画像の縮小版（WebP）とプレースホルダーを作るワーカー
+    app.state.image_generation_service.event_bus = get_event_bus()
+    app.state.image_variant_worker = ImageVariantWorker(
+        app.state.image_generation_service.image_store, event_bus=get_event_bus()
+    )
+    app.state.image_variant_worker.start()
+
+    # 参照されなくなった画像ファイルを定期的に削除する
+    app.state.image_gc = ImageGarbageCollector(app.state.image_generation_service.image_store)
+    app.state.image_gc.start()
+
+    # LLMクライアントはプロセス全体で共有する
+    app.state.llm_client_registry = LLMClientRegistry()
+    app.state.llm_client_registry.warm_up()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    job_queue = getattr(app.state, "image_job_queue", None)
+    if job_queue:
+        await job_queue.stop()
+    variant_worker = getattr(app.state, "image_variant_worker", None)
+    if variant_worker:
+        await variant_worker.stop()
+    image_gc = getattr(app.state, "image_gc", None)
+    if image_gc:
+        await image_gc.stop()
+    registry = getattr(app.state, "llm_client_registry", None)
+    if registry:
+        await registry.aclose()
+    close_cassette()
+    shutdown_image_io_executor()
+
 # Logging configuration
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -52,6 +97,8 @@ app.include_router(auth.router, prefix="/api/v1")
 app.include_router(agents.router, prefix="/api/v1")
 app.include_router(chat.router, prefix="/api/v1")
 app.include_router(tags.router, prefix="/api/v1")
+app.include_router(system.router, prefix="/api/v1")
+app.include_router(usage.router, prefix="/api/v1")
 
 
 @app.get("/")
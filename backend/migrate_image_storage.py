@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""static/agent_images の画像を内容アドレスの保存先へ移行するスクリプト
+
+各画像をハッシュで保存し直し、エージェント・ギャラリー・メッセージ・生成ログ・ジョブの
+URLを書き換える。参照数は画像を参照している行の数になる。
+"""
+
+import argparse
+import logging
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Tuple
+from urllib.parse import urlparse
+
+from sqlalchemy.orm import Session
+
+import models
+from services.image_storage import ImageStore, LEGACY_IMAGE_DIR, LEGACY_URL_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# 画像URLを持つ列
+IMAGE_URL_COLUMNS = [
+    (models.Agent, "image_url"),
+    (models.AgentImage, "image_url"),
+    (models.Message, "image_url"),
+    (models.ImageGenerationLog, "image_url"),
+    (models.ImageJob, "result_url"),
+]
+
+
+def _legacy_filename(image_url: str) -> str:
+    return Path(urlparse(image_url).path).name
+
+
+def _rewrite_url(old_url: str, stored_url: str) -> str:
+    """移行前のURLの /static/agent_images/<名前> の部分を新しい保存先に置き換える"""
+    if stored_url.startswith("http"):
+        return stored_url
+    return old_url[:old_url.index(LEGACY_URL_PREFIX)] + stored_url
+
+
+def migrate_legacy_images(
+    db: Session,
+    store: ImageStore,
+    legacy_dir: Path = LEGACY_IMAGE_DIR,
+    dry_run: bool = False,
+    delete_originals: bool = False,
+) -> Dict[str, int]:
+    """移行前の画像を保存し直してURLを書き換え、件数を返す"""
+    references: Dict[str, List[Tuple[object, str]]] = defaultdict(list)
+    for model, column in IMAGE_URL_COLUMNS:
+        rows = db.query(model).filter(getattr(model, column).like(f"%{LEGACY_URL_PREFIX}%")).all()
+        for row in rows:
+            references[_legacy_filename(getattr(row, column))].append((row, column))
+
+    stats = {"files": 0, "migrated": 0, "missing": 0, "unreferenced": 0, "rows": 0}
+    files = {path.name: path for path in Path(legacy_dir).glob("*") if path.is_file()}
+    stats["files"] = len(files)
+    stats["missing"] = len(set(references) - set(files))
+
+    for name, path in sorted(files.items()):
+        owners = references.get(name, [])
+        if not owners:
+            stats["unreferenced"] += 1
+            continue
+        stats["migrated"] += 1
+        stats["rows"] += len(owners)
+        if dry_run:
+            continue
+
+        data = path.read_bytes()
+        content_type = "image/png" if path.suffix.lower() == ".png" else f"image/{path.suffix.lstrip('.').lower()}"
+        for row, column in owners:
+            # 参照している行ごとに保存し、参照数を行数に合わせる（2回目以降は参照数が増えるだけ）
+            stored_url = store.save(db, data, extension=path.suffix.lower(), content_type=content_type)
+            setattr(row, column, _rewrite_url(getattr(row, column), stored_url))
+        db.commit()
+        if delete_originals:
+            path.unlink()
+        logger.info(f"Migrated {name} ({len(owners)} references)")
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate legacy agent images to content-addressed storage")
+    parser.add_argument("--dry-run", action="store_true", help="移行対象を数えるだけで書き換えない")
+    parser.add_argument("--delete-originals", action="store_true", help="移行した元のファイルを削除する")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        stats = migrate_legacy_images(
+            db, ImageStore.from_env(), dry_run=args.dry_run, delete_originals=args.delete_originals
+        )
+    finally:
+        db.close()
+    print(
+        f"files={stats['files']} migrated={stats['migrated']} rows={stats['rows']} "
+        f"unreferenced={stats['unreferenced']} missing={stats['missing']}"
+        + (" (dry run)" if args.dry_run else "")
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Table, Text, Boolean, BigInteger
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Table, Text, Boolean, BigInteger, Index, JSON
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -56,6 +56,8 @@ class Agent(Base):
     first_person = Column(String, nullable=True)
     first_person_other = Column(String, nullable=True)
     second_person = Column(String, nullable=True)
+    # プロフィール更新のたびに増える版数（描画済みプロンプトのキャッシュキーに使う）
+    revision = Column(Integer, nullable=False, default=0, server_default="0")
     
     owner = relationship("User", back_populates="agents")
     chats = relationship("Chat", back_populates="agent")
@@ -71,6 +73,10 @@ class Chat(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     agent_id = Column(Integer, ForeignKey("agents.id"))
     created_at = Column(DateTime, default=datetime.utcnow)
+    # 古い会話の要約（summary_message_id までのメッセージを畳み込んだもの）
+    summary = Column(Text, nullable=True)
+    summary_message_id = Column(Integer, nullable=True)
+    summary_updated_at = Column(DateTime, nullable=True)
     
     user = relationship("User", back_populates="chats")
     agent = relationship("Agent", back_populates="chats")
@@ -84,9 +90,51 @@ class Message(Base):
     content = Column(String)
     sender = Column(String)  # "user" or "ai"
     image_url = Column(String, nullable=True)
+    # 応答の送信後に生成する画像の状態（"pending" / "completed" / "failed" / "cancelled"、画像なしはNone）
+    image_status = Column(String, nullable=True)
+    # 画像の縮小版（WebP）とぼかしプレースホルダー（未作成はNone）
+    variants = Column(JSON, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     chat = relationship("Chat", back_populates="messages")
+    usage = relationship("MessageUsage", back_populates="message", uselist=False, cascade="all, delete-orphan")
+
+    __table_args__ = (
+        # 直近メッセージの取得（chat_idで絞り込み、id降順）用
+        Index("ix_messages_chat_id_id", "chat_id", "id"),
+    )
+
+class MessageUsage(Base):
+    __tablename__ = "message_usages"
+
+    id = Column(Integer, primary_key=True, index=True)
+    message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"), nullable=False, unique=True)
+    chat_id = Column(Integer, ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
+    # エージェント・ユーザー・日付ごとの集計用に非正規化して保持する
+    agent_id = Column(Integer, ForeignKey("agents.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    provider = Column(String, nullable=True)
+    model = Column(String, nullable=True)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    total_tokens = Column(Integer, nullable=False, default=0)
+    # プロバイダーがトークン数を返さず、ローカルの概算値を使った場合はTrue
+    usage_estimated = Column(Boolean, nullable=False, default=False)
+    # 処理段階ごとの所要時間（ミリ秒）
+    context_ms = Column(Integer, nullable=True)
+    prompt_ms = Column(Integer, nullable=True)
+    llm_ms = Column(Integer, nullable=True)
+    first_token_ms = Column(Integer, nullable=True)
+    image_ms = Column(Integer, nullable=True)
+    total_ms = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    message = relationship("Message", back_populates="usage")
+
+    __table_args__ = (
+        Index("ix_message_usages_agent_id_created_at", "agent_id", "created_at"),
+        Index("ix_message_usages_user_id_created_at", "user_id", "created_at"),
+    )
 
 class Personality(Base):
     __tablename__ = "personalities"
@@ -119,11 +167,27 @@ class AgentImage(Base):
     agent_id = Column(Integer, ForeignKey("agents.id", ondelete="CASCADE"))
     image_url = Column(String, nullable=False)
     is_primary = Column(Boolean, default=False, nullable=False)
+    # 画像の縮小版（WebP）とぼかしプレースホルダー（未作成はNone）
+    variants = Column(JSON, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     agent = relationship("Agent", back_populates="images")
 
 
+class ImageBlob(Base):
+    """内容（SHA-256）で重複を排除して保存した画像ファイルと、その参照数"""
+    __tablename__ = "image_blobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String(64), nullable=False, unique=True, index=True)
+    # ストレージ内のパス（例: "ab/cd/abcd....png"）
+    storage_key = Column(String, nullable=False, unique=True)
+    size = Column(Integer, nullable=False)
+    content_type = Column(String, nullable=True)
+    ref_count = Column(Integer, nullable=False, default=1)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
 class ImageGenerationLog(Base):
     __tablename__ = "image_generation_logs"
 
@@ -139,4 +203,41 @@ class ImageGenerationLog(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
     agent = relationship("Agent")
-    message = relationship("Message")
\ No newline at end of file
+    message = relationship("Message")
+
+
+class ImageJob(Base):
+    """画像生成ジョブ（ワーカーが SELECT ... FOR UPDATE SKIP LOCKED で取り出すキュー）"""
+    __tablename__ = "image_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)  # "profile" or "chat"
+    # "queued" / "running" / "cancelling"（別のプロセスのワーカーに取り消しを依頼中） / "completed" / "failed" / "cancelled"
+    status = Column(String, nullable=False, default="queued")
+    priority = Column(Integer, nullable=False, default=0)
+    agent_id = Column(Integer, ForeignKey("agents.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    chat_id = Column(Integer, ForeignKey("chats.id", ondelete="CASCADE"), nullable=True)
+    message_id = Column(Integer, nullable=True)
+    payload = Column(JSON, nullable=False, default=dict)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=2)
+    worker_id = Column(String, nullable=True)
+    result_url = Column(String, nullable=True)
+    result_seed = Column(BigInteger, nullable=True)
+    error = Column(Text, nullable=True)
+    # 生成ログ（進捗・各ステップ）。実行中も一定間隔で書き出される
+    log = Column(JSON, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # リトライ時はバックオフ後の時刻まで取り出さない
+    available_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    agent = relationship("Agent")
+
+    __table_args__ = (
+        # 待ち行列の先頭の取得（status, 優先度, 登録順）用
+        Index("ix_image_jobs_status_priority_id", "status", "priority", "id"),
+    )
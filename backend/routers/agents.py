@@ -1,18 +1,19 @@
 import logging
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Request, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Request, UploadFile, File
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
-import shutil
-import uuid
+from typing import List, Optional
+import json
 from pathlib import Path
 
 import crud
 import schemas
 from database import get_db
-from auth import oauth2_scheme
+from auth import oauth2_scheme, get_user_from_token
 from jose import JWTError, jwt
 from auth import SECRET_KEY, ALGORITHM
 from services.image_generation_service import ImageGenerationService
+from services.image_variants import AGENT_IMAGE, request_variants, variant_urls
 
 router = APIRouter(
     prefix="/agents",
@@ -115,13 +116,17 @@ def delete_agent_image(
         if not agent:
             raise HTTPException(status_code=404, detail="Agent not found")
         
+        primary_image = next((image for image in crud.get_agent_images(db, agent_id=agent_id) if image.is_primary), None)
+        variants_to_delete = variant_urls(primary_image.variants) if primary_image else []
         updated_agent, image_url_to_delete = crud.delete_primary_agent_image(db, agent_id=agent_id, user_id=current_user.id)
 
         if not updated_agent:
             raise HTTPException(status_code=404, detail="Agent not found")
 
         if image_url_to_delete:
-            image_service._remove_old_image(image_url_to_delete)
+            image_service._remove_old_image(db, image_url_to_delete)
+        for variant_url in variants_to_delete:
+            image_service._remove_old_image(db, variant_url)
         
         logger.info(f"Successfully deleted primary image for agent {agent_id}")
         return {"detail": "Image deleted successfully"}
@@ -154,7 +159,14 @@ async def generate_agent_image(
     if not agent:
         raise HTTPException(status_code=404, detail="Agent not found")
 
-    # 画像生成をバックグラウンドタスクとして追加
+    # 画像生成ジョブを待ち行列に登録（待ち行列が未起動の場合はバックグラウンドタスクで生成）
+    job = image_service.enqueue_profile_image(
+        db, agent_id=agent_id, user_id=current_user.id, force_regenerate=request.force_regenerate
+    )
+    if job is not None:
+        logger.info(f"Image generation job {job.id} for agent {agent_id} has been queued.")
+        return {"message": "Image generation started in the background.", "job_id": job.id}
+
     background_tasks.add_task(
         image_service.generate_and_save_image,
         agent_id=agent_id,
@@ -170,6 +182,8 @@ async def generate_agent_image(
 @router.get("/{agent_id}/generation-log")
 def get_generation_log(
     agent_id: int,
+    job_id: Optional[int] = None,
+    limit: int = Query(10, ge=1, le=50),
     db: Session = Depends(get_db),
     current_user: schemas.User = Depends(get_current_user),
     image_service: ImageGenerationService = Depends(get_image_generation_service)
@@ -178,25 +192,110 @@ def get_generation_log(
     
     Args:
         agent_id: エージェントID
+        job_id: 対象のジョブID（省略時は最新のプロフィール画像の生成）
+        limit: jobs に含める最近のジョブ数
     
     Returns:
-        生成ログの詳細情報
+        対象ジョブの生成ログ（status, progress, image_url など）と、最近のジョブのログ一覧（jobs）
     """
     # エージェントの存在確認
     agent = crud.get_agent(db, agent_id=agent_id, user_id=current_user.id)
     if not agent:
         raise HTTPException(status_code=404, detail="Agent not found")
     
-    # 画像生成サービスからログを取得
-    generation_log = image_service.get_generation_log(agent_id)
+    # 画像生成サービスからジョブ単位のログを取得
+    jobs = image_service.get_generation_logs(db, agent_id, limit=limit)
+
+    if job_id is not None:
+        generation_log = next((entry for entry in jobs if entry.get("job_id") == job_id), None)
+        if generation_log is None:
+            job = crud.get_image_job(db, job_id)
+            if not job or job.agent_id != agent_id:
+                raise HTTPException(status_code=404, detail="Image generation job not found")
+            generation_log = image_service.job_log_entry(job)
+    else:
+        # チャット画像の生成で上書きされないよう、プロフィール画像のログを優先する
+        generation_log = next((entry for entry in jobs if entry.get("kind") == "profile"), None)
+        if generation_log is None and jobs:
+            generation_log = jobs[0]
     
     if not generation_log:
         return {
             "message": "No generation log found for this agent",
-            "agent_id": agent_id
+            "agent_id": agent_id,
+            "jobs": []
         }
     
-    return generation_log
+    return {**generation_log, "jobs": jobs}
+
+
+@router.get("/{agent_id}/image-jobs/{job_id}/events")
+async def stream_image_job_events(
+    agent_id: int,
+    job_id: int,
+    request: Request,
+    token: str = Query(...),
+    db: Session = Depends(get_db)
+):
+    """画像生成ジョブの進捗（%・残り秒数・待ち順）をServer-Sent Eventsで配信します。
+
+    EventSourceはヘッダーを付けられないため、WebSocketと同様にトークンをクエリで受け取ります。
+    ジョブが終わるとストリームを閉じます。
+    """
+    user = get_user_from_token(db, token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Could not validate credentials")
+    agent = crud.get_agent(db, agent_id=agent_id, user_id=user.id)
+    if not agent:
+        raise HTTPException(status_code=404, detail="Agent not found")
+    job = crud.get_image_job(db, job_id)
+    if not job or job.agent_id != agent_id:
+        raise HTTPException(status_code=404, detail="Image generation job not found")
+    job_queue = getattr(request.app.state, "image_job_queue", None)
+    if job_queue is None:
+        raise HTTPException(status_code=503, detail="Image job queue is not running")
+
+    async def event_stream():
+        async for event in job_queue.watch(job_id):
+            if await request.is_disconnected():
+                break
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: image_progress\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/{agent_id}/image-jobs/{job_id}/cancel")
+async def cancel_image_job(
+    agent_id: int,
+    job_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_user)
+):
+    """画像生成ジョブを取り消します。
+
+    待機中のジョブはそのまま取り消し、実行中のジョブはWebUIの生成も中断します。
+    別のプロセスのワーカーが実行中の場合は、そのワーカーが数秒以内に取り消します。
+    """
+    agent = crud.get_agent(db, agent_id=agent_id, user_id=current_user.id)
+    if not agent:
+        raise HTTPException(status_code=404, detail="Agent not found")
+    job = crud.get_image_job(db, job_id)
+    if not job or job.agent_id != agent_id:
+        raise HTTPException(status_code=404, detail="Image generation job not found")
+    job_queue = getattr(request.app.state, "image_job_queue", None)
+    if job_queue is None:
+        raise HTTPException(status_code=503, detail="Image job queue is not running")
+    if not job_queue.cancel(job_id):
+        raise HTTPException(status_code=409, detail="Image generation job has already finished")
+    return {"job_id": job_id, "cancelled": True}
 
 
 # Agent Images (Photo Gallery) endpoints
@@ -237,22 +336,18 @@ async def upload_agent_image(
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="Invalid file type. Only images are allowed.")
     
-    # ファイル保存
+    # ファイル保存（内容が同じ画像は既存のファイルを共有する）
+    image_url = None
     try:
-        # ユニークなファイル名を生成
-        file_extension = Path(file.filename).suffix
-        unique_filename = f"agent_{agent_id}_{uuid.uuid4()}{file_extension}"
-        file_path = image_service.storage_path / unique_filename
-        
-        # ファイルを保存
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # URLを生成
-        image_url = f"/static/agent_images/{unique_filename}"
+        file_extension = Path(file.filename or "").suffix.lower() or ".png"
+        data = await file.read()
+        image_url = await image_service.image_store.save_async(
+            db, data, extension=file_extension, content_type=file.content_type
+        )
         
         # データベースに保存
         db_image = crud.create_agent_image(db, agent_id=agent_id, image_url=image_url, is_primary=is_primary)
+        request_variants(image_service.event_bus, AGENT_IMAGE, db_image.id)
         
         logger.info(f"Successfully uploaded image for agent {agent_id}: {image_url}")
         return db_image
@@ -260,8 +355,8 @@ async def upload_agent_image(
     except Exception as e:
         logger.error(f"Error uploading image for agent {agent_id}: {str(e)}")
         # クリーンアップ
-        if file_path.exists():
-            file_path.unlink()
+        if image_url:
+            await image_service._remove_old_image_async(db, image_url)
         raise HTTPException(status_code=500, detail=f"Failed to upload image: {str(e)}")
 
 
@@ -289,9 +384,11 @@ def delete_agent_gallery_image(
         raise HTTPException(status_code=404, detail="Image not found")
     
     try:
-        # 物理ファイルを削除
+        # 物理ファイルを削除（縮小版も含む）
         if image_to_delete.image_url:
-            image_service._remove_old_image(image_to_delete.image_url)
+            image_service._remove_old_image(db, image_to_delete.image_url)
+        for variant_url in variant_urls(image_to_delete.variants):
+            image_service._remove_old_image(db, variant_url)
         
         # データベースから削除
         success = crud.delete_agent_gallery_image(db, agent_id=agent_id, image_id=image_id)
@@ -1,28 +1,108 @@
 from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, status, Request
 from datetime import datetime
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 import json
+import asyncio
 import httpx
 import logging
 import schemas, crud, models
-from database import get_db
+from database import get_db, SessionLocal
 from auth import get_current_user, get_user_from_token
 from services.llm_service import LLMService
 from services.feedback_service import FeedbackService
-from dependencies import get_llm_service, get_ws_llm_service, get_feedback_service, get_prompt_builder
+from services.conversation_summarizer import ConversationSummarizer
+from dependencies import get_llm_service, get_ws_llm_service, get_feedback_service, get_prompt_builder, get_conversation_summarizer, get_event_bus, get_image_job_tracker
 from services.prompt_builder import PromptBuilder
+from services.event_bus import EventBus, chat_topic
+from services.image_jobs import ImageJobTracker, IMAGE_PENDING
+from services.image_variants import MESSAGE_IMAGE, request_variants
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/chats", tags=["chats"])
 
+def _apply_second_person(db: Session, agent: models.Agent, second_person: Optional[str], user_id: int) -> models.Agent:
+    """抽出した二人称をエージェントに反映する（変更がない場合は更新しない）"""
+    if not second_person or second_person == agent.second_person:
+        return agent
+    agent_update = schemas.AgentUpdate(second_person=second_person)
+    # Update the agent and get the updated object back
+    return crud.update_agent(db=db, agent_id=agent.id, agent=agent_update, user_id=user_id)
+
+async def _finish_second_person_extraction(
+    db: Session, agent: models.Agent, extraction_task: "asyncio.Task[Optional[str]]", user_id: int
+) -> models.Agent:
+    """応答生成と並行して走らせた二人称抽出の結果を待ち、次のターン向けに反映する"""
+    try:
+        extracted_second_person = await extraction_task
+    except Exception as e:
+        logger.error(f"Second person extraction failed: {e}")
+        return agent
+    return _apply_second_person(db, agent, extracted_second_person, user_id)
+
+# 応答の返却後に実行中の二人称の反映（完了まで参照を保持する）
+_second_person_tasks: "set[asyncio.Task[None]]" = set()
+
+def _finish_second_person_extraction_in_background(
+    extraction_task: "asyncio.Task[Optional[str]]", agent_id: int, user_id: int
+) -> None:
+    """応答を返した後に二人称の抽出結果を反映する（リクエストのセッションは閉じられるため専用のセッションを使う）"""
+    async def apply() -> None:
+        db = SessionLocal()
+        try:
+            agent = crud.get_agent(db, agent_id=agent_id, user_id=user_id)
+            if agent:
+                await _finish_second_person_extraction(db, agent, extraction_task, user_id)
+        except Exception as e:
+            logger.error(f"Failed to apply second person for agent {agent_id}: {e}")
+        finally:
+            db.close()
+
+    task = asyncio.create_task(apply())
+    _second_person_tasks.add(task)
+    task.add_done_callback(_second_person_tasks.discard)
+
+def _image_status(response: dict) -> Optional[str]:
+    """応答後に画像を届ける場合は、保存するAIメッセージの画像の状態を返す"""
+    return IMAGE_PENDING if response.get("image_task") is not None else None
+
+def _track_image(image_jobs: ImageJobTracker, response: dict, chat_id: int, ai_message: models.Message) -> None:
+    """生成中の画像をAIメッセージに紐付け、完成時にメッセージを更新させる"""
+    image_task = response.get("image_task")
+    if image_task is not None:
+        image_jobs.submit(image_task, chat_id=chat_id, message_id=ai_message.id)
+    elif ai_message.image_url:
+        request_variants(image_jobs.event_bus, MESSAGE_IMAGE, ai_message.id)
+
+async def _forward_chat_events(websocket: WebSocket, events: "asyncio.Queue[dict]") -> None:
+    """イベントバスに届いたチャットのイベント（message_updatedなど）をWebSocketへ転送する"""
+    while True:
+        event = await events.get()
+        try:
+            await websocket.send_json(event)
+        except Exception as e:
+            logger.warning(f"Failed to forward {event.get('type')} event: {e}")
+            return
+
+def _record_usage(db: Session, ai_message: models.Message, agent_id: int, user_id: int, response: dict) -> None:
+    """AIメッセージのトークン使用量と所要時間を保存する（失敗しても応答には影響させない）"""
+    metadata = response.get("metadata")
+    if not metadata:
+        return
+    try:
+        crud.create_message_usage(db, ai_message, agent_id=agent_id, user_id=user_id, metadata=metadata)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to record usage for message {ai_message.id}: {e}")
+
 @router.post("/", response_model=schemas.ChatWithFirstMessages)
 async def create_chat(
     chat: schemas.ChatCreate,
     request: Request,
     db: Session = Depends(get_db),
     current_user: schemas.User = Depends(get_current_user),
-    llm_service: LLMService = Depends(get_llm_service)
+    llm_service: LLMService = Depends(get_llm_service),
+    image_jobs: ImageJobTracker = Depends(get_image_job_tracker)
 ):
     agent = crud.get_agent(db, chat.agent_id, current_user.id)
     if not agent:
@@ -46,6 +126,7 @@ async def create_chat(
                 chat_id=db_chat.id,
                 user_message_id=user_message.id,
                 websocket=None, # No websocket for the first message
+                defer_image=True,
             )
             
             ai_message_content = response.get("content", "...")
@@ -55,10 +136,16 @@ async def create_chat(
             logger.error(f"Error generating first AI response for chat {db_chat.id}: {e}")
             ai_message_content = "申し訳ございません、最初の応答を生成できませんでした。"
             image_url = None
+            response = {}
 
         # 3. Save AI's first message
         ai_message_schema = schemas.MessageCreate(content=ai_message_content)
-        ai_message = crud.create_message(db=db, message=ai_message_schema, chat_id=db_chat.id, sender="ai", image_url=image_url)
+        ai_message = crud.create_message(
+            db=db, message=ai_message_schema, chat_id=db_chat.id, sender="ai",
+            image_url=image_url, image_status=_image_status(response)
+        )
+        _track_image(image_jobs, response, db_chat.id, ai_message)
+        _record_usage(db, ai_message, agent.id, current_user.id, response)
         messages.append(ai_message)
 
     # Return chat with messages
@@ -97,6 +184,17 @@ def get_messages(chat_id: int, skip: int = 0, limit: int = 100, db: Session = De
     
     return crud.get_messages(db=db, chat_id=chat_id, skip=skip, limit=limit)
 
+@router.get("/{chat_id}/messages/{message_id}", response_model=schemas.Message)
+def get_message(chat_id: int, message_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
+    """メッセージを取得します（image_statusがpendingの間は画像の完成をポーリングできます）。"""
+    chat = crud.get_chat(db, chat_id, current_user.id)
+    if not chat:
+        raise HTTPException(status_code=404, detail="Chat not found")
+    message = crud.get_chat_message(db, chat_id=chat_id, message_id=message_id)
+    if not message:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return message
+
 @router.post("/{chat_id}/messages", response_model=List[schemas.Message])
 async def send_message(
     chat_id: int,
@@ -106,7 +204,9 @@ async def send_message(
     current_user: schemas.User = Depends(get_current_user),
     llm_service: LLMService = Depends(get_llm_service),
     feedback_service: FeedbackService = Depends(get_feedback_service),
-    prompt_builder: PromptBuilder = Depends(get_prompt_builder)
+    prompt_builder: PromptBuilder = Depends(get_prompt_builder),
+    conversation_summarizer: ConversationSummarizer = Depends(get_conversation_summarizer),
+    image_jobs: ImageJobTracker = Depends(get_image_job_tracker)
 ):
     chat = crud.get_chat(db, chat_id, current_user.id)
     if not chat:
@@ -123,15 +223,15 @@ async def send_message(
             raise HTTPException(status_code=404, detail="Agent not found when fetching for prompt")
 
         # Fetch conversation history to include in the prompt display
-        db_messages = crud.get_messages(db, chat_id=chat_id, skip=0, limit=5)
-        context = [
-            {"sender": msg.sender, "content": msg.content}
-            for msg in reversed(db_messages)
-        ]
+        conversation_summary, summary_message_id = crud.get_chat_summary(db, chat_id)
+        context = llm_service.context_assembler.assemble(
+            db, chat_id=chat_id, exclude_message_id=user_message.id, after_id=summary_message_id
+        )
         system_prompt = await prompt_builder.build(
             agent=latest_agent,
             message="",
-            context=context
+            context=context,
+            conversation_summary=conversation_summary
         )
         ai_message_content = f"【システムプロンプト】\n```\n{system_prompt}\n```"
         ai_message_schema = schemas.MessageCreate(content=ai_message_content)
@@ -145,12 +245,8 @@ async def send_message(
         raise HTTPException(status_code=404, detail="Agent for this chat not found")
 
     # --- Second Person Feedback Extraction ---
-    extracted_second_person = await feedback_service.extract_second_person(message.content)
-    if extracted_second_person:
-        agent_update = schemas.AgentUpdate(second_person=extracted_second_person)
-        # Update the agent and get the updated object back
-        agent = crud.update_agent(db=db, agent_id=chat.agent_id, agent=agent_update, user_id=current_user.id)
-    # --- End of Feedback Extraction ---
+    # 抽出は応答生成と並行して実行し、結果は次のターンから反映する
+    extraction_task = asyncio.create_task(feedback_service.extract_second_person(message.content))
     
     try:
         # Get AI response using LLM service, passing the agent object directly
@@ -159,7 +255,11 @@ async def send_message(
             message=message.content,
             agent=agent,
             chat_id=chat_id,
+            user_message_id=user_message.id,
+            defer_image=True,
         )
+        # 抽出の結果は次のターンから使うため、応答を待たせずに返却後に反映する
+        _finish_second_person_extraction_in_background(extraction_task, agent.id, current_user.id)
         
         if response.get("error"):
             # If there's an error, still create an AI message with the error content
@@ -174,10 +274,16 @@ async def send_message(
                 message=ai_message_schema,
                 chat_id=chat_id,
                 sender="ai",
-                image_url=image_url
+                image_url=image_url,
+                image_status=_image_status(response)
             )
+            _track_image(image_jobs, response, chat_id, ai_message)
+            _record_usage(db, ai_message, agent.id, current_user.id, response)
+            # 古いメッセージを要約へ畳み込む（必要な場合のみ、バックグラウンドで実行）
+            conversation_summarizer.schedule(chat_id, agent_name=agent.name)
         
     except Exception as e:
+        extraction_task.cancel()
         # Create an error message as AI response
         error_content = "申し訳ございません、応答の生成中にエラーが発生しました。"
         ai_message_schema = schemas.MessageCreate(content=error_content)
@@ -192,7 +298,10 @@ async def websocket_endpoint(
     db: Session = Depends(get_db),
     llm_service: LLMService = Depends(get_ws_llm_service),
     feedback_service: FeedbackService = Depends(get_feedback_service),
-    prompt_builder: PromptBuilder = Depends(get_prompt_builder)
+    prompt_builder: PromptBuilder = Depends(get_prompt_builder),
+    conversation_summarizer: ConversationSummarizer = Depends(get_conversation_summarizer),
+    event_bus: EventBus = Depends(get_event_bus),
+    image_jobs: ImageJobTracker = Depends(get_image_job_tracker)
 ):
     logger.info(f"WebSocket connection attempt for chat_id: {chat_id}")
     
@@ -219,147 +328,181 @@ async def websocket_endpoint(
 
     await websocket.accept()
     logger.info(f"WebSocket connection accepted for chat {chat_id} with user {user.email}")
-    try:
-        while True:
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
-
-            # --- Special command handling ---
-            if message_data["content"] == "システムプロンプト見せて":
-                # Re-fetch the agent directly to ensure all fields are up-to-date
-                latest_agent = crud.get_agent(db, agent_id=chat.agent_id, user_id=user.id)
-                if not latest_agent:
-                    # This should ideally not happen if the initial check passed
-                    await websocket.send_json({"error": True, "content": "Agent not found."})
+    # 画像の完成などの後から届く更新は、イベントバス経由でこの接続へ転送する
+    with event_bus.subscribe(chat_topic(chat_id)) as events:
+        forwarder = asyncio.create_task(_forward_chat_events(websocket, events))
+        try:
+            while True:
+                data = await websocket.receive_text()
+                message_data = json.loads(data)
+
+                # 生成中の画像の取り消し（message_id を省略するとチャットのすべての画像）
+                if message_data.get("type") == "cancel_image":
+                    message_id = message_data.get("message_id")
+                    if message_id is None:
+                        cancelled = image_jobs.cancel_chat(chat_id)
+                    else:
+                        cancelled = int(image_jobs.cancel(message_id, chat_id=chat_id))
+                    await websocket.send_json({
+                        "type": "image_cancel",
+                        "message_id": message_id,
+                        "cancelled": cancelled,
+                    })
                     continue
 
-                # Build the prompt
-                # Fetch conversation history to include in the prompt display
-                db_messages = crud.get_messages(db, chat_id=chat_id, skip=0, limit=5)
-                context = [
-                    {"sender": msg.sender, "content": msg.content}
-                    for msg in reversed(db_messages)
-                ]
-                system_prompt = await prompt_builder.build(
-                    agent=latest_agent,
-                    message="",
-                    context=context
-                )
+                # --- Special command handling ---
+                if message_data["content"] == "システムプロンプト見せて":
+                    # Re-fetch the agent directly to ensure all fields are up-to-date
+                    latest_agent = crud.get_agent(db, agent_id=chat.agent_id, user_id=user.id)
+                    if not latest_agent:
+                        # This should ideally not happen if the initial check passed
+                        await websocket.send_json({"error": True, "content": "Agent not found."})
+                        continue
+
+                    # Build the prompt
+                    # Fetch conversation history to include in the prompt display
+                    conversation_summary, summary_message_id = crud.get_chat_summary(db, chat_id)
+                    context = llm_service.context_assembler.assemble(
+                        db, chat_id=chat_id, after_id=summary_message_id
+                    )
+                    system_prompt = await prompt_builder.build(
+                        agent=latest_agent,
+                        message="",
+                        context=context,
+                        conversation_summary=conversation_summary
+                    )
                 
-                # Send the prompt as an AI message
+                    # Send the prompt as an AI message
+                    await websocket.send_json({
+                        "id": f"system_prompt_{chat_id}",
+                        "content": f"【システムプロンプト】\n```\n{system_prompt}\n```",
+                        "sender": "ai",
+                        "image_url": None,
+                        "timestamp": datetime.utcnow().isoformat(),
+                        "metadata": {"type": "system_prompt"}
+                    })
+                    continue # Skip the rest of the loop
+
+                # Create user message
+                user_message = schemas.MessageCreate(content=message_data["content"])
+                saved_user_message = crud.create_message(db=db, message=user_message, chat_id=chat_id, sender="user")
+
+                # Get the agent associated with the chat
+                agent = crud.get_agent(db, agent_id=chat.agent_id, user_id=user.id)
+                if not agent:
+                    await websocket.send_json({"error": True, "content": "Agent for this chat not found"})
+                    continue
+
+                # --- Second Person Feedback Extraction ---
+                # 抽出は応答生成と並行して実行し、結果は次のターンから反映する
+                extraction_task = asyncio.create_task(
+                    feedback_service.extract_second_person(saved_user_message.content)
+                )
+
+                # Send user message back to client
                 await websocket.send_json({
-                    "id": f"system_prompt_{chat_id}",
-                    "content": f"【システムプロンプト】\n```\n{system_prompt}\n```",
-                    "sender": "ai",
-                    "image_url": None,
-                    "timestamp": datetime.utcnow().isoformat(),
-                    "metadata": {"type": "system_prompt"}
+                    "id": saved_user_message.id,
+                    "content": saved_user_message.content,
+                    "sender": saved_user_message.sender,
+                    "image_url": saved_user_message.image_url,
+                    "timestamp": saved_user_message.created_at.isoformat()
                 })
-                continue # Skip the rest of the loop
-
-            # Create user message
-            user_message = schemas.MessageCreate(content=message_data["content"])
-            saved_user_message = crud.create_message(db=db, message=user_message, chat_id=chat_id, sender="user")
-
-            # Get the agent associated with the chat
-            agent = crud.get_agent(db, agent_id=chat.agent_id, user_id=user.id)
-            if not agent:
-                await websocket.send_json({"error": True, "content": "Agent for this chat not found"})
-                continue
-
-            # --- Second Person Feedback Extraction ---
-            extracted_second_person = await feedback_service.extract_second_person(saved_user_message.content)
-            if extracted_second_person:
-                agent_update = schemas.AgentUpdate(second_person=extracted_second_person)
-                # Update the agent and get the updated object back
-                agent = crud.update_agent(db=db, agent_id=chat.agent_id, agent=agent_update, user_id=user.id)
-            # --- End of Feedback Extraction ---
-
-            # Send user message back to client
-            await websocket.send_json({
-                "id": saved_user_message.id,
-                "content": saved_user_message.content,
-                "sender": saved_user_message.sender,
-                "image_url": saved_user_message.image_url,
-                "timestamp": saved_user_message.created_at.isoformat()
-            })
             
-            # Send "thinking" status
-            try:
-                await websocket.send_json({
-                    "type": "status",
-                    "status": "thinking",
-                    "message": "考え中..."
-                })
-            except Exception as e:
-                logger.error(f"Failed to send thinking status: {e}")
-
-            # Get AI response
-            try:
-                response = await llm_service.generate_response(
-                    db=db,
-                    message=message_data["content"],
-                    agent=agent,
-                    chat_id=chat_id,
-                    user_message_id=saved_user_message.id,
-                    websocket=websocket, # Pass websocket object
-                )
+                # Send "thinking" status
+                try:
+                    await websocket.send_json({
+                        "type": "status",
+                        "status": "thinking",
+                        "message": "考え中..."
+                    })
+                except Exception as e:
+                    logger.error(f"Failed to send thinking status: {e}")
+
+                # Get AI response
+                try:
+                    response = await llm_service.generate_response(
+                        db=db,
+                        message=message_data["content"],
+                        agent=agent,
+                        chat_id=chat_id,
+                        user_message_id=saved_user_message.id,
+                        websocket=websocket, # Pass websocket object
+                        defer_image=True,
+                    )
+
+                    if response.get("error"):
+                        # エラーレスポンスの構造を統一
+                        error_response = {
+                            "id": f"error_{chat_id}_{datetime.utcnow().timestamp()}",
+                            "content": response.get("content", "エラーが発生しました"),
+                            "sender": "system",
+                            "image_url": None,
+                            "timestamp": datetime.utcnow().isoformat(),
+                            "error": True,
+                            "error_type": response.get("error_type", "unknown"),
+                            "reply_to": saved_user_message.id
+                        }
+                        await websocket.send_json(error_response)
+                        logger.error(f"LLM service returned error: {response}")
+                        await _finish_second_person_extraction(db, agent, extraction_task, user.id)
+                        continue
 
-                if response.get("error"):
-                    # エラーレスポンスの構造を統一
+                    # Save AI message with image URL if present
+                    ai_message = schemas.MessageCreate(content=response["content"])
+                    image_url = response.get("image_url")
+                    saved_ai_message = crud.create_message(
+                        db=db,
+                        message=ai_message,
+                        chat_id=chat_id,
+                        sender="ai",
+                        image_url=image_url,
+                        image_status=_image_status(response)
+                    )
+                    _track_image(image_jobs, response, chat_id, saved_ai_message)
+                    _record_usage(db, saved_ai_message, agent.id, user.id, response)
+                
+                    # Send AI message to client
+                    await websocket.send_json({
+                        "id": saved_ai_message.id,
+                        "content": saved_ai_message.content,
+                        "sender": saved_ai_message.sender,
+                        "image_url": saved_ai_message.image_url,
+                        "image_status": saved_ai_message.image_status,
+                        "timestamp": saved_ai_message.created_at.isoformat(),
+                        "reply_to": saved_user_message.id,
+                        "metadata": response.get("metadata", {})
+                    })
+
+                    # 古いメッセージを要約へ畳み込む（必要な場合のみ、バックグラウンドで実行）
+                    conversation_summarizer.schedule(chat_id, agent_name=agent.name)
+
+                    # 抽出の結果は次のターンから使うため、応答を送った後に待って反映する
+                    await _finish_second_person_extraction(db, agent, extraction_task, user.id)
+                
+                except Exception as e:
+                    extraction_task.cancel()
+                    # This is a fallback for unexpected errors within the router itself.
+                    # The LLMService errors are already handled.
+                    logger.error(f"Unexpected error in WebSocket handler: {e}", exc_info=True)
                     error_response = {
                         "id": f"error_{chat_id}_{datetime.utcnow().timestamp()}",
-                        "content": response.get("content", "エラーが発生しました"),
+                        "content": "申し訳ございません、予期せぬエラーが発生しました。",
                         "sender": "system",
                         "image_url": None,
                         "timestamp": datetime.utcnow().isoformat(),
                         "error": True,
-                        "error_type": response.get("error_type", "unknown")
+                        "error_type": "system_error"
                     }
-                    await websocket.send_json(error_response)
-                    logger.error(f"LLM service returned error: {response}")
-                    continue
-
-                # Save AI message with image URL if present
-                ai_message = schemas.MessageCreate(content=response["content"])
-                image_url = response.get("image_url")
-                saved_ai_message = crud.create_message(
-                    db=db,
-                    message=ai_message,
-                    chat_id=chat_id,
-                    sender="ai",
-                    image_url=image_url
-                )
+                    try:
+                        await websocket.send_json(error_response)
+                    except Exception as send_error:
+                        logger.error(f"Failed to send error response: {send_error}")
                 
-                # Send AI message to client
-                await websocket.send_json({
-                    "id": saved_ai_message.id,
-                    "content": saved_ai_message.content,
-                    "sender": saved_ai_message.sender,
-                    "image_url": saved_ai_message.image_url,
-                    "timestamp": saved_ai_message.created_at.isoformat(),
-                    "metadata": response.get("metadata", {})
-                })
-                
-            except Exception as e:
-                # This is a fallback for unexpected errors within the router itself.
-                # The LLMService errors are already handled.
-                logger.error(f"Unexpected error in WebSocket handler: {e}", exc_info=True)
-                error_response = {
-                    "id": f"error_{chat_id}_{datetime.utcnow().timestamp()}",
-                    "content": "申し訳ございません、予期せぬエラーが発生しました。",
-                    "sender": "system",
-                    "image_url": None,
-                    "timestamp": datetime.utcnow().isoformat(),
-                    "error": True,
-                    "error_type": "system_error"
-                }
-                try:
-                    await websocket.send_json(error_response)
-                except Exception as send_error:
-                    logger.error(f"Failed to send error response: {send_error}")
-                
-    except WebSocketDisconnect:
-        logger.info(f"WebSocket disconnected for chat {chat_id}")
-    except Exception as e:
-        logger.error(f"Unexpected error in WebSocket for chat {chat_id}: {e}", exc_info=True)
+        except WebSocketDisconnect:
+            logger.info(f"WebSocket disconnected for chat {chat_id}")
+        except Exception as e:
+            logger.error(f"Unexpected error in WebSocket for chat {chat_id}: {e}", exc_info=True)
+        finally:
+            forwarder.cancel()
+    # 再接続がないまま猶予時間が過ぎたら、誰も受け取らない画像の生成を取り消す
+    image_jobs.schedule_cancel_unwatched(chat_id)
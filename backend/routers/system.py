@@ -0,0 +1,65 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+
+from auth import get_current_user
+from dependencies import get_llm_client_registry, get_prompt_builder, get_image_job_tracker
+from services.llm_clients.registry import LLMClientRegistry
+from services.prompt_builder import PromptBuilder
+from services.circuit_breaker import circuit_breaker_stats
+from services.image_jobs import ImageJobTracker
+
+# 待ち行列の中身やプロバイダーの状態を含むため、ログイン済みの利用者だけに公開する
+router = APIRouter(prefix="/system", tags=["system"], dependencies=[Depends(get_current_user)])
+
+
+@router.get("/llm-cache")
+def get_llm_cache_stats(registry: LLMClientRegistry = Depends(get_llm_client_registry)):
+    """LLM応答キャッシュのヒット/ミス統計を取得します。"""
+    return registry.response_cache.stats()
+
+
+@router.get("/prompt-cache")
+def get_prompt_cache_stats(prompt_builder: PromptBuilder = Depends(get_prompt_builder)):
+    """描画済みペルソナ部分のキャッシュのヒット/ミス統計を取得します。"""
+    return prompt_builder.prefix_cache.stats()
+
+
+@router.get("/llm-governors")
+def get_llm_governor_stats(registry: LLMClientRegistry = Depends(get_llm_client_registry)):
+    """プロバイダーごとの同時実行数・待ち行列・待ち時間の統計を取得します。"""
+    return registry.governor_stats()
+
+
+@router.get("/circuit-breakers")
+def get_circuit_breaker_states():
+    """LLM・画像生成プロバイダーごとのサーキットブレーカーの状態を取得します。"""
+    return circuit_breaker_stats()
+
+
+@router.get("/image-jobs")
+def get_image_job_stats(image_jobs: ImageJobTracker = Depends(get_image_job_tracker)):
+    """応答の送信後に生成中のチャット画像の件数を取得します。"""
+    return image_jobs.stats()
+
+
+@router.get("/image-queue")
+def get_image_queue_stats(request: Request):
+    """画像生成ジョブの待ち行列（ステータスごとの件数・ワーカー数）の統計を取得します。"""
+    job_queue = getattr(request.app.state, "image_job_queue", None)
+    if job_queue is None:
+        raise HTTPException(status_code=503, detail="Image job queue is not running")
+    return job_queue.stats()
+
+
+@router.get("/render-cache")
+def get_render_cache_stats(request: Request):
+    """固定シードの描画結果キャッシュの件数・合計サイズ・ヒット率を取得します。"""
+    return request.app.state.image_generation_service.render_cache.stats()
+
+
+@router.get("/image-gc")
+def get_image_gc_stats(request: Request):
+    """参照されなくなった画像ファイルの削除（マークアンドスイープ）の設定と前回の結果を取得します。"""
+    image_gc = getattr(request.app.state, "image_gc", None)
+    if image_gc is None:
+        raise HTTPException(status_code=503, detail="Image garbage collector is not running")
+    return image_gc.stats()
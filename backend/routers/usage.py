@@ -0,0 +1,29 @@
+from datetime import date
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+import crud
+import schemas
+from auth import get_current_user
+from database import get_db
+
+router = APIRouter(prefix="/usage", tags=["usage"])
+
+
+@router.get("/summary", response_model=List[schemas.UsageSummary])
+def get_usage_summary(
+    group_by: Literal["agent", "day"] = "day",
+    agent_id: Optional[int] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    db: Session = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_user),
+):
+    """ログインユーザーのトークン使用量と応答時間をエージェントごと・日ごとに集計します。"""
+    if agent_id is not None and not crud.get_agent(db, agent_id, current_user.id):
+        raise HTTPException(status_code=404, detail="Agent not found")
+    return crud.get_usage_summary(
+        db, user_id=current_user.id, group_by=group_by, agent_id=agent_id, start=start, end=end
+    )
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
 from datetime import datetime
 
 class Token(BaseModel):
@@ -130,6 +130,9 @@ class Message(MessageBase):
     chat_id: int
     sender: str
     image_url: Optional[str] = None
+    image_status: Optional[str] = None
+    # {"srcset": {幅: URL}, "placeholder": data URI, "width": .., "height": ..}
+    variants: Optional[Dict[str, Any]] = None
     created_at: datetime
 
     class Config:
@@ -145,6 +148,7 @@ class AgentImageCreate(AgentImageBase):
 class AgentImage(AgentImageBase):
     id: int
     agent_id: int
+    variants: Optional[Dict[str, Any]] = None
     created_at: datetime
 
     class Config:
@@ -174,4 +178,16 @@ class ImageGenerationLog(ImageGenerationLogBase):
     created_at: datetime
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+class UsageSummary(BaseModel):
+    key: str
+    messages: int
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+    estimated_messages: int
+    avg_llm_ms: Optional[int] = None
+    avg_first_token_ms: Optional[int] = None
+    avg_total_ms: Optional[int] = None
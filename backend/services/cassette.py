@@ -0,0 +1,142 @@
+import os
+import gzip
+import json
+import base64
+import hashlib
+import logging
+import threading
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "record", "replay")
+PACES = ("fast", "recorded")
+
+
+def request_key(kind: str, *parts: Any) -> str:
+    """リクエスト内容から照合用のキーを作成"""
+    payload = json.dumps([kind, *parts], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def encode_bytes(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def decode_bytes(data: str) -> bytes:
+    return base64.b64decode(data)
+
+
+class Cassette:
+    """プロバイダーとの通信を記録・再生する gzip 圧縮の JSON Lines ファイル
+
+    record モードでは1リクエストごとに1行追記し、
+    replay モードでは種類とリクエストのキーが一致する記録を優先して、
+    なければ同じ種類の記録を記録順に（末尾に達したら先頭から）返す。
+    """
+
+    def __init__(self, path: str, mode: str = "replay", pace: str = "fast"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        if pace not in PACES:
+            raise ValueError(f"Unknown cassette pace: {pace}")
+        self.path = path
+        self.mode = mode
+        self.pace = pace
+        self._lock = threading.Lock()
+        self._writer = None
+        self._by_key: Dict[Tuple[str, str], Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._by_kind: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._cursor: Dict[str, int] = defaultdict(int)
+
+        if mode == "replay":
+            self._load()
+        else:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._writer = gzip.open(path, "at", encoding="utf-8")
+        logger.info(f"Cassette {path} opened in {mode} mode (pace={pace})")
+
+    @property
+    def realtime(self) -> bool:
+        """記録時のペースで再生するか"""
+        return self.pace == "recorded"
+
+    def _load(self) -> None:
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self._by_key[(entry["kind"], entry["key"])].append(entry)
+                self._by_kind[entry["kind"]].append(entry)
+        logger.info(
+            f"Loaded cassette {self.path}: "
+            + ", ".join(f"{kind}={len(entries)}" for kind, entries in self._by_kind.items())
+        )
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        """1件の記録を追記"""
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            if self._writer is None:
+                raise RuntimeError("Cassette is not open for recording")
+            self._writer.write(line + "\n")
+            self._writer.flush()
+
+    def has_match(self, kind: str, key: str) -> bool:
+        """種類とキーが一致する記録があるか"""
+        with self._lock:
+            return bool(self._by_key.get((kind, key)))
+
+    def next_entry(self, kind: str, key: str) -> Dict[str, Any]:
+        """再生する記録を取得（種類とキーの一致 → 同じ種類の記録順の順に探す）"""
+        with self._lock:
+            matches = self._by_key.get((kind, key))
+            if matches:
+                entry = matches.popleft()
+                # 同じリクエストが繰り返された場合も同じ記録を返す
+                matches.append(entry)
+                return entry
+            entries = self._by_kind.get(kind)
+            if not entries:
+                raise Exception(f"Cassette API error: no recorded {kind} interactions in {self.path}")
+            entry = entries[self._cursor[kind] % len(entries)]
+            self._cursor[kind] += 1
+            return entry
+
+    def close(self) -> None:
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+_cassette: Optional[Cassette] = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette_from_env() -> Optional[Cassette]:
+    """CASSETTE_PATH / CASSETTE_MODE / CASSETTE_PACE からプロセス共有のカセットを取得"""
+    global _cassette
+    mode = os.getenv("CASSETTE_MODE", "off").lower()
+    if mode not in MODES:
+        raise ValueError(f"Unknown CASSETTE_MODE: {mode}")
+    if mode == "off":
+        return None
+    with _cassette_lock:
+        if _cassette is None:
+            path = os.getenv("CASSETTE_PATH", "cassettes/traffic.jsonl.gz")
+            _cassette = Cassette(path, mode=mode, pace=os.getenv("CASSETTE_PACE", "fast").lower())
+        return _cassette
+
+
+def close_cassette() -> None:
+    """プロセス共有のカセットを閉じる（アプリ終了時）"""
+    global _cassette
+    with _cassette_lock:
+        if _cassette is not None:
+            _cassette.close()
+            _cassette = None
@@ -0,0 +1,290 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 一時的な障害とみなすエラーメッセージの断片
+TRANSIENT_ERROR_MARKERS = (
+    "timeout",
+    "timed out",
+    "connection",
+    "connect",
+    "temporarily",
+    "unavailable",
+    "not available",
+    "429",
+    "500",
+    "502",
+    "503",
+    "504",
+    "resource exhausted",
+    "overloaded",
+)
+
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているため呼び出しを行わなかった"""
+
+
+def counts_as_failure(error: Exception) -> bool:
+    """ブレーカーの失敗として数えるか（自プロセス側で断った呼び出しは数えない）"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    return "rate limited" not in str(error).lower()
+
+
+def is_transient_error(error: Exception) -> bool:
+    """リトライで回復が見込める一時的なエラーかを判定"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    message = str(error).lower()
+    if "rate limited" in message:
+        # 自プロセスの同時実行数制限は混雑の合図なのでリトライしない
+        return False
+    return any(marker in message for marker in TRANSIENT_ERROR_MARKERS)
+
+
+def is_retryable_llm_error(error: Exception) -> bool:
+    """
+    LLMの呼び出しをリトライするかを判定
+
+    タイムアウトは1回でタイムアウト秒数を使い切っているため、同じプロバイダーでやり直すと
+    障害中の待ち時間が倍になる。リトライせずに次のプロバイダーへ切り替えさせる。
+    """
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+        return False
+    message = str(error).lower()
+    if "timeout" in message or "timed out" in message:
+        return False
+    return is_transient_error(error)
+
+
+class CircuitBreaker:
+    """プロバイダーごとのサーキットブレーカー
+
+    連続して failure_threshold 回失敗すると open になり、recovery_timeout 秒の間は
+    呼び出しを行わずに CircuitOpenError を返す。その後 half_open になり、
+    half_open_max_calls 件の試行呼び出しが成功すれば closed に戻る。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        half_open_max_calls: int = 1,
+        is_failure: Callable[[Exception], bool] = counts_as_failure,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.is_failure = is_failure
+
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._half_open_in_flight = 0
+        self._lock = threading.Lock()
+
+        self.total_calls = 0
+        self.total_failures = 0
+        self.total_rejected = 0
+        self.last_error: Optional[str] = None
+        self.last_state_change: float = time.time()
+
+    @classmethod
+    def from_env(cls, name: str, env_prefix: str, **defaults: Any) -> "CircuitBreaker":
+        """<PREFIX>_BREAKER_* 環境変数から設定を読み込んで生成"""
+        return cls(
+            name=name,
+            failure_threshold=int(os.getenv(f"{env_prefix}_BREAKER_FAILURE_THRESHOLD", defaults.get("failure_threshold", 5))),
+            recovery_timeout=float(os.getenv(f"{env_prefix}_BREAKER_RECOVERY_TIMEOUT", defaults.get("recovery_timeout", 30))),
+            half_open_max_calls=int(os.getenv(f"{env_prefix}_BREAKER_HALF_OPEN_CALLS", defaults.get("half_open_max_calls", 1))),
+        )
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _set_state(self, state: str) -> None:
+        if self._state != state:
+            logger.warning(f"Circuit breaker {self.name}: {self._state} -> {state}")
+            self._state = state
+            self.last_state_change = time.time()
+
+    def _maybe_half_open(self) -> None:
+        if self._state == self.OPEN and self._opened_at is not None:
+            if time.monotonic() - self._opened_at >= self.recovery_timeout:
+                self._set_state(self.HALF_OPEN)
+                self._half_open_in_flight = 0
+
+    def before_call(self) -> bool:
+        """呼び出し可否を判定（開いている場合は CircuitOpenError）
+
+        Returns:
+            half_open の試行呼び出しとして許可された場合はTrue
+        """
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.OPEN or (
+                self._state == self.HALF_OPEN and self._half_open_in_flight >= self.half_open_max_calls
+            ):
+                self.total_rejected += 1
+                raise CircuitOpenError(f"{self.name} circuit open: failing fast after repeated errors")
+            self.total_calls += 1
+            if self._state == self.HALF_OPEN:
+                self._half_open_in_flight += 1
+                return True
+            return False
+
+    def record_success(self, trial: bool = False) -> None:
+        with self._lock:
+            if trial:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+            self._consecutive_failures = 0
+            if self._state == self.HALF_OPEN:
+                self._set_state(self.CLOSED)
+
+    def record_failure(self, error: Exception, trial: bool = False) -> None:
+        with self._lock:
+            if trial:
+                self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+            if not self.is_failure(error):
+                return
+            self.total_failures += 1
+            self._consecutive_failures += 1
+            self.last_error = str(error)[:200]
+            if self._state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                self._set_state(self.OPEN)
+                self._opened_at = time.monotonic()
+
+    def release_trial(self) -> None:
+        """結果を記録せずに試行呼び出しの枠を返却（キャンセル時など）"""
+        with self._lock:
+            self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+
+    async def call(self, func: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+        """ブレーカーを通して非同期関数を呼び出す"""
+        trial = self.before_call()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(e, trial=trial)
+            raise
+        except BaseException:
+            if trial:
+                self.release_trial()
+            raise
+        self.record_success(trial=trial)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        state = self.state
+        with self._lock:
+            retry_in = None
+            if state == self.OPEN and self._opened_at is not None:
+                retry_in = max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+            return {
+                "name": self.name,
+                "state": state,
+                "consecutive_failures": self._consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "recovery_timeout": self.recovery_timeout,
+                "retry_in_seconds": retry_in,
+                "total_calls": self.total_calls,
+                "total_failures": self.total_failures,
+                "total_rejected": self.total_rejected,
+                "last_error": self.last_error,
+                "last_state_change": self.last_state_change,
+            }
+
+
+class RetryPolicy:
+    """一時的なエラーに対する、上限付きでジッターを加えた指数バックオフ"""
+
+    def __init__(
+        self,
+        max_attempts: int = 2,
+        base_delay: float = 0.5,
+        max_delay: float = 4.0,
+        is_retryable: Callable[[Exception], bool] = is_transient_error,
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.is_retryable = is_retryable
+
+    @classmethod
+    def from_env(
+        cls, env_prefix: str, is_retryable: Callable[[Exception], bool] = is_transient_error, **defaults: Any
+    ) -> "RetryPolicy":
+        """<PREFIX>_RETRY_* 環境変数から設定を読み込んで生成"""
+        return cls(
+            max_attempts=int(os.getenv(f"{env_prefix}_RETRY_MAX_ATTEMPTS", defaults.get("max_attempts", 2))),
+            base_delay=float(os.getenv(f"{env_prefix}_RETRY_BASE_DELAY", defaults.get("base_delay", 0.5))),
+            max_delay=float(os.getenv(f"{env_prefix}_RETRY_MAX_DELAY", defaults.get("max_delay", 4.0))),
+            is_retryable=is_retryable,
+        )
+
+    def backoff(self, attempt: int) -> float:
+        """attempt回目の失敗後の待ち時間（フルジッター）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    async def run(
+        self,
+        func: Callable[..., Awaitable[T]],
+        *args: Any,
+        breaker: Optional[CircuitBreaker] = None,
+        **kwargs: Any,
+    ) -> T:
+        """一時的なエラーの場合はリトライしながら呼び出す"""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                if breaker is not None:
+                    return await breaker.call(func, *args, **kwargs)
+                return await func(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_attempts or not self.is_retryable(e):
+                    raise
+                delay = self.backoff(attempt)
+                logger.warning(f"Transient error (attempt {attempt}/{self.max_attempts}), retrying in {delay:.2f}s: {e}")
+                await asyncio.sleep(delay)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str, env_prefix: str, **defaults: Any) -> CircuitBreaker:
+    """名前ごとに共有されるサーキットブレーカーを取得（未生成の場合は生成）"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker.from_env(name, env_prefix, **defaults)
+            _breakers[name] = breaker
+        return breaker
+
+
+def circuit_breaker_stats() -> Dict[str, Dict[str, Any]]:
+    """全サーキットブレーカーの状態"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.stats() for breaker in breakers}
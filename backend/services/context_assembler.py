@@ -0,0 +1,101 @@
+import os
+import logging
+from typing import Dict, List, Optional
+from sqlalchemy.orm import Session
+
+import crud
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """ローカルで高速にトークン数を概算する
+
+    日本語などの非ASCII文字は1文字≒1トークン、ASCII文字は4文字≒1トークンとして数える。
+    """
+    if not text:
+        return 0
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    non_ascii_chars = len(text) - ascii_chars
+    return non_ascii_chars + (ascii_chars + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """概算トークン数が上限に収まるよう末尾を切り詰める"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 二分探索で上限に収まる最長の先頭部分を求める
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) + 1 <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + "…"
+
+
+class ContextAssembler:
+    """トークン予算内で直近の会話履歴を組み立てる"""
+
+    def __init__(
+        self,
+        token_budget: Optional[int] = None,
+        max_message_tokens: Optional[int] = None,
+        max_messages: Optional[int] = None,
+        page_size: int = 20,
+    ):
+        self.token_budget = token_budget or int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+        self.max_message_tokens = max_message_tokens or int(os.getenv("CONTEXT_MAX_MESSAGE_TOKENS", "300"))
+        self.max_messages = max_messages or int(os.getenv("CONTEXT_MAX_MESSAGES", "50"))
+        self.page_size = page_size
+
+    def assemble(
+        self,
+        db: Session,
+        chat_id: Optional[int],
+        exclude_message_id: Optional[int] = None,
+        after_id: Optional[int] = None,
+    ) -> List[Dict[str, str]]:
+        """
+        直近のメッセージから順にトークン予算を満たすまで履歴を集める
+
+        Args:
+            db: データベースセッション
+            chat_id: チャットID
+            exclude_message_id: 除外するメッセージID（現在のユーザー発話など）
+            after_id: このID以前のメッセージは含めない（要約済みのメッセージなど）
+
+        Returns:
+            古い順に並んだ会話履歴
+        """
+        if chat_id is None:
+            return []
+
+        context: List[Dict[str, str]] = []
+        used_tokens = 0
+        before_id = None
+        scanned = 0
+
+        while scanned < self.max_messages:
+            page = crud.get_recent_messages(
+                db, chat_id=chat_id, limit=min(self.page_size, self.max_messages - scanned), before_id=before_id
+            )
+            if not page:
+                break
+
+            for msg in page:
+                if after_id is not None and msg.id <= after_id:
+                    return list(reversed(context))
+                scanned += 1
+                before_id = msg.id
+                if msg.id == exclude_message_id:
+                    continue
+                content = truncate_to_tokens(msg.content or "", self.max_message_tokens)
+                tokens = estimate_tokens(content)
+                if used_tokens + tokens > self.token_budget:
+                    return list(reversed(context))
+                used_tokens += tokens
+                context.append({"sender": msg.sender, "content": content})
+
+        return list(reversed(context))
@@ -0,0 +1,121 @@
+import os
+import asyncio
+import logging
+from typing import Callable, Dict, Optional
+from sqlalchemy.orm import Session
+
+import crud
+from .prompt_builder import PromptBuilder
+from .llm_clients.base import LLMClientInterface
+from .context_assembler import truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationSummarizer:
+    """チャットごとの要約を、新しいメッセージだけを畳み込んで段階的に更新する
+
+    要約済みのメッセージIDを Chat.summary_message_id に保持し、
+    それ以降のメッセージが keep_recent + every 件たまったときに、
+    直近 keep_recent 件を除いた古い分だけを既存の要約へ統合する。
+    会話履歴全体を読み直すことはない。
+    """
+
+    TEMPLATE_NAME = "summarize_conversation.j2"
+
+    # 要約中のチャット（プロセス内で同じチャットの要約を重複実行しない）
+    _in_flight: Dict[int, "asyncio.Task[Optional[str]]"] = {}
+
+    def __init__(
+        self,
+        prompt_builder: PromptBuilder,
+        llm_client: LLMClientInterface,
+        every: Optional[int] = None,
+        keep_recent: Optional[int] = None,
+        max_fold_messages: Optional[int] = None,
+        max_chars: Optional[int] = None,
+        max_message_tokens: Optional[int] = None,
+        session_factory: Optional[Callable[[], Session]] = None,
+    ):
+        self.prompt_builder = prompt_builder
+        self.llm_client = llm_client
+        self.every = every if every is not None else int(os.getenv("CHAT_SUMMARY_EVERY", "10"))
+        self.keep_recent = keep_recent if keep_recent is not None else int(os.getenv("CHAT_SUMMARY_KEEP_RECENT", "10"))
+        self.max_fold_messages = max_fold_messages or int(os.getenv("CHAT_SUMMARY_MAX_FOLD", "40"))
+        self.max_chars = max_chars or int(os.getenv("CHAT_SUMMARY_MAX_CHARS", "600"))
+        self.max_message_tokens = max_message_tokens or int(os.getenv("CONTEXT_MAX_MESSAGE_TOKENS", "300"))
+        self.session_factory = session_factory
+
+    @property
+    def enabled(self) -> bool:
+        return self.every > 0
+
+    def schedule(self, chat_id: int, agent_name: Optional[str] = None) -> Optional["asyncio.Task[Optional[str]]"]:
+        """要約の更新をバックグラウンドで開始（実行中の場合は何もしない）"""
+        if not self.enabled or chat_id in self._in_flight:
+            return None
+        task = asyncio.create_task(self._run(chat_id, agent_name))
+        self._in_flight[chat_id] = task
+        task.add_done_callback(lambda _: self._in_flight.pop(chat_id, None))
+        return task
+
+    async def _run(self, chat_id: int, agent_name: Optional[str]) -> Optional[str]:
+        # リクエストのセッションは応答後に閉じられるため、専用のセッションを使う
+        if self.session_factory is None:
+            from database import SessionLocal
+            self.session_factory = SessionLocal
+        db = self.session_factory()
+        try:
+            return await self.update(db, chat_id, agent_name)
+        except Exception as e:
+            logger.error(f"Failed to update conversation summary for chat {chat_id}: {e}", exc_info=True)
+            return None
+        finally:
+            db.close()
+
+    async def update(self, db: Session, chat_id: int, agent_name: Optional[str] = None) -> Optional[str]:
+        """
+        未要約のメッセージが十分たまっていれば要約を更新する
+
+        Args:
+            db: データベースセッション
+            chat_id: チャットID
+            agent_name: 要約中で使うエージェント名
+
+        Returns:
+            更新後の要約（更新しなかった場合はNone）
+        """
+        summary, summary_message_id = crud.get_chat_summary(db, chat_id)
+        foldable = crud.count_messages_after(db, chat_id, after_id=summary_message_id) - self.keep_recent
+        if foldable < self.every:
+            return None
+
+        # 一度に畳み込む件数を制限し、残りは次回以降に回す
+        messages = crud.get_messages_after(
+            db, chat_id, after_id=summary_message_id, limit=min(foldable, self.max_fold_messages)
+        )
+        if not messages:
+            return None
+
+        prompt = await self.prompt_builder.build(
+            message="",
+            template_name=self.TEMPLATE_NAME,
+            agent_name=agent_name,
+            previous_summary=summary,
+            new_messages=[
+                {"sender": msg.sender, "content": truncate_to_tokens(msg.content or "", self.max_message_tokens)}
+                for msg in messages
+            ],
+            max_chars=self.max_chars,
+        )
+        raw_response = await self.llm_client.generate(prompt, call_type="summary")
+        new_summary = (raw_response.get("content") or "").strip()
+        if not new_summary:
+            logger.warning(f"Empty conversation summary returned for chat {chat_id}")
+            return None
+        if len(new_summary) > self.max_chars:
+            new_summary = new_summary[: self.max_chars] + "…"
+
+        crud.update_chat_summary(db, chat_id, summary=new_summary, summary_message_id=messages[-1].id)
+        logger.info(f"Folded {len(messages)} messages into conversation summary for chat {chat_id}")
+        return new_summary
@@ -4,6 +4,8 @@ from enum import Enum
 
 class ErrorType(Enum):
     API_ERROR = "api_error"
+    RATE_LIMITED = "rate_limited"
+    SERVICE_UNAVAILABLE = "service_unavailable"
     TIMEOUT = "timeout"
     INVALID_RESPONSE = "invalid_response"
     AGENT_NOT_FOUND = "agent_not_found"
@@ -16,6 +18,8 @@ class ErrorHandler:
         self.logger = logger
         self.fallback_responses = {
             ErrorType.API_ERROR: "申し訳ございません、AIとの接続に問題が発生しました。",
+            ErrorType.SERVICE_UNAVAILABLE: "申し訳ございません、AIが一時的に利用できません。しばらくしてからもう一度お試しください。",
+            ErrorType.RATE_LIMITED: "ただいま混み合っています。少し時間をおいてから、もう一度話しかけてください。",
             ErrorType.TIMEOUT: "申し訳ございません、AIの応答が時間内に得られませんでした。",
             ErrorType.INVALID_RESPONSE: "申し訳ございません、AIから予期せぬ応答がありました。",
             ErrorType.AGENT_NOT_FOUND: "指定されたエージェントが見つかりませんでした。",
@@ -53,6 +57,10 @@ class ErrorHandler:
             return ErrorType.AGENT_NOT_FOUND
         elif "invalid response" in error_message:
             return ErrorType.INVALID_RESPONSE
+        elif "circuit open" in error_message:
+            return ErrorType.SERVICE_UNAVAILABLE
+        elif "rate limited" in error_message or "429" in error_message or "resource exhausted" in error_message:
+            return ErrorType.RATE_LIMITED
         elif "api error" in error_message:
             return ErrorType.API_ERROR
         else:
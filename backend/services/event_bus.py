@@ -0,0 +1,55 @@
+import asyncio
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Set
+
+logger = logging.getLogger(__name__)
+
+
+def chat_topic(chat_id: int) -> str:
+    """チャットごとのイベントのトピック名"""
+    return f"chat:{chat_id}"
+
+
+def image_job_topic(job_id: int) -> str:
+    """画像生成ジョブごとの進捗イベントのトピック名"""
+    return f"image_job:{job_id}"
+
+
+class EventBus:
+    """プロセス内のイベント配信
+
+    トピックごとに購読者のキューを保持し、publishしたイベントを全購読者へ配る。
+    購読者の処理が追いつかずキューがあふれた場合は古いイベントから捨てる。
+    """
+
+    def __init__(self, max_queue: int = 100):
+        self.max_queue = max_queue
+        self._subscribers: Dict[str, Set["asyncio.Queue[Dict[str, Any]]"]] = {}
+
+    def publish(self, topic: str, event: Dict[str, Any]) -> int:
+        """イベントを配信し、配信した購読者の数を返す"""
+        queues = list(self._subscribers.get(topic, ()))
+        for queue in queues:
+            if queue.full():
+                dropped = queue.get_nowait()
+                logger.warning(f"Event queue for {topic} is full, dropped {dropped.get('type')} event")
+            queue.put_nowait(event)
+        return len(queues)
+
+    @contextmanager
+    def subscribe(self, topic: str) -> Iterator["asyncio.Queue[Dict[str, Any]]"]:
+        """トピックを購読する（withブロックを抜けると購読を解除）"""
+        queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=self.max_queue)
+        self._subscribers.setdefault(topic, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            subscribers = self._subscribers.get(topic)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[topic]
+
+    def subscriber_count(self, topic: str) -> int:
+        return len(self._subscribers.get(topic, ()))
@@ -3,6 +3,8 @@ import re
 from typing import Dict, Any, Optional
 from .prompt_builder import PromptBuilder
 from .llm_clients.base import LLMClientInterface
+from .llm_clients.response_cache import make_cache_key
+from .second_person_prefilter import SecondPersonPrefilter
 from .error_handler import ErrorHandler
 import logging
 
@@ -16,20 +18,32 @@ class FeedbackService:
         prompt_builder: PromptBuilder,
         llm_client: LLMClientInterface,
         error_handler: ErrorHandler,
+        second_person_prefilter: Optional[SecondPersonPrefilter] = None,
     ):
         self.prompt_builder = prompt_builder
         self.llm_client = llm_client
         self.error_handler = error_handler
+        self.second_person_prefilter = second_person_prefilter or SecondPersonPrefilter()
 
     async def extract_second_person(self, message: str) -> Optional[str]:
         """ユーザーメッセージから二人称を抽出する"""
+        # 呼び方の指定が含まれえないメッセージではLLMを呼ばない
+        if not self.second_person_prefilter.may_contain_naming(message):
+            return None
+
         try:
+            template_name = "extract_second_person.j2"
             prompt = await self.prompt_builder.build(
                 message=message,
-                template_name="extract_second_person.j2"
+                template_name=template_name
             )
             
-            raw_response = await self.llm_client.generate(prompt)
+            # 同じ言い回しの抽出結果は決定的なので応答キャッシュを利用する
+            raw_response = await self.llm_client.generate(
+                prompt,
+                cache_key=make_cache_key(template_name, message),
+                call_type="feedback"
+            )
             response_content = raw_response.get("content", "")
 
             # 正規表現でJSONブロックを抽出する、より堅牢な方法
@@ -0,0 +1,103 @@
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+import crud
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationLogStore:
+    """画像生成ログをジョブ単位で保持する
+
+    実行中・直近のログはプロセス内のLRU（最大 max_entries 件）に置き、
+    image_jobs.log へ書き出す。進捗の更新は flush_interval 秒ごとにまとめて書き出すため、
+    別のプロセスのワーカーが処理しているジョブもDBから参照できる。
+    ジョブを経由しない生成（待ち行列の未起動時）のログはLRUにのみ残る。
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        session_factory: Optional[Callable[[], Session]] = None,
+    ):
+        self.max_entries = max_entries or int(os.getenv("IMAGE_GENERATION_LOG_CACHE_SIZE", "256"))
+        self.flush_interval = (
+            flush_interval if flush_interval is not None
+            else float(os.getenv("IMAGE_GENERATION_LOG_FLUSH_INTERVAL", "2.0"))
+        )
+        self.session_factory = session_factory
+        self._logs: "OrderedDict[Any, Dict[str, Any]]" = OrderedDict()
+        self._flushed_at: Dict[Any, float] = {}
+
+    def _session(self) -> Session:
+        if self.session_factory is None:
+            from database import SessionLocal
+            self.session_factory = SessionLocal
+        return self.session_factory()
+
+    def __len__(self) -> int:
+        return len(self._logs)
+
+    def start(self, job_id: Optional[int], agent_id: int, kind: str, provider: str) -> Dict[str, Any]:
+        """ジョブの生成ログを作成（同じジョブの再試行では上書きする）"""
+        key = job_id if job_id is not None else f"local-{uuid.uuid4().hex}"
+        log = {
+            "job_id": job_id,
+            "agent_id": agent_id,
+            "kind": kind,
+            "status": "started",
+            "started_at": datetime.now().isoformat(),
+            "provider": provider,
+            "steps": [],
+            "progress": 0.0,
+        }
+        self._logs[key] = log
+        self._logs.move_to_end(key)
+        while len(self._logs) > self.max_entries:
+            evicted, _ = self._logs.popitem(last=False)
+            self._flushed_at.pop(evicted, None)
+        return log
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        log = self._logs.get(job_id)
+        if log is not None:
+            self._logs.move_to_end(job_id)
+        return log
+
+    def recent_local(self, agent_id: int) -> List[Dict[str, Any]]:
+        """ジョブを経由しなかった生成のログを新しい順に取得"""
+        return [
+            log for log in reversed(self._logs.values())
+            if log["job_id"] is None and log["agent_id"] == agent_id
+        ]
+
+    def update_progress(self, log: Dict[str, Any], progress: float, eta: Optional[float] = None) -> None:
+        """進捗（と残り秒数）を更新し、前回の書き出しから flush_interval 秒以上経っていれば書き出す"""
+        log["progress"] = round(progress, 1)
+        if eta is not None:
+            log["eta"] = round(eta, 1)
+        last = self._flushed_at.get(log["job_id"], 0.0)
+        if time.monotonic() - last >= self.flush_interval:
+            self.flush(log)
+
+    def flush(self, log: Dict[str, Any]) -> None:
+        """ログを image_jobs.log に書き出す"""
+        job_id = log["job_id"]
+        if job_id is None:
+            return
+        self._flushed_at[job_id] = time.monotonic()
+        db = self._session()
+        try:
+            crud.save_image_job_log(db, job_id, dict(log, steps=[dict(step) for step in log["steps"]]))
+        except Exception as e:
+            logger.warning(f"Failed to flush generation log of image job {job_id}: {e}")
+        finally:
+            db.close()
@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from sqlalchemy.orm import Session
+
+import crud
+from services.image_storage import ImageStore, LEGACY_URL_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# レポートに含める削除対象の例の数
+SAMPLE_LIMIT = 50
+
+
+def _chunks(iterable, size: int) -> Iterator[List[Any]]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ImageGarbageCollector:
+    """どこからも参照されなくなった画像ファイルを削除するマークアンドスイープ
+
+    マーク: エージェント・ギャラリー・メッセージ（縮小版を含む）・生成ログ・ジョブの
+    画像URLから参照中のファイルの集合を作る。
+    スイープ: image_blobs の登録、保存先のファイル、移行前の static/agent_images を
+    batch_size 件ずつ走査し、参照されておらず grace_period 秒より古いものを削除する。
+    解放されて参照数（ref_count）が0になった画像のほか、参照数が漏れた画像や、
+    チャット・エージェントの削除で取り残された画像も対象になる。
+    """
+
+    def __init__(
+        self,
+        image_store: ImageStore,
+        grace_period: Optional[float] = None,
+        interval: Optional[float] = None,
+        batch_size: Optional[int] = None,
+        batch_pause: Optional[float] = None,
+        dry_run: Optional[bool] = None,
+        session_factory: Optional[Callable[[], Session]] = None,
+    ):
+        self.image_store = image_store
+        self.grace_period = grace_period if grace_period is not None else float(os.getenv("IMAGE_GC_GRACE_PERIOD", "86400"))
+        self.interval = interval if interval is not None else float(os.getenv("IMAGE_GC_INTERVAL", "21600"))
+        self.batch_size = batch_size or int(os.getenv("IMAGE_GC_BATCH_SIZE", "500"))
+        self.batch_pause = batch_pause if batch_pause is not None else float(os.getenv("IMAGE_GC_BATCH_PAUSE", "0.05"))
+        self.dry_run = dry_run if dry_run is not None else os.getenv("IMAGE_GC_DRY_RUN", "false").lower() == "true"
+        self.session_factory = session_factory
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._lock = asyncio.Lock()
+
+    def _session(self) -> Session:
+        if self.session_factory is None:
+            from database import SessionLocal
+            self.session_factory = SessionLocal
+        return self.session_factory()
+
+    def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        # 起動直後の負荷を避けるため、最初の実行は少し待つ
+        await asyncio.sleep(min(self.interval, 600))
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Image garbage collection failed: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self, dry_run: Optional[bool] = None) -> Dict[str, Any]:
+        """別スレッドで1回実行する（同時に実行されるのは1回まで）"""
+        async with self._lock:
+            return await asyncio.get_running_loop().run_in_executor(None, self.collect, dry_run)
+
+    def _mark(self, db: Session) -> Tuple[Set[str], Set[str]]:
+        """参照中の保存先のキーと、移行前のファイル名の集合を作る"""
+        keys: Set[str] = set()
+        legacy_names: Set[str] = set()
+        for url in crud.iter_referenced_image_urls(db, batch_size=self.batch_size):
+            key = self.image_store.driver.key_for_url(url)
+            if key is not None:
+                keys.add(key)
+                continue
+            path = urlparse(url).path
+            if path.startswith(LEGACY_URL_PREFIX):
+                legacy_names.add(Path(path).name)
+        return keys, legacy_names
+
+    def collect(self, dry_run: Optional[bool] = None) -> Dict[str, Any]:
+        """マークとスイープを1回行い、結果のレポートを返す"""
+        dry_run = self.dry_run if dry_run is None else dry_run
+        started = time.monotonic()
+        report: Dict[str, Any] = {
+            "dry_run": dry_run,
+            "started_at": datetime.utcnow().isoformat(),
+            "grace_period": self.grace_period,
+            "referenced": 0,
+            "blobs_scanned": 0,
+            "files_scanned": 0,
+            "legacy_files_scanned": 0,
+            "orphaned": 0,
+            "orphaned_bytes": 0,
+            "deleted": 0,
+            "samples": [],
+        }
+        db = self._session()
+        try:
+            blobs = self._snapshot_blobs(db)
+            keys, legacy_names = self._mark(db)
+            report["referenced"] = len(keys) + len(legacy_names)
+            cutoff = time.time() - self.grace_period
+            self._sweep_blobs(db, blobs, keys, datetime.utcnow() - timedelta(seconds=self.grace_period), dry_run, report)
+            self._sweep_files(db, keys, cutoff, dry_run, report)
+            self._sweep_legacy(legacy_names, cutoff, dry_run, report)
+        finally:
+            db.close()
+        report["duration"] = round(time.monotonic() - started, 3)
+        self.last_report = report
+        logger.info(
+            f"Image GC{' (dry run)' if dry_run else ''}: {report['orphaned']} orphaned "
+            f"({report['orphaned_bytes']} bytes), {report['deleted']} deleted"
+        )
+        return report
+
+    def _orphan(self, report: Dict[str, Any], name: str, size: int) -> None:
+        report["orphaned"] += 1
+        report["orphaned_bytes"] += size
+        if len(report["samples"]) < SAMPLE_LIMIT:
+            report["samples"].append(name)
+
+    def _snapshot_blobs(self, db: Session) -> List[Tuple[str, int, int, Optional[datetime]]]:
+        """マークの前に image_blobs の参照数を読み取る
+
+        マーク後に同じ内容が保存されると参照数が増えるため、削除時にこの値と比べて
+        変わっていれば消さない（新しい参照がまだマークに現れていない可能性がある）。
+        """
+        blobs = []
+        after_id = 0
+        while True:
+            batch = crud.get_image_blobs_after(db, after_id, limit=self.batch_size)
+            if not batch:
+                return blobs
+            after_id = batch[-1].id
+            blobs.extend((blob.storage_key, blob.ref_count, blob.size, blob.created_at) for blob in batch)
+
+    def _sweep_blobs(
+        self, db: Session, blobs: List[Tuple[str, int, int, Optional[datetime]]], keys: Set[str],
+        cutoff: datetime, dry_run: bool, report: Dict[str, Any],
+    ) -> None:
+        """参照されていない image_blobs の登録とファイルを削除"""
+        for batch in _chunks(blobs, self.batch_size):
+            for storage_key, ref_count, size, created_at in batch:
+                report["blobs_scanned"] += 1
+                if storage_key in keys or (created_at and created_at > cutoff):
+                    continue
+                self._orphan(report, storage_key, size)
+                if dry_run:
+                    continue
+                if crud.delete_image_blob_if_unchanged(
+                    db, storage_key, ref_count, delete_file=self.image_store.driver.delete
+                ):
+                    report["deleted"] += 1
+            time.sleep(self.batch_pause)
+
+    def _sweep_files(self, db: Session, keys: Set[str], cutoff: float, dry_run: bool, report: Dict[str, Any]) -> None:
+        """image_blobs に登録されていない保存先のファイル（書き込み途中で止まったものなど）を削除"""
+        for entries in _chunks(self.image_store.driver.iter_entries(), self.batch_size):
+            registered = crud.get_registered_image_blob_keys(db, [key for key, _, _ in entries])
+            for key, size, mtime in entries:
+                report["files_scanned"] += 1
+                if key in registered or key in keys or mtime > cutoff:
+                    continue
+                self._orphan(report, key, size)
+                if dry_run:
+                    continue
+                if crud.get_image_blob_by_key(db, key) is None:
+                    self.image_store.driver.delete(key)
+                    report["deleted"] += 1
+            time.sleep(self.batch_pause)
+
+    def _sweep_legacy(self, legacy_names: Set[str], cutoff: float, dry_run: bool, report: Dict[str, Any]) -> None:
+        """移行前の static/agent_images にある参照されていないファイルを削除"""
+        legacy_dir = self.image_store.legacy_dir
+        if not legacy_dir.is_dir():
+            return
+        with os.scandir(legacy_dir) as entries:
+            for chunk in _chunks(entries, self.batch_size):
+                for entry in chunk:
+                    if not entry.is_file():
+                        continue
+                    report["legacy_files_scanned"] += 1
+                    stat = entry.stat()
+                    if entry.name in legacy_names or stat.st_mtime > cutoff:
+                        continue
+                    self._orphan(report, f"{LEGACY_URL_PREFIX}{entry.name}", stat.st_size)
+                    if not dry_run:
+                        try:
+                            os.unlink(entry.path)
+                            report["deleted"] += 1
+                        except FileNotFoundError:
+                            pass
+                time.sleep(self.batch_pause)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "interval": self.interval,
+            "grace_period": self.grace_period,
+            "dry_run": self.dry_run,
+            "last_report": self.last_report,
+        }
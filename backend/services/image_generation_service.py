@@ -1,11 +1,11 @@
 import os
-import uuid
+import random
 import logging
 import traceback
 import asyncio
 import schemas
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 from io import BytesIO
 from datetime import datetime
 from fastapi import HTTPException
@@ -18,9 +18,24 @@ from services.llm_clients.huggingface_client import get_huggingface_client
 from services.llm_clients.modelslab_client import ModelsLabClient
 from services.llm_clients.stable_diffusion_webui_client import get_stable_diffusion_webui_client
 from services.r18_content_analyzer import analyze_r18_score
+from services.circuit_breaker import CircuitOpenError, RetryPolicy, get_circuit_breaker
+from services.generation_log_store import GenerationLogStore
+from services.render_cache import RenderResultCache, render_cache_key
+from services.image_storage import ImageStore
+from services.image_io import run_image_io
+from services.image_variants import AGENT_IMAGE, request_variants
+from services.cassette import get_cassette_from_env
+from services.llm_clients.cassette_client import RecordingImageClient, ReplayImageClient
 
 logger = logging.getLogger(__name__)
 
+
+def _is_retryable_image_error(error: Exception) -> bool:
+    """接続できなかった場合のみリトライする（生成途中のタイムアウトは重いのでリトライしない）"""
+    message = str(error).lower()
+    return any(marker in message for marker in ("not available", "connect", "502", "503"))
+
+
 class ImageGenerationService:
     """画像生成と保存を管理するサービス"""
 
@@ -29,11 +44,16 @@ class ImageGenerationService:
         self.storage_path = Path("backend/static/agent_images")
         self.storage_path.mkdir(parents=True, exist_ok=True)
         self.fallback_image_url = "/static/fallback_agent.png"
-        self.generation_logs = {}  # 生成ログを一時的に保存
+        self.generation_logs = GenerationLogStore()  # ジョブ単位の生成ログ
         self.r18_mode_image = r18_mode_image
+        # 起動時に設定される画像生成ジョブの待ち行列（未設定の場合はその場で生成する）
+        self.job_queue = None
+        # 起動時に設定されるイベントバス（縮小版の作成依頼に使う）
+        self.event_bus = None
         
         # プロバイダーの決定：環境変数 > デフォルト
         provider = os.getenv("IMAGE_GENERATION_PROVIDER", "huggingface")
+        self.provider = provider
 
         try:
             if provider == "modelslab":
@@ -49,6 +69,25 @@ class ImageGenerationService:
             logger.error(f"Failed to initialize image generation client for provider {provider}: {e}")
             self.client = None
 
+        # 通信の記録・再生（CASSETTE_MODE=record/replay）
+        cassette = get_cassette_from_env()
+        if cassette is not None and cassette.mode == "replay":
+            self.client = ReplayImageClient(cassette)
+            logger.info("Image generation replays recorded traffic from the cassette.")
+        elif cassette is not None and self.client is not None:
+            self.client = RecordingImageClient(self.client, cassette)
+
+        # プロバイダー障害時は待たずに失敗させる
+        self.circuit_breaker = get_circuit_breaker(
+            f"image:{provider}", "IMAGE", failure_threshold=3, recovery_timeout=60
+        )
+        self.retry_policy = RetryPolicy.from_env("IMAGE", base_delay=2.0, max_delay=10.0)
+        self.retry_policy.is_retryable = _is_retryable_image_error
+
+        # 同じパラメータ（固定シード）の描画結果のキャッシュ
+        self.render_cache = RenderResultCache.from_env()
+        self.image_store = ImageStore.from_env()  # 内容で重複を排除する画像の保存先
+
     def _generate_prompt(self, agent: Agent) -> str:
         """エージェントの属性から画像生成用のプロンプトを作成します。"""
         details = [
@@ -76,29 +115,77 @@ class ImageGenerationService:
         
         return prompt
 
+    def _render_cache_key(
+        self, prompt: str, negative_prompt: str, seed: Optional[int], extra: Dict[str, Any]
+    ) -> Optional[str]:
+        """描画結果に影響するすべてのパラメータからキャッシュキーを作成（シードが固定でなければNone）"""
+        if seed is None or seed <= 0:
+            return None
+        return render_cache_key({
+            "provider": self.provider,
+            "client": self.client.__class__.__name__,
+            "model": getattr(self.client, "model", None) or getattr(self.client, "model_id", None),
+            "base_url": getattr(self.client, "base_url", None),
+            "prompt": prompt,
+            "negative_prompt": negative_prompt,
+            "seed": seed,
+            **extra,
+        })
+
     def _generate_negative_prompt(self) -> str:
         """ネガティブプロンプトを返します。"""
         return "(worst quality:2), (low quality:2), (normal quality:2), (jpeg artifacts), (blurry), (duplicate), (morbid), (mutilated), (out of frame), (extra limbs), (bad anatomy), (disfigured), (deformed), (cross-eye), (glitch), (oversaturated), (overexposed), (underexposed), (bad proportions), (bad hands), (bad feet), (cloned face), (long neck), (missing arms), (missing legs), (extra fingers), (fused fingers), (poorly drawn hands), (poorly drawn face), (mutation), (deformed eyes), watermark, text, logo, signature, grainy, tiling, censored, ugly, blurry eyes, noisy image, bad lighting, unnatural skin, asymmetry, cartoon, anime, drawing, painting, illustration, rendered, 3d, cgi, plastic, doll, fake"
 
-    def _remove_old_image(self, image_url: Optional[str]) -> None:
-        """古い画像ファイルを削除します。"""
+    def _remove_old_image(self, db: Session, image_url: Optional[str]) -> None:
+        """古い画像の参照を解放します（参照がなくなったファイルはGCが削除します）。"""
+        if not image_url or image_url == self.fallback_image_url:
+            return
+        
+        try:
+            self.image_store.release(db, image_url)
+        except Exception as e:
+            logger.warning(f"Failed to remove old image: {e}")
+
+    async def _remove_old_image_async(self, db: Session, image_url: Optional[str]) -> None:
+        """_remove_old_image の非同期版"""
         if not image_url or image_url == self.fallback_image_url:
             return
         
         try:
-            # URLからファイルパスを抽出
-            if image_url.startswith("/static/agent_images/"):
-                filename = image_url.split("/")[-1]
-                file_path = self.storage_path / filename
-                if file_path.exists():
-                    file_path.unlink()
-                    logger.info(f"Removed old image: {file_path}")
+            await self.image_store.release_async(db, image_url)
         except Exception as e:
             logger.warning(f"Failed to remove old image: {e}")
 
-    def get_generation_log(self, agent_id: int) -> Optional[Dict[str, Any]]:
-        """エージェントの画像生成ログを取得"""
-        return self.generation_logs.get(agent_id)
+    def get_generation_logs(self, db: Session, agent_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+        """エージェントの最近の画像生成ログをジョブ単位で新しい順に取得"""
+        entries = [self.job_log_entry(job) for job in crud.get_recent_image_jobs(db, agent_id, limit=limit)]
+        # 待ち行列を経由しない生成（待ち行列の未起動時）のログはメモリ上にのみある
+        entries.extend(self.generation_logs.recent_local(agent_id))
+        return entries[:limit]
+
+    def job_log_entry(self, job: Any) -> Dict[str, Any]:
+        """ジョブの状態と生成ログをまとめる"""
+        # このプロセスで実行中・直近のジョブはメモリ上のログの方が新しい
+        log = self.generation_logs.get(job.id) or job.log or {}
+        entry = {
+            "steps": [],
+            "progress": 0.0,
+            **log,
+            "job_id": job.id,
+            "kind": job.kind,
+            "agent_id": job.agent_id,
+            "message_id": job.message_id,
+            "attempts": job.attempts,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+        }
+        # 待機中・取消・失敗はジョブの状態を優先（ログが書かれる前に終わった場合を含む）
+        if job.status in ("queued", "cancelled", "failed") or "status" not in log:
+            entry["status"] = job.status
+        if job.status == "completed":
+            entry.update({"image_url": job.result_url, "image_seed": job.result_seed, "progress": 100.0})
+        if job.error and job.status == "failed":
+            entry["error"] = job.error
+        return entry
 
     async def _generate_and_save_image_internal(
         self,
@@ -109,179 +196,270 @@ class ImageGenerationService:
         user_message: Optional[str] = None,
         keywords: Optional[str] = None,
         message_id: Optional[int] = None,
-        websocket: Optional[Any] = None
+        websocket: Optional[Any] = None,
+        job_id: Optional[int] = None,
+        seed: Optional[int] = None
     ):
-        """画像生成のコアロジック"""
+        """画像生成のコアロジック（seed はジョブで決めたシード、省略時は従来どおり）"""
         agent_id = agent.id
-        # 生成ログを初期化
-        self.generation_logs[agent_id] = {
-            "status": "started",
-            "started_at": datetime.now().isoformat(),
-            "provider": self.client.__class__.__name__ if self.client else "Unknown",
-            "steps": [],
-            "progress": 0.0,
-        }
-
-        if agent.image_url and not force_regenerate:
-            logger.info(f"Using cached image for agent {agent_id}: {agent.image_url}")
-            self.generation_logs[agent_id].update({
-                "status": "cached",
-                "steps": [{"step": "cache_check", "status": "cached", "message": "Using existing image", "timestamp": datetime.now().isoformat()}]
-            })
-            return agent.image_url, agent.image_seed
+        # 生成ログはジョブ単位で保持し、終了時（失敗を含む）に書き出す
+        log = self.generation_logs.start(
+            job_id,
+            agent_id=agent_id,
+            kind="chat" if user_message else "profile",
+            provider=self.client.__class__.__name__ if self.client else "Unknown",
+        )
+        try:
+            if agent.image_url and not force_regenerate:
+                logger.info(f"Using cached image for agent {agent_id}: {agent.image_url}")
+                log.update({
+                    "status": "cached",
+                    "steps": [{"step": "cache_check", "status": "cached", "message": "Using existing image", "timestamp": datetime.now().isoformat()}]
+                })
+                return agent.image_url, agent.image_seed
 
-        # プロンプト生成
-        self.generation_logs[agent_id]["steps"].append({"step": "prompt_generation", "status": "started", "timestamp": datetime.now().isoformat()})
+            # プロンプト生成
+            log["steps"].append({"step": "prompt_generation", "status": "started", "timestamp": datetime.now().isoformat()})
         
-        final_prompt = prompt
-        negative_prompt = self._generate_negative_prompt()
-
-        # R18モードが有効で、ユーザーメッセージがある場合にスコアを判定
-        if self.r18_mode_image and user_message:
-            r18_score = analyze_r18_score(user_message)
-            logger.info(f"R18 score for message '{user_message[:50]}...': {r18_score}")
-            if websocket:
-                try:
-                    # R18スコアをフロントエンドに送信
-                    r18_score_payload = {
-                        "type": "status",
-                        "status": "image_generation_r18_score",
-                        "message": "画像を生成しています...",
-                        "r18_score": r18_score
-                    }
-                    logger.info(f"Sending R18 score payload: {r18_score_payload}")
-                    asyncio.create_task(websocket.send_json(r18_score_payload))
-                except Exception as e:
-                    logger.warning(f"Failed to send R18 score via WebSocket: {e}")
-
-            if r18_score >= 60:
-                logger.info("R18 content detected. Modifying prompt for NSFW.")
-                # R18用のプロンプト調整
-                final_prompt = f"(NSFW:1.5), (sex:1.3), {prompt}"
-                # R18用のネガティブプロンプト調整 (nsfw, censoredを削除)
-                negative_prompt = negative_prompt.replace("nsfw, ", "").replace("censored, ", "")
-
-        self.generation_logs[agent_id].update({"prompt": final_prompt, "negative_prompt": negative_prompt})
-        self.generation_logs[agent_id]["steps"][-1].update({"status": "completed", "message": "Prompt generated successfully"})
-
-        if not self.client:
-            logger.error("Image generation client is not available.")
-            self.generation_logs[agent_id].update({"status": "failed", "error": "Image generation service is not available."})
-            raise HTTPException(status_code=503, detail="Image generation service is not available.")
-
-        # 進捗更新用のコールバック
-        async def progress_callback(progress_data: Dict[str, Any]):
-            progress = progress_data.get("progress", 0) * 100
-            self.generation_logs[agent_id]["progress"] = round(progress, 1)
-            logger.debug(f"Agent {agent_id} progress: {progress:.1f}%")
+            final_prompt = prompt
+            negative_prompt = self._generate_negative_prompt()
 
-        try:
-            self.generation_logs[agent_id]["steps"].append({"step": "image_generation", "status": "started", "timestamp": datetime.now().isoformat(), "provider": self.client.__class__.__name__})
-            logger.info(f"Generating image for agent {agent_id} with prompt: {final_prompt}")
-            
-            generation_start = datetime.now()
+            # R18モードが有効で、ユーザーメッセージがある場合にスコアを判定
+            if self.r18_mode_image and user_message:
+                r18_score = analyze_r18_score(user_message)
+                logger.info(f"R18 score for message '{user_message[:50]}...': {r18_score}")
+                if websocket:
+                    self._notify_r18_score(websocket, r18_score)
+
+                if r18_score >= 60:
+                    logger.info("R18 content detected. Modifying prompt for NSFW.")
+                    # R18用のプロンプト調整
+                    final_prompt = f"(NSFW:1.5), (sex:1.3), {prompt}"
+                    # R18用のネガティブプロンプト調整 (nsfw, censoredを削除)
+                    negative_prompt = negative_prompt.replace("nsfw, ", "").replace("censored, ", "")
+
+            log.update({"prompt": final_prompt, "negative_prompt": negative_prompt})
+            log["steps"][-1].update({"status": "completed", "message": "Prompt generated successfully"})
+
+            if not self.client:
+                logger.error("Image generation client is not available.")
+                log.update({"status": "failed", "error": "Image generation service is not available."})
+                raise HTTPException(status_code=503, detail="Image generation service is not available.")
+
+            # 進捗更新用のコールバック
+            async def progress_callback(progress_data: Dict[str, Any]):
+                progress = progress_data.get("progress", 0) * 100
+                eta = progress_data.get("eta_relative")
+                self.generation_logs.update_progress(log, progress, eta=eta)
+                if job_id is not None and self.job_queue is not None:
+                    self.job_queue.report_progress(job_id, progress, eta=eta)
+                logger.debug(f"Agent {agent_id} progress: {progress:.1f}%")
+
+            try:
+                log["steps"].append({"step": "image_generation", "status": "started", "timestamp": datetime.now().isoformat(), "provider": self.client.__class__.__name__})
+                self.generation_logs.flush(log)
+                logger.info(f"Generating image for agent {agent_id} with prompt: {final_prompt}")
             
-            # IP-Adapter用の引数を準備
-            ip_adapter_kwargs = {}
-            ip_adapter_model = None
-            if isinstance(self.client, get_stable_diffusion_webui_client().__class__) and agent.image_url:
-                ip_adapter_kwargs['ip_adapter_image_url'] = agent.image_url
-                # This is a simplification. You might want to get the actual model name from the client
-                ip_adapter_model = "default_ip_adapter"
-
-            image_data, generated_seed = await self.client.generate_image_async(
-                prompt=final_prompt,
-                negative_prompt=negative_prompt,
-                progress_callback=progress_callback,
-                seed=agent.image_seed if not force_regenerate else None,
-                **ip_adapter_kwargs
-            )
+                generation_start = datetime.now()
             
-            generation_time = (datetime.now() - generation_start).total_seconds()
+                # IP-Adapter用の引数を準備
+                ip_adapter_kwargs = {}
+                ip_adapter_model = None
+                if getattr(self.client, "supports_ip_adapter", False) and agent.image_url:
+                    ip_adapter_kwargs['ip_adapter_image_url'] = agent.image_url
+                    # This is a simplification. You might want to get the actual model name from the client
+                    ip_adapter_model = "default_ip_adapter"
 
-            logger.info(f"Successfully generated image for agent {agent_id}")
-            self.generation_logs[agent_id]["steps"][-1].update({"status": "completed", "message": "Image generated successfully", "generation_time": f"{generation_time:.2f}s"})
+                # エージェントのシードが固定されていれば、同じパラメータで描画済みの画像を再利用する
+                # （ジョブで決めたシードは再試行のためのもので、キャッシュには使わない）
+                render_key = None
+                if seed is None:
+                    seed = agent.image_seed if not force_regenerate else None
+                    render_key = self._render_cache_key(final_prompt, negative_prompt, seed, ip_adapter_kwargs)
+                cached_image = await run_image_io(self.render_cache.get, render_key) if render_key else None
 
-        except Exception as e:
-            error_msg = str(e)
-            logger.error(f"Failed to generate image for agent {agent_id}: {e}\n{traceback.format_exc()}")
-            self.generation_logs[agent_id].update({"status": "failed", "error": error_msg})
-            self.generation_logs[agent_id]["steps"][-1].update({"status": "failed", "error": error_msg})
-            raise HTTPException(status_code=500, detail=f"Failed to generate image: {error_msg}")
+                if cached_image is not None:
+                    image_data, generated_seed = cached_image, seed
+                    logger.info(f"Reused cached render for agent {agent_id} (key: {render_key[:12]})")
+                    message = "Reused a cached render with identical parameters"
+                else:
+                    image_data, generated_seed = await self.retry_policy.run(
+                        self.client.generate_image_async,
+                        breaker=self.circuit_breaker,
+                        prompt=final_prompt,
+                        negative_prompt=negative_prompt,
+                        progress_callback=progress_callback,
+                        seed=seed,
+                        **ip_adapter_kwargs
+                    )
+                    if render_key:
+                        await run_image_io(self.render_cache.set, render_key, image_data)
+                    logger.info(f"Successfully generated image for agent {agent_id}")
+                    message = "Image generated successfully"
+            
+                generation_time = (datetime.now() - generation_start).total_seconds()
 
-        if force_regenerate and agent.image_url:
-            self._remove_old_image(agent.image_url)
+                log["steps"][-1].update({"status": "completed", "message": message, "generation_time": f"{generation_time:.2f}s"})
 
-        filename = f"{uuid.uuid4()}.png"
-        file_path = self.storage_path / filename
-        
-        self.generation_logs[agent_id]["steps"].append({"step": "save_image", "status": "started", "timestamp": datetime.now().isoformat()})
-        try:
-            with open(file_path, "wb") as f:
-                f.write(image_data)
-            logger.info(f"Saved image for agent {agent_id}: {file_path}")
-            self.generation_logs[agent_id]["steps"][-1].update({"status": "completed", "message": f"Image saved as {filename}"})
-        except Exception as e:
-            logger.error(f"Failed to save image file: {e}")
-            self.generation_logs[agent_id].update({"status": "failed", "error": str(e)})
-            self.generation_logs[agent_id]["steps"][-1].update({"status": "failed", "error": str(e)})
-            raise HTTPException(status_code=500, detail=f"Failed to save image: {e}")
+            except asyncio.CancelledError:
+                log.update({"status": "cancelled", "error": "Cancelled"})
+                log["steps"][-1].update({"status": "cancelled"})
+                raise
+            except CircuitOpenError as e:
+                error_msg = str(e)
+                logger.warning(f"Skipped image generation for agent {agent_id}: {error_msg}")
+                log.update({"status": "failed", "error": error_msg})
+                log["steps"][-1].update({"status": "failed", "error": error_msg})
+                raise HTTPException(status_code=503, detail="Image generation service is temporarily unavailable.")
+            except Exception as e:
+                error_msg = str(e)
+                logger.error(f"Failed to generate image for agent {agent_id}: {e}\n{traceback.format_exc()}")
+                log.update({"status": "failed", "error": error_msg})
+                log["steps"][-1].update({"status": "failed", "error": error_msg})
+                raise HTTPException(status_code=500, detail=f"Failed to generate image: {error_msg}")
+
+            log["steps"].append({"step": "save_image", "status": "started", "timestamp": datetime.now().isoformat()})
+            try:
+                stored_url = await self.image_store.save_async(db, image_data, extension=".png", content_type="image/png")
+                logger.info(f"Saved image for agent {agent_id}: {stored_url}")
+                log["steps"][-1].update({"status": "completed", "message": f"Image saved as {stored_url.rsplit('/', 1)[-1]}"})
+            except Exception as e:
+                logger.error(f"Failed to save image file: {e}")
+                log.update({"status": "failed", "error": str(e)})
+                log["steps"][-1].update({"status": "failed", "error": str(e)})
+                raise HTTPException(status_code=500, detail=f"Failed to save image: {e}")
         
-        # 完全なURLを生成
-        relative_path = file_path.relative_to(Path("backend/static"))
-        image_url = f"{self.backend_url}/static/{relative_path}"
+            # 完全なURLを生成（オブジェクトストレージのURLはそのまま使う）
+            image_url = stored_url if stored_url.startswith("http") else f"{self.backend_url}{stored_url}"
         
-        # データベースにログを保存
-        if user_message and prompt:
-            log_entry = schemas.ImageGenerationLogCreate(
-                agent_id=agent_id,
-                message_id=message_id,
-                user_message=user_message,
-                keywords=keywords,
-                model=self.client.__class__.__name__,
-                prompt=prompt,
-                ip_adapter_model=ip_adapter_model,
-                image_url=image_url
-            )
-            crud.create_image_generation_log(db, log=log_entry)
-
-        self.generation_logs[agent_id].update({
-            "status": "completed",
-            "completed_at": datetime.now().isoformat(),
-            "image_url": image_url,
-            "image_seed": generated_seed,
-            "progress": 100.0
-        })
-        total_time = (datetime.fromisoformat(self.generation_logs[agent_id]["completed_at"]) -
-                     datetime.fromisoformat(self.generation_logs[agent_id]["started_at"])).total_seconds()
-        self.generation_logs[agent_id]["total_time"] = f"{total_time:.2f}s"
+            # データベースにログを保存
+            if user_message and prompt:
+                log_entry = schemas.ImageGenerationLogCreate(
+                    agent_id=agent_id,
+                    message_id=message_id,
+                    user_message=user_message,
+                    keywords=keywords,
+                    model=self.client.__class__.__name__,
+                    prompt=prompt,
+                    ip_adapter_model=ip_adapter_model,
+                    image_url=image_url
+                )
+                crud.create_image_generation_log(db, log=log_entry)
+
+            log.update({
+                "status": "completed",
+                "completed_at": datetime.now().isoformat(),
+                "image_url": image_url,
+                "image_seed": generated_seed,
+                "progress": 100.0
+            })
+            total_time = (datetime.fromisoformat(log["completed_at"]) -
+                         datetime.fromisoformat(log["started_at"])).total_seconds()
+            log["total_time"] = f"{total_time:.2f}s"
         
-        return image_url, generated_seed
+            return image_url, generated_seed
+        finally:
+            self.generation_logs.flush(log)
 
-    async def generate_and_save_image(self, agent_id: int, user_id: int, force_regenerate: bool = False):
-        """エージェントのプロフィール画像などを生成します。"""
-        db: Session = SessionLocal()
+    def _notify_r18_score(self, websocket: Any, r18_score: int) -> None:
+        """R18スコアをフロントエンドに送信"""
         try:
-            agent = crud.get_agent(db, agent_id=agent_id, user_id=user_id)
+            r18_score_payload = {
+                "type": "status",
+                "status": "image_generation_r18_score",
+                "message": "画像を生成しています...",
+                "r18_score": r18_score
+            }
+            logger.info(f"Sending R18 score payload: {r18_score_payload}")
+            asyncio.create_task(websocket.send_json(r18_score_payload))
+        except Exception as e:
+            logger.warning(f"Failed to send R18 score via WebSocket: {e}")
+
+    def _assign_job_seed(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        ジョブのシードを登録時に決めてペイロードに保存します。
+
+        ジョブの再試行（ワーカーの停止後のやり直しなど）は同じシードで描画されます。
+        別のジョブのシードは引き継がないため、再生成の依頼は毎回新しい画像になります。
+        """
+        return {**payload, "seed": random.randint(1, 2**31 - 1)}
+
+    def enqueue_profile_image(self, db: Session, agent_id: int, user_id: int, force_regenerate: bool = False):
+        """プロフィール画像の生成ジョブを登録します（待ち行列が未起動の場合はNone）。"""
+        if self.job_queue is None:
+            return None
+        payload = {"force_regenerate": force_regenerate}
+        if force_regenerate:
+            # 再生成ではエージェントのシードを使わないため、ここでシードを決めておく
+            payload = self._assign_job_seed(payload)
+        return self.job_queue.enqueue(
+            db, kind="profile", agent_id=agent_id, user_id=user_id,
+            payload=payload,
+            supersede=True,
+        )
+
+    async def run_job(self, db: Session, job: Any) -> Tuple[str, int]:
+        """待ち行列のワーカーから呼ばれ、ジョブの種類に応じて画像を生成します。"""
+        payload = job.payload or {}
+        if job.kind == "profile":
+            return await self._generate_profile_image(
+                db, job.agent_id, job.user_id, force_regenerate=payload.get("force_regenerate", False),
+                job_id=job.id, seed=payload.get("seed"),
+            )
+        if job.kind == "chat":
+            agent = crud.get_agent_without_user_check(db, job.agent_id)
             if not agent:
-                logger.error(f"Agent not found for id: {agent_id} and user: {user_id}")
                 raise HTTPException(status_code=404, detail="Agent not found")
-
-            prompt = self._generate_prompt(agent)
-            
-            image_url, generated_seed = await self._generate_and_save_image_internal(
+            return await self._generate_image_in_chat_internal(
                 db=db,
                 agent=agent,
-                prompt=prompt,
-                force_regenerate=force_regenerate
+                prompt=payload["prompt"],
+                user_message=payload.get("user_message"),
+                keywords=payload.get("keywords"),
+                message_id=job.message_id,
+                force_regenerate=payload.get("force_regenerate", False),
+                job_id=job.id,
+                seed=payload.get("seed"),
             )
-            
-            # Update agent's primary image
-            crud.create_agent_image(db, agent_id=agent_id, image_url=image_url, is_primary=True, image_seed=generated_seed)
-            
+        raise ValueError(f"Unknown image job kind: {job.kind}")
+
+    async def generate_and_save_image(self, agent_id: int, user_id: int, force_regenerate: bool = False):
+        """エージェントのプロフィール画像などを生成します。"""
+        db: Session = SessionLocal()
+        try:
+            await self._generate_profile_image(db, agent_id, user_id, force_regenerate=force_regenerate)
         finally:
             db.close()
 
+    async def _generate_profile_image(
+        self, db: Session, agent_id: int, user_id: int, force_regenerate: bool = False,
+        job_id: Optional[int] = None, seed: Optional[int] = None
+    ) -> Tuple[str, int]:
+        agent = crud.get_agent(db, agent_id=agent_id, user_id=user_id)
+        if not agent:
+            logger.error(f"Agent not found for id: {agent_id} and user: {user_id}")
+            raise HTTPException(status_code=404, detail="Agent not found")
+
+        prompt = self._generate_prompt(agent)
+        previous_url = agent.image_url
+        
+        image_url, generated_seed = await self._generate_and_save_image_internal(
+            db=db,
+            agent=agent,
+            prompt=prompt,
+            force_regenerate=force_regenerate,
+            job_id=job_id,
+            seed=seed
+        )
+        
+        # Update agent's primary image
+        db_image = crud.create_agent_image(db, agent_id=agent_id, image_url=image_url, is_primary=True, image_seed=generated_seed)
+        request_variants(self.event_bus, AGENT_IMAGE, db_image.id)
+        # 以前のプライマリ画像はギャラリーに残るため、どの行からも参照されなくなった場合だけ解放する
+        if previous_url and previous_url != image_url and not crud.is_agent_image_url_in_use(db, agent_id, previous_url):
+            await self._remove_old_image_async(db, previous_url)
+        return image_url, generated_seed
+
     async def generate_image_in_chat(
         self,
         db: Session,
@@ -295,6 +473,61 @@ class ImageGenerationService:
         websocket: Optional[Any] = None
     ):
         """チャットの文脈で画像を生成し、メッセージとして保存します。"""
+        if self.job_queue is None:
+            return await self._generate_image_in_chat_internal(
+                db=db,
+                agent=agent,
+                prompt=prompt,
+                user_message=user_message,
+                keywords=keywords,
+                message_id=message_id,
+                force_regenerate=force_regenerate,
+                websocket=websocket
+            )
+
+        # ワーカーは接続を持たないため、R18スコアはここで送信しておく
+        if websocket and self.r18_mode_image and user_message:
+            self._notify_r18_score(websocket, analyze_r18_score(user_message))
+
+        payload = {
+            "prompt": prompt,
+            "user_message": user_message,
+            "keywords": keywords,
+            "force_regenerate": force_regenerate,
+        }
+        if force_regenerate:
+            payload = self._assign_job_seed(payload)
+        job = self.job_queue.enqueue(
+            db,
+            kind="chat",
+            agent_id=agent.id,
+            user_id=agent.owner_id,
+            chat_id=chat_id,
+            message_id=message_id,
+            payload=payload,
+            priority=self.job_queue.CHAT_PRIORITY,
+            supersede=True,
+        )
+        try:
+            return await self.job_queue.wait_for(job.id)
+        except asyncio.CancelledError:
+            # 応答側で不要になった場合（投機的な生成のやり直しなど）はジョブも取り消す
+            self.job_queue.cancel(job.id)
+            raise
+
+    async def _generate_image_in_chat_internal(
+        self,
+        db: Session,
+        agent: Agent,
+        prompt: str,
+        user_message: str,
+        keywords: Optional[str],
+        message_id: int,
+        force_regenerate: bool = False,
+        websocket: Optional[Any] = None,
+        job_id: Optional[int] = None,
+        seed: Optional[int] = None
+    ) -> Tuple[str, int]:
         image_url, generated_seed = await self._generate_and_save_image_internal(
             db=db,
             agent=agent,
@@ -303,7 +536,9 @@ class ImageGenerationService:
             user_message=user_message,
             keywords=keywords,
             message_id=message_id,
-            websocket=websocket
+            websocket=websocket,
+            job_id=job_id,
+            seed=seed
         )
 
         # Update message with image url
@@ -0,0 +1,67 @@
+import asyncio
+import base64
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Any, Callable, Optional, Tuple, TypeVar
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _default_workers() -> int:
+    return int(os.getenv("IMAGE_IO_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+
+def get_image_io_executor() -> ThreadPoolExecutor:
+    """画像のデコード・検証・ファイル入出力に使う専用のスレッドプールを取得
+
+    既定のスレッドプール（DB処理などと共有）とは分け、同時に実行する数を
+    IMAGE_IO_WORKERS までに制限する。
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=_default_workers(), thread_name_prefix="image-io")
+    return _executor
+
+
+def shutdown_image_io_executor() -> None:
+    """スレッドプールを停止（アプリケーションの終了時に呼ぶ）"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+
+async def run_image_io(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """CPUやディスクを使う画像処理を専用のスレッドプールで実行し、イベントループを止めない"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_image_io_executor(), functools.partial(func, *args, **kwargs))
+
+
+def decode_and_verify_image(image_b64: str) -> Tuple[bytes, Tuple[int, int]]:
+    """Base64の画像をデコードして壊れていないか検証し、バイト列とサイズを返す"""
+    image_data = base64.b64decode(image_b64)
+    try:
+        image = Image.open(BytesIO(image_data))
+        size = image.size
+        image.verify()
+    except Exception as e:
+        raise ValueError(f"Generated image is invalid: {e}") from e
+    return image_data, size
+
+
+def encode_image_b64(image_data: bytes) -> str:
+    return base64.b64encode(image_data).decode("utf-8")
@@ -0,0 +1,461 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+import crud
+import models
+from .event_bus import EventBus, chat_topic, image_job_topic
+from .image_variants import MESSAGE_IMAGE, request_variants
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+class ImageJobCancelledError(Exception):
+    """待ち行列のジョブが取り消された"""
+
+
+class ImageJobQueue:
+    """image_jobs テーブルを待ち行列とする画像生成のワーカープール
+
+    ジョブはDBに登録され、ワーカーが SELECT ... FOR UPDATE SKIP LOCKED で1件ずつ取り出して
+    ImageGenerationService.run_job で生成する。同時に生成する数はワーカー数で制限される。
+    実行中のジョブは定期的に生存時刻を更新し、プロセスが落ちて更新が途絶えたジョブは
+    stale_after 秒後に待ち行列へ戻される。
+
+    ジョブの状態・進捗・待ち順は image_progress イベントとしてジョブのトピック
+    （チャット画像はチャットのトピックにも）へ配信する。進捗は progress_interval 秒に1回までに間引く。
+    """
+
+    # チャット画像はプロフィール画像より先に取り出す
+    CHAT_PRIORITY = 10
+    PROFILE_PRIORITY = 0
+
+    def __init__(
+        self,
+        image_service: Any,
+        workers: Optional[int] = None,
+        poll_interval: Optional[float] = None,
+        stale_after: Optional[float] = None,
+        max_attempts: Optional[int] = None,
+        session_factory: Optional[Callable[[], Session]] = None,
+        event_bus: Optional[EventBus] = None,
+        progress_interval: Optional[float] = None,
+        cancel_poll_interval: Optional[float] = None,
+    ):
+        self.image_service = image_service
+        self.workers = workers if workers is not None else int(os.getenv("IMAGE_JOB_WORKERS", "1"))
+        self.poll_interval = poll_interval or float(os.getenv("IMAGE_JOB_POLL_INTERVAL", "1.0"))
+        self.stale_after = stale_after or float(os.getenv("IMAGE_JOB_STALE_AFTER", "300"))
+        self.heartbeat_interval = self.stale_after / 3
+        # 別のプロセスからの取り消しの依頼を確認する間隔
+        self.cancel_poll_interval = (
+            cancel_poll_interval if cancel_poll_interval is not None
+            else float(os.getenv("IMAGE_JOB_CANCEL_POLL_INTERVAL", "2.0"))
+        )
+        self.max_attempts = max_attempts or int(os.getenv("IMAGE_JOB_MAX_ATTEMPTS", "2"))
+        self.session_factory = session_factory
+        self.event_bus = event_bus or EventBus()
+        self.progress_interval = (
+            progress_interval if progress_interval is not None
+            else float(os.getenv("IMAGE_PROGRESS_MIN_INTERVAL", "1.0"))
+        )
+        # 待ち順を配信する待機中のジョブの最大数
+        self.position_limit = int(os.getenv("IMAGE_PROGRESS_QUEUE_LIMIT", "50"))
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+        self._tasks: List["asyncio.Task[None]"] = []
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._waiters: Dict[int, "asyncio.Future[None]"] = {}
+        self._running: Dict[int, "asyncio.Task[Tuple[str, int]]"] = {}
+        # 実行中のジョブの進捗配信用の情報（開始時刻・最後に配信した時刻）
+        self._active: Dict[int, Dict[str, Any]] = {}
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    def _session(self) -> Session:
+        if self.session_factory is None:
+            from database import SessionLocal
+            self.session_factory = SessionLocal
+        return self.session_factory()
+
+    async def start(self) -> None:
+        """ワーカーと、止まったジョブを回収するタスクを起動"""
+        self._stopping = False
+        self._recover_stale_jobs()
+        self._tasks = [asyncio.create_task(self._worker(index)) for index in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintenance()))
+        logger.info(f"Image job queue started with {self.workers} worker(s)")
+
+    async def stop(self) -> None:
+        """ワーカーを停止（実行中のジョブは待ち行列に戻す）"""
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def enqueue(
+        self,
+        db: Session,
+        kind: str,
+        agent_id: int,
+        user_id: int,
+        payload: Dict[str, Any],
+        chat_id: Optional[int] = None,
+        message_id: Optional[int] = None,
+        priority: Optional[int] = None,
+        supersede: bool = False,
+    ) -> models.ImageJob:
+        """
+        ジョブを登録してワーカーを起こす
+
+        supersede=True の場合は、同じエージェント（チャット画像は同じチャット）の
+        待機中・実行中のジョブを取り消してから登録する。
+        """
+        if supersede:
+            for old_job in crud.get_active_image_jobs(db, kind, agent_id, chat_id=chat_id if kind == "chat" else None):
+                if self.cancel(old_job.id):
+                    logger.info(f"Image job {old_job.id} was superseded by a new {kind} request")
+        job = crud.create_image_job(
+            db,
+            kind=kind,
+            agent_id=agent_id,
+            user_id=user_id,
+            payload=payload,
+            chat_id=chat_id,
+            message_id=message_id,
+            priority=priority if priority is not None else self.PROFILE_PRIORITY,
+            max_attempts=self.max_attempts,
+        )
+        logger.info(f"Enqueued {kind} image job {job.id} for agent {agent_id}")
+        self._publish(self._job_event(job, "queued", queue_position=crud.get_image_job_queue_position(db, job)))
+        self._wakeup.set()
+        return job
+
+    def report_progress(self, job_id: int, progress: float, eta: Optional[float] = None) -> None:
+        """生成中のジョブの進捗（%）を配信する（progress_interval 秒に1回まで）"""
+        active = self._active.get(job_id)
+        if active is None:
+            return
+        now = time.monotonic()
+        if now - active["published"] < self.progress_interval:
+            return
+        active["published"] = now
+        if eta is None and progress > 0:
+            # プロバイダーが残り時間を返さない場合は経過時間から見積もる
+            eta = (now - active["started"]) * (100 - progress) / progress
+        self._publish(self._job_event(
+            active["job"], "running", progress=round(progress, 1), eta=round(eta, 1) if eta is not None else None
+        ))
+
+    def snapshot(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """DBに記録されたジョブの状態を進捗イベントの形で取得"""
+        db = self._session()
+        try:
+            job = crud.get_image_job(db, job_id)
+            if job is None:
+                return None
+            if job.status == "queued":
+                return self._job_event(job, "queued", queue_position=crud.get_image_job_queue_position(db, job))
+            if job.status == "completed":
+                return self._job_event(job, "completed", progress=100.0, image_url=job.result_url)
+            if job.status == "failed":
+                return self._job_event(job, "failed", error=job.error)
+            log = job.log or {}
+            return self._job_event(job, job.status, progress=log.get("progress", 0.0), eta=log.get("eta"))
+        finally:
+            db.close()
+
+    async def watch(self, job_id: int, poll_interval: float = 2.0) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        ジョブが終わるまで進捗イベントを順に返す
+
+        他のプロセスのワーカーが処理しているジョブのイベントは届かないため、
+        poll_interval 秒イベントがなければDBの記録を確認する（変化がなければNoneを返す）。
+        """
+        with self.event_bus.subscribe(image_job_topic(job_id)) as events:
+            last = self.snapshot(job_id)
+            if last is None:
+                return
+            yield last
+            while last["status"] not in TERMINAL_STATUSES:
+                try:
+                    event = await asyncio.wait_for(events.get(), timeout=poll_interval)
+                except asyncio.TimeoutError:
+                    event = self.snapshot(job_id)
+                    if event is None:
+                        return
+                    # DBへの書き出しは間引かれているため、配信済みの進捗より古ければ送らない
+                    if event == last or (event["status"] == last["status"] and event["progress"] < last["progress"]):
+                        yield None
+                        continue
+                last = event
+                yield event
+
+    @staticmethod
+    def _job_event(
+        job: models.ImageJob,
+        status: str,
+        progress: float = 0.0,
+        eta: Optional[float] = None,
+        queue_position: Optional[int] = None,
+        **extra: Any,
+    ) -> Dict[str, Any]:
+        return {
+            "type": "image_progress",
+            "job_id": job.id,
+            "kind": job.kind,
+            "agent_id": job.agent_id,
+            "chat_id": job.chat_id,
+            "reply_to": job.message_id,
+            "status": status,
+            "progress": progress,
+            "eta": eta,
+            "queue_position": queue_position,
+            **extra,
+        }
+
+    def _publish(self, event: Dict[str, Any]) -> None:
+        self.event_bus.publish(image_job_topic(event["job_id"]), event)
+        if event["chat_id"]:
+            self.event_bus.publish(chat_topic(event["chat_id"]), event)
+
+    def _publish_queue_positions(self) -> None:
+        """ジョブが取り出されて繰り上がった待ち順を配信する"""
+        db = self._session()
+        try:
+            queued = crud.get_queued_image_jobs(db, limit=self.position_limit)
+        finally:
+            db.close()
+        for position, job in enumerate(queued, start=1):
+            self._publish(self._job_event(job, "queued", queue_position=position))
+
+    async def wait_for(self, job_id: int) -> Tuple[str, int]:
+        """ジョブの完了を待って (画像URL, シード) を返す（失敗した場合は例外）"""
+        future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._waiters[job_id] = future
+        try:
+            while True:
+                job = self._load(job_id)
+                if job is None:
+                    raise Exception(f"Image job {job_id} not found")
+                if job.status in TERMINAL_STATUSES:
+                    return self._result_of(job)
+                # 他のプロセスのワーカーが処理した場合に備えて、定期的にDBも確認する
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), timeout=self.poll_interval * 5)
+                except asyncio.TimeoutError:
+                    continue
+        finally:
+            self._waiters.pop(job_id, None)
+
+    def cancel(self, job_id: int) -> bool:
+        """
+        ジョブを取り消す
+
+        待機中はDB上で取り消し、このプロセスで実行中ならタスクを取り消す（プロバイダー側の
+        生成も中断される）。別のプロセスのワーカーが実行中の場合は "cancelling" にして、
+        そのワーカーが cancel_poll_interval 秒以内に取り消す。
+        """
+        task = self._running.get(job_id)
+        if task is not None:
+            logger.info(f"Cancelling running image job {job_id}")
+            task.cancel()
+            return True
+        db = self._session()
+        try:
+            if crud.cancel_image_job(db, job_id):
+                logger.info(f"Cancelled queued image job {job_id}")
+                self._publish(self._job_event(crud.get_image_job(db, job_id), "cancelled"))
+                self._notify(job_id)
+                return True
+            if crud.request_image_job_cancel(db, job_id):
+                logger.info(f"Requested cancellation of image job {job_id} running in another process")
+                self._publish(self._job_event(crud.get_image_job(db, job_id), "cancelling"))
+                return True
+        finally:
+            db.close()
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        db = self._session()
+        try:
+            by_status = crud.count_image_jobs_by_status(db)
+        finally:
+            db.close()
+        return {
+            "workers": self.workers,
+            "queued": by_status.get("queued", 0),
+            "running": by_status.get("running", 0),
+            "by_status": by_status,
+            "running_in_process": sorted(self._running),
+            "waiting_in_process": len(self._waiters),
+            "completed_in_process": self.completed,
+            "failed_in_process": self.failed,
+            "cancelled_in_process": self.cancelled,
+        }
+
+    def _load(self, job_id: int) -> Optional[models.ImageJob]:
+        db = self._session()
+        try:
+            return crud.get_image_job(db, job_id)
+        finally:
+            db.close()
+
+    @staticmethod
+    def _result_of(job: models.ImageJob) -> Tuple[str, int]:
+        if job.status == "completed":
+            return job.result_url, job.result_seed
+        if job.status == "cancelled":
+            raise ImageJobCancelledError(f"Image job {job.id} was cancelled")
+        raise Exception(job.error or f"Image job {job.id} failed")
+
+    def _notify(self, job_id: int) -> None:
+        future = self._waiters.get(job_id)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    def _recover_stale_jobs(self) -> None:
+        db = self._session()
+        try:
+            recovered = crud.requeue_stale_image_jobs(
+                db, stale_before=datetime.utcnow() - timedelta(seconds=self.stale_after)
+            )
+        except Exception as e:
+            logger.error(f"Failed to recover stale image jobs: {e}", exc_info=True)
+            return
+        finally:
+            db.close()
+        if recovered:
+            logger.warning(f"Requeued {recovered} stale image job(s)")
+            self._wakeup.set()
+
+    async def _maintenance(self) -> None:
+        while True:
+            await asyncio.sleep(self.stale_after / 2)
+            self._recover_stale_jobs()
+
+    def _claim(self, worker_id: str) -> Optional[models.ImageJob]:
+        db = self._session()
+        try:
+            return crud.claim_image_job(db, worker_id)
+        finally:
+            db.close()
+
+    async def _worker(self, index: int) -> None:
+        worker_id = f"{self.worker_prefix}:{index}"
+        while True:
+            self._wakeup.clear()
+            try:
+                job = self._claim(worker_id)
+            except Exception as e:
+                logger.error(f"Image worker {worker_id} failed to claim a job: {e}", exc_info=True)
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._publish(self._job_event(job, "running"))
+            self._publish_queue_positions()
+            await self._execute(job, worker_id)
+
+    async def _heartbeat(self, job_id: int) -> None:
+        """生存時刻を更新しつつ、別のプロセスからの取り消しの依頼を確認する"""
+        last_beat = time.monotonic()
+        while True:
+            await asyncio.sleep(min(self.heartbeat_interval, self.cancel_poll_interval))
+            db = self._session()
+            try:
+                if crud.get_image_job_status(db, job_id) == "cancelling":
+                    task = self._running.get(job_id)
+                    if task is not None:
+                        logger.info(f"Cancelling image job {job_id} on request from another process")
+                        task.cancel()
+                    return
+                if time.monotonic() - last_beat >= self.heartbeat_interval:
+                    crud.heartbeat_image_job(db, job_id)
+                    last_beat = time.monotonic()
+            except Exception as e:
+                logger.warning(f"Failed to update heartbeat of image job {job_id}: {e}")
+            finally:
+                db.close()
+
+    async def _execute(self, job: models.ImageJob, worker_id: str) -> None:
+        logger.info(f"Image worker {worker_id} started {job.kind} job {job.id} (attempt {job.attempts})")
+        db = self._session()
+        task = asyncio.create_task(self.image_service.run_job(db, job))
+        self._running[job.id] = task
+        self._active[job.id] = {"job": job, "started": time.monotonic(), "published": 0.0}
+        heartbeat = asyncio.create_task(self._heartbeat(job.id))
+        image_url: Optional[str] = None
+        status = "failed"
+        error: Optional[str] = None
+        try:
+            image_url, seed = await task
+            status = "completed"
+            crud.finish_image_job(db, job.id, status, result_url=image_url, result_seed=seed)
+            self.completed += 1
+        except asyncio.CancelledError:
+            if self._stopping and crud.get_image_job_status(db, job.id) != "cancelling":
+                # 停止時は待ち行列に戻し、次に起動したワーカーに任せる（取り消し依頼中のものは除く）
+                crud.retry_image_job(db, job.id, error="Worker stopped", delay_seconds=0)
+                raise
+            status = "cancelled"
+            crud.finish_image_job(db, job.id, status, error="Cancelled")
+            self.cancelled += 1
+        except Exception as e:
+            error = str(e.detail if isinstance(e, HTTPException) else e)
+            logger.error(f"Image job {job.id} failed: {error}")
+            crud.finish_image_job(db, job.id, status, error=error)
+            self.failed += 1
+        finally:
+            heartbeat.cancel()
+            self._running.pop(job.id, None)
+            self._active.pop(job.id, None)
+            if not self._stopping:
+                if status == "completed":
+                    self._publish(self._job_event(job, status, progress=100.0, image_url=image_url))
+                else:
+                    self._publish(self._job_event(job, status, error=error))
+                self._finish_unwatched_chat_job(db, job, image_url, status)
+            db.close()
+            self._notify(job.id)
+
+    def _finish_unwatched_chat_job(
+        self, db: Session, job: models.ImageJob, image_url: Optional[str], status: str
+    ) -> None:
+        """
+        待っているリクエストがないチャット画像（再起動前に登録されたものなど）は、
+        ワーカー側で返信メッセージに反映して通知する
+        """
+        if job.kind != "chat" or job.id in self._waiters or not job.chat_id or job.message_id is None:
+            return
+        image_status = status if status in ("completed", "cancelled") else "failed"
+        try:
+            message = crud.update_pending_reply_image(db, job.chat_id, job.message_id, image_url, image_status)
+        except Exception as e:
+            logger.error(f"Failed to attach image of job {job.id} to its reply: {e}", exc_info=True)
+            return
+        if message is not None:
+            if message.image_url:
+                request_variants(self.event_bus, MESSAGE_IMAGE, message.id)
+            self.event_bus.publish(chat_topic(job.chat_id), {
+                "type": "message_updated",
+                "id": message.id,
+                "chat_id": job.chat_id,
+                "image_url": message.image_url,
+                "image_status": image_status,
+            })
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+from typing import Any, Callable, Dict, Optional, Set
+
+from sqlalchemy.orm import Session
+
+import crud
+from .event_bus import EventBus, chat_topic
+from .image_job_queue import ImageJobCancelledError
+from .image_variants import MESSAGE_IMAGE, request_variants
+
+logger = logging.getLogger(__name__)
+
+# messages.image_status の値
+IMAGE_PENDING = "pending"
+IMAGE_COMPLETED = "completed"
+IMAGE_FAILED = "failed"
+IMAGE_CANCELLED = "cancelled"
+
+
+class ImageJobTracker:
+    """応答の送信後も続くチャット画像の生成を追跡する
+
+    生成が終わるとAIメッセージの image_url / image_status を更新し、
+    チャットのトピックへ message_updated イベントを配信する。
+    取り消された生成（利用者の取り消し、切断後に誰も見ていないチャット）は cancelled になる。
+    """
+
+    def __init__(
+        self,
+        event_bus: EventBus,
+        session_factory: Optional[Callable[[], Session]] = None,
+        disconnect_grace: Optional[float] = None,
+    ):
+        self.event_bus = event_bus
+        self.session_factory = session_factory
+        # 切断後、再接続を待ってから生成を取り消すまでの秒数（負の値で取り消さない）
+        self.disconnect_grace = (
+            disconnect_grace if disconnect_grace is not None
+            else float(os.getenv("IMAGE_CANCEL_ON_DISCONNECT_GRACE", "10"))
+        )
+        self.jobs: Dict[int, "asyncio.Task[None]"] = {}
+        self.image_tasks: Dict[int, "asyncio.Task[Optional[str]]"] = {}
+        self.chat_ids: Dict[int, int] = {}
+        self._watchers: Set["asyncio.Task[int]"] = set()
+
+    def submit(self, image_task: "asyncio.Task[Optional[str]]", chat_id: int, message_id: int) -> "asyncio.Task[None]":
+        """画像生成タスクをAIメッセージに紐付けて追跡を開始"""
+        job = asyncio.create_task(self._complete(image_task, chat_id, message_id))
+        self.jobs[message_id] = job
+        self.image_tasks[message_id] = image_task
+        self.chat_ids[message_id] = chat_id
+        job.add_done_callback(lambda _: self._forget(message_id))
+        return job
+
+    def _forget(self, message_id: int) -> None:
+        self.jobs.pop(message_id, None)
+        self.image_tasks.pop(message_id, None)
+        self.chat_ids.pop(message_id, None)
+
+    def cancel(self, message_id: int, chat_id: Optional[int] = None) -> bool:
+        """
+        メッセージの画像生成を取り消す（待ち行列のジョブとWebUIの生成も中断される）
+
+        chat_id を指定した場合は、そのチャットのメッセージでなければ取り消さない。
+        """
+        image_task = self.image_tasks.get(message_id)
+        if image_task is None or image_task.done():
+            return False
+        if chat_id is not None and self.chat_ids.get(message_id) != chat_id:
+            return False
+        logger.info(f"Cancelling image job for message {message_id}")
+        image_task.cancel()
+        return True
+
+    def cancel_chat(self, chat_id: int) -> int:
+        """チャットの生成中の画像をすべて取り消し、件数を返す"""
+        message_ids = [message_id for message_id, owner in self.chat_ids.items() if owner == chat_id]
+        return sum(1 for message_id in message_ids if self.cancel(message_id))
+
+    async def cancel_unwatched(self, chat_id: int, delay: Optional[float] = None) -> int:
+        """
+        猶予時間が過ぎてもチャットを見ている接続がなければ、生成中の画像を取り消す
+
+        再読み込みや一時的な切断ではすぐに再接続されるため、猶予時間を置いてから判断する。
+        """
+        delay = self.disconnect_grace if delay is None else delay
+        if delay < 0 or chat_id not in self.chat_ids.values():
+            return 0
+        await asyncio.sleep(delay)
+        if self.event_bus.subscriber_count(chat_topic(chat_id)) > 0:
+            return 0
+        cancelled = self.cancel_chat(chat_id)
+        if cancelled:
+            logger.info(f"Cancelled {cancelled} image job(s) of chat {chat_id} after the client disconnected")
+        return cancelled
+
+    def schedule_cancel_unwatched(self, chat_id: int) -> Optional["asyncio.Task[int]"]:
+        """切断時に呼ばれ、cancel_unwatched をバックグラウンドで実行する"""
+        if self.disconnect_grace < 0 or chat_id not in self.chat_ids.values():
+            return None
+        watcher = asyncio.create_task(self.cancel_unwatched(chat_id))
+        self._watchers.add(watcher)
+        watcher.add_done_callback(self._watchers.discard)
+        return watcher
+
+    async def _complete(self, image_task: "asyncio.Task[Optional[str]]", chat_id: int, message_id: int) -> None:
+        image_url: Optional[str] = None
+        cancelled = False
+        try:
+            image_url = await image_task
+        except asyncio.CancelledError:
+            if not image_task.cancelled():
+                raise
+            cancelled = True
+        except ImageJobCancelledError:
+            cancelled = True
+        except Exception as e:
+            logger.error(f"Image job for message {message_id} failed: {e}", exc_info=True)
+        if image_url:
+            status = IMAGE_COMPLETED
+        else:
+            status = IMAGE_CANCELLED if cancelled else IMAGE_FAILED
+
+        # リクエストのセッションは応答後に閉じられるため、専用のセッションを使う
+        if self.session_factory is None:
+            from database import SessionLocal
+            self.session_factory = SessionLocal
+        db = self.session_factory()
+        try:
+            crud.update_message_image(db, message_id, image_url=image_url, image_status=status)
+        except Exception as e:
+            logger.error(f"Failed to update image of message {message_id}: {e}", exc_info=True)
+        finally:
+            db.close()
+        if image_url:
+            request_variants(self.event_bus, MESSAGE_IMAGE, message_id)
+
+        self.event_bus.publish(chat_topic(chat_id), {
+            "type": "message_updated",
+            "id": message_id,
+            "chat_id": chat_id,
+            "image_url": image_url,
+            "image_status": status,
+        })
+        logger.info(f"Image job for message {message_id} finished with status {status}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self.jobs),
+            "message_ids": sorted(self.jobs),
+            "disconnect_grace": self.disconnect_grace,
+        }
@@ -0,0 +1,318 @@
+import hashlib
+import logging
+import os
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Iterator, Optional, Tuple
+from urllib.parse import urlparse
+
+import aiofiles
+import aiofiles.os
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import crud
+from services.image_io import run_image_io
+
+logger = logging.getLogger(__name__)
+
+# 移行前の画像が置かれていたフラットなディレクトリ
+LEGACY_IMAGE_DIR = Path("backend/static/agent_images")
+LEGACY_URL_PREFIX = "/static/agent_images/"
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def content_key(sha256: str, extension: str) -> str:
+    """内容のハッシュから2段のシャーディングをした保存先のキーを作成（例: "ab/cd/abcd...png"）"""
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}"
+
+
+class StorageDriver(ABC):
+    """画像ファイルの保存先の共通インターフェース"""
+
+    @abstractmethod
+    def put(self, key: str, data: bytes, content_type: Optional[str] = None) -> None:
+        pass
+
+    @abstractmethod
+    def get(self, key: str) -> bytes:
+        pass
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        pass
+
+    @abstractmethod
+    def iter_entries(self) -> Iterator[Tuple[str, int, float]]:
+        """保存されているファイルを (キー, サイズ, 更新時刻のUNIX時間) として順に返す"""
+        pass
+
+    async def put_async(self, key: str, data: bytes, content_type: Optional[str] = None) -> None:
+        """put を画像用のスレッドプールで実行"""
+        await run_image_io(self.put, key, data, content_type)
+
+    async def delete_async(self, key: str) -> None:
+        """delete を画像用のスレッドプールで実行"""
+        await run_image_io(self.delete, key)
+
+    @abstractmethod
+    def url(self, key: str) -> str:
+        """キーを配信用のURL（ローカルの場合は /static からのパス）に変換"""
+        pass
+
+    @abstractmethod
+    def key_for_url(self, url: str) -> Optional[str]:
+        """このドライバーのURLからキーを取り出す（別の保存先のURLの場合はNone）"""
+        pass
+
+
+class LocalStorageDriver(StorageDriver):
+    """ローカルのファイルシステムに保存し、/static から配信する"""
+
+    def __init__(self, root: Path, url_prefix: str = "/static/images"):
+        self.root = Path(root)
+        self.url_prefix = url_prefix.rstrip("/")
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key
+
+    def put(self, key: str, data: bytes, content_type: Optional[str] = None) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 書きかけのファイルが配信されないよう、一時ファイルに書いてから置き換える
+        tmp_path = path.with_name(f".{uuid.uuid4().hex}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    async def put_async(self, key: str, data: bytes, content_type: Optional[str] = None) -> None:
+        path = self._path(key)
+        await aiofiles.os.makedirs(path.parent, exist_ok=True)
+        tmp_path = path.with_name(f".{uuid.uuid4().hex}.tmp")
+        async with aiofiles.open(tmp_path, "wb") as f:
+            await f.write(data)
+        await aiofiles.os.replace(tmp_path, path)
+
+    def get(self, key: str) -> bytes:
+        return self._path(key).read_bytes()
+
+    def delete(self, key: str) -> None:
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def iter_entries(self) -> Iterator[Tuple[str, int, float]]:
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = Path(dirpath) / filename
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                yield path.relative_to(self.root).as_posix(), stat.st_size, stat.st_mtime
+
+    def url(self, key: str) -> str:
+        return f"{self.url_prefix}/{key}"
+
+    def key_for_url(self, url: str) -> Optional[str]:
+        path = urlparse(url).path
+        prefix = f"{self.url_prefix}/"
+        if path.startswith(prefix):
+            return path[len(prefix):]
+        return None
+
+
+class S3StorageDriver(StorageDriver):
+    """S3互換のオブジェクトストレージ（AWS S3 / MinIO など）に保存する"""
+
+    def __init__(
+        self,
+        bucket: str,
+        public_url: str,
+        endpoint_url: Optional[str] = None,
+        prefix: str = "",
+        region: Optional[str] = None,
+        access_key_id: Optional[str] = None,
+        secret_access_key: Optional[str] = None,
+        client: Any = None,
+    ):
+        if client is None:
+            try:
+                import boto3
+            except ImportError as e:
+                raise ImportError("IMAGE_STORAGE_DRIVER=s3 requires the boto3 package") from e
+            client = boto3.client(
+                "s3",
+                endpoint_url=endpoint_url,
+                region_name=region,
+                aws_access_key_id=access_key_id,
+                aws_secret_access_key=secret_access_key,
+            )
+        self.client = client
+        self.bucket = bucket
+        self.public_url = public_url.rstrip("/")
+        self.prefix = prefix.strip("/")
+
+    @classmethod
+    def from_env(cls) -> "S3StorageDriver":
+        bucket = os.getenv("S3_BUCKET")
+        if not bucket:
+            raise ValueError("S3_BUCKET environment variable not set.")
+        endpoint_url = os.getenv("S3_ENDPOINT_URL")
+        return cls(
+            bucket=bucket,
+            # MinIOなどでは <endpoint>/<bucket> で公開されることが多い
+            public_url=os.getenv("S3_PUBLIC_URL") or f"{endpoint_url or f'https://{bucket}.s3.amazonaws.com'}/{bucket}",
+            endpoint_url=endpoint_url,
+            prefix=os.getenv("S3_PREFIX", "images"),
+            region=os.getenv("S3_REGION"),
+            access_key_id=os.getenv("S3_ACCESS_KEY_ID"),
+            secret_access_key=os.getenv("S3_SECRET_ACCESS_KEY"),
+        )
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put(self, key: str, data: bytes, content_type: Optional[str] = None) -> None:
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._object_key(key),
+            Body=data,
+            ContentType=content_type or "application/octet-stream",
+            # 内容が変わらないキーなので長期間キャッシュさせる
+            CacheControl="public, max-age=31536000, immutable",
+        )
+
+    def get(self, key: str) -> bytes:
+        response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        return response["Body"].read()
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except Exception:
+            return False
+
+    def iter_entries(self) -> Iterator[Tuple[str, int, float]]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        prefix = f"{self.prefix}/" if self.prefix else ""
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                yield obj["Key"][len(prefix):], obj["Size"], obj["LastModified"].timestamp()
+
+    def url(self, key: str) -> str:
+        return f"{self.public_url}/{self._object_key(key)}"
+
+    def key_for_url(self, url: str) -> Optional[str]:
+        prefix = f"{self.public_url}/{self.prefix}/" if self.prefix else f"{self.public_url}/"
+        if url.startswith(prefix):
+            return url[len(prefix):]
+        return None
+
+
+class ImageStore:
+    """内容で重複を排除して画像を保存する
+
+    画像は SHA-256 から決まるキー（ab/cd/<ハッシュ>.<拡張子>）に保存し、同じ内容の画像は
+    1つのファイルを共有する。image_blobs テーブルで参照数を数え、最後の参照が
+    解放されたときにファイルを削除する。
+    """
+
+    def __init__(self, driver: StorageDriver, legacy_dir: Path = LEGACY_IMAGE_DIR):
+        self.driver = driver
+        self.legacy_dir = Path(legacy_dir)
+
+    @classmethod
+    def from_env(cls) -> "ImageStore":
+        """IMAGE_STORAGE_DRIVER（local / s3）に応じて保存先を選ぶ"""
+        driver_name = os.getenv("IMAGE_STORAGE_DRIVER", "local").lower()
+        if driver_name == "s3":
+            driver: StorageDriver = S3StorageDriver.from_env()
+        elif driver_name == "local":
+            driver = LocalStorageDriver(Path(os.getenv("IMAGE_STORAGE_ROOT", "backend/static/images")))
+        else:
+            raise ValueError(f"Unknown image storage driver: {driver_name}")
+        return cls(driver)
+
+    def save(self, db: Session, data: bytes, extension: str = ".png", content_type: Optional[str] = "image/png") -> str:
+        """画像を保存してURLを返す（同じ内容が保存済みなら参照数を増やすだけ）"""
+        sha256 = _sha256(data)
+        if crud.add_image_blob_ref(db, sha256):
+            return self.driver.url(crud.get_image_blob(db, sha256).storage_key)
+
+        key = content_key(sha256, extension.lower() or ".png")
+        self.driver.put(key, data, content_type=content_type)
+        try:
+            crud.create_image_blob(db, sha256=sha256, storage_key=key, size=len(data), content_type=content_type)
+        except IntegrityError:
+            # 同じ内容が同時に保存された場合は、先に登録された方を参照する
+            db.rollback()
+            crud.add_image_blob_ref(db, sha256)
+        return self.driver.url(key)
+
+    async def save_async(
+        self, db: Session, data: bytes, extension: str = ".png", content_type: Optional[str] = "image/png"
+    ) -> str:
+        """save の非同期版（ハッシュ計算と書き込みをイベントループの外で行う）"""
+        sha256 = await run_image_io(_sha256, data)
+        if crud.add_image_blob_ref(db, sha256):
+            return self.driver.url(crud.get_image_blob(db, sha256).storage_key)
+
+        key = content_key(sha256, extension.lower() or ".png")
+        await self.driver.put_async(key, data, content_type=content_type)
+        try:
+            crud.create_image_blob(db, sha256=sha256, storage_key=key, size=len(data), content_type=content_type)
+        except IntegrityError:
+            db.rollback()
+            crud.add_image_blob_ref(db, sha256)
+        return self.driver.url(key)
+
+    def release(self, db: Session, image_url: Optional[str]) -> None:
+        """
+        画像の参照を1つ解放する
+
+        参照がなくなったファイルはその場では削除せず、猶予期間の後にGCが削除する
+        （直後に同じ内容が保存されても、登録とファイルがそのまま再利用される）。
+        移行前のディレクトリの画像は参照数を持たないため、どこからも参照されて
+        いないかどうかはGCのマークで判断する。
+        """
+        if not image_url:
+            return
+        key = self.driver.key_for_url(image_url)
+        if key is not None and crud.release_image_blob_ref(db, key):
+            logger.info(f"Image blob is no longer referenced: {key}")
+
+    async def release_async(self, db: Session, image_url: Optional[str]) -> None:
+        """release の非同期版"""
+        self.release(db, image_url)
+
+    def load(self, image_url: str) -> Optional[bytes]:
+        """URLの画像を読み込む（この保存先にも移行前のディレクトリにもない場合はNone）"""
+        key = self.driver.key_for_url(image_url)
+        if key is not None:
+            try:
+                return self.driver.get(key)
+            except FileNotFoundError:
+                return None
+        path = urlparse(image_url).path
+        if path.startswith(LEGACY_URL_PREFIX):
+            file_path = self.legacy_dir / Path(path).name
+            if file_path.exists():
+                return file_path.read_bytes()
+        return None
@@ -0,0 +1,182 @@
+import asyncio
+import base64
+import logging
+import os
+from io import BytesIO
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageOps
+from sqlalchemy.orm import Session
+
+import crud
+from services.event_bus import EventBus
+from services.image_io import run_image_io
+from services.image_storage import ImageStore
+
+logger = logging.getLogger(__name__)
+
+# 縮小版の作成を依頼するイベントのトピック
+IMAGE_VARIANTS_TOPIC = "image_variants"
+
+# 縮小版を作る画像の種類（crud.IMAGE_VARIANT_MODELS のキー）
+AGENT_IMAGE = "agent_image"
+MESSAGE_IMAGE = "message"
+
+PLACEHOLDER_WIDTH = 16
+
+
+def _default_widths() -> List[int]:
+    return sorted({int(width) for width in os.getenv("IMAGE_VARIANT_WIDTHS", "160,320,640").split(",") if width.strip()})
+
+
+def request_variants(event_bus: Optional[EventBus], kind: str, row_id: int) -> None:
+    """保存した画像の縮小版の作成を依頼する（ワーカーが起動していなければ何もしない）"""
+    if event_bus is not None:
+        event_bus.publish(IMAGE_VARIANTS_TOPIC, {"kind": kind, "id": row_id})
+
+
+def variant_urls(variants: Optional[Dict[str, Any]]) -> List[str]:
+    """縮小版のURLの一覧（参照の解放用）"""
+    if not variants:
+        return []
+    return list((variants.get("srcset") or {}).values())
+
+
+def render_variants(
+    data: bytes, widths: Sequence[int], quality: int = 80
+) -> Tuple[Tuple[int, int], Dict[int, bytes], bytes]:
+    """画像から幅ごとのWebPとぼかしプレースホルダーを作成
+
+    元の幅より小さい幅の縮小版に加えて、元の幅のWebPも作る。
+    Returns:
+        (元のサイズ, {幅: WebPのバイト列}, プレースホルダーのWebP)
+    """
+    with Image.open(BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    width, height = image.size
+
+    def encode(target_width: int, target_quality: int) -> bytes:
+        target_height = max(1, round(height * target_width / width))
+        resized = image if target_width == width else image.resize((target_width, target_height), Image.LANCZOS)
+        buffer = BytesIO()
+        resized.save(buffer, format="WEBP", quality=target_quality, method=4)
+        return buffer.getvalue()
+
+    outputs = {target: encode(target, quality) for target in widths if target < width}
+    outputs[width] = encode(width, quality)
+    placeholder = encode(min(PLACEHOLDER_WIDTH, width), 30)
+    return (width, height), outputs, placeholder
+
+
+class ImageVariantWorker:
+    """保存した画像の縮小版（WebP）とぼかしプレースホルダーを作るワーカー
+
+    IMAGE_VARIANTS_TOPIC に届いた依頼を順に処理する。デコードとエンコードは
+    画像用のスレッドプールで行い、縮小版は ImageStore に保存して
+    agent_images.variants / messages.variants に記録する。
+    """
+
+    def __init__(
+        self,
+        image_store: ImageStore,
+        event_bus: Optional[EventBus] = None,
+        widths: Optional[Sequence[int]] = None,
+        quality: Optional[int] = None,
+        session_factory: Optional[Callable[[], Session]] = None,
+    ):
+        self.image_store = image_store
+        self.event_bus = event_bus
+        self.widths = list(widths) if widths is not None else _default_widths()
+        self.quality = quality if quality is not None else int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
+        self.session_factory = session_factory
+        self._task: Optional["asyncio.Task[None]"] = None
+        self.processed = 0
+        self.failed = 0
+
+    def _session(self) -> Session:
+        if self.session_factory is None:
+            from database import SessionLocal
+            self.session_factory = SessionLocal
+        return self.session_factory()
+
+    def start(self) -> None:
+        if self._task is None and self.event_bus is not None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        with self.event_bus.subscribe(IMAGE_VARIANTS_TOPIC) as requests:
+            while True:
+                request = await requests.get()
+                db = self._session()
+                try:
+                    await self.process(db, request["kind"], request["id"])
+                except Exception as e:
+                    logger.error(f"Failed to create variants of {request['kind']} {request['id']}: {e}", exc_info=True)
+                finally:
+                    db.close()
+
+    async def process(self, db: Session, kind: str, row_id: int) -> Optional[Dict[str, Any]]:
+        """1件の画像の縮小版を作成して記録（他で処理中・処理済みの場合はNone）"""
+        image_url = crud.claim_image_variants(db, kind, row_id)
+        if image_url is None:
+            return None
+        try:
+            variants = await self.create_variants(db, image_url)
+            self.processed += 1
+        except Exception as e:
+            logger.warning(f"Could not create variants for {image_url}: {e}")
+            # 作り直しを繰り返さないよう、失敗も記録する
+            variants = {"error": str(e)}
+            self.failed += 1
+        crud.set_image_variants(db, kind, row_id, variants)
+        return variants
+
+    async def create_variants(self, db: Session, image_url: str) -> Dict[str, Any]:
+        data = await run_image_io(self.image_store.load, image_url)
+        if data is None:
+            raise ValueError("source image is not available")
+        (width, height), outputs, placeholder = await run_image_io(render_variants, data, self.widths, self.quality)
+        srcset = {}
+        for target_width, webp in sorted(outputs.items()):
+            srcset[str(target_width)] = await self.image_store.save_async(
+                db, webp, extension=".webp", content_type="image/webp"
+            )
+        return {
+            "width": width,
+            "height": height,
+            "srcset": srcset,
+            "placeholder": "data:image/webp;base64," + base64.b64encode(placeholder).decode("ascii"),
+        }
+
+    async def backfill(self, db: Session, batch_size: int = 100, limit: Optional[int] = None) -> int:
+        """縮小版がまだない画像をまとめて処理し、処理した件数を返す"""
+        done = 0
+        for kind in (AGENT_IMAGE, MESSAGE_IMAGE):
+            while limit is None or done < limit:
+                row_ids = crud.get_image_ids_without_variants(db, kind, limit=batch_size)
+                if not row_ids:
+                    break
+                for row_id in row_ids:
+                    if limit is not None and done >= limit:
+                        break
+                    if await self.process(db, kind, row_id) is not None:
+                        done += 1
+        return done
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "widths": self.widths,
+            "processed": self.processed,
+            "failed": self.failed,
+        }
@@ -0,0 +1,103 @@
+import asyncio
+from typing import Dict, Any, AsyncIterator, Optional
+from anthropic import AsyncAnthropic
+from .base import LLMClientInterface
+
+class AnthropicClient(LLMClientInterface):
+    """Anthropic Messages API クライアント"""
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "claude-3-5-haiku-latest",
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        timeout: int = 60,
+        base_url: Optional[str] = None
+    ):
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        # base_urlを指定するとローカルのスタブサーバーに接続できる
+        self.client = AsyncAnthropic(api_key=api_key, base_url=base_url, timeout=timeout)
+
+    def _build_request(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "max_tokens": kwargs.get("max_tokens", self.max_tokens),
+            "temperature": kwargs.get("temperature", self.temperature),
+            "messages": [{"role": "user", "content": self._build_content(prompt, kwargs.get("cacheable_prefix"))}],
+        }
+
+    @staticmethod
+    def _build_content(prompt: str, cacheable_prefix: Optional[str]) -> Any:
+        """共通の先頭部分をプロンプトキャッシュの対象としてブロックを分ける"""
+        if not cacheable_prefix or not prompt.startswith(cacheable_prefix) or len(prompt) == len(cacheable_prefix):
+            return prompt
+        return [
+            {"type": "text", "text": cacheable_prefix, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": prompt[len(cacheable_prefix):]},
+        ]
+
+    async def generate(
+        self,
+        prompt: str,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """Anthropic APIを使用して応答を生成"""
+        try:
+            response = await asyncio.wait_for(
+                self.client.messages.create(**self._build_request(prompt, **kwargs)),
+                timeout=self.timeout
+            )
+            content = "".join(
+                block.text for block in response.content if getattr(block, "type", None) == "text"
+            )
+            usage = response.usage
+            return {
+                "content": content,
+                "model": response.model or self.model,
+                "usage": {
+                    "prompt_tokens": usage.input_tokens if usage else None,
+                    "completion_tokens": usage.output_tokens if usage else None,
+                    "total_tokens": (usage.input_tokens + usage.output_tokens) if usage else None,
+                },
+                "finish_reason": response.stop_reason
+            }
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Anthropic API timeout after {self.timeout} seconds")
+        except Exception as e:
+            raise Exception(f"Anthropic API error: {str(e)}")
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """Anthropic APIのストリーミング応答をデルタ単位で返す"""
+        try:
+            async with self.client.messages.stream(**self._build_request(prompt, **kwargs)) as stream:
+                async for text in stream.text_stream:
+                    if text:
+                        yield text
+                usage_sink = kwargs.get("usage_sink")
+                if usage_sink is not None:
+                    usage = (await stream.get_final_message()).usage
+                    usage_sink.update({
+                        "prompt_tokens": usage.input_tokens,
+                        "completion_tokens": usage.output_tokens,
+                        "total_tokens": usage.input_tokens + usage.output_tokens,
+                    })
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Anthropic API timeout after {self.timeout} seconds")
+        except Exception as e:
+            raise Exception(f"Anthropic API error: {str(e)}")
+
+    async def validate_response(self, response: Dict[str, Any]) -> bool:
+        """応答の妥当性を検証"""
+        return bool(response.get("content"))
+
+    async def aclose(self) -> None:
+        """HTTP接続を解放"""
+        await self.client.close()
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any
+from typing import Dict, Any, AsyncIterator
 
 class LLMClientInterface(ABC):
     """LLMクライアントの共通インターフェース"""
@@ -13,7 +13,22 @@ class LLMClientInterface(ABC):
         """LLMから応答を生成"""
         pass
 
+    async def generate_stream(
+        self,
+        prompt: str,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """LLMから応答を差分（デルタ）単位で生成
+
+        ストリーミングに対応していないクライアントでは、
+        generateの結果を1つのデルタとして返す。
+        """
+        response = await self.generate(prompt, **kwargs)
+        content = response.get("content")
+        if content:
+            yield content
+
     @abstractmethod
     async def validate_response(self, response: Dict[str, Any]) -> bool:
         """応答の妥当性を検証"""
-        pass
\ No newline at end of file
+        pass
@@ -0,0 +1,232 @@
+import time
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .base import LLMClientInterface
+from ..cassette import Cassette, decode_bytes, encode_bytes, request_key
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def _error_fields(error: BaseException) -> Dict[str, Any]:
+    return {
+        "error": str(error),
+        "error_type": "timeout" if isinstance(error, (TimeoutError, asyncio.TimeoutError)) else "error",
+    }
+
+
+def _raise_recorded_error(entry: Dict[str, Any]) -> None:
+    if entry.get("error_type") == "timeout":
+        raise TimeoutError(entry["error"])
+    if entry.get("error"):
+        raise Exception(entry["error"])
+
+
+async def _sleep_until(started: float, offset: float) -> None:
+    delay = offset - (time.monotonic() - started)
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+class RecordingLLMClient(LLMClientInterface):
+    """実際のプロバイダーを呼び出し、リクエストと応答・所要時間をカセットに記録する"""
+
+    def __init__(self, client: LLMClientInterface, cassette: Cassette):
+        self.client = client
+        self.cassette = cassette
+
+    @property
+    def model(self) -> Optional[str]:
+        return getattr(self.client, "model", None)
+
+    def _base_entry(self, kind: str, prompt: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        # プロンプト本文は保存せず、照合用のハッシュとサイズだけを残す
+        return {
+            "kind": kind,
+            "key": request_key("llm", self.model, prompt),
+            "model": self.model,
+            "call_type": kwargs.get("call_type"),
+            "prompt_chars": len(prompt),
+        }
+
+    async def generate(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        entry = self._base_entry("llm", prompt, kwargs)
+        started = time.monotonic()
+        try:
+            response = await self.client.generate(prompt, **kwargs)
+        except Exception as e:
+            entry.update(duration=time.monotonic() - started, **_error_fields(e))
+            self.cassette.record(entry)
+            raise
+        entry.update(duration=time.monotonic() - started, response=response)
+        self.cassette.record(entry)
+        return response
+
+    async def generate_stream(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        entry = self._base_entry("llm_stream", prompt, kwargs)
+        chunks: List[Tuple[float, str]] = []
+        started = time.monotonic()
+        try:
+            async for delta in self.client.generate_stream(prompt, **kwargs):
+                chunks.append((time.monotonic() - started, delta))
+                yield delta
+        except Exception as e:
+            entry.update(duration=time.monotonic() - started, chunks=chunks, **_error_fields(e))
+            self.cassette.record(entry)
+            raise
+        entry.update(duration=time.monotonic() - started, chunks=chunks)
+        self.cassette.record(entry)
+
+    async def validate_response(self, response: Dict[str, Any]) -> bool:
+        return await self.client.validate_response(response)
+
+    async def aclose(self) -> None:
+        close = getattr(self.client, "aclose", None)
+        if close is not None:
+            await close()
+
+
+class ReplayLLMClient(LLMClientInterface):
+    """カセットに記録した応答を、ネットワークを使わずに再生する"""
+
+    def __init__(self, cassette: Cassette, model: str = "replay"):
+        self.cassette = cassette
+        self.model = model
+
+    def _next_entry(self, kinds: Tuple[str, str], key: str) -> Dict[str, Any]:
+        """
+        再生する記録を取得する
+
+        通常の呼び出しとストリーミングは同じキーになるため、先に種類ごとのキー一致を探し、
+        もう一方の種類でしか記録されていない呼び出しはそちらの記録で代用する。
+        """
+        for kind in kinds:
+            if self.cassette.has_match(kind, key):
+                return self.cassette.next_entry(kind, key)
+        for kind in kinds:
+            try:
+                return self.cassette.next_entry(kind, key)
+            except Exception:
+                continue
+        return self.cassette.next_entry(kinds[0], key)
+
+    async def generate(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        started = time.monotonic()
+        entry = self._next_entry(("llm", "llm_stream"), request_key("llm", self.model, prompt))
+        if self.cassette.realtime:
+            await _sleep_until(started, entry.get("duration", 0.0))
+        _raise_recorded_error(entry)
+        if entry["kind"] == "llm_stream":
+            # ストリーミングで記録した呼び出しは、デルタを連結した応答として返す
+            return {
+                "content": "".join(delta for _, delta in entry.get("chunks", [])),
+                "model": entry.get("model"),
+            }
+        return dict(entry["response"])
+
+    async def generate_stream(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        started = time.monotonic()
+        entry = self._next_entry(("llm_stream", "llm"), request_key("llm", self.model, prompt))
+        if entry["kind"] == "llm_stream":
+            chunks = entry.get("chunks", [])
+        else:
+            # 通常の呼び出しで記録した応答は1デルタで返す
+            chunks = [(entry.get("duration", 0.0), entry.get("response", {}).get("content", ""))]
+        for offset, delta in chunks:
+            if self.cassette.realtime:
+                await _sleep_until(started, offset)
+            yield delta
+        if self.cassette.realtime:
+            await _sleep_until(started, entry.get("duration", 0.0))
+        _raise_recorded_error(entry)
+
+    async def validate_response(self, response: Dict[str, Any]) -> bool:
+        return bool(response.get("content"))
+
+
+class RecordingImageClient:
+    """画像生成クライアントを包み、生成結果・進捗・所要時間をカセットに記録する"""
+
+    def __init__(self, client: Any, cassette: Cassette):
+        self.client = client
+        self.cassette = cassette
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
+
+    async def generate_image_async(
+        self,
+        prompt: str,
+        negative_prompt: str = "",
+        progress_callback: Optional[ProgressCallback] = None,
+        seed: Optional[int] = None,
+        **kwargs
+    ) -> Tuple[bytes, int]:
+        entry: Dict[str, Any] = {
+            "kind": "image",
+            "key": request_key("image", prompt, negative_prompt, seed),
+            "provider": self.client.__class__.__name__,
+            "prompt_chars": len(prompt),
+            "requested_seed": seed,
+        }
+        progress: List[Tuple[float, Dict[str, Any]]] = []
+        started = time.monotonic()
+
+        async def recording_callback(progress_data: Dict[str, Any]) -> None:
+            # プレビュー画像は大きいので記録しない
+            progress.append((time.monotonic() - started, {k: v for k, v in progress_data.items() if k != "current_image"}))
+            if progress_callback:
+                await progress_callback(progress_data)
+
+        try:
+            image_data, generated_seed = await self.client.generate_image_async(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                progress_callback=recording_callback,
+                seed=seed,
+                **kwargs
+            )
+        except Exception as e:
+            entry.update(duration=time.monotonic() - started, progress=progress, **_error_fields(e))
+            self.cassette.record(entry)
+            raise
+        entry.update(
+            duration=time.monotonic() - started,
+            progress=progress,
+            image=encode_bytes(image_data),
+            seed=generated_seed,
+        )
+        self.cassette.record(entry)
+        return image_data, generated_seed
+
+
+class ReplayImageClient:
+    """カセットに記録した画像生成結果を、ネットワークを使わずに再生する"""
+
+    supports_ip_adapter = True
+
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+
+    async def generate_image_async(
+        self,
+        prompt: str,
+        negative_prompt: str = "",
+        progress_callback: Optional[ProgressCallback] = None,
+        seed: Optional[int] = None,
+        **kwargs
+    ) -> Tuple[bytes, int]:
+        started = time.monotonic()
+        entry = self.cassette.next_entry("image", request_key("image", prompt, negative_prompt, seed))
+        for offset, progress_data in entry.get("progress", []):
+            if self.cassette.realtime:
+                await _sleep_until(started, offset)
+            if progress_callback:
+                await progress_callback(progress_data)
+        if self.cassette.realtime:
+            await _sleep_until(started, entry.get("duration", 0.0))
+        _raise_recorded_error(entry)
+        return decode_bytes(entry["image"]), entry.get("seed", -1)
@@ -0,0 +1,203 @@
+import os
+import json
+import math
+import asyncio
+import random
+import hashlib
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
+from .base import LLMClientInterface
+
+# 応答本文の生成に使う文の断片
+_FILLER_SENTENCES = [
+    "そうなんだ、教えてくれてありがとう。",
+    "それはとても面白い話だね。",
+    "もう少し詳しく聞かせてほしいな。",
+    "今日はどんな一日だった？",
+    "わたしも同じことを考えていたよ。",
+    "なるほど、そういう考え方もあるんだね。",
+]
+
+
+class LatencyModel:
+    """応答遅延の分布（fixed / lognormal / histogram）"""
+
+    def __init__(
+        self,
+        kind: str = "fixed",
+        fixed: float = 0.0,
+        mu: float = 0.0,
+        sigma: float = 0.0,
+        buckets: Optional[List[Tuple[float, float, float]]] = None,
+    ):
+        if kind not in ("fixed", "lognormal", "histogram"):
+            raise ValueError(f"Unknown latency distribution: {kind}")
+        if kind == "histogram" and not buckets:
+            raise ValueError("Histogram latency requires at least one bucket")
+        self.kind = kind
+        self.fixed = fixed
+        self.mu = mu
+        self.sigma = sigma
+        self.buckets = buckets or []
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyModel":
+        """
+        設定文字列から遅延分布を生成
+
+        - "fixed:0.8"                 常に0.8秒
+        - "lognormal:1.2,0.4"         中央値1.2秒、対数標準偏差0.4
+        - "histogram:/path/to.json"   記録したヒストグラムから再生
+        """
+        kind, _, value = (spec or "fixed:0").partition(":")
+        kind = kind.strip().lower()
+        if kind == "fixed":
+            return cls("fixed", fixed=float(value or 0))
+        if kind == "lognormal":
+            median, _, sigma = value.partition(",")
+            return cls("lognormal", mu=math.log(float(median)), sigma=float(sigma or 0.5))
+        if kind == "histogram":
+            with open(value, "r", encoding="utf-8") as f:
+                return cls("histogram", buckets=cls._parse_histogram(json.load(f)))
+        raise ValueError(f"Unknown latency distribution: {spec}")
+
+    @staticmethod
+    def _parse_histogram(data: Any) -> List[Tuple[float, float, float]]:
+        """
+        ヒストグラムを (下限, 上限, 度数) のバケット列に変換
+
+        [[上限秒, 度数], ...] 形式、または計測値の配列をそのまま受け付ける。
+        """
+        if isinstance(data, dict):
+            data = data.get("buckets", [])
+        if data and all(isinstance(item, (int, float)) for item in data):
+            return [(float(sample), float(sample), 1.0) for sample in data]
+        buckets = []
+        lower = 0.0
+        for upper, count in sorted((float(u), float(c)) for u, c in data):
+            buckets.append((lower, upper, count))
+            lower = upper
+        return buckets
+
+    def sample(self, rng: random.Random) -> float:
+        """遅延を1つサンプリング（秒）"""
+        if self.kind == "fixed":
+            return self.fixed
+        if self.kind == "lognormal":
+            return rng.lognormvariate(self.mu, self.sigma)
+        lower, upper, _ = rng.choices(self.buckets, weights=[b[2] for b in self.buckets])[0]
+        return rng.uniform(lower, upper)
+
+
+class FakeLLMClient(LLMClientInterface):
+    """負荷試験・レイテンシ計測用の決定的な疑似LLMクライアント
+
+    実際のAPIは呼ばず、設定した遅延分布・エラー率・応答サイズで応答を返す。
+    同じシードとプロンプトからは同じ応答本文が生成される。
+    """
+
+    def __init__(
+        self,
+        model: str = "fake-model",
+        latency: Optional[LatencyModel] = None,
+        error_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        response_chars: int = 120,
+        chunk_chars: int = 8,
+        first_token_ratio: float = 0.3,
+        seed: Optional[int] = None,
+    ):
+        self.model = model
+        self.latency = latency or LatencyModel()
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.response_chars = response_chars
+        self.chunk_chars = max(1, chunk_chars)
+        self.first_token_ratio = first_token_ratio
+        self.seed = seed
+        self._rng = random.Random(seed)
+        self.calls = 0
+
+    @classmethod
+    def from_env(cls, model: str) -> "FakeLLMClient":
+        """FAKE_LLM_* 環境変数から設定を読み込んで生成"""
+        seed = os.getenv("FAKE_LLM_SEED")
+        return cls(
+            model=model,
+            latency=LatencyModel.parse(os.getenv("FAKE_LLM_LATENCY", "fixed:0.5")),
+            error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+            timeout_rate=float(os.getenv("FAKE_LLM_TIMEOUT_RATE", "0")),
+            response_chars=int(os.getenv("FAKE_LLM_RESPONSE_CHARS", "120")),
+            chunk_chars=int(os.getenv("FAKE_LLM_CHUNK_CHARS", "8")),
+            seed=int(seed) if seed else None,
+        )
+
+    def _content_for(self, prompt: str) -> str:
+        """プロンプトとシードから決定的に応答本文を生成"""
+        digest = hashlib.sha256(f"{self.seed}:{prompt}".encode("utf-8")).digest()
+        rng = random.Random(digest)
+        text = ""
+        while len(text) < self.response_chars:
+            text += rng.choice(_FILLER_SENTENCES)
+        return text[: self.response_chars]
+
+    async def _simulate_failure(self, delay: float) -> None:
+        """設定した確率でエラーやタイムアウトを発生させる"""
+        roll = self._rng.random()
+        if roll < self.timeout_rate:
+            await asyncio.sleep(delay)
+            raise TimeoutError("Fake API timeout (injected)")
+        if roll < self.timeout_rate + self.error_rate:
+            await asyncio.sleep(delay * self._rng.random())
+            raise Exception("Fake API error: 503 Service Unavailable (injected)")
+
+    async def generate(
+        self,
+        prompt: str,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """遅延分布に従って待機した後に疑似応答を返す"""
+        self.calls += 1
+        delay = self.latency.sample(self._rng)
+        await self._simulate_failure(delay)
+        await asyncio.sleep(delay)
+        content = self._content_for(prompt)
+        return {
+            "content": content,
+            "model": self.model,
+            "usage": {
+                "prompt_tokens": len(prompt),
+                "completion_tokens": len(content),
+                "total_tokens": len(prompt) + len(content),
+            },
+            "finish_reason": "stop",
+            "latency": delay,
+        }
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """最初のデルタまでに遅延の一部を、残りをチャンク間に配分してストリーミングする"""
+        self.calls += 1
+        delay = self.latency.sample(self._rng)
+        await self._simulate_failure(delay)
+        content = self._content_for(prompt)
+        chunks = [content[i:i + self.chunk_chars] for i in range(0, len(content), self.chunk_chars)]
+        await asyncio.sleep(delay * self.first_token_ratio)
+        interval = delay * (1 - self.first_token_ratio) / max(1, len(chunks) - 1)
+        for index, chunk in enumerate(chunks):
+            if index:
+                await asyncio.sleep(interval)
+            yield chunk
+        usage_sink = kwargs.get("usage_sink")
+        if usage_sink is not None:
+            usage_sink.update({
+                "prompt_tokens": len(prompt),
+                "completion_tokens": len(content),
+                "total_tokens": len(prompt) + len(content),
+            })
+
+    async def validate_response(self, response: Dict[str, Any]) -> bool:
+        """応答の妥当性を検証"""
+        return bool(response.get("content"))
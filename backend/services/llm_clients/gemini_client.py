@@ -1,6 +1,6 @@
 import os
 import asyncio
-from typing import Dict, Any
+from typing import Dict, Any, AsyncIterator
 import google.generativeai as genai
 from .base import LLMClientInterface
 
@@ -36,13 +36,7 @@ class GeminiClient(LLMClientInterface):
             return {
                 "content": response.text,
                 "model": self.model,
-                "usage": {
-                    # NOTE: Gemini API does not return token usage directly in the response object.
-                    # This would need to be estimated or handled differently if required.
-                    "prompt_tokens": None,
-                    "completion_tokens": None,
-                    "total_tokens": None,
-                },
+                "usage": self._extract_usage(response),
                 "finish_reason": "stop" # Placeholder, Gemini API has different finish reasons
             }
         except asyncio.TimeoutError:
@@ -50,14 +44,55 @@ class GeminiClient(LLMClientInterface):
         except Exception as e:
             raise Exception(f"Gemini API error: {str(e)}")
 
-    async def _call_api(self, prompt: str, **kwargs) -> Any:
+    async def generate_stream(
+        self,
+        prompt: str,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """Gemini APIのストリーミング応答をデルタ単位で返す"""
+        try:
+            response = await asyncio.wait_for(
+                self._call_api(prompt, stream=True, **kwargs),
+                timeout=self.timeout
+            )
+            usage_sink = kwargs.get("usage_sink")
+            chunks = response.__aiter__()
+            while True:
+                # チャンク間の待ち時間にもタイムアウトを適用する
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=self.timeout)
+                except StopAsyncIteration:
+                    break
+                if usage_sink is not None:
+                    # 最後のチャンクのusage_metadataに累計のトークン数が入る
+                    usage_sink.update(self._extract_usage(chunk))
+                text = getattr(chunk, "text", "")
+                if text:
+                    yield text
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Gemini API timeout after {self.timeout} seconds")
+        except Exception as e:
+            raise Exception(f"Gemini API error: {str(e)}")
+
+    @staticmethod
+    def _extract_usage(response: Any) -> Dict[str, Any]:
+        """usage_metadataからトークン数を取得（取得できない値はNone）"""
+        metadata = getattr(response, "usage_metadata", None)
+        return {
+            "prompt_tokens": getattr(metadata, "prompt_token_count", None) or None,
+            "completion_tokens": getattr(metadata, "candidates_token_count", None) or None,
+            "total_tokens": getattr(metadata, "total_token_count", None) or None,
+        }
+
+    async def _call_api(self, prompt: str, stream: bool = False, **kwargs) -> Any:
         """実際のAPI呼び出し"""
         generation_config = genai.types.GenerationConfig(
             temperature=kwargs.get("temperature", self.temperature)
         )
         return await self.genai_model.generate_content_async(
             prompt,
-            generation_config=generation_config
+            generation_config=generation_config,
+            stream=stream
         )
 
     async def validate_response(self, response: Dict[str, Any]) -> bool:
@@ -0,0 +1,241 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .base import LLMClientInterface
+
+logger = logging.getLogger(__name__)
+
+# 呼び出し種別ごとの優先度（小さいほど優先）
+CALL_TYPE_PRIORITIES: Dict[str, int] = {
+    "chat": 0,
+    "feedback": 1,
+    "image_prompt": 2,
+    "summary": 3,
+}
+DEFAULT_PRIORITY = 1
+
+# 呼び出し種別ごとの待ち行列のデッドライン（秒）
+DEFAULT_QUEUE_TIMEOUTS: Dict[str, float] = {
+    "chat": 30.0,
+    "feedback": 5.0,
+    "image_prompt": 15.0,
+    "summary": 60.0,
+}
+
+
+class LLMRateLimitedError(Exception):
+    """同時実行数・レート制限により呼び出しを受け付けられなかった"""
+
+
+class ConcurrencyGovernor:
+    """トークンバケットと最大同時実行数でプロバイダーへの呼び出しを制御する
+
+    枠が空いていない呼び出しは優先度順の待ち行列に入り、
+    デッドラインまでに枠を取れなければ LLMRateLimitedError となる。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_in_flight: int = 8,
+        rate_per_second: Optional[float] = None,
+        burst: Optional[int] = None,
+        max_queue: int = 100,
+        queue_timeouts: Optional[Dict[str, float]] = None,
+        default_queue_timeout: float = 20.0,
+    ):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.rate_per_second = rate_per_second or None
+        self.burst = burst or max(1, int(rate_per_second or 1))
+        self.max_queue = max_queue
+        self.queue_timeouts = {**DEFAULT_QUEUE_TIMEOUTS, **(queue_timeouts or {})}
+        self.default_queue_timeout = default_queue_timeout
+
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._in_flight = 0
+        self._waiters: List[List[Any]] = []
+        self._queued: Dict[str, int] = {}
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+        self.acquired = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @classmethod
+    def from_env(cls, provider: str) -> "ConcurrencyGovernor":
+        """環境変数から設定を読み込んで生成（<PROVIDER>_ の設定が LLM_ の設定より優先）"""
+        def setting(name: str, default: Optional[str] = None) -> Optional[str]:
+            return os.getenv(f"{provider.upper()}_{name}") or os.getenv(f"LLM_{name}", default)
+
+        rate = setting("RATE_PER_SECOND")
+        burst = setting("BURST")
+        queue_timeouts = {
+            call_type: float(os.environ[f"LLM_QUEUE_TIMEOUT_{call_type.upper()}"])
+            for call_type in CALL_TYPE_PRIORITIES
+            if os.getenv(f"LLM_QUEUE_TIMEOUT_{call_type.upper()}")
+        }
+        return cls(
+            name=provider,
+            max_in_flight=int(setting("MAX_IN_FLIGHT", "8")),
+            rate_per_second=float(rate) if rate else None,
+            burst=int(burst) if burst else None,
+            max_queue=int(setting("MAX_QUEUE", "100")),
+            queue_timeouts=queue_timeouts,
+        )
+
+    def _refill(self) -> None:
+        if self.rate_per_second is None:
+            return
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate_per_second)
+        self._refilled_at = now
+
+    def _try_take(self) -> bool:
+        if self._in_flight >= self.max_in_flight:
+            return False
+        self._refill()
+        if self.rate_per_second is not None and self._tokens < 1:
+            return False
+        if self.rate_per_second is not None:
+            self._tokens -= 1
+        self._in_flight += 1
+        return True
+
+    def _dispatch(self) -> None:
+        """待ち行列の先頭から、枠が取れる限り呼び出しを再開させる"""
+        while self._waiters:
+            future = self._waiters[0][2]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._try_take():
+                break
+            heapq.heappop(self._waiters)
+            future.set_result(None)
+
+        # レート制限で止まっている場合はトークンが溜まる時刻に再試行する
+        if (
+            self._waiters
+            and self._wakeup is None
+            and self._in_flight < self.max_in_flight
+            and self.rate_per_second is not None
+        ):
+            delay = max(0.0, (1 - self._tokens) / self.rate_per_second)
+            self._wakeup = asyncio.get_running_loop().call_later(delay, self._on_wakeup)
+
+    def _on_wakeup(self) -> None:
+        self._wakeup = None
+        self._dispatch()
+
+    def _queue_timeout(self, call_type: Optional[str]) -> float:
+        return self.queue_timeouts.get(call_type or "", self.default_queue_timeout)
+
+    async def acquire(self, call_type: Optional[str] = None, timeout: Optional[float] = None) -> None:
+        """実行枠を取得（デッドラインまでに取得できなければ LLMRateLimitedError）"""
+        if not self._waiters and self._try_take():
+            self.acquired += 1
+            return
+
+        call_type_key = call_type or "default"
+        if sum(self._queued.values()) >= self.max_queue:
+            self.rejected += 1
+            raise LLMRateLimitedError(f"LLM rate limited: {self.name} queue is full")
+
+        priority = CALL_TYPE_PRIORITIES.get(call_type or "", DEFAULT_PRIORITY)
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._sequence), future])
+        self._queued[call_type_key] = self._queued.get(call_type_key, 0) + 1
+        started = time.monotonic()
+        deadline = timeout if timeout is not None else self._queue_timeout(call_type)
+        try:
+            await asyncio.wait_for(future, timeout=deadline)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise LLMRateLimitedError(
+                f"LLM rate limited: waited {deadline:.1f}s for {self.name} ({call_type_key})"
+            )
+        except asyncio.CancelledError:
+            # 枠を受け取った直後にキャンセルされた場合は返却する
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            self._queued[call_type_key] -= 1
+
+        waited = time.monotonic() - started
+        self.acquired += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def release(self) -> None:
+        """実行枠を返却し、待っている呼び出しを再開させる"""
+        self._in_flight = max(0, self._in_flight - 1)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, call_type: Optional[str] = None) -> AsyncIterator[None]:
+        await self.acquire(call_type)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        self._refill()
+        queued_total = sum(self._queued.values())
+        return {
+            "name": self.name,
+            "in_flight": self._in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queue_depth": queued_total,
+            "queue_depth_by_call_type": {k: v for k, v in self._queued.items() if v},
+            "max_queue": self.max_queue,
+            "rate_per_second": self.rate_per_second,
+            "tokens": round(self._tokens, 2) if self.rate_per_second is not None else None,
+            "acquired": self.acquired,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_seconds": self.total_wait / self.acquired if self.acquired else 0.0,
+            "max_wait_seconds": self.max_wait,
+        }
+
+
+class GovernedLLMClient(LLMClientInterface):
+    """ConcurrencyGovernor の枠を取得してからプロバイダーを呼び出すラッパー"""
+
+    def __init__(self, client: LLMClientInterface, governor: ConcurrencyGovernor):
+        self.client = client
+        self.governor = governor
+
+    @property
+    def model(self) -> Optional[str]:
+        return getattr(self.client, "model", None)
+
+    async def generate(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        async with self.governor.slot(kwargs.get("call_type")):
+            return await self.client.generate(prompt, **kwargs)
+
+    async def generate_stream(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        # ストリームを読み終えるまで枠を保持する
+        async with self.governor.slot(kwargs.get("call_type")):
+            async for delta in self.client.generate_stream(prompt, **kwargs):
+                yield delta
+
+    async def validate_response(self, response: Dict[str, Any]) -> bool:
+        return await self.client.validate_response(response)
+
+    async def aclose(self) -> None:
+        close = getattr(self.client, "aclose", None)
+        if close is not None:
+            await close()
@@ -0,0 +1,94 @@
+import asyncio
+from typing import Dict, Any, AsyncIterator, Optional
+from openai import AsyncOpenAI
+from .base import LLMClientInterface
+
+class OpenAIClient(LLMClientInterface):
+    """OpenAI (および互換API) クライアント"""
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "gpt-4o-mini",
+        temperature: float = 0.7,
+        timeout: int = 60,
+        base_url: Optional[str] = None
+    ):
+        self.model = model
+        self.temperature = temperature
+        self.timeout = timeout
+        # base_urlを指定するとローカルのスタブサーバーや互換APIに接続できる
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=timeout)
+
+    async def generate(
+        self,
+        prompt: str,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """OpenAI APIを使用して応答を生成"""
+        try:
+            response = await asyncio.wait_for(
+                self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=kwargs.get("temperature", self.temperature)
+                ),
+                timeout=self.timeout
+            )
+            choice = response.choices[0]
+            usage = response.usage
+            return {
+                "content": choice.message.content or "",
+                "model": response.model or self.model,
+                "usage": {
+                    "prompt_tokens": usage.prompt_tokens if usage else None,
+                    "completion_tokens": usage.completion_tokens if usage else None,
+                    "total_tokens": usage.total_tokens if usage else None,
+                },
+                "finish_reason": choice.finish_reason
+            }
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"OpenAI API timeout after {self.timeout} seconds")
+        except Exception as e:
+            raise Exception(f"OpenAI API error: {str(e)}")
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """OpenAI APIのストリーミング応答をデルタ単位で返す"""
+        try:
+            stream = await asyncio.wait_for(
+                self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=kwargs.get("temperature", self.temperature),
+                    stream=True,
+                    # 最後のチャンクでトークン数を受け取る
+                    stream_options={"include_usage": True}
+                ),
+                timeout=self.timeout
+            )
+            usage_sink = kwargs.get("usage_sink")
+            async for chunk in stream:
+                if usage_sink is not None and getattr(chunk, "usage", None):
+                    usage_sink.update({
+                        "prompt_tokens": chunk.usage.prompt_tokens,
+                        "completion_tokens": chunk.usage.completion_tokens,
+                        "total_tokens": chunk.usage.total_tokens,
+                    })
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"OpenAI API timeout after {self.timeout} seconds")
+        except Exception as e:
+            raise Exception(f"OpenAI API error: {str(e)}")
+
+    async def validate_response(self, response: Dict[str, Any]) -> bool:
+        """応答の妥当性を検証"""
+        return bool(response.get("content"))
+
+    async def aclose(self) -> None:
+        """HTTP接続を解放"""
+        await self.client.close()
@@ -0,0 +1,238 @@
+import os
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .base import LLMClientInterface
+from .governor import ConcurrencyGovernor, GovernedLLMClient
+from .resilient_client import ResilientLLMClient
+from ..circuit_breaker import RetryPolicy, get_circuit_breaker, is_retryable_llm_error
+from ..cassette import Cassette, get_cassette_from_env
+from .response_cache import CachingLLMClient, InMemoryResponseCache, ResponseCacheBackend
+
+logger = logging.getLogger(__name__)
+
+ClientFactory = Callable[[str], LLMClientInterface]
+
+# ルーティング時の呼び出し種別
+CALL_TYPES = ("chat", "feedback", "image_prompt", "summary")
+
+
+def _create_gemini_client(model: str) -> LLMClientInterface:
+    from .gemini_client import GeminiClient
+
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY environment variable not set")
+    return GeminiClient(api_key=api_key, model=model)
+
+
+def _create_openai_client(model: str) -> LLMClientInterface:
+    from .openai_client import OpenAIClient
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY environment variable not set")
+    return OpenAIClient(api_key=api_key, model=model, base_url=os.getenv("OPENAI_BASE_URL"))
+
+
+def _create_anthropic_client(model: str) -> LLMClientInterface:
+    from .anthropic_client import AnthropicClient
+
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    if not api_key:
+        raise ValueError("ANTHROPIC_API_KEY environment variable not set")
+    return AnthropicClient(api_key=api_key, model=model, base_url=os.getenv("ANTHROPIC_BASE_URL"))
+
+
+def _create_fake_client(model: str) -> LLMClientInterface:
+    from .fake_client import FakeLLMClient
+
+    # 負荷試験用（APIキー不要、FAKE_LLM_* で遅延やエラー率を設定）
+    return FakeLLMClient.from_env(model)
+
+
+def _parse_provider_list(value: Optional[str]) -> List[str]:
+    return [name.strip().lower() for name in (value or "").split(",") if name.strip()]
+
+
+def _optional_float(value: Optional[str]) -> Optional[float]:
+    return float(value) if value else None
+
+
+class LLMClientRegistry:
+    """プロバイダー/モデルごとのLLMクライアントをプロセス内で共有するレジストリ
+
+    アプリ起動時に一度だけ生成して app.state に保持し、
+    リクエストごとのクライアント生成・接続確立コストを避ける。
+    LLM_PROVIDERS に複数のプロバイダーが指定された場合は、
+    それらを束ねた RoutingLLMClient を既定のクライアントとして返す。
+    """
+
+    DEFAULT_MODELS: Dict[str, str] = {
+        "gemini": "gemini-1.5-flash",
+        "openai": "gpt-4o-mini",
+        "anthropic": "claude-3-5-haiku-latest",
+        "fake": "fake-model",
+    }
+
+    def __init__(
+        self,
+        default_provider: Optional[str] = None,
+        default_model: Optional[str] = None,
+        response_cache: Optional[ResponseCacheBackend] = None,
+        provider_order: Optional[List[str]] = None,
+        cassette: Optional[Cassette] = None,
+    ):
+        self.default_provider = (default_provider or os.getenv("LLM_PROVIDER", "gemini")).lower()
+        self.default_model = default_model or os.getenv("LLM_MODEL")
+        self._factories: Dict[str, ClientFactory] = {
+            "gemini": _create_gemini_client,
+            "openai": _create_openai_client,
+            "anthropic": _create_anthropic_client,
+            "fake": _create_fake_client,
+        }
+        # プロバイダーのクライアント本体と、キャッシュ等で包んだ共有クライアント
+        self._clients: Dict[Tuple[str, str], LLMClientInterface] = {}
+        self._shared: Dict[Tuple[str, str], LLMClientInterface] = {}
+        # プロバイダーごとの同時実行数・レート制限（モデルをまたいで共有）
+        self.governors: Dict[str, ConcurrencyGovernor] = {}
+        self._lock = threading.RLock()
+
+        # 決定的なサブ呼び出し（二人称抽出など）向けの応答キャッシュ
+        self.response_cache = response_cache or InMemoryResponseCache(
+            max_entries=int(os.getenv("LLM_RESPONSE_CACHE_SIZE", "1024")),
+            ttl_seconds=float(os.getenv("LLM_RESPONSE_CACHE_TTL", "3600")),
+        )
+
+        # マルチプロバイダー・ルーティングの設定
+        self.provider_order = provider_order or _parse_provider_list(os.getenv("LLM_PROVIDERS"))
+        self.route_priorities: Dict[str, List[str]] = {}
+        for call_type in CALL_TYPES:
+            order = _parse_provider_list(os.getenv(f"LLM_ROUTE_{call_type.upper()}"))
+            if order:
+                self.route_priorities[call_type] = order
+        # 通信の記録・再生（CASSETTE_MODE=record/replay）
+        self.cassette = cassette or get_cassette_from_env()
+        self.attempt_timeout = _optional_float(os.getenv("LLM_ATTEMPT_TIMEOUT"))
+        self.hedge_after = _optional_float(os.getenv("LLM_HEDGE_AFTER"))
+
+    def register_factory(self, provider: str, factory: ClientFactory) -> None:
+        """プロバイダーのクライアント生成関数を登録"""
+        self._factories[provider.lower()] = factory
+
+    def _resolve_model(self, provider: str, model: Optional[str]) -> str:
+        if model:
+            return model
+        if provider == self.default_provider and self.default_model:
+            return self.default_model
+        return os.getenv(f"{provider.upper()}_MODEL") or self.DEFAULT_MODELS.get(provider, "")
+
+    def _get_provider_client(self, provider: str, model: str) -> LLMClientInterface:
+        """プロバイダーのクライアント本体を取得（未生成の場合は生成）"""
+        key = (provider, model)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                factory = self._factories.get(provider)
+                if factory is None:
+                    raise ValueError(f"Unknown LLM provider: {provider}")
+                provider_client = self._create_with_cassette(factory, model)
+                governor = self.governors.get(provider)
+                if governor is None:
+                    governor = ConcurrencyGovernor.from_env(provider)
+                    self.governors[provider] = governor
+                # ブレーカーを外側に置き、障害中は待ち行列に並ばずに失敗させる
+                client = ResilientLLMClient(
+                    GovernedLLMClient(provider_client, governor),
+                    breaker=get_circuit_breaker(f"llm:{provider}", "LLM"),
+                    retry_policy=RetryPolicy.from_env("LLM", is_retryable=is_retryable_llm_error),
+                )
+                self._clients[key] = client
+                logger.info(f"Initialized shared LLM client for provider={provider}, model={model}")
+        return client
+
+    def _create_with_cassette(self, factory: ClientFactory, model: str) -> LLMClientInterface:
+        """カセットのモードに応じてプロバイダーのクライアントを生成"""
+        from .cassette_client import RecordingLLMClient, ReplayLLMClient
+
+        if self.cassette is None:
+            return factory(model)
+        if self.cassette.mode == "replay":
+            return ReplayLLMClient(self.cassette, model=model)
+        return RecordingLLMClient(factory(model), self.cassette)
+
+    def _create_router(self) -> LLMClientInterface:
+        from .routing_client import RoutingLLMClient
+
+        providers = list(dict.fromkeys(
+            self.provider_order + [name for order in self.route_priorities.values() for name in order]
+        ))
+        clients: Dict[str, LLMClientInterface] = {}
+        for provider in providers:
+            try:
+                clients[provider] = self._get_provider_client(provider, self._resolve_model(provider, None))
+            except Exception as e:
+                # 設定が不足しているプロバイダーはルーティング対象から外す
+                logger.warning(f"Skipping LLM provider {provider} for routing: {e}")
+        order = [name for name in self.provider_order if name in clients]
+        if not order:
+            raise ValueError(f"No LLM provider could be initialized from {self.provider_order}")
+        logger.info(
+            f"Initialized LLM router: order={order}, priorities={self.route_priorities}, "
+            f"attempt_timeout={self.attempt_timeout}, hedge_after={self.hedge_after}"
+        )
+        return RoutingLLMClient(
+            clients=clients,
+            default_order=order,
+            priorities=self.route_priorities,
+            attempt_timeout=self.attempt_timeout,
+            hedge_after=self.hedge_after,
+        )
+
+    def get(self, provider: Optional[str] = None, model: Optional[str] = None) -> LLMClientInterface:
+        """共有クライアントを取得（未生成の場合は生成してキャッシュ）"""
+        if provider is None and model is None and len(self.provider_order) > 1:
+            key = ("router", ",".join(self.provider_order))
+        else:
+            provider = (provider or self.default_provider).lower()
+            key = (provider, self._resolve_model(provider, model))
+
+        shared = self._shared.get(key)
+        if shared is not None:
+            return shared
+
+        with self._lock:
+            shared = self._shared.get(key)
+            if shared is None:
+                if key[0] == "router":
+                    client = self._create_router()
+                else:
+                    client = self._get_provider_client(*key)
+                shared = CachingLLMClient(client, self.response_cache)
+                self._shared[key] = shared
+        return shared
+
+    def governor_stats(self) -> Dict[str, Dict]:
+        """プロバイダーごとの待ち行列・同時実行数の統計"""
+        return {provider: governor.stats() for provider, governor in self.governors.items()}
+
+    def warm_up(self) -> None:
+        """デフォルトクライアントを事前に生成する（失敗しても起動は継続）"""
+        try:
+            self.get()
+        except Exception as e:
+            logger.warning(f"Failed to warm up default LLM client ({self.default_provider}): {e}")
+
+    async def aclose(self) -> None:
+        """保持しているクライアントの接続を解放"""
+        for (provider, model), client in list(self._clients.items()):
+            close = getattr(client, "aclose", None)
+            if close is None:
+                continue
+            try:
+                await close()
+            except Exception as e:
+                logger.warning(f"Failed to close LLM client {provider}/{model}: {e}")
+        self._clients.clear()
+        self._shared.clear()
@@ -0,0 +1,58 @@
+import logging
+from typing import Any, AsyncIterator, Dict, Optional
+
+from .base import LLMClientInterface
+from ..circuit_breaker import CircuitBreaker, RetryPolicy, is_retryable_llm_error
+
+logger = logging.getLogger(__name__)
+
+
+class ResilientLLMClient(LLMClientInterface):
+    """サーキットブレーカーとリトライを挟むLLMクライアントのラッパー
+
+    プロバイダーの障害中は CircuitOpenError で即座に失敗させ、
+    5xxや接続エラーなどの一時的なエラーはジッター付きでリトライする。
+    タイムアウトはリトライせず、呼び出し側（ルーティング）のフェイルオーバーに任せる。
+    """
+
+    def __init__(self, client: LLMClientInterface, breaker: CircuitBreaker, retry_policy: Optional[RetryPolicy] = None):
+        self.client = client
+        self.breaker = breaker
+        self.retry_policy = retry_policy or RetryPolicy(is_retryable=is_retryable_llm_error)
+
+    @property
+    def model(self) -> Optional[str]:
+        return getattr(self.client, "model", None)
+
+    async def generate(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        return await self.retry_policy.run(self.client.generate, prompt, breaker=self.breaker, **kwargs)
+
+    async def _open_stream(self, prompt: str, **kwargs) -> Any:
+        """ストリームを開き、最初のデルタまでを取得する"""
+        stream = self.client.generate_stream(prompt, **kwargs).__aiter__()
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = None
+        return stream, first
+
+    async def generate_stream(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        # 最初のデルタが届くまではリトライ可能、以降の失敗はブレーカーに記録して送出する
+        stream, first = await self.retry_policy.run(self._open_stream, prompt, breaker=self.breaker, **kwargs)
+        if first is None:
+            return
+        yield first
+        try:
+            async for delta in stream:
+                yield delta
+        except Exception as e:
+            self.breaker.record_failure(e)
+            raise
+
+    async def validate_response(self, response: Dict[str, Any]) -> bool:
+        return await self.client.validate_response(response)
+
+    async def aclose(self) -> None:
+        close = getattr(self.client, "aclose", None)
+        if close is not None:
+            await close()
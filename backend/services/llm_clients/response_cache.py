@@ -0,0 +1,135 @@
+import re
+import time
+import threading
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Any, AsyncIterator, Optional, Tuple
+
+from .base import LLMClientInterface
+
+
+def make_cache_key(template_name: str, text: str) -> str:
+    """テンプレート名と正規化した入力からキャッシュキーを作成
+
+    NFKC正規化・前後空白の除去・連続空白の圧縮を行い、
+    表記揺れ（全角/半角など）による取りこぼしを減らす。
+    """
+    normalized = unicodedata.normalize("NFKC", text or "")
+    normalized = re.sub(r"\s+", " ", normalized).strip()
+    return f"{template_name}:{normalized}"
+
+
+class ResponseCacheBackend(ABC):
+    """LLM応答キャッシュの共通インターフェース"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """キャッシュ済みの応答を取得（存在しない・期限切れの場合はNone）"""
+        pass
+
+    @abstractmethod
+    def set(self, key: str, response: Dict[str, Any]) -> None:
+        """応答をキャッシュに保存"""
+        pass
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """ヒット/ミスなどの統計情報を返す"""
+        pass
+
+
+class InMemoryResponseCache(ResponseCacheBackend):
+    """LRU + TTLで上限を設けたプロセス内キャッシュ"""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def set(self, key: str, response: Dict[str, Any]) -> None:
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            self._entries[key] = (expires_at, dict(response))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class CachingLLMClient(LLMClientInterface):
+    """応答キャッシュを挟むLLMクライアントのラッパー
+
+    呼び出し側が `cache_key` を指定した場合のみキャッシュを利用する（オプトイン）。
+    """
+
+    def __init__(self, client: LLMClientInterface, cache: ResponseCacheBackend):
+        self.client = client
+        self.cache = cache
+
+    @property
+    def model(self) -> Optional[str]:
+        return getattr(self.client, "model", None)
+
+    async def generate(
+        self,
+        prompt: str,
+        cache_key: Optional[str] = None,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """キャッシュキーがあればキャッシュを参照し、なければそのまま生成"""
+        if cache_key is None:
+            return await self.client.generate(prompt, **kwargs)
+
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            cached["cached"] = True
+            return cached
+
+        response = await self.client.generate(prompt, **kwargs)
+        if await self.client.validate_response(response):
+            self.cache.set(cache_key, response)
+        return response
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """ストリーミングはキャッシュせずにそのまま中継"""
+        kwargs.pop("cache_key", None)
+        async for delta in self.client.generate_stream(prompt, **kwargs):
+            yield delta
+
+    async def validate_response(self, response: Dict[str, Any]) -> bool:
+        return await self.client.validate_response(response)
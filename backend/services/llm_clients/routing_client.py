@@ -0,0 +1,168 @@
+import asyncio
+import logging
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
+
+from .base import LLMClientInterface
+
+logger = logging.getLogger(__name__)
+
+
+class RoutingLLMClient(LLMClientInterface):
+    """複数プロバイダーを束ねるルーティングクライアント
+
+    呼び出し種別（call_type）ごとの優先順位に従ってプロバイダーを選び、
+    エラーやタイムアウト時は次のプロバイダーへフェイルオーバーする。
+    hedge_after を指定すると、その秒数以内に応答がない場合に次のプロバイダーへも
+    並行してリクエストを送り、先に成功した応答を採用する。
+    """
+
+    def __init__(
+        self,
+        clients: Dict[str, LLMClientInterface],
+        default_order: List[str],
+        priorities: Optional[Dict[str, List[str]]] = None,
+        attempt_timeout: Optional[float] = None,
+        hedge_after: Optional[float] = None,
+    ):
+        if not default_order:
+            raise ValueError("default_order must contain at least one provider")
+        unknown = [name for name in default_order if name not in clients]
+        if unknown:
+            raise ValueError(f"Unknown providers in routing order: {unknown}")
+        self.clients = clients
+        self.default_order = default_order
+        self.priorities = priorities or {}
+        self.attempt_timeout = attempt_timeout
+        self.hedge_after = hedge_after
+
+    @property
+    def model(self) -> Optional[str]:
+        return getattr(self.clients[self.default_order[0]], "model", None)
+
+    def _order_for(self, call_type: Optional[str]) -> List[str]:
+        order = self.priorities.get(call_type or "", self.default_order)
+        return [name for name in order if name in self.clients] or self.default_order
+
+    async def _attempt(self, provider: str, prompt: str, call_type: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        client = self.clients[provider]
+        # 配下の GovernedLLMClient が優先度と待ち行列のデッドラインを決めるため、呼び出し種別も渡す
+        call = client.generate(prompt, call_type=call_type, **kwargs)
+        if self.attempt_timeout:
+            try:
+                response = await asyncio.wait_for(call, timeout=self.attempt_timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"{provider} timed out after {self.attempt_timeout} seconds")
+        else:
+            response = await call
+        if not await client.validate_response(response):
+            raise ValueError(f"Invalid response from {provider}")
+        response["provider"] = provider
+        return response
+
+    async def generate(
+        self,
+        prompt: str,
+        call_type: Optional[str] = None,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """優先順位に従って応答を生成（フェイルオーバー・ヘッジ対応）"""
+        queue = list(self._order_for(call_type))
+        pending: Dict["asyncio.Task[Dict[str, Any]]", str] = {}
+        errors: List[Tuple[str, Exception]] = []
+
+        def launch_next() -> None:
+            provider = queue.pop(0)
+            task = asyncio.create_task(self._attempt(provider, prompt, call_type=call_type, **kwargs))
+            pending[task] = provider
+
+        launch_next()
+        try:
+            while pending:
+                # 次の候補があればヘッジ用のタイマーを設定する
+                timeout = self.hedge_after if (self.hedge_after and queue) else None
+                done, _ = await asyncio.wait(
+                    pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    logger.info(
+                        f"No response within {self.hedge_after}s from {list(pending.values())}, "
+                        f"hedging to {queue[0]}"
+                    )
+                    launch_next()
+                    continue
+
+                for task in done:
+                    provider = pending.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        return task.result()
+                    logger.warning(f"LLM provider {provider} failed: {error}")
+                    errors.append((provider, error))
+
+                if not pending and queue:
+                    launch_next()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if errors and all(isinstance(error, TimeoutError) for _, error in errors):
+            raise TimeoutError(f"All LLM providers timed out: {[provider for provider, _ in errors]}")
+        summary = "; ".join(f"{provider}: {error}" for provider, error in errors)
+        raise Exception(f"LLM API error: all providers failed ({summary})")
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        call_type: Optional[str] = None,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """最初のデルタが届くまではフェイルオーバーし、以降はそのプロバイダーを使い続ける"""
+        errors: List[Tuple[str, Exception]] = []
+        for provider in self._order_for(call_type):
+            stream = self.clients[provider].generate_stream(prompt, call_type=call_type, **kwargs).__aiter__()
+            try:
+                first = stream.__anext__()
+                if self.attempt_timeout:
+                    first_delta = await asyncio.wait_for(first, timeout=self.attempt_timeout)
+                else:
+                    first_delta = await first
+            except StopAsyncIteration:
+                errors.append((provider, ValueError("Empty response")))
+                continue
+            except Exception as e:
+                logger.warning(f"LLM provider {provider} failed before streaming: {e}")
+                errors.append((provider, e))
+                await self._close_stream(stream)
+                continue
+
+            usage_sink = kwargs.get("usage_sink")
+            if usage_sink is not None:
+                usage_sink["provider"] = provider
+                usage_sink["model"] = getattr(self.clients[provider], "model", None)
+            yield first_delta
+            async for delta in stream:
+                yield delta
+            return
+
+        summary = "; ".join(f"{provider}: {error}" for provider, error in errors)
+        raise Exception(f"LLM API error: all providers failed ({summary})")
+
+    @staticmethod
+    async def _close_stream(stream: Any) -> None:
+        close = getattr(stream, "aclose", None)
+        if close is not None:
+            try:
+                await close()
+            except Exception:
+                pass
+
+    async def validate_response(self, response: Dict[str, Any]) -> bool:
+        """応答の妥当性を検証"""
+        return bool(response.get("content"))
+
+    async def aclose(self) -> None:
+        """配下のクライアントの接続を解放"""
+        for client in self.clients.values():
+            close = getattr(client, "aclose", None)
+            if close is not None:
+                await close()
@@ -1,22 +1,34 @@
 import os
 import json
-import base64
 import logging
 import asyncio
+import uuid
 from typing import Optional, Dict, Any, Callable, Awaitable, Tuple
-from io import BytesIO
 import httpx
-from PIL import Image
+
+from ..image_io import decode_and_verify_image, encode_image_b64, run_image_io
 
 
 logger = logging.getLogger(__name__)
 
+
+class ImageGenerationInterruptedError(asyncio.CancelledError):
+    """WebUI側で生成が中断された（途中までの画像は結果として扱わず、取り消しとみなす）"""
+
+
 class StableDiffusionWebUIClient:
     """Stable Diffusion WebUI API クライアント"""
+
+    # IP-Adapter（ControlNet）による参照画像の指定に対応
+    supports_ip_adapter = True
     
     def __init__(self):
         self.base_url = os.getenv("WEBUI_API_URL", "http://stable-diffusion-webui:7860")
         self.timeout = int(os.getenv("WEBUI_TIMEOUT", "600"))  # タイムアウトを環境変数から取得（デフォルト10分）
+        # このWebUIに生成を送るのがこのプロセスの1ワーカーだけの場合はtrue
+        # （タスクIDを返さない古いWebUIでも、取り消し時に実行中の生成を中断してよい）
+        self.exclusive = os.getenv("WEBUI_EXCLUSIVE", "false").lower() == "true"
+        self.poll_interval = 1.0  # 生成中に進捗を確認する間隔（秒）
         logger.info(f"Initialized Stable Diffusion WebUI client with base URL: {self.base_url} and timeout: {self.timeout}s")
     
     async def _check_api_health(self) -> bool:
@@ -47,6 +59,44 @@ class StableDiffusionWebUIClient:
             logger.warning(f"Failed to get progress: {e}")
             return {}
 
+    async def interrupt_async(self) -> bool:
+        """WebUIで実行中の生成を中断（どの依頼の生成かは確認しない）"""
+        try:
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                response = await client.post(f"{self.base_url}/sdapi/v1/interrupt")
+                logger.info(f"Interrupted WebUI generation: {response.status_code}")
+                return response.status_code == 200
+        except Exception as e:
+            logger.warning(f"Failed to interrupt WebUI generation: {e}")
+            return False
+
+    def _is_own_task(self, progress_data: Dict[str, Any], task_id: str) -> bool:
+        """進捗の current_task がこの依頼のタスクか（タスクIDを返さないWebUIは exclusive の場合のみ）"""
+        if "current_task" not in progress_data:
+            return self.exclusive
+        return progress_data.get("current_task") == task_id
+
+    async def _interrupt_own_task(self, task_id: str) -> bool:
+        """
+        実行中の生成がこの依頼のものである場合だけ中断する
+
+        /sdapi/v1/interrupt は依頼を区別せずに実行中の生成を止めるため、
+        他のワーカー・プロセスの生成を途中の画像で終わらせないよう先に確認する。
+        """
+        progress_data = await self.get_progress_async()
+        if not progress_data or not self._is_own_task(progress_data, task_id):
+            logger.info(f"WebUI is not rendering {task_id}, skipping interrupt")
+            return False
+        return await self.interrupt_async()
+
+    async def _was_interrupted(self, task_id: str) -> bool:
+        """生成の終了後に、WebUI側で中断されていたかを確認する（次の生成が始まるまで状態が残る）"""
+        progress_data = await self.get_progress_async()
+        if not progress_data or not (progress_data.get("state") or {}).get("interrupted"):
+            return False
+        current_task = progress_data.get("current_task")
+        return current_task in (None, task_id) if "current_task" in progress_data else self.exclusive
+
     async def _get_models(self) -> list:
         """利用可能なモデル一覧を取得"""
         try:
@@ -129,8 +179,12 @@ class StableDiffusionWebUIClient:
         models = await self._get_models()
         selected_model = await self._select_best_model(models)
 
+        # 中断の前に、実行中の生成がこの依頼のものかを確認するためのタスクID
+        task_id = f"task({uuid.uuid4().hex})"
+
         # リクエストペイロード
         payload = {
+            "force_task_id": task_id,
             "prompt": prompt.replace("(selfie:1.3)", "(selfie:1.3), (upper body:1.3)"),
             "negative_prompt": negative_prompt,
             "width": 480,
@@ -156,7 +210,7 @@ class StableDiffusionWebUIClient:
                     response = await client.get(ip_adapter_image_url)
                     response.raise_for_status()
                     image_data = response.content
-                    encoded_image = base64.b64encode(image_data).decode('utf-8')
+                encoded_image = await run_image_io(encode_image_b64, image_data)
 
                 payload["alwayson_scripts"] = {
                     "controlnet": {
@@ -192,22 +246,35 @@ class StableDiffusionWebUIClient:
                     headers={"Content-Type": "application/json"}
                 ))
 
-                # 生成タスクが完了するまで進捗をポーリング
-                while not generation_task.done():
-                    if progress_callback:
+                interrupted = False
+                try:
+                    # 生成タスクが完了するまで進捗をポーリング
+                    while not generation_task.done():
                         progress_data = await self.get_progress_async()
-                        if progress_data and progress_data.get("progress", 0) > 0:
+                        if progress_data and self._is_own_task(progress_data, task_id):
+                            interrupted = interrupted or bool((progress_data.get("state") or {}).get("interrupted"))
+                        if progress_callback and progress_data and progress_data.get("progress", 0) > 0:
                             await progress_callback(progress_data)
-                    await asyncio.sleep(1)
+                        await asyncio.sleep(self.poll_interval)
+
+                    response = await generation_task
+                except asyncio.CancelledError:
+                    # 依頼が取り消された場合は、接続を切るだけでなくWebUI側のこの依頼の生成も中断する
+                    generation_task.cancel()
+                    await self._interrupt_own_task(task_id)
+                    raise
 
-                response = await generation_task
+                # 中断された生成も途中の画像が200で返るため、結果にせず取り消しとして扱う
+                if response.status_code == 200 and (interrupted or await self._was_interrupted(task_id)):
+                    raise ImageGenerationInterruptedError(f"WebUI generation {task_id} was interrupted")
 
                 if response.status_code != 200:
                     error_msg = f"WebUI API error: {response.status_code} - {response.text}"
                     logger.error(error_msg)
                     raise Exception(error_msg)
 
-                result = response.json()
+                # 数MBのBase64を含むJSONの解析もイベントループの外で行う
+                result = await run_image_io(response.json)
 
                 # 生成された画像を取得
                 if "images" not in result or not result["images"][0]:
@@ -232,17 +299,12 @@ class StableDiffusionWebUIClient:
                     logger.warning(f"Could not extract seed from response: {e}. Info field: {result.get('info')}")
                     response_seed = -1
 
-                # Base64デコード
-                image_b64 = result["images"][0]
-                image_data = base64.b64decode(image_b64)
-
-                # 画像の検証
+                # Base64デコードと画像の検証
                 try:
-                    image = Image.open(BytesIO(image_data))
-                    image.verify()
-                    logger.info(f"Successfully generated image: {image.size}")
-                except Exception as e:
-                    raise Exception(f"Generated image is invalid: {e}")
+                    image_data, image_size = await run_image_io(decode_and_verify_image, result["images"][0])
+                    logger.info(f"Successfully generated image: {image_size}")
+                except ValueError as e:
+                    raise Exception(str(e))
 
                 return image_data, response_seed
 
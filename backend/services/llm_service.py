@@ -1,4 +1,4 @@
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Callable, List, Optional, Tuple
 from sqlalchemy.orm import Session
 import crud
 import models
@@ -8,9 +8,13 @@ from .error_handler import ErrorHandler
 from .image_request_detector import ImageRequestDetector
 from .image_prompt_analyzer import ImagePromptAnalyzer
 from .image_generation_service import ImageGenerationService
+from .image_job_queue import ImageJobCancelledError
 from .r18_content_analyzer import R18ContentAnalyzer, analyze_r18_score
+from .context_assembler import ContextAssembler
+from .usage_tracker import StageTimer, resolve_usage
 import logging
 import asyncio
+import os
 
 logger = logging.getLogger(__name__)
 
@@ -27,10 +31,14 @@ class LLMService:
         image_generation_service: Optional[ImageGenerationService] = None,
         r18_content_analyzer: Optional[R18ContentAnalyzer] = None,
         r18_mode_chat: bool = False,
+        context_assembler: Optional[ContextAssembler] = None,
+        speculative_image: Optional[bool] = None,
+        session_factory: Optional[Callable[[], Session]] = None,
     ):
         self.prompt_builder = prompt_builder
         self.llm_client = llm_client
         self.error_handler = error_handler
+        self.context_assembler = context_assembler or ContextAssembler()
         
         # 画像生成関連のサービス（オプショナル）
         self.image_request_detector = image_request_detector
@@ -43,40 +51,84 @@ class LLMService:
         # R18モード設定
         self.r18_mode_chat = r18_mode_chat
 
+        # 画像要求を検出した時点で、応答の生成と並行して画像生成を始めるか
+        if speculative_image is None:
+            speculative_image = os.getenv("IMAGE_SPECULATIVE_GENERATION", "true").lower() == "true"
+        self.speculative_image = speculative_image
+        self.session_factory = session_factory
+
     async def generate_response(
         self,
         db: Session,
         message: str,
         agent: models.Agent,
         chat_id: int,
-        user_message_id: int,
+        user_message_id: Optional[int] = None,
         websocket: Optional[Any] = None,  # WebSocketオブジェクトをオプショナルで受け取る
+        defer_image: bool = False,
     ) -> Dict[str, Any]:
-        """エージェントのパーソナリティを反映した応答を生成"""
+        """
+        エージェントのパーソナリティを反映した応答を生成
+
+        defer_image=True の場合は画像の完成を待たずに応答を返し、
+        生成中の画像は戻り値の image_task（URLを返すタスク）として渡す。
+        """
+        timer = StageTimer()
+        speculative_image: Optional[Dict[str, Any]] = None
+        # 応答を返した後も画像生成で使えるよう、画像を後から届ける場合は専用のセッションを使う
+        image_db: Optional[Session] = None
         try:
             # 1. エージェント情報とコンテキストを取得
             # Agent is now passed directly
             if not agent:
                 raise ValueError("Agent object is required")
                 
-            # For simplicity, we get the last 5 messages as context.
-            db_messages = crud.get_messages(db, chat_id=chat_id, skip=0, limit=5)
-            context = [
-                {"sender": msg.sender, "content": msg.content}
-                for msg in reversed(db_messages)
-            ]
+            with timer.stage("context"):
+                # 要約済みの古い会話は要約として渡し、それ以降のメッセージだけを履歴に含める
+                conversation_summary, summary_message_id = crud.get_chat_summary(db, chat_id)
+
+                # 直近のメッセージをトークン予算内で取得（現在のユーザー発話は除く）
+                context = self.context_assembler.assemble(
+                    db, chat_id=chat_id, exclude_message_id=user_message_id, after_id=summary_message_id
+                )
 
             # 2. プロンプトを構築
-            prompt = await self.prompt_builder.build(
-                agent=agent,
-                message=message,
-                context=context,
-                r18_mode_chat=self.r18_mode_chat
-            )
+            with timer.stage("prompt"):
+                prompt = await self.prompt_builder.build(
+                    agent=agent,
+                    message=message,
+                    context=context,
+                    r18_mode_chat=self.r18_mode_chat,
+                    conversation_summary=conversation_summary
+                )
+
+                # プロンプト先頭のペルソナ部分は、対応プロバイダーではコンテキストキャッシュに載せる
+                cacheable_prefix = self.prompt_builder.cacheable_prefix(agent, r18_mode_chat=self.r18_mode_chat)
+
+            # 画像要求はユーザー発話だけで判定できるので、応答を待たずに画像生成を始める
+            image_requested = self._detect_image_request(message)
+            image_agent = agent
+            if image_requested and defer_image:
+                image_db = self._open_session()
+                # リクエストのセッションは応答の保存でコミットされ閉じられるため、専用のセッションで読み直す
+                image_agent = crud.get_agent(image_db, agent.id, user_id=None) or agent
+            if image_requested and self.speculative_image:
+                speculative_image = await self._start_speculative_image(
+                    image_db or db, message, image_agent, context, chat_id, user_message_id, websocket
+                )
 
             # 3. LLM APIを呼び出し
             logger.info(f"Calling LLM API for agent {agent.id} with message: {message[:50]}...")
-            raw_response = await self.llm_client.generate(prompt)
+            with timer.stage("llm"):
+                if websocket:
+                    # WebSocket接続時はデルタをストリーミング送信する
+                    raw_response = await self._generate_streaming(
+                        prompt, websocket, user_message_id, cacheable_prefix=cacheable_prefix, timer=timer
+                    )
+                else:
+                    raw_response = await self.llm_client.generate(
+                        prompt, call_type="chat", cacheable_prefix=cacheable_prefix
+                    )
 
             # 4. 応答を処理・検証 (簡易版)
             is_valid = await self.llm_client.validate_response(raw_response)
@@ -104,34 +156,44 @@ class LLMService:
                 except Exception as e:
                     logger.error(f"Failed to send R18 score: {e}")
             image_url = None
+            image_task = None
             
-            # 5. 画像要求の検出と処理
-            if self.image_request_detector and self.image_prompt_analyzer and self.image_generation_service:
+            # 5. 画像要求の処理
+            if image_requested:
                 try:
-                    # 画像要求を検出
-                    if self.image_request_detector.detect_image_request(message):
-                        logger.info(f"Image request detected in message: {message}")
-                        
-                        # 画像生成タスクを非同期で開始
-                        if websocket:
-                            try:
-                                status_message = "画像を生成しています..."
-                                if r18_score is not None:
-                                    status_message += f" (R18スコア: {r18_score})"
-                                
-                                await websocket.send_json({
-                                    "type": "status",
-                                    "status": "image_generation_started",
-                                    "message": status_message,
-                                    "r18_score": r18_score
-                                })
-                            except Exception as ws_error:
-                                logger.warning(f"Failed to send WebSocket status: {ws_error}")
-                        
-                        image_url = await self._handle_image_generation(
-                            db, message, response_content, agent, context, chat_id, user_message_id, websocket
-                        )
-                        
+                    if websocket:
+                        try:
+                            status_message = "画像を生成しています..."
+                            if r18_score is not None:
+                                status_message += f" (R18スコア: {r18_score})"
+                            
+                            await websocket.send_json({
+                                "type": "status",
+                                "status": "image_generation_started",
+                                "message": status_message,
+                                "r18_score": r18_score
+                            })
+                        except Exception as ws_error:
+                            logger.warning(f"Failed to send WebSocket status: {ws_error}")
+                    
+                    if defer_image:
+                        # 応答はすぐに返し、画像は完成後にメッセージの更新として届ける
+                        image_task = asyncio.create_task(self._resolve_deferred_image(
+                            speculative_image, image_db, message, response_content, agent.id, context,
+                            chat_id, user_message_id, websocket
+                        ))
+                        image_task.add_done_callback(lambda _, session=image_db: session.close())
+                        speculative_image, image_db = None, None
+                    else:
+                        with timer.stage("image"):
+                            image_url = await self._resolve_image(
+                                speculative_image, db, message, response_content, agent, context,
+                                chat_id, user_message_id, websocket
+                            )
+                        speculative_image = None
+                    
+                except ImageJobCancelledError:
+                    logger.info(f"Image generation for chat {chat_id} was cancelled")
                 except Exception as e:
                     logger.error(f"Failed to handle image generation: {e}", exc_info=True)
                     # 画像生成に失敗してもチャットは続行
@@ -141,15 +203,255 @@ class LLMService:
             return {
                 "content": response_content,
                 "image_url": image_url,
+                "image_task": image_task,
                 "metadata": {
                     "model": raw_response.get("model"),
-                    "usage": raw_response.get("usage"),
-                    "image_generated": image_url is not None
+                    "provider": raw_response.get("provider"),
+                    # プロバイダーが返さなかったトークン数はローカルの概算で補う
+                    "usage": resolve_usage(raw_response.get("usage"), prompt, response_content),
+                    "timings": timer.as_dict(),
+                    "image_generated": image_url is not None,
+                    "image_pending": image_task is not None
                 }
             }
         except Exception as e:
             logger.error(f"Error in generate_response for agent {agent.id}: {str(e)}", exc_info=True)
             return self.error_handler.handle(e, agent_id=agent.id)
+        finally:
+            # 応答の生成に失敗した場合は投機的に始めた画像生成も取り消す
+            if speculative_image:
+                speculative_image["task"].cancel()
+            if image_db is not None:
+                image_db.close()
+
+    async def _generate_streaming(
+        self,
+        prompt: str,
+        websocket: Any,
+        user_message_id: Optional[int],
+        cacheable_prefix: Optional[str] = None,
+        timer: Optional[StageTimer] = None,
+    ) -> Dict[str, Any]:
+        """LLMの応答をストリーミングし、deltaフレームとしてクライアントへ送信する"""
+        chunks: List[str] = []
+        can_send = True
+        # ストリーム終了時にプロバイダーが報告したトークン数を受け取る
+        usage: Dict[str, Any] = {}
+        async for delta in self.llm_client.generate_stream(
+            prompt, call_type="chat", cacheable_prefix=cacheable_prefix, usage_sink=usage
+        ):
+            if timer:
+                timer.mark_first_token()
+            chunks.append(delta)
+            if not can_send:
+                continue
+            try:
+                await websocket.send_json({
+                    "type": "delta",
+                    "reply_to": user_message_id,
+                    "content": delta
+                })
+            except Exception as e:
+                # 送信に失敗しても応答全体の生成は継続し、最終メッセージは保存する
+                logger.warning(f"Failed to send delta frame: {e}")
+                can_send = False
+
+        return {
+            "content": "".join(chunks),
+            "model": usage.pop("model", None) or getattr(self.llm_client, "model", None),
+            "provider": usage.pop("provider", None),
+            "usage": usage or None,
+        }
+
+    def _open_session(self) -> Session:
+        if self.session_factory is None:
+            from database import SessionLocal
+            self.session_factory = SessionLocal
+        return self.session_factory()
+
+    def _detect_image_request(self, message: str) -> bool:
+        """画像生成サービスが利用可能で、ユーザー発話が画像要求かを判定"""
+        if not (self.image_request_detector and self.image_prompt_analyzer and self.image_generation_service):
+            return False
+        try:
+            detected = self.image_request_detector.detect_image_request(message)
+        except Exception as e:
+            logger.error(f"Failed to detect image request: {e}", exc_info=True)
+            return False
+        if detected:
+            logger.info(f"Image request detected in message: {message}")
+        return bool(detected)
+
+    async def _build_image_prompt(
+        self,
+        user_message: str,
+        agent_response: str,
+        agent: models.Agent,
+        context: List[Dict[str, str]],
+    ) -> Tuple[Dict[str, Any], Optional[Dict[str, str]]]:
+        """ユーザー発話と応答から画像生成プロンプトを構築し、抽出したキーワードと共に返す"""
+        # 画像のコンテキストとタイプを抽出
+        extracted_keywords = self.image_request_detector.extract_image_context(user_message)
+        image_type = self.image_request_detector.get_image_type_hint(user_message)
+        
+        logger.info(f"Extracted keywords: {extracted_keywords}, Image type: {image_type}")
+        
+        # プロンプトを分析・構築
+        prompt_data = await self.image_prompt_analyzer.analyze_and_build_prompt(
+            user_message=user_message,
+            agent_response=agent_response,
+            agent=agent,
+            context=context,
+            image_type=image_type,
+            extracted_keywords=extracted_keywords,
+            is_user_request=True
+        )
+        return prompt_data, extracted_keywords
+
+    async def _generate_image(
+        self,
+        db: Session,
+        agent: models.Agent,
+        prompt_data: Dict[str, Any],
+        user_message: str,
+        extracted_keywords: Optional[Dict[str, str]],
+        chat_id: int,
+        user_message_id: int,
+        websocket: Optional[Any] = None,
+    ) -> Optional[str]:
+        """構築済みのプロンプトで画像を生成し、URLを返す"""
+        logger.info(f"Generating image with prompt: {prompt_data['prompt']}")
+        
+        image_url, _ = await self.image_generation_service.generate_image_in_chat(
+            db=db,
+            agent=agent,
+            prompt=prompt_data["prompt"],
+            user_message=user_message,
+            keywords=extracted_keywords,
+            chat_id=chat_id,
+            message_id=user_message_id,
+            force_regenerate=True,
+            websocket=websocket
+        )
+        
+        logger.info(f"Image generated and saved: {image_url}")
+        return image_url
+
+    async def _start_speculative_image(
+        self,
+        db: Session,
+        user_message: str,
+        agent: models.Agent,
+        context: List[Dict[str, str]],
+        chat_id: int,
+        user_message_id: int,
+        websocket: Optional[Any] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        応答を待たずに、ユーザー発話と会話履歴だけから画像生成を開始する
+
+        Returns:
+            実行中のタスクと使用したプロンプト（開始できなかった場合はNone）
+        """
+        try:
+            prompt_data, extracted_keywords = await self._build_image_prompt(user_message, "", agent, context)
+        except Exception as e:
+            logger.error(f"Failed to build speculative image prompt: {e}", exc_info=True)
+            return None
+        task = asyncio.create_task(self._generate_image(
+            db, agent, prompt_data, user_message, extracted_keywords, chat_id, user_message_id, websocket
+        ))
+        return {"task": task, "prompt": prompt_data["prompt"]}
+
+    async def _finish_speculative_image(
+        self,
+        speculative: Dict[str, Any],
+        db: Session,
+        user_message: str,
+        agent_response: str,
+        agent: models.Agent,
+        context: List[Dict[str, str]],
+        chat_id: int,
+        user_message_id: int,
+        websocket: Optional[Any] = None,
+    ) -> Optional[str]:
+        """
+        応答が揃った時点で投機的な画像生成を照合する
+
+        応答を加えて組み直したプロンプトが変わった（場所や動作が応答で決まった）場合は、
+        実行中の生成を取り消して新しいプロンプトでやり直す。既に生成が終わっていれば
+        その画像を採用する。
+        """
+        task = speculative["task"]
+        try:
+            prompt_data, extracted_keywords = await self._build_image_prompt(
+                user_message, agent_response, agent, context
+            )
+        except Exception as e:
+            logger.warning(f"Failed to rebuild image prompt with the reply, keeping speculative image: {e}")
+            prompt_data = None
+
+        if prompt_data and prompt_data["prompt"] != speculative["prompt"] and not task.done():
+            logger.info("Reply changed the image scene, restarting image generation")
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            task = asyncio.create_task(self._generate_image(
+                db, agent, prompt_data, user_message, extracted_keywords, chat_id, user_message_id, websocket
+            ))
+            speculative["task"] = task
+
+        try:
+            return await task
+        except ImageJobCancelledError:
+            # 取り消された（新しい依頼に置き換えられた）ことを呼び出し側に伝える
+            raise
+        except Exception as e:
+            logger.error(f"Error in image generation: {e}", exc_info=True)
+            return None
+
+    async def _resolve_image(
+        self,
+        speculative: Optional[Dict[str, Any]],
+        db: Session,
+        user_message: str,
+        agent_response: str,
+        agent: models.Agent,
+        context: List[Dict[str, str]],
+        chat_id: int,
+        user_message_id: int,
+        websocket: Optional[Any] = None,
+    ) -> Optional[str]:
+        """投機的に開始した生成があれば照合し、なければ応答を踏まえて画像を生成する"""
+        if speculative:
+            return await self._finish_speculative_image(
+                speculative, db, user_message, agent_response, agent, context, chat_id, user_message_id, websocket
+            )
+        return await self._handle_image_generation(
+            db, user_message, agent_response, agent, context, chat_id, user_message_id, websocket
+        )
+
+    async def _resolve_deferred_image(
+        self,
+        speculative: Optional[Dict[str, Any]],
+        db: Session,
+        user_message: str,
+        agent_response: str,
+        agent_id: int,
+        context: List[Dict[str, str]],
+        chat_id: int,
+        user_message_id: int,
+        websocket: Optional[Any] = None,
+    ) -> Optional[str]:
+        """応答を返した後に画像を解決する（エージェントは画像用のセッションで読み直す）"""
+        agent = crud.get_agent(db, agent_id, user_id=None)
+        if agent is None:
+            logger.warning(f"Agent {agent_id} was deleted before its image was generated")
+            if speculative:
+                speculative["task"].cancel()
+            return None
+        return await self._resolve_image(
+            speculative, db, user_message, agent_response, agent, context, chat_id, user_message_id, websocket
+        )
 
     async def _handle_image_generation(
         self,
@@ -164,41 +466,14 @@ class LLMService:
     ) -> Optional[str]:
         """画像生成を処理し、URLを返す"""
         try:
-            # 画像のコンテキストとタイプを抽出
-            extracted_keywords = self.image_request_detector.extract_image_context(user_message)
-            image_type = self.image_request_detector.get_image_type_hint(user_message)
-            
-            logger.info(f"Extracted keywords: {extracted_keywords}, Image type: {image_type}")
-            
-            # プロンプトを分析・構築
-            prompt_data = await self.image_prompt_analyzer.analyze_and_build_prompt(
-                user_message=user_message,
-                agent_response=agent_response,
-                agent=agent,
-                context=context,
-                image_type=image_type,
-                extracted_keywords=extracted_keywords,
-                is_user_request=True
+            prompt_data, extracted_keywords = await self._build_image_prompt(
+                user_message, agent_response, agent, context
             )
-            
-            # 画像を生成
-            logger.info(f"Generating image with prompt: {prompt_data['prompt']}")
-            
-            image_url, _ = await self.image_generation_service.generate_image_in_chat(
-                db=db,
-                agent=agent,
-                prompt=prompt_data["prompt"],
-                user_message=user_message,
-                keywords=extracted_keywords,
-                chat_id=chat_id,
-                message_id=user_message_id,
-                force_regenerate=True,
-                websocket=websocket
+            return await self._generate_image(
+                db, agent, prompt_data, user_message, extracted_keywords, chat_id, user_message_id, websocket
             )
-            
-            logger.info(f"Image generated and saved: {image_url}")
-            return image_url
-                
+        except ImageJobCancelledError:
+            raise
         except Exception as e:
             logger.error(f"Error in image generation: {e}", exc_info=True)
-            return None
\ No newline at end of file
+            return None
@@ -1,13 +1,61 @@
-from typing import Dict, List, Any, Optional
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
+from jinja2 import TemplateNotFound
 import models
 import schemas
 from .prompt_template_engine import PromptTemplateEngine
 
+# ペルソナ部分（プロフィール・性格・役割・口調・ルール）のテンプレートを置くディレクトリ
+PERSONA_TEMPLATE_DIR = "persona"
+
+
+class PersonaPrefixCache:
+    """エージェントのリビジョンごとに描画済みのペルソナ部分を保持するLRUキャッシュ"""
+
+    def __init__(self, max_entries: Optional[int] = None):
+        self.max_entries = max_entries or int(os.getenv("PERSONA_PREFIX_CACHE_SIZE", "512"))
+        self._entries: "OrderedDict[Tuple[Any, ...], Tuple[str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple[Any, ...]) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key: Tuple[Any, ...], value: Tuple[str, str]) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
 class PromptBuilder:
     """エージェントのパーソナリティを反映したプロンプトを構築"""
 
-    def __init__(self, template_engine: PromptTemplateEngine):
+    def __init__(self, template_engine: PromptTemplateEngine, prefix_cache: Optional[PersonaPrefixCache] = None):
         self.template_engine = template_engine
+        self.prefix_cache = prefix_cache or PersonaPrefixCache()
 
     async def build(
         self,
@@ -19,23 +67,8 @@ class PromptBuilder:
         **kwargs: Any
     ) -> str:
         """プロンプトを構築"""
-        
-        # 1. Determine the template name
-        if template_name is None:
-            if agent:
-                personality_info = self._extract_personality_info(agent)
-                # Simple logic to select a template based on roles
-                if "customer_support" in personality_info["roles"]:
-                    final_template_name = "customer_support.j2"
-                else:
-                    final_template_name = "default.j2"
-            else:
-                # Default template if no agent and no specific template is requested
-                final_template_name = "default.j2"
-        else:
-            final_template_name = template_name
 
-        # 2. Prepare rendering context
+        # 1. Prepare rendering context
         render_context = {
             "user_message": message,
             "conversation_history": context or [],
@@ -44,33 +77,91 @@ class PromptBuilder:
         }
 
         if agent:
-            # This ensures personality_info is calculated if not already done
-            if 'personality_info' not in locals():
-                personality_info = self._extract_personality_info(agent)
-            
-            render_context.update({
-                "agent_name": agent.name,
-                "agent_description": agent.description,
-                "agent_background": agent.background,
-                "personalities": personality_info["personalities"],
-                "roles": personality_info["roles"],
-                "tones": personality_info["tones"],
-                "gender": agent.gender,
-                "first_person": agent.first_person,
-                "second_person": agent.second_person,
-                "relationship": agent.relationship_status,
-            })
-
-        # 3. Get template and render
+            # ペルソナ部分はエージェントのリビジョンごとに一度だけ描画し、会話履歴と発話だけを毎回描画する
+            final_template_name, persona_prefix = self.build_persona_prefix(
+                agent, template_name=template_name, r18_mode_chat=r18_mode_chat
+            )
+            render_context["agent_name"] = agent.name
+            if persona_prefix is not None:
+                render_context["persona_prefix"] = persona_prefix
+            else:
+                render_context.update(self._agent_context(agent))
+        else:
+            # Default template if no agent and no specific template is requested
+            final_template_name = template_name or "default.j2"
+
+        # 2. Get template and render
         template = self.template_engine.get_template(final_template_name)
         prompt = template.render(render_context)
-        
+
         return prompt
 
+    def build_persona_prefix(
+        self,
+        agent: models.Agent,
+        template_name: Optional[str] = None,
+        r18_mode_chat: bool = False,
+    ) -> Tuple[str, Optional[str]]:
+        """
+        エージェントのペルソナ部分を描画（キャッシュがあれば再利用）
+
+        Returns:
+            (使用するテンプレート名, 描画済みのペルソナ部分)
+            ペルソナ用テンプレートがない場合、ペルソナ部分はNone
+        """
+        revision = getattr(agent, "revision", None)
+        # 未保存のエージェントはリビジョンで変更を検知できないためキャッシュしない
+        cacheable = agent.id is not None and revision is not None
+        key = (agent.id, revision, template_name, r18_mode_chat)
+        if cacheable:
+            cached = self.prefix_cache.get(key)
+            if cached is not None:
+                return cached
+
+        agent_context = self._agent_context(agent)
+        if template_name is None:
+            # Simple logic to select a template based on roles
+            if "customer_support" in agent_context["roles"]:
+                final_template_name = "customer_support.j2"
+            else:
+                final_template_name = "default.j2"
+        else:
+            final_template_name = template_name
+
+        try:
+            persona_template = self.template_engine.get_template(f"{PERSONA_TEMPLATE_DIR}/{final_template_name}")
+        except TemplateNotFound:
+            return final_template_name, None
+
+        persona_prefix = persona_template.render({**agent_context, "r18_mode_enabled": r18_mode_chat})
+        if cacheable:
+            self.prefix_cache.set(key, (final_template_name, persona_prefix))
+        return final_template_name, persona_prefix
+
+    def cacheable_prefix(self, agent: models.Agent, r18_mode_chat: bool = False) -> Optional[str]:
+        """プロバイダー側のコンテキストキャッシュに載せられるプロンプト先頭部分を取得"""
+        return self.build_persona_prefix(agent, r18_mode_chat=r18_mode_chat)[1]
+
+    def _agent_context(self, agent: models.Agent) -> Dict[str, Any]:
+        """テンプレートに渡すエージェント情報を作成"""
+        personality_info = self._extract_personality_info(agent)
+        return {
+            "agent_name": agent.name,
+            "agent_description": agent.description,
+            "agent_background": agent.background,
+            "personalities": personality_info["personalities"],
+            "roles": personality_info["roles"],
+            "tones": personality_info["tones"],
+            "gender": agent.gender,
+            "first_person": agent.first_person,
+            "second_person": agent.second_person,
+            "relationship": agent.relationship_status,
+        }
+
     def _extract_personality_info(self, agent: models.Agent) -> Dict[str, List[str]]:
         """エージェントのパーソナリティ情報を抽出・整形"""
         return {
             "personalities": [p.name for p in agent.personalities],
             "roles": [r.name for r in agent.roles],
             "tones": [t.name for t in agent.tones]
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def render_cache_key(params: Dict[str, Any]) -> str:
+    """描画パラメータを正規化したJSONのハッシュからキャッシュキーを作成"""
+    payload = json.dumps(params, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class RenderResultCache:
+    """描画パラメータが同一の生成結果を再利用するディスクキャッシュ
+
+    シードを固定した生成だけが対象（ランダムなシードでは同じ画像にならないため）。
+    画像は <root>/<キーの先頭2文字>/<キー>.png に保存し、合計バイト数が max_bytes を超えると
+    最後に使われた時刻（ファイルの更新時刻）が古いものから削除する。
+    画像の保存先（ImageStore）とは別に持つのは、保存した画像が解放されてGCに削除された後も
+    再描画を避けるため（その分同じ画像が二重に保存されうるが、容量は max_bytes で制限する）。
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.enabled:
+            self._load_index()
+
+    @classmethod
+    def from_env(cls) -> "RenderResultCache":
+        """IMAGE_RENDER_CACHE_* 環境変数から生成（MAX_BYTES=0で無効）"""
+        return cls(
+            root=Path(os.getenv("IMAGE_RENDER_CACHE_DIR", "backend/render_cache")),
+            max_bytes=int(os.getenv("IMAGE_RENDER_CACHE_MAX_BYTES", str(512 * 1024 * 1024))),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.png"
+
+    def _load_index(self) -> None:
+        """既存のキャッシュファイルを最終使用時刻の古い順に読み込む"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        files = sorted(self.root.glob("*/*.png"), key=lambda path: path.stat().st_mtime)
+        for path in files:
+            size = path.stat().st_size
+            self._entries[path.stem] = size
+            self._total_bytes += size
+        self._evict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """キャッシュ済みの画像を取得（存在しない場合はNone）"""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        with self._lock:
+            try:
+                data = path.read_bytes()
+                # 最終使用時刻を更新し、再起動後もLRUの順序を保つ
+                os.utime(path)
+            except FileNotFoundError:
+                # 別のプロセスが削除した場合
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._drop(key)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            self.hits += 1
+            return data
+
+    def set(self, key: str, data: bytes) -> None:
+        """画像を保存し、上限を超えた分を古いものから削除"""
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        with self._lock:
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_name(f".{uuid.uuid4().hex}.tmp")
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"Failed to store render cache entry {key}: {e}")
+                return
+            self._drop(key)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+
+    def _drop(self, key: str) -> None:
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def _evict(self) -> None:
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                self._path(key).unlink()
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
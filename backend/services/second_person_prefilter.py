@@ -0,0 +1,51 @@
+import re
+import unicodedata
+
+
+class SecondPersonPrefilter:
+    """ユーザーメッセージに「呼び方の指定」が含まれうるかを判定するローカルフィルタ
+
+    LLMによる二人称抽出の前段で使用する。取りこぼし（偽陰性）を避けるため、
+    判定は再現率を優先しており、Trueの場合のみLLMでの抽出を行う。
+    """
+
+    def __init__(self):
+        # 呼び方の指定を示す手がかりとなるパターン
+        self.cue_patterns = [
+            r"(?:呼|よ)(?:んで|んでほしい|んでください|んでくれ|べ|ぶ|ばれ|ばせ|び方|びかた|び名|びな)",
+            r"呼称|二人称|あだ名|あだな|ニックネーム|愛称",
+            r"(?:呼び捨て|よびすて)",
+            r"(?:さん|様|さま|くん|君|ちゃん|殿|先輩)(?:付け|づけ)",
+            r"(?:俺|おれ|オレ|私|わたし|あたし|僕|ぼく|ボク|自分|うち|わし|拙者)(?:の|のこと)(?:は|を)",
+            r"(?:名前|なまえ)(?:は|で|を)",
+            r"(?:って|と)(?:言って|いって|言え|いえ|言ってほしい|いってほしい)",
+            r"call\s+me|my\s+name\s+is|refer\s+to\s+me",
+        ]
+        # 「ボスだよ」のような、呼称だけを伝える短い発話
+        self.short_declaration_pattern = re.compile(
+            r"^[^\s、。,.!?！？]{1,10}(?:だよ|です|(?<!ん)だ|でーす|っす|だぞ)[!！。〜~ー]*$"
+        )
+
+        # コンパイル済みの正規表現パターン
+        self.compiled_patterns = [re.compile(pattern, re.IGNORECASE) for pattern in self.cue_patterns]
+
+    def may_contain_naming(self, user_message: str) -> bool:
+        """
+        メッセージに呼び方の指定が含まれる可能性があるかを判定
+
+        Args:
+            user_message: ユーザーのメッセージ
+
+        Returns:
+            呼び方の指定が含まれる可能性がある場合True
+        """
+        if not user_message:
+            return False
+
+        normalized = unicodedata.normalize("NFKC", user_message).strip()
+
+        for pattern in self.compiled_patterns:
+            if pattern.search(normalized):
+                return True
+
+        return bool(self.short_declaration_pattern.match(normalized))
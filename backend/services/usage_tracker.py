@@ -0,0 +1,59 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from .context_assembler import estimate_tokens
+
+# 計測する処理段階（MessageUsageの *_ms カラムに対応）
+STAGES = ("context", "prompt", "llm", "first_token", "image", "total")
+
+
+class StageTimer:
+    """応答生成の処理段階ごとの所要時間（ミリ秒）を計測する"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations: Dict[str, int] = {}
+        self._llm_started: Optional[float] = None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        if name == "llm":
+            self._llm_started = started
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0) + int((time.perf_counter() - started) * 1000)
+
+    def mark_first_token(self) -> None:
+        """LLM呼び出し開始から最初のデルタを受け取るまでの時間を記録"""
+        if "first_token" not in self.durations and self._llm_started is not None:
+            self.durations["first_token"] = int((time.perf_counter() - self._llm_started) * 1000)
+
+    def as_dict(self) -> Dict[str, int]:
+        return {**self.durations, "total": int((time.perf_counter() - self.started) * 1000)}
+
+
+def resolve_usage(usage: Optional[Dict[str, Any]], prompt: str, completion: str) -> Dict[str, Any]:
+    """
+    プロバイダーが返したトークン数を採用し、欠けている値はローカルの概算で補う
+
+    Returns:
+        prompt_tokens / completion_tokens / total_tokens と、概算を含むかどうか（estimated）
+    """
+    usage = usage or {}
+    prompt_tokens = usage.get("prompt_tokens")
+    completion_tokens = usage.get("completion_tokens")
+    estimated = prompt_tokens is None or completion_tokens is None
+    if prompt_tokens is None:
+        prompt_tokens = estimate_tokens(prompt)
+    if completion_tokens is None:
+        completion_tokens = estimate_tokens(completion)
+    total_tokens = usage.get("total_tokens") if not estimated else None
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": total_tokens if total_tokens is not None else prompt_tokens + completion_tokens,
+        "estimated": estimated,
+    }
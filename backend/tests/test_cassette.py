@@ -0,0 +1,116 @@
+import pytest
+from services.cassette import Cassette
+from services.llm_clients.base import LLMClientInterface
+from services.llm_clients.cassette_client import (
+    RecordingLLMClient, ReplayLLMClient, RecordingImageClient, ReplayImageClient
+)
+
+
+class EchoClient(LLMClientInterface):
+    """プロンプトをそのまま返すテスト用クライアント"""
+
+    model = "echo-model"
+
+    async def generate(self, prompt, **kwargs):
+        if prompt == "fail":
+            raise TimeoutError("Echo API timeout")
+        return {"content": f"echo: {prompt}", "model": self.model}
+
+    async def generate_stream(self, prompt, **kwargs):
+        for delta in ["echo", ": ", prompt]:
+            yield delta
+
+    async def validate_response(self, response):
+        return bool(response.get("content"))
+
+
+class StubImageClient:
+    """固定の画像を返すテスト用画像クライアント"""
+
+    async def generate_image_async(self, prompt, negative_prompt="", progress_callback=None, seed=None, **kwargs):
+        if progress_callback:
+            await progress_callback({"progress": 0.5, "eta_relative": 1.0, "current_image": "large"})
+        return b"\x89PNG fake", 1234
+
+
+class TestCassette:
+    """カセットの記録・再生のテストクラス"""
+
+    @pytest.mark.asyncio
+    async def test_record_and_replay_llm(self, tmp_path):
+        """LLMの応答を記録して再生できることのテスト"""
+        path = str(tmp_path / "traffic.jsonl.gz")
+        cassette = Cassette(path, mode="record")
+        recorder = RecordingLLMClient(EchoClient(), cassette)
+        await recorder.generate("こんにちは", call_type="chat")
+        streamed = [delta async for delta in recorder.generate_stream("やあ")]
+        with pytest.raises(TimeoutError):
+            await recorder.generate("fail")
+        cassette.close()
+
+        replay = ReplayLLMClient(Cassette(path, mode="replay"), model="echo-model")
+
+        assert (await replay.generate("こんにちは"))["content"] == "echo: こんにちは"
+        assert [delta async for delta in replay.generate_stream("やあ")] == streamed
+        with pytest.raises(TimeoutError):
+            await replay.generate("fail")
+
+    @pytest.mark.asyncio
+    async def test_replay_with_the_other_call_kind(self, tmp_path):
+        """通常の呼び出しとストリーミングを入れ替えて再生しても、同じ応答を返すことのテスト"""
+        path = str(tmp_path / "traffic.jsonl.gz")
+        cassette = Cassette(path, mode="record")
+        recorder = RecordingLLMClient(EchoClient(), cassette)
+        await recorder.generate("こんにちは")
+        [delta async for delta in recorder.generate_stream("やあ")]
+        cassette.close()
+
+        replay = ReplayLLMClient(Cassette(path, mode="replay"), model="echo-model")
+
+        assert "".join([delta async for delta in replay.generate_stream("こんにちは")]) == "echo: こんにちは"
+        response = await replay.generate("やあ")
+        assert response == {"content": "echo: やあ", "model": "echo-model"}
+
+    @pytest.mark.asyncio
+    async def test_replay_unknown_prompt_in_recorded_order(self, tmp_path):
+        """未知のプロンプトには記録順に応答を返すことのテスト"""
+        path = str(tmp_path / "traffic.jsonl.gz")
+        cassette = Cassette(path, mode="record")
+        recorder = RecordingLLMClient(EchoClient(), cassette)
+        await recorder.generate("1")
+        await recorder.generate("2")
+        cassette.close()
+
+        replay = ReplayLLMClient(Cassette(path, mode="replay"), model="echo-model")
+        contents = [(await replay.generate(f"other {i}"))["content"] for i in range(3)]
+
+        assert contents == ["echo: 1", "echo: 2", "echo: 1"]
+
+    @pytest.mark.asyncio
+    async def test_record_and_replay_image(self, tmp_path):
+        """画像生成の結果と進捗を記録して再生できることのテスト"""
+        path = str(tmp_path / "traffic.jsonl.gz")
+        cassette = Cassette(path, mode="record")
+        await RecordingImageClient(StubImageClient(), cassette).generate_image_async("a cat", seed=1)
+        cassette.close()
+
+        progress = []
+
+        async def on_progress(data):
+            progress.append(data)
+
+        image, seed = await ReplayImageClient(Cassette(path, mode="replay")).generate_image_async(
+            "a cat", seed=1, progress_callback=on_progress
+        )
+
+        assert image == b"\x89PNG fake"
+        assert seed == 1234
+        assert progress == [{"progress": 0.5, "eta_relative": 1.0}]
+
+    def test_replay_without_recordings(self, tmp_path):
+        """記録がない場合はAPIエラーになることのテスト"""
+        path = str(tmp_path / "empty.jsonl.gz")
+        Cassette(path, mode="record").close()
+
+        with pytest.raises(Exception, match="API error"):
+            Cassette(path, mode="replay").next_entry("llm", "missing")
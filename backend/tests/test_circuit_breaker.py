@@ -0,0 +1,159 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from services.circuit_breaker import (
+    CircuitBreaker, CircuitOpenError, RetryPolicy, is_retryable_llm_error, is_transient_error
+)
+from services.llm_clients.base import LLMClientInterface
+from services.llm_clients.resilient_client import ResilientLLMClient
+
+
+class FlakyClient(LLMClientInterface):
+    """指定回数だけ失敗するテスト用クライアント"""
+
+    def __init__(self, failures, error=None):
+        self.failures = failures
+        self.error = error or Exception("Gemini API error: 503 Service Unavailable")
+        self.calls = 0
+
+    async def generate(self, prompt, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return {"content": "ok"}
+
+    async def validate_response(self, response):
+        return bool(response.get("content"))
+
+
+class TestCircuitBreaker:
+    """CircuitBreakerのテストクラス"""
+
+    async def _fail(self, breaker):
+        async def boom():
+            raise Exception("WebUI API error: 502")
+        with pytest.raises(Exception):
+            await breaker.call(boom)
+
+    @pytest.mark.asyncio
+    async def test_opens_after_consecutive_failures(self):
+        """連続した失敗でオープンになり、即座に失敗することのテスト"""
+        breaker = CircuitBreaker("test", failure_threshold=2, recovery_timeout=60)
+
+        await self._fail(breaker)
+        assert breaker.state == CircuitBreaker.CLOSED
+        await self._fail(breaker)
+        assert breaker.state == CircuitBreaker.OPEN
+
+        async def never_called():
+            raise AssertionError("should not be called")
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(never_called)
+        assert breaker.stats()["total_rejected"] == 1
+
+    @pytest.mark.asyncio
+    async def test_half_open_trial_closes_on_success(self):
+        """回復待ち時間の後、試行呼び出しの成功でクローズに戻ることのテスト"""
+        breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout=10)
+        with patch("services.circuit_breaker.time.monotonic", return_value=100.0):
+            await self._fail(breaker)
+
+        async def ok():
+            return "ok"
+        with patch("services.circuit_breaker.time.monotonic", return_value=111.0):
+            assert breaker.state == CircuitBreaker.HALF_OPEN
+            assert await breaker.call(ok) == "ok"
+
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    @pytest.mark.asyncio
+    async def test_half_open_trial_failure_reopens(self):
+        """試行呼び出しが失敗すると再びオープンになることのテスト"""
+        breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout=10)
+        with patch("services.circuit_breaker.time.monotonic", return_value=100.0):
+            await self._fail(breaker)
+        with patch("services.circuit_breaker.time.monotonic", return_value=111.0):
+            await self._fail(breaker)
+            assert breaker.state == CircuitBreaker.OPEN
+
+    @pytest.mark.asyncio
+    async def test_local_rate_limit_is_not_failure(self):
+        """自プロセスのレート制限はブレーカーの失敗に数えないことのテスト"""
+        breaker = CircuitBreaker("test", failure_threshold=1)
+
+        async def limited():
+            raise Exception("LLM rate limited: queue is full")
+        with pytest.raises(Exception):
+            await breaker.call(limited)
+
+        assert breaker.state == CircuitBreaker.CLOSED
+
+
+class TestRetryPolicy:
+    """RetryPolicyとResilientLLMClientのテストクラス"""
+
+    def test_transient_error_classification(self):
+        """一時的なエラーの判定テスト"""
+        assert is_transient_error(TimeoutError("timed out"))
+        assert is_transient_error(Exception("Gemini API error: 503"))
+        assert not is_transient_error(Exception("Gemini API error: 400 invalid argument"))
+        assert not is_transient_error(CircuitOpenError("circuit open"))
+
+    def test_backoff_is_bounded(self):
+        """バックオフが上限を超えないことのテスト"""
+        policy = RetryPolicy(max_attempts=5, base_delay=1.0, max_delay=3.0)
+
+        assert all(0 <= policy.backoff(attempt) <= 3.0 for attempt in range(1, 10))
+
+    @pytest.mark.asyncio
+    async def test_retries_transient_errors(self):
+        """一時的なエラーがリトライで回復することのテスト"""
+        inner = FlakyClient(failures=1)
+        client = ResilientLLMClient(
+            inner, CircuitBreaker("test"), RetryPolicy(max_attempts=2, base_delay=0.001)
+        )
+
+        result = await client.generate("hello")
+
+        assert result["content"] == "ok"
+        assert inner.calls == 2
+
+    @pytest.mark.asyncio
+    async def test_does_not_retry_permanent_errors(self):
+        """恒久的なエラーはリトライしないことのテスト"""
+        inner = FlakyClient(failures=1, error=Exception("Gemini API error: 400 invalid argument"))
+        client = ResilientLLMClient(
+            inner, CircuitBreaker("test"), RetryPolicy(max_attempts=3, base_delay=0.001)
+        )
+
+        with pytest.raises(Exception, match="400"):
+            await client.generate("hello")
+        assert inner.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_does_not_retry_llm_timeouts(self):
+        """LLMのタイムアウトはリトライせず、すぐにフェイルオーバーさせることのテスト"""
+        assert not is_retryable_llm_error(TimeoutError("Gemini API timeout after 60 seconds"))
+        assert not is_retryable_llm_error(Exception("Request timed out"))
+        assert is_retryable_llm_error(Exception("Gemini API error: 503"))
+        inner = FlakyClient(failures=1, error=TimeoutError("Gemini API timeout after 60 seconds"))
+        policy = RetryPolicy.from_env("LLM", is_retryable=is_retryable_llm_error, base_delay=0.001)
+        client = ResilientLLMClient(inner, CircuitBreaker("test"), policy)
+
+        with pytest.raises(TimeoutError):
+            await client.generate("hello")
+        assert inner.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_fails_fast_when_open(self):
+        """ブレーカーが開いた後はプロバイダーを呼ばないことのテスト"""
+        inner = FlakyClient(failures=100)
+        client = ResilientLLMClient(
+            inner, CircuitBreaker("test", failure_threshold=2), RetryPolicy(max_attempts=2, base_delay=0.001)
+        )
+
+        with pytest.raises(Exception):
+            await client.generate("hello")
+        with pytest.raises(CircuitOpenError):
+            await client.generate("hello")
+        assert inner.calls == 2
@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+from services.context_assembler import ContextAssembler, estimate_tokens, truncate_to_tokens
+
+
+def make_messages(count, content="こんにちは"):
+    """テスト用のメッセージ一覧を作成"""
+    return [
+        SimpleNamespace(id=i, sender="user" if i % 2 else "ai", content=f"{content}{i}")
+        for i in range(1, count + 1)
+    ]
+
+
+def fake_recent_messages(messages):
+    """crud.get_recent_messagesの代替（id降順のページング）"""
+    def _get(db, chat_id, limit=20, before_id=None):
+        candidates = [m for m in messages if before_id is None or m.id < before_id]
+        return sorted(candidates, key=lambda m: m.id, reverse=True)[:limit]
+    return _get
+
+
+class TestEstimateTokens:
+    """トークン概算のテストクラス"""
+
+    def test_estimate_tokens(self):
+        """日本語と英語のトークン概算テスト"""
+        assert estimate_tokens("") == 0
+        assert estimate_tokens("こんにちは") == 5
+        assert estimate_tokens("hello world!") == 3
+
+    def test_truncate_to_tokens(self):
+        """上限を超えるテキストが切り詰められることのテスト"""
+        text = "あ" * 100
+        truncated = truncate_to_tokens(text, 10)
+
+        assert truncated.endswith("…")
+        assert estimate_tokens(truncated) <= 10
+        assert truncate_to_tokens("短い", 10) == "短い"
+
+
+class TestContextAssembler:
+    """ContextAssemblerのテストクラス"""
+
+    def test_selects_most_recent_messages_in_order(self):
+        """直近のメッセージが古い順に並んで返されることのテスト"""
+        assembler = ContextAssembler(token_budget=1000, max_message_tokens=100, max_messages=5)
+        messages = make_messages(10_000)
+
+        with patch('crud.get_recent_messages', side_effect=fake_recent_messages(messages)):
+            context = assembler.assemble(Mock(), chat_id=1)
+
+        assert [c["content"] for c in context] == [f"こんにちは{i}" for i in range(9996, 10001)]
+
+    def test_respects_token_budget(self):
+        """トークン予算を超えないことのテスト"""
+        assembler = ContextAssembler(token_budget=30, max_message_tokens=100, max_messages=50)
+        messages = make_messages(100, content="あ" * 8)
+
+        with patch('crud.get_recent_messages', side_effect=fake_recent_messages(messages)):
+            context = assembler.assemble(Mock(), chat_id=1)
+
+        assert sum(estimate_tokens(c["content"]) for c in context) <= 30
+        assert context[-1]["content"].endswith("100")
+
+    def test_excludes_current_message_and_truncates(self):
+        """現在の発話を除外し、長いメッセージを切り詰めることのテスト"""
+        assembler = ContextAssembler(token_budget=1000, max_message_tokens=10, max_messages=10)
+        messages = make_messages(3, content="い" * 50)
+
+        with patch('crud.get_recent_messages', side_effect=fake_recent_messages(messages)):
+            context = assembler.assemble(Mock(), chat_id=1, exclude_message_id=3)
+
+        assert len(context) == 2
+        assert all(estimate_tokens(c["content"]) <= 10 for c in context)
+
+    def test_stops_at_summarized_messages(self):
+        """要約済みのメッセージが履歴に含まれないことのテスト"""
+        assembler = ContextAssembler(token_budget=1000, max_message_tokens=100, max_messages=50)
+        messages = make_messages(30)
+
+        with patch('crud.get_recent_messages', side_effect=fake_recent_messages(messages)):
+            context = assembler.assemble(Mock(), chat_id=1, after_id=25)
+
+        assert [c["content"] for c in context] == [f"こんにちは{i}" for i in range(26, 31)]
+
+    def test_no_chat_id(self):
+        """chat_idがない場合は空の履歴を返すことのテスト"""
+        assert ContextAssembler().assemble(Mock(), chat_id=None) == []
@@ -0,0 +1,141 @@
+import pytest
+from types import SimpleNamespace
+from unittest.mock import Mock, AsyncMock, patch
+from services.conversation_summarizer import ConversationSummarizer
+from services.prompt_builder import PromptBuilder
+from services.prompt_template_engine import PromptTemplateEngine
+
+
+class FakeChatStore:
+    """crudのチャット要約・メッセージ関数の代替"""
+
+    def __init__(self, message_count):
+        self.messages = [
+            SimpleNamespace(id=i, sender="user" if i % 2 else "ai", content=f"メッセージ{i}")
+            for i in range(1, message_count + 1)
+        ]
+        self.summary = None
+        self.summary_message_id = None
+        self.fetched_ids = []
+
+    def get_chat_summary(self, db, chat_id):
+        return self.summary, self.summary_message_id
+
+    def count_messages_after(self, db, chat_id, after_id=None):
+        return len([m for m in self.messages if after_id is None or m.id > after_id])
+
+    def get_messages_after(self, db, chat_id, after_id=None, limit=100):
+        page = [m for m in self.messages if after_id is None or m.id > after_id][:limit]
+        self.fetched_ids.extend(m.id for m in page)
+        return page
+
+    def update_chat_summary(self, db, chat_id, summary, summary_message_id):
+        self.summary = summary
+        self.summary_message_id = summary_message_id
+
+    def patches(self):
+        return [
+            patch('crud.get_chat_summary', side_effect=self.get_chat_summary),
+            patch('crud.count_messages_after', side_effect=self.count_messages_after),
+            patch('crud.get_messages_after', side_effect=self.get_messages_after),
+            patch('crud.update_chat_summary', side_effect=self.update_chat_summary),
+        ]
+
+
+class TestConversationSummarizer:
+    """ConversationSummarizerのテストクラス"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される"""
+        self.prompt_builder = PromptBuilder(PromptTemplateEngine())
+        self.llm_client = Mock()
+        self.llm_client.generate = AsyncMock(return_value={"content": "- ユーザーは猫が好き"})
+
+    async def _update(self, store, summarizer):
+        patches = store.patches()
+        for p in patches:
+            p.start()
+        try:
+            return await summarizer.update(Mock(), chat_id=1, agent_name="テストエージェント")
+        finally:
+            for p in patches:
+                p.stop()
+
+    @pytest.mark.asyncio
+    async def test_skips_until_enough_new_messages(self):
+        """未要約のメッセージが少ない場合は要約しないことのテスト"""
+        store = FakeChatStore(message_count=14)
+        summarizer = ConversationSummarizer(self.prompt_builder, self.llm_client, every=5, keep_recent=10)
+
+        assert await self._update(store, summarizer) is None
+        self.llm_client.generate.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_folds_only_new_messages(self):
+        """直近のメッセージを残し、未要約のメッセージだけを畳み込むことのテスト"""
+        store = FakeChatStore(message_count=20)
+        summarizer = ConversationSummarizer(self.prompt_builder, self.llm_client, every=5, keep_recent=10)
+
+        assert await self._update(store, summarizer) == "- ユーザーは猫が好き"
+        assert store.summary_message_id == 10
+        assert store.fetched_ids == list(range(1, 11))
+
+        # 新しいメッセージが追加されたら、前回の要約以降の分だけを読む
+        store.messages += [SimpleNamespace(id=i, sender="user", content=f"メッセージ{i}") for i in range(21, 26)]
+        store.fetched_ids = []
+        await self._update(store, summarizer)
+
+        assert store.fetched_ids == list(range(11, 16))
+        assert store.summary_message_id == 15
+        prompt = self.llm_client.generate.call_args.args[0]
+        assert "- ユーザーは猫が好き" in prompt
+        assert "メッセージ15" in prompt
+        assert "メッセージ10" not in prompt
+        assert self.llm_client.generate.call_args.kwargs["call_type"] == "summary"
+
+    @pytest.mark.asyncio
+    async def test_limits_messages_per_update(self):
+        """一度に畳み込むメッセージ数が制限されることのテスト"""
+        store = FakeChatStore(message_count=200)
+        summarizer = ConversationSummarizer(
+            self.prompt_builder, self.llm_client, every=5, keep_recent=10, max_fold_messages=30
+        )
+
+        await self._update(store, summarizer)
+
+        assert store.fetched_ids == list(range(1, 31))
+        assert store.summary_message_id == 30
+
+    @pytest.mark.asyncio
+    async def test_schedule_runs_once_per_chat(self):
+        """同じチャットの要約が重複して実行されないことのテスト"""
+        db = Mock()
+        summarizer = ConversationSummarizer(
+            self.prompt_builder, self.llm_client, every=5, keep_recent=10, session_factory=lambda: db
+        )
+
+        with patch.object(summarizer, 'update', AsyncMock(return_value="要約")) as mock_update:
+            first = summarizer.schedule(1)
+            second = summarizer.schedule(1)
+            assert await first == "要約"
+
+        assert second is None
+        mock_update.assert_called_once()
+        db.close.assert_called_once()
+
+
+class TestDefaultTemplateSummary:
+    """default.j2への要約の注入のテストクラス"""
+
+    @pytest.mark.asyncio
+    async def test_summary_is_rendered(self):
+        """会話の要約がプロンプトに含まれることのテスト"""
+        builder = PromptBuilder(PromptTemplateEngine())
+
+        prompt = await builder.build(
+            message="こんにちは", template_name="default.j2", agent_name="テスト",
+            conversation_summary="- ユーザーは猫が好き"
+        )
+
+        assert "【これまでの会話の要約】" in prompt
+        assert "- ユーザーは猫が好き" in prompt
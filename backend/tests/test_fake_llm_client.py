@@ -0,0 +1,72 @@
+import json
+import random
+import pytest
+from services.llm_clients.fake_client import FakeLLMClient, LatencyModel
+from services.llm_clients.registry import LLMClientRegistry
+
+
+class TestLatencyModel:
+    """LatencyModelのテストクラス"""
+
+    def test_parse_fixed_and_lognormal(self):
+        """fixed・lognormalの設定文字列の解析テスト"""
+        rng = random.Random(0)
+
+        assert LatencyModel.parse("fixed:0.25").sample(rng) == 0.25
+        samples = sorted(LatencyModel.parse("lognormal:1.0,0.3").sample(rng) for _ in range(1001))
+        assert 0.9 < samples[500] < 1.1
+
+    def test_parse_histogram(self, tmp_path):
+        """ヒストグラムからの遅延の再生テスト"""
+        path = tmp_path / "latency.json"
+        path.write_text(json.dumps({"buckets": [[0.5, 0], [1.0, 10]]}))
+        rng = random.Random(0)
+
+        model = LatencyModel.parse(f"histogram:{path}")
+
+        assert all(0.5 <= model.sample(rng) <= 1.0 for _ in range(100))
+
+    def test_unknown_distribution(self):
+        """未知の分布指定でエラーになることのテスト"""
+        with pytest.raises(ValueError):
+            LatencyModel.parse("uniform:1")
+
+
+class TestFakeLLMClient:
+    """FakeLLMClientのテストクラス"""
+
+    @pytest.mark.asyncio
+    async def test_deterministic_response(self):
+        """同じシードとプロンプトで同じ応答が返ることのテスト"""
+        first = await FakeLLMClient(seed=1, response_chars=50).generate("こんにちは")
+        second = await FakeLLMClient(seed=1, response_chars=50).generate("こんにちは")
+
+        assert first["content"] == second["content"]
+        assert len(first["content"]) == 50
+
+    @pytest.mark.asyncio
+    async def test_error_injection(self):
+        """エラー率1.0で必ずAPIエラーになることのテスト"""
+        client = FakeLLMClient(error_rate=1.0, seed=1)
+
+        with pytest.raises(Exception, match="API error"):
+            await client.generate("hello")
+
+    @pytest.mark.asyncio
+    async def test_streaming_matches_generate(self):
+        """ストリーミングのデルタを連結すると全文になることのテスト"""
+        client = FakeLLMClient(seed=3, response_chars=30, chunk_chars=7)
+
+        deltas = [delta async for delta in client.generate_stream("hello")]
+        full = await client.generate("hello")
+
+        assert "".join(deltas) == full["content"]
+        assert len(deltas) == 5
+
+    def test_selectable_from_registry(self, monkeypatch):
+        """LLM_PROVIDER=fakeでレジストリから取得できることのテスト"""
+        monkeypatch.setenv("FAKE_LLM_LATENCY", "fixed:0")
+
+        client = LLMClientRegistry(default_provider="fake").get()
+
+        assert client.model == "fake-model"
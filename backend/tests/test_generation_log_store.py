@@ -0,0 +1,102 @@
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import crud
+import models
+from services.generation_log_store import GenerationLogStore
+from services.image_generation_service import ImageGenerationService
+
+
+class TestGenerationLogStore:
+    """ジョブ単位の画像生成ログのテストクラス"""
+
+    def setup_method(self):
+        engine = create_engine(
+            "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+        )
+        models.Base.metadata.create_all(engine)
+        self.session_factory = sessionmaker(bind=engine)
+        self.db = self.session_factory()
+        self.user = models.User(email="user@example.com", hashed_password="x")
+        self.db.add(self.user)
+        self.db.commit()
+        self.agent = models.Agent(name="A", owner_id=self.user.id)
+        self.db.add(self.agent)
+        self.db.commit()
+
+    def teardown_method(self):
+        self.db.close()
+
+    def _job(self, kind="profile"):
+        return crud.create_image_job(self.db, kind=kind, agent_id=self.agent.id, user_id=self.user.id, payload={})
+
+    def test_logs_are_keyed_by_job_and_bounded(self):
+        """同じエージェントの生成でもジョブごとに別のログになり、古いものから追い出される"""
+        store = GenerationLogStore(max_entries=2, session_factory=self.session_factory)
+        first = store.start(1, agent_id=self.agent.id, kind="profile", provider="Stub")
+        second = store.start(2, agent_id=self.agent.id, kind="chat", provider="Stub")
+        first["progress"] = 50.0
+
+        assert store.get(2) is second and store.get(1) is first
+        store.start(3, agent_id=self.agent.id, kind="chat", provider="Stub")
+        # 直前に参照した1は残り、2が追い出される
+        assert store.get(2) is None
+        assert store.get(1)["progress"] == 50.0
+        assert len(store) == 2
+
+    def test_progress_flush_is_throttled(self):
+        """進捗は flush_interval ごとにまとめてDBへ書き出す"""
+        job = self._job()
+        store = GenerationLogStore(flush_interval=60, session_factory=self.session_factory)
+        log = store.start(job.id, agent_id=self.agent.id, kind="profile", provider="Stub")
+
+        store.update_progress(log, 10.0)
+        store.update_progress(log, 40.0)
+        self.db.refresh(job)
+        assert job.log["progress"] == 10.0
+
+        store.flush(log)
+        self.db.refresh(job)
+        assert job.log["progress"] == 40.0
+
+    @pytest.mark.asyncio
+    async def test_failed_generation_log_is_persisted(self):
+        """失敗した生成のログもジョブに書き出され、別のプロセスからも参照できる"""
+        job = self._job()
+        service = ImageGenerationService()
+        service.client = None
+        service.generation_logs = GenerationLogStore(session_factory=self.session_factory)
+
+        with pytest.raises(HTTPException):
+            await service._generate_and_save_image_internal(
+                db=self.db, agent=self.agent, prompt="portrait", force_regenerate=True, job_id=job.id
+            )
+        crud.finish_image_job(self.db, job.id, "failed", error="Image generation service is not available.")
+
+        self.db.refresh(job)
+        assert job.log["status"] == "failed"
+        assert job.log["steps"][0]["step"] == "prompt_generation"
+
+        # メモリ上のログを持たない別プロセスの参照
+        other = ImageGenerationService()
+        other.generation_logs = GenerationLogStore(session_factory=self.session_factory)
+        entries = other.get_generation_logs(self.db, self.agent.id)
+        assert [entry["job_id"] for entry in entries] == [job.id]
+        assert entries[0]["status"] == "failed"
+        assert entries[0]["prompt"] == "portrait"
+
+    def test_queued_job_is_listed_before_it_has_a_log(self):
+        """まだ実行されていないジョブも待機中として一覧に含まれる"""
+        profile = self._job()
+        chat = self._job(kind="chat")
+        service = ImageGenerationService()
+        service.generation_logs = GenerationLogStore(session_factory=self.session_factory)
+
+        entries = service.get_generation_logs(self.db, self.agent.id)
+
+        assert [(entry["job_id"], entry["kind"], entry["status"]) for entry in entries] == [
+            (chat.id, "chat", "queued"), (profile.id, "profile", "queued")
+        ]
+        assert entries[0]["steps"] == [] and entries[0]["progress"] == 0.0
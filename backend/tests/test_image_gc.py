@@ -0,0 +1,144 @@
+import os
+import time
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import crud
+import models
+import schemas
+from services.image_gc import ImageGarbageCollector
+from services.image_storage import ImageStore, LocalStorageDriver
+
+
+class TestImageGarbageCollector:
+    """参照されなくなった画像ファイルのマークアンドスイープのテストクラス"""
+
+    @pytest.fixture(autouse=True)
+    def setup_db(self, tmp_path):
+        engine = create_engine(
+            "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+        )
+        models.Base.metadata.create_all(engine)
+        self.session_factory = sessionmaker(bind=engine)
+        self.db = self.session_factory()
+        user = models.User(email="user@example.com", hashed_password="x")
+        self.db.add(user)
+        self.db.commit()
+        self.agent = models.Agent(name="A", owner_id=user.id)
+        self.db.add(self.agent)
+        self.db.commit()
+        self.chat = models.Chat(user_id=user.id, agent_id=self.agent.id)
+        self.db.add(self.chat)
+        self.db.commit()
+        self.root = tmp_path / "images"
+        self.legacy_dir = tmp_path / "agent_images"
+        self.legacy_dir.mkdir()
+        self.store = ImageStore(LocalStorageDriver(self.root), legacy_dir=self.legacy_dir)
+        yield
+        self.db.close()
+
+    def _collector(self, grace_period=3600):
+        return ImageGarbageCollector(
+            self.store, grace_period=grace_period, batch_size=2, batch_pause=0,
+            session_factory=self.session_factory,
+        )
+
+    def _age(self, url=None, path=None, hours=2):
+        """登録時刻とファイルの更新時刻を過去にずらす"""
+        past = datetime.utcnow() - timedelta(hours=hours)
+        if url is not None:
+            key = self.store.driver.key_for_url(url)
+            blob = crud.get_image_blob_by_key(self.db, key)
+            blob.created_at = past
+            self.db.commit()
+            path = self.root / key
+        timestamp = time.time() - hours * 3600
+        os.utime(path, (timestamp, timestamp))
+        return path
+
+    def test_sweeps_only_old_unreferenced_images(self):
+        """参照されていない古い画像だけを削除し、参照中・猶予期間内の画像は残す"""
+        kept = self.store.save(self.db, b"kept")
+        crud.create_message(
+            self.db, schemas.MessageCreate(content="どうぞ"), chat_id=self.chat.id, sender="ai", image_url=kept
+        )
+        variant = self.store.save(self.db, b"variant")
+        db_image = crud.create_agent_image(self.db, agent_id=self.agent.id, image_url=kept)
+        crud.set_image_variants(self.db, "agent_image", db_image.id, {"srcset": {"160": variant}})
+        # 削除されたチャットに残っていた画像（参照数が減らないまま取り残された）
+        orphan = self.store.save(self.db, b"orphan")
+        recent = self.store.save(self.db, b"recent")
+        for url in (kept, variant, orphan):
+            self._age(url=url)
+
+        report = self._collector().collect()
+
+        assert report["deleted"] == 1 and report["samples"] == [self.store.driver.key_for_url(orphan)]
+        assert report["orphaned_bytes"] == len(b"orphan")
+        for url in (kept, variant, recent):
+            assert (self.root / self.store.driver.key_for_url(url)).exists()
+        assert not (self.root / self.store.driver.key_for_url(orphan)).exists()
+        assert crud.get_image_blob_by_key(self.db, self.store.driver.key_for_url(orphan)) is None
+
+    def test_dry_run_reports_without_deleting(self):
+        """ドライランでは削除対象を報告するだけで何も消さない"""
+        orphan_path = self._age(url=self.store.save(self.db, b"orphan"))
+        legacy = self.legacy_dir / "old.png"
+        legacy.write_bytes(b"legacy")
+        self._age(path=legacy)
+
+        report = self._collector().collect(dry_run=True)
+
+        assert (report["dry_run"], report["orphaned"], report["deleted"]) == (True, 2, 0)
+        assert "/static/agent_images/old.png" in report["samples"]
+        assert orphan_path.exists() and legacy.exists()
+        assert self.db.query(models.ImageBlob).count() == 1
+
+    def test_sweeps_legacy_and_unregistered_files(self):
+        """移行前のディレクトリと、登録のないまま残った保存先のファイルも対象にする"""
+        self.agent.image_url = "http://localhost:8000/static/agent_images/used.png"
+        self.db.commit()
+        for name in ("used.png", "unused.png"):
+            (self.legacy_dir / name).write_bytes(name.encode())
+            self._age(path=self.legacy_dir / name)
+        stray = self.root / "ab" / "cd" / "stray.png"
+        stray.parent.mkdir(parents=True)
+        stray.write_bytes(b"stray")
+        self._age(path=stray)
+
+        report = self._collector().collect()
+
+        assert report["deleted"] == 2
+        assert (self.legacy_dir / "used.png").exists()
+        assert not (self.legacy_dir / "unused.png").exists() and not stray.exists()
+
+    def test_blob_reused_after_mark_is_kept(self):
+        """マーク後に同じ内容が保存されて参照数が増えた画像は消さない"""
+        url = self.store.save(self.db, b"image")
+        self._age(url=url)
+        collector = self._collector()
+        original_mark = collector._mark
+
+        def mark_then_save(db):
+            marked = original_mark(db)
+            self.store.save(self.db, b"image")
+            return marked
+
+        collector._mark = mark_then_save
+        report = collector.collect()
+
+        assert report["deleted"] == 0
+        assert (self.root / self.store.driver.key_for_url(url)).exists()
+
+    def test_released_blob_is_deleted_with_its_file(self):
+        """解放されて参照数が0になった画像は、猶予期間の後に登録とファイルをまとめて削除する"""
+        url = self.store.save(self.db, b"released")
+        path = self._age(url=url)
+        self.store.release(self.db, url)
+
+        report = self._collector().collect()
+
+        assert report["deleted"] == 1 and not path.exists()
+        assert self.db.query(models.ImageBlob).count() == 0
@@ -84,8 +84,9 @@ class TestImageGenerationIntegration:
         self.mock_image_generation_service.storage_path = Mock()
         self.mock_image_generation_service.storage_path.__str__ = Mock(return_value="static/agent_images")
         
-        # crud.get_messagesのモック
-        with patch('crud.get_messages', return_value=[]):
+        # crud.get_recent_messagesのモック
+        with patch('crud.get_recent_messages', return_value=[]), \
+             patch('crud.get_chat_summary', return_value=(None, None)):
             # crud.create_agent_imageのモック
             with patch('crud.create_agent_image') as mock_create_image:
                 # ファイル書き込みのモック
@@ -134,8 +135,9 @@ class TestImageGenerationIntegration:
         # 画像要求検出をFalseに設定
         self.mock_image_request_detector.detect_image_request.return_value = False
         
-        # crud.get_messagesのモック
-        with patch('crud.get_messages', return_value=[]):
+        # crud.get_recent_messagesのモック
+        with patch('crud.get_recent_messages', return_value=[]), \
+             patch('crud.get_chat_summary', return_value=(None, None)):
             # テスト実行
             result = await self.llm_service.generate_response(
                 db=self.mock_db,
@@ -180,8 +182,9 @@ class TestImageGenerationIntegration:
             side_effect=Exception("Image analysis error")
         )
         
-        # crud.get_messagesのモック
-        with patch('crud.get_messages', return_value=[]):
+        # crud.get_recent_messagesのモック
+        with patch('crud.get_recent_messages', return_value=[]), \
+             patch('crud.get_chat_summary', return_value=(None, None)):
             # テスト実行
             result = await self.llm_service.generate_response(
                 db=self.mock_db,
@@ -0,0 +1,78 @@
+import asyncio
+import base64
+import threading
+import time
+import pytest
+from io import BytesIO
+from PIL import Image
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import models
+from services.image_io import decode_and_verify_image, run_image_io
+from services.image_storage import ImageStore, LocalStorageDriver
+
+
+def _png_b64(size=(4, 3)) -> str:
+    buffer = BytesIO()
+    Image.new("RGB", size, (255, 0, 0)).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+class TestImageIO:
+    """画像のデコード・検証・ファイル入出力をイベントループの外で行う処理のテストクラス"""
+
+    def test_decode_and_verify_image(self):
+        """Base64の画像をデコードしてサイズを返し、壊れた画像はValueErrorにする"""
+        image_data, size = decode_and_verify_image(_png_b64())
+
+        assert size == (4, 3)
+        assert image_data.startswith(b"\x89PNG")
+        with pytest.raises(ValueError, match="Generated image is invalid"):
+            decode_and_verify_image(base64.b64encode(b"not an image").decode("utf-8"))
+
+    @pytest.mark.asyncio
+    async def test_blocking_work_does_not_stall_event_loop(self):
+        """専用のスレッドで実行し、その間も他のコルーチンが進む"""
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        def blocking():
+            time.sleep(0.2)
+            return threading.current_thread().name
+
+        task = asyncio.create_task(ticker())
+        try:
+            thread_name = await run_image_io(blocking)
+        finally:
+            task.cancel()
+
+        assert thread_name.startswith("image-io")
+        assert ticks >= 5
+
+    @pytest.mark.asyncio
+    async def test_save_async_writes_once(self, tmp_path):
+        """非同期の保存でも同じ内容の画像は1つのファイルを共有する"""
+        engine = create_engine(
+            "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+        )
+        models.Base.metadata.create_all(engine)
+        db = sessionmaker(bind=engine)()
+        store = ImageStore(LocalStorageDriver(tmp_path / "images"), legacy_dir=tmp_path / "agent_images")
+        try:
+            first = await store.save_async(db, b"image-bytes")
+            second = await store.save_async(db, b"image-bytes")
+            path = tmp_path / "images" / store.driver.key_for_url(first)
+            assert first == second and path.read_bytes() == b"image-bytes"
+
+            await store.release_async(db, first)
+            await store.release_async(db, second)
+            # 参照がなくなったファイルはGCが削除する
+            assert path.exists() and db.query(models.ImageBlob).one().ref_count == 0
+        finally:
+            db.close()
@@ -0,0 +1,359 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import crud
+import models
+import schemas
+from services.event_bus import EventBus, chat_topic, image_job_topic
+from services.image_job_queue import ImageJobQueue, ImageJobCancelledError
+from services.llm_clients.stable_diffusion_webui_client import ImageGenerationInterruptedError
+
+
+class StubImageService:
+    """ジョブごとに結果を返すテスト用の画像生成サービス"""
+
+    def __init__(self):
+        self.started = []
+        self.release = asyncio.Event()
+        self.fail = False
+        self.interrupted = False
+
+    async def run_job(self, db, job):
+        self.started.append(job.id)
+        await self.release.wait()
+        if self.fail:
+            raise Exception("provider error")
+        if self.interrupted:
+            raise ImageGenerationInterruptedError("interrupted in the WebUI")
+        return f"/static/{job.id}.png", job.id * 10
+
+
+class TestImageJobQueue:
+    """DBを待ち行列とする画像生成ワーカープールのテストクラス"""
+
+    def setup_method(self):
+        engine = create_engine(
+            "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+        )
+        models.Base.metadata.create_all(engine)
+        self.session_factory = sessionmaker(bind=engine)
+        self.db = self.session_factory()
+        self.user = models.User(email="user@example.com", hashed_password="x")
+        self.db.add(self.user)
+        self.db.commit()
+        self.agent = models.Agent(name="A", owner_id=self.user.id)
+        self.db.add(self.agent)
+        self.db.commit()
+        self.chat = models.Chat(user_id=self.user.id, agent_id=self.agent.id)
+        self.db.add(self.chat)
+        self.db.commit()
+        self.image_service = StubImageService()
+        self.event_bus = EventBus()
+
+    def teardown_method(self):
+        self.db.close()
+
+    def _queue(self, workers=1, **kwargs):
+        return ImageJobQueue(
+            self.image_service,
+            workers=workers,
+            poll_interval=0.01,
+            session_factory=self.session_factory,
+            event_bus=self.event_bus,
+            **kwargs,
+        )
+
+    def _enqueue(self, queue, kind="profile", priority=None, **kwargs):
+        return queue.enqueue(
+            self.db, kind=kind, agent_id=self.agent.id, user_id=self.user.id,
+            payload={}, priority=priority, **kwargs,
+        )
+
+    def test_claim_order_by_priority(self):
+        """優先度の高いジョブから、同じ優先度なら登録順に取り出す"""
+        queue = self._queue()
+        profile = self._enqueue(queue)
+        chat = self._enqueue(queue, kind="chat", priority=queue.CHAT_PRIORITY)
+
+        first = crud.claim_image_job(self.db, "worker-1")
+        second = crud.claim_image_job(self.db, "worker-2")
+
+        assert (first.id, second.id) == (chat.id, profile.id)
+        assert first.status == "running" and first.attempts == 1 and first.worker_id == "worker-1"
+        assert crud.claim_image_job(self.db, "worker-3") is None
+
+    def test_stale_jobs_are_requeued_until_attempts_run_out(self):
+        """生存時刻が途絶えたジョブは待ち行列に戻し、試行回数を使い切ったら失敗にする"""
+        queue = self._queue(max_attempts=2)
+        job = self._enqueue(queue)
+        crud.claim_image_job(self.db, "dead-worker")
+        stale_before = datetime.utcnow() + timedelta(seconds=1)
+
+        assert crud.requeue_stale_image_jobs(self.db, stale_before) == 1
+        self.db.refresh(job)
+        assert job.status == "queued" and job.worker_id is None
+
+        crud.claim_image_job(self.db, "dead-worker")
+        crud.requeue_stale_image_jobs(self.db, stale_before)
+        self.db.refresh(job)
+        assert job.status == "failed"
+
+    @pytest.mark.asyncio
+    async def test_worker_completes_job_and_wakes_waiter(self):
+        """ワーカーが生成した結果を、待っているリクエストが受け取る"""
+        queue = self._queue()
+        await queue.start()
+        try:
+            job = self._enqueue(queue)
+            waiter = asyncio.create_task(queue.wait_for(job.id))
+            self.image_service.release.set()
+            image_url, seed = await asyncio.wait_for(waiter, timeout=1)
+        finally:
+            await queue.stop()
+
+        assert (image_url, seed) == (f"/static/{job.id}.png", job.id * 10)
+        self.db.refresh(job)
+        assert job.status == "completed" and job.result_url == image_url
+
+    @pytest.mark.asyncio
+    async def test_workers_limit_concurrency(self):
+        """同時に生成するジョブの数はワーカー数までに制限される"""
+        queue = self._queue(workers=2)
+        await queue.start()
+        try:
+            for _ in range(3):
+                self._enqueue(queue)
+            await asyncio.sleep(0.1)
+            assert len(self.image_service.started) == 2
+            assert queue.stats()["queued"] == 1
+        finally:
+            await queue.stop()
+
+    @pytest.mark.asyncio
+    async def test_failed_job_raises_for_waiter(self):
+        """生成に失敗したジョブは失敗として記録され、待っている側には例外が届く"""
+        queue = self._queue()
+        self.image_service.fail = True
+        await queue.start()
+        try:
+            job = self._enqueue(queue)
+            self.image_service.release.set()
+            with pytest.raises(Exception, match="provider error"):
+                await asyncio.wait_for(queue.wait_for(job.id), timeout=1)
+        finally:
+            await queue.stop()
+
+        self.db.refresh(job)
+        assert job.status == "failed" and job.error == "provider error"
+
+    @pytest.mark.asyncio
+    async def test_cancel_queued_job(self):
+        """実行前のジョブを取り消すと、待っている側にはキャンセルが届く"""
+        queue = self._queue()
+        job = self._enqueue(queue)
+        waiter = asyncio.create_task(queue.wait_for(job.id))
+        await asyncio.sleep(0)
+
+        assert queue.cancel(job.id) is True
+        with pytest.raises(ImageJobCancelledError):
+            await asyncio.wait_for(waiter, timeout=1)
+
+    @pytest.mark.asyncio
+    async def test_cancel_running_job_from_another_process(self):
+        """別のプロセスから取り消しを依頼された実行中のジョブは、実行中のワーカーが取り消す"""
+        queue = self._queue(cancel_poll_interval=0.01)
+        other_process = self._queue()
+        await queue.start()
+        try:
+            job = self._enqueue(queue)
+            waiter = asyncio.create_task(queue.wait_for(job.id))
+            await asyncio.sleep(0.05)
+
+            assert other_process.cancel(job.id) is True
+            assert crud.get_image_job_status(self.db, job.id) == "cancelling"
+            with pytest.raises(ImageJobCancelledError):
+                await asyncio.wait_for(waiter, timeout=1)
+        finally:
+            await queue.stop()
+
+        self.db.refresh(job)
+        assert job.status == "cancelled" and queue.stats()["cancelled_in_process"] == 1
+
+    @pytest.mark.asyncio
+    async def test_interrupted_render_is_cancelled_not_completed(self):
+        """WebUI側で中断された生成は、途中の画像を結果にせず取り消しとして記録する"""
+        queue = self._queue()
+        self.image_service.interrupted = True
+        await queue.start()
+        try:
+            job = self._enqueue(queue)
+            self.image_service.release.set()
+            with pytest.raises(ImageJobCancelledError):
+                await asyncio.wait_for(queue.wait_for(job.id), timeout=1)
+        finally:
+            await queue.stop()
+
+        self.db.refresh(job)
+        assert job.status == "cancelled" and job.result_url is None
+
+    def test_supersede_cancels_active_jobs_of_same_chat(self):
+        """新しい依頼は、同じチャットの待機中・実行中のジョブを置き換える"""
+        other_chat = models.Chat(user_id=self.user.id, agent_id=self.agent.id)
+        self.db.add(other_chat)
+        self.db.commit()
+        queue = self._queue()
+        running = self._enqueue(queue, kind="chat", chat_id=self.chat.id)
+        crud.claim_image_job(self.db, "worker-in-another-process")
+        old = self._enqueue(queue, kind="chat", chat_id=self.chat.id)
+        kept = self._enqueue(queue, kind="chat", chat_id=other_chat.id)
+
+        new = self._enqueue(queue, kind="chat", chat_id=self.chat.id, supersede=True)
+
+        for job in (old, running, kept, new):
+            self.db.refresh(job)
+        assert (old.status, running.status) == ("cancelled", "cancelling")
+        assert (kept.status, new.status) == ("queued", "queued")
+
+    @pytest.mark.asyncio
+    async def test_stop_returns_running_job_to_queue(self):
+        """停止時に実行中だったジョブは待ち行列に戻される"""
+        queue = self._queue()
+        await queue.start()
+        job = self._enqueue(queue)
+        await asyncio.sleep(0.05)
+        await queue.stop()
+
+        self.db.refresh(job)
+        assert job.status == "queued" and job.attempts == 1
+
+    @pytest.mark.asyncio
+    async def test_unwatched_chat_job_updates_pending_reply(self):
+        """待っているリクエストがないチャット画像は、ワーカーが返信に反映して通知する"""
+        user_message = crud.create_message(
+            self.db, schemas.MessageCreate(content="写真を見せて"), chat_id=self.chat.id, sender="user"
+        )
+        reply = crud.create_message(
+            self.db, schemas.MessageCreate(content="どうぞ"), chat_id=self.chat.id, sender="ai",
+            image_status="pending",
+        )
+        queue = self._queue()
+        with self.event_bus.subscribe(chat_topic(self.chat.id)) as events:
+            await queue.start()
+            try:
+                job = self._enqueue(
+                    queue, kind="chat", priority=queue.CHAT_PRIORITY,
+                    chat_id=self.chat.id, message_id=user_message.id,
+                )
+                self.image_service.release.set()
+                # チャットのトピックには進捗イベントも流れる
+                event = await asyncio.wait_for(events.get(), timeout=1)
+                while event["type"] != "message_updated":
+                    event = await asyncio.wait_for(events.get(), timeout=1)
+            finally:
+                await queue.stop()
+
+        assert event["id"] == reply.id
+        assert event["image_url"] == f"/static/{job.id}.png"
+        self.db.refresh(reply)
+        assert (reply.image_url, reply.image_status) == (f"/static/{job.id}.png", "completed")
+
+
+class TestImageJobProgress:
+    """画像生成ジョブの進捗配信のテストクラス"""
+
+    def setup_method(self):
+        engine = create_engine(
+            "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+        )
+        models.Base.metadata.create_all(engine)
+        self.session_factory = sessionmaker(bind=engine)
+        self.db = self.session_factory()
+        self.user = models.User(email="user@example.com", hashed_password="x")
+        self.db.add(self.user)
+        self.db.commit()
+        self.agent = models.Agent(name="A", owner_id=self.user.id)
+        self.db.add(self.agent)
+        self.db.commit()
+        self.image_service = StubImageService()
+        self.event_bus = EventBus()
+        self.queue = ImageJobQueue(
+            self.image_service, workers=1, poll_interval=0.01, session_factory=self.session_factory,
+            event_bus=self.event_bus, progress_interval=60,
+        )
+
+    def teardown_method(self):
+        self.db.close()
+
+    def _enqueue(self):
+        return self.queue.enqueue(self.db, kind="profile", agent_id=self.agent.id, user_id=self.user.id, payload={})
+
+    @pytest.mark.asyncio
+    async def test_enqueue_reports_queue_position(self):
+        """登録時に待ち順を配信し、前のジョブが取り出されると繰り上がる"""
+        first = self._enqueue()
+        with self.event_bus.subscribe(image_job_topic(first.id + 1)) as events:
+            second = self._enqueue()
+            assert events.get_nowait()["queue_position"] == 2
+
+            await self.queue.start()
+            try:
+                event = await asyncio.wait_for(events.get(), timeout=1)
+            finally:
+                await self.queue.stop()
+
+        assert (event["job_id"], event["status"], event["queue_position"]) == (second.id, "queued", 1)
+
+    @pytest.mark.asyncio
+    async def test_progress_is_throttled_with_eta(self):
+        """進捗は progress_interval に1回までに間引き、残り時間を見積もる"""
+        job = self._enqueue()
+        await self.queue.start()
+        try:
+            with self.event_bus.subscribe(image_job_topic(job.id)) as events:
+                while (await asyncio.wait_for(events.get(), timeout=1))["status"] != "running":
+                    pass
+                self.queue.report_progress(job.id, 25.0)
+                self.queue.report_progress(job.id, 50.0, eta=3.0)
+                event = events.get_nowait()
+                assert events.empty()
+        finally:
+            self.image_service.release.set()
+            await self.queue.stop()
+
+        assert (event["status"], event["progress"]) == ("running", 25.0)
+        assert event["eta"] is not None and event["eta"] >= 0
+
+    @pytest.mark.asyncio
+    async def test_watch_ends_with_terminal_event(self):
+        """watch はジョブが終わるまでイベントを返し、完了イベントで終わる"""
+        job = self._enqueue()
+        await self.queue.start()
+        try:
+            self.image_service.release.set()
+            statuses = []
+            async for event in self.queue.watch(job.id, poll_interval=0.05):
+                if event is not None:
+                    statuses.append(event["status"])
+        finally:
+            await self.queue.stop()
+
+        assert statuses[0] in ("queued", "running")
+        assert statuses[-1] == "completed"
+
+    @pytest.mark.asyncio
+    async def test_watch_falls_back_to_database(self):
+        """他のプロセスで処理されたジョブも、DBの記録から終了を検知する"""
+        job = self._enqueue()
+        crud.claim_image_job(self.db, "other-process")
+        crud.save_image_job_log(self.db, job.id, {"progress": 40.0, "eta": 12.0})
+        events = self.queue.watch(job.id, poll_interval=0.01)
+
+        first = await events.__anext__()
+        crud.finish_image_job(self.db, job.id, "completed", result_url="/static/x.png", result_seed=1)
+        rest = [event async for event in events if event is not None]
+
+        assert (first["status"], first["progress"], first["eta"]) == ("running", 40.0, 12.0)
+        assert [(event["status"], event["image_url"]) for event in rest] == [("completed", "/static/x.png")]
@@ -0,0 +1,246 @@
+import asyncio
+import pytest
+from unittest.mock import Mock, AsyncMock, patch
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import models
+from services.event_bus import EventBus, chat_topic
+from services.image_jobs import ImageJobTracker
+from services.llm_service import LLMService
+from services.prompt_builder import PromptBuilder
+from services.error_handler import ErrorHandler
+from services.image_request_detector import ImageRequestDetector
+from services.image_prompt_analyzer import ImagePromptAnalyzer
+from services.image_generation_service import ImageGenerationService
+from models import Agent
+
+
+class TestEventBus:
+    """プロセス内イベントバスのテストクラス"""
+
+    @pytest.mark.asyncio
+    async def test_publish_to_subscribers_of_topic(self):
+        """同じトピックの購読者だけにイベントが届く"""
+        bus = EventBus()
+        with bus.subscribe(chat_topic(1)) as events, bus.subscribe(chat_topic(2)) as other:
+            assert bus.publish(chat_topic(1), {"type": "message_updated", "id": 3}) == 1
+            assert events.get_nowait() == {"type": "message_updated", "id": 3}
+            assert other.empty()
+        assert bus.subscriber_count(chat_topic(1)) == 0
+
+    @pytest.mark.asyncio
+    async def test_full_queue_drops_oldest_event(self):
+        """購読者のキューがあふれた場合は古いイベントから捨てる"""
+        bus = EventBus(max_queue=2)
+        with bus.subscribe("t") as events:
+            for i in range(3):
+                bus.publish("t", {"type": "x", "id": i})
+            assert [events.get_nowait()["id"] for _ in range(2)] == [1, 2]
+
+
+class TestImageJobTracker:
+    """応答後に届ける画像の追跡のテストクラス"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される"""
+        self.bus = EventBus()
+        self.session = Mock()
+        self.tracker = ImageJobTracker(self.bus, session_factory=lambda: self.session)
+
+    async def _run_job(self, coro):
+        with patch('crud.update_message_image') as mock_update:
+            with self.bus.subscribe(chat_topic(7)) as events:
+                job = self.tracker.submit(asyncio.create_task(coro), chat_id=7, message_id=42)
+                assert self.tracker.stats()["pending"] == 1
+                await job
+                event = events.get_nowait()
+        return mock_update, event
+
+    @pytest.mark.asyncio
+    async def test_completed_image_updates_message_and_notifies(self):
+        """画像が完成したらメッセージを更新し、message_updatedを配信する"""
+        async def generate():
+            return "/static/agent_images/a.png"
+
+        mock_update, event = await self._run_job(generate())
+
+        mock_update.assert_called_once_with(
+            self.session, 42, image_url="/static/agent_images/a.png", image_status="completed"
+        )
+        self.session.close.assert_called_once()
+        assert event == {
+            "type": "message_updated",
+            "id": 42,
+            "chat_id": 7,
+            "image_url": "/static/agent_images/a.png",
+            "image_status": "completed",
+        }
+        assert self.tracker.stats()["pending"] == 0
+
+    @pytest.mark.asyncio
+    async def test_failed_image_marks_message_failed(self):
+        """画像生成に失敗した場合はfailedとして通知する"""
+        async def generate():
+            raise Exception("WebUI error")
+
+        mock_update, event = await self._run_job(generate())
+
+        mock_update.assert_called_once_with(self.session, 42, image_url=None, image_status="failed")
+        assert event["image_status"] == "failed"
+
+    @pytest.mark.asyncio
+    async def test_cancelled_image_marks_message_cancelled(self):
+        """利用者が取り消した画像生成はcancelledとして通知する"""
+        started = asyncio.Event()
+
+        async def generate():
+            started.set()
+            await asyncio.Event().wait()
+
+        with patch('crud.update_message_image') as mock_update:
+            with self.bus.subscribe(chat_topic(7)) as events:
+                job = self.tracker.submit(asyncio.create_task(generate()), chat_id=7, message_id=42)
+                await started.wait()
+                assert self.tracker.cancel(42, chat_id=8) is False
+                assert self.tracker.cancel(42, chat_id=7) is True
+                await job
+                event = events.get_nowait()
+
+        mock_update.assert_called_once_with(self.session, 42, image_url=None, image_status="cancelled")
+        assert event["image_status"] == "cancelled"
+        assert self.tracker.cancel(42) is False
+
+    @pytest.mark.asyncio
+    async def test_cancel_unwatched_only_without_subscribers(self):
+        """切断後に再接続されたチャットの画像は取り消さず、誰も見ていなければ取り消す"""
+        async def generate():
+            await asyncio.Event().wait()
+
+        with patch('crud.update_message_image'):
+            job = self.tracker.submit(asyncio.create_task(generate()), chat_id=7, message_id=42)
+            with self.bus.subscribe(chat_topic(7)):
+                assert await self.tracker.cancel_unwatched(7, delay=0) == 0
+            assert await self.tracker.cancel_unwatched(7, delay=0) == 1
+            await job
+        assert self.tracker.stats()["pending"] == 0
+
+
+class TestDeferredImage:
+    """画像の完成を待たずに応答を返すテストクラス"""
+
+    @pytest.mark.asyncio
+    async def test_reply_is_returned_before_image(self):
+        """defer_image=Trueでは応答をすぐに返し、画像はimage_taskで後から届く"""
+        finish = asyncio.Event()
+
+        async def generate_image_in_chat(db, **kwargs):
+            await finish.wait()
+            return "/static/agent_images/late.png", 1
+
+        detector = Mock(spec=ImageRequestDetector)
+        detector.detect_image_request.return_value = True
+        detector.extract_image_context.return_value = None
+        detector.get_image_type_hint.return_value = "portrait"
+        analyzer = Mock(spec=ImagePromptAnalyzer)
+        analyzer.analyze_and_build_prompt = AsyncMock(return_value={"prompt": "portrait", "negative_prompt": "", "metadata": {}})
+        image_service = Mock(spec=ImageGenerationService)
+        image_service.generate_image_in_chat = AsyncMock(side_effect=generate_image_in_chat)
+        prompt_builder = Mock(spec=PromptBuilder)
+        prompt_builder.build = AsyncMock(return_value="test prompt")
+        llm_client = Mock()
+        llm_client.generate = AsyncMock(return_value={"content": "撮ってくるね", "model": "test-model"})
+        llm_client.validate_response = AsyncMock(return_value=True)
+        image_db = Mock()
+
+        service = LLMService(
+            prompt_builder=prompt_builder,
+            llm_client=llm_client,
+            error_handler=Mock(spec=ErrorHandler),
+            image_request_detector=detector,
+            image_prompt_analyzer=analyzer,
+            image_generation_service=image_service,
+            speculative_image=True,
+            session_factory=lambda: image_db,
+        )
+        with patch('crud.get_recent_messages', return_value=[]), \
+             patch('crud.get_chat_summary', return_value=(None, None)):
+            result = await asyncio.wait_for(service.generate_response(
+                db=Mock(), message="写真を見せて", agent=Agent(id=1, name="テスト"),
+                chat_id=1, user_message_id=5, defer_image=True,
+            ), timeout=1)
+
+        assert result["content"] == "撮ってくるね"
+        assert result["image_url"] is None
+        assert result["metadata"]["image_pending"] is True
+        assert not result["image_task"].done()
+
+        finish.set()
+        assert await result["image_task"] == "/static/agent_images/late.png"
+        await asyncio.sleep(0)
+        # 画像生成は応答後も使える専用のセッションで行い、終了後に閉じる
+        assert image_service.generate_image_in_chat.call_args.kwargs["db"] is image_db
+        image_db.close.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_image_resolves_after_request_session_is_closed(self):
+        """リクエストのセッションが閉じた後も、画像用のセッションで読み直したエージェントで生成する"""
+        finish = asyncio.Event()
+        seen = []
+
+        async def generate_image_in_chat(db, agent, **kwargs):
+            await finish.wait()
+            seen.append((agent.name, agent.image_url))
+            return "/static/agent_images/late.png", 1
+
+        engine = create_engine(
+            "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+        )
+        models.Base.metadata.create_all(engine)
+        session_factory = sessionmaker(bind=engine)
+        request_db = session_factory()
+        user = models.User(email="user@example.com", hashed_password="x")
+        request_db.add(user)
+        request_db.commit()
+        agent = models.Agent(name="テスト", owner_id=user.id, image_url="/static/agent_images/a.png")
+        request_db.add(agent)
+        request_db.commit()
+
+        detector = Mock(spec=ImageRequestDetector)
+        detector.detect_image_request.return_value = True
+        detector.extract_image_context.return_value = None
+        detector.get_image_type_hint.return_value = "portrait"
+        analyzer = Mock(spec=ImagePromptAnalyzer)
+        analyzer.analyze_and_build_prompt = AsyncMock(return_value={"prompt": "portrait", "negative_prompt": "", "metadata": {}})
+        image_service = Mock(spec=ImageGenerationService)
+        image_service.generate_image_in_chat = AsyncMock(side_effect=generate_image_in_chat)
+        prompt_builder = Mock(spec=PromptBuilder)
+        prompt_builder.build = AsyncMock(return_value="test prompt")
+        llm_client = Mock()
+        llm_client.generate = AsyncMock(return_value={"content": "撮ってくるね", "model": "test-model"})
+        llm_client.validate_response = AsyncMock(return_value=True)
+
+        service = LLMService(
+            prompt_builder=prompt_builder,
+            llm_client=llm_client,
+            error_handler=Mock(spec=ErrorHandler),
+            image_request_detector=detector,
+            image_prompt_analyzer=analyzer,
+            image_generation_service=image_service,
+            speculative_image=True,
+            session_factory=session_factory,
+        )
+        with patch('crud.get_recent_messages', return_value=[]), \
+             patch('crud.get_chat_summary', return_value=(None, None)):
+            result = await asyncio.wait_for(service.generate_response(
+                db=request_db, message="写真を見せて", agent=agent,
+                chat_id=1, user_message_id=5, defer_image=True,
+            ), timeout=1)
+
+        # 応答の保存でコミットされ、RESTではリクエストの終了時にセッションが閉じられる
+        request_db.commit()
+        request_db.close()
+        finish.set()
+
+        assert await result["image_task"] == "/static/agent_images/late.png"
+        assert seen == [("テスト", "/static/agent_images/a.png")]
@@ -0,0 +1,230 @@
+import os
+import uuid
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import crud
+import models
+from migrate_image_storage import migrate_legacy_images
+from services.image_generation_service import ImageGenerationService
+from services.image_storage import ImageStore, LocalStorageDriver, S3StorageDriver
+from services.render_cache import RenderResultCache
+
+
+class TestImageStore:
+    """内容アドレスで重複を排除する画像保存のテストクラス"""
+
+    def setup_method(self):
+        engine = create_engine(
+            "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+        )
+        models.Base.metadata.create_all(engine)
+        self.db = sessionmaker(bind=engine)()
+
+    def teardown_method(self):
+        self.db.close()
+
+    def _store(self, tmp_path):
+        return ImageStore(LocalStorageDriver(tmp_path / "images"), legacy_dir=tmp_path / "agent_images")
+
+    def test_same_content_is_stored_once(self, tmp_path):
+        """同じ内容の画像は1つのファイルを共有し、参照数が増える"""
+        store = self._store(tmp_path)
+
+        first = store.save(self.db, b"image-bytes")
+        second = store.save(self.db, b"image-bytes")
+        other = store.save(self.db, b"other-bytes")
+
+        assert first == second != other
+        assert first.startswith("/static/images/") and first.endswith(".png")
+        blob = self.db.query(models.ImageBlob).filter_by(storage_key=store.driver.key_for_url(first)).one()
+        assert blob.ref_count == 2 and blob.size == len(b"image-bytes")
+        # ハッシュの先頭2文字ずつで2段に分ける
+        key = blob.storage_key
+        assert key.split("/")[:2] == [blob.sha256[:2], blob.sha256[2:4]]
+        assert (tmp_path / "images" / key).read_bytes() == b"image-bytes"
+        assert len(list((tmp_path / "images").rglob("*.png"))) == 2
+
+    def test_released_file_is_left_for_gc_and_reused(self, tmp_path):
+        """最後の参照を解放してもファイルは消さず、直後に同じ内容を保存すると登録ごと再利用する"""
+        store = self._store(tmp_path)
+        url = store.save(self.db, b"image-bytes")
+        store.save(self.db, b"image-bytes")
+        path = tmp_path / "images" / store.driver.key_for_url(url)
+
+        store.release(self.db, url)
+        store.release(self.db, f"http://localhost:8000{url}")
+        blob = self.db.query(models.ImageBlob).one()
+        assert blob.ref_count == 0 and path.exists()
+
+        assert store.save(self.db, b"image-bytes") == url
+        self.db.refresh(blob)
+        assert blob.ref_count == 1 and path.read_bytes() == b"image-bytes"
+
+    def test_release_legacy_image_is_left_for_gc(self, tmp_path):
+        """移行前のフラットなディレクトリの画像も解放時には削除せず、GCのマークに任せる"""
+        store = self._store(tmp_path)
+        legacy = tmp_path / "agent_images" / "old.png"
+        legacy.parent.mkdir()
+        legacy.write_bytes(b"old")
+
+        store.release(self.db, "http://localhost:8000/static/agent_images/old.png")
+
+        assert legacy.exists()
+
+    def test_s3_urls_map_back_to_keys(self):
+        """オブジェクトストレージのURLからキーを取り出せる（別の保存先のURLはNone）"""
+        driver = S3StorageDriver(bucket="images", public_url="https://cdn.example.com/", prefix="agents", client=object())
+
+        url = driver.url("ab/cd/abcd.png")
+
+        assert url == "https://cdn.example.com/agents/ab/cd/abcd.png"
+        assert driver.key_for_url(url) == "ab/cd/abcd.png"
+        assert driver.key_for_url("/static/images/ab/cd/abcd.png") is None
+
+
+class CountingImageClient:
+    """呼び出しごとに違う画像を返すテスト用の画像生成クライアント"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def generate_image_async(self, prompt, negative_prompt="", progress_callback=None, seed=None, **kwargs):
+        self.calls += 1
+        return f"{prompt}:{self.calls}".encode("utf-8"), self.calls
+
+
+class TestImageReleaseOnGeneration:
+    """画像生成で参照中の画像を解放しないことのテストクラス"""
+
+    @pytest.fixture(autouse=True)
+    def setup_service(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        engine = create_engine(
+            "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+        )
+        models.Base.metadata.create_all(engine)
+        self.db = sessionmaker(bind=engine)()
+        self.service = ImageGenerationService()
+        self.service.client = CountingImageClient()
+        self.service.image_store = ImageStore(LocalStorageDriver(tmp_path / "images"), legacy_dir=tmp_path / "agent_images")
+        self.service.render_cache = RenderResultCache(tmp_path / "render_cache", max_bytes=0)
+        user = models.User(email="user@example.com", hashed_password="x")
+        self.db.add(user)
+        self.db.commit()
+        self.agent = models.Agent(name="A", owner_id=user.id)
+        self.db.add(self.agent)
+        self.db.commit()
+        self.chat = models.Chat(user_id=user.id, agent_id=self.agent.id)
+        self.db.add(self.chat)
+        self.db.commit()
+        yield
+        self.db.close()
+
+    async def _generate_profile(self, force_regenerate=False):
+        return await self.service._generate_profile_image(
+            self.db, self.agent.id, self.agent.owner_id, force_regenerate=force_regenerate
+        )
+
+    @pytest.mark.asyncio
+    async def test_chat_image_keeps_profile_image(self):
+        """チャットでの画像生成の後も、プロフィール画像のファイルと参照が残る"""
+        profile_url, _ = await self._generate_profile()
+        message = models.Message(chat_id=self.chat.id, content="photo", sender="ai")
+        self.db.add(message)
+        self.db.commit()
+
+        await self.service._generate_image_in_chat_internal(
+            db=self.db, agent=self.agent, prompt="selfie", user_message="写真を見せて",
+            keywords="selfie", message_id=message.id, force_regenerate=True,
+        )
+
+        self.db.refresh(self.agent)
+        assert self.agent.image_url == profile_url
+        assert self.service.image_store.load(self.agent.image_url) == b"%s:1" % self.service._generate_prompt(self.agent).encode("utf-8")
+        key = self.service.image_store.driver.key_for_url(profile_url)
+        assert crud.get_image_blob_by_key(self.db, key).ref_count == 1
+
+    @pytest.mark.asyncio
+    async def test_regenerated_profile_keeps_gallery_image(self):
+        """再生成の前のプロフィール画像はギャラリーに残るため、参照を解放しない"""
+        old_url, _ = await self._generate_profile()
+        new_url, _ = await self._generate_profile(force_regenerate=True)
+
+        assert new_url != old_url
+        assert [image.image_url for image in crud.get_agent_images(self.db, self.agent.id)] == [new_url, old_url]
+        key = self.service.image_store.driver.key_for_url(old_url)
+        assert crud.get_image_blob_by_key(self.db, key).ref_count == 1
+        assert self.service.image_store.load(old_url) is not None
+
+
+class TestImageStorageMigration:
+    """移行前の画像を内容アドレスの保存先へ移すスクリプトのテストクラス"""
+
+    def setup_method(self):
+        engine = create_engine(
+            "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+        )
+        models.Base.metadata.create_all(engine)
+        self.db = sessionmaker(bind=engine)()
+        user = models.User(email="user@example.com", hashed_password="x")
+        self.db.add(user)
+        self.db.commit()
+        self.agent = models.Agent(
+            name="A", owner_id=user.id, image_url="http://localhost:8000/static/agent_images/a.png"
+        )
+        self.db.add(self.agent)
+        self.db.commit()
+        self.gallery = crud.create_agent_image(self.db, agent_id=self.agent.id, image_url="/static/agent_images/a.png")
+
+    def teardown_method(self):
+        self.db.close()
+
+    def test_migrate_rewrites_urls_and_counts_references(self, tmp_path):
+        """参照している行のURLを書き換え、参照数を行数に合わせる"""
+        legacy_dir = tmp_path / "agent_images"
+        legacy_dir.mkdir()
+        (legacy_dir / "a.png").write_bytes(b"image-a")
+        (legacy_dir / "orphan.png").write_bytes(b"orphan")
+        store = ImageStore(LocalStorageDriver(tmp_path / "images"), legacy_dir=legacy_dir)
+
+        dry_run = migrate_legacy_images(self.db, store, legacy_dir=legacy_dir, dry_run=True)
+        assert (dry_run["migrated"], dry_run["rows"], dry_run["unreferenced"]) == (1, 2, 1)
+        assert self.db.query(models.ImageBlob).count() == 0
+
+        migrate_legacy_images(self.db, store, legacy_dir=legacy_dir, delete_originals=True)
+        self.db.refresh(self.agent)
+        self.db.refresh(self.gallery)
+
+        blob = self.db.query(models.ImageBlob).one()
+        assert blob.ref_count == 2
+        assert self.agent.image_url == f"http://localhost:8000/static/images/{blob.storage_key}"
+        assert self.gallery.image_url == f"/static/images/{blob.storage_key}"
+        assert not (legacy_dir / "a.png").exists() and (legacy_dir / "orphan.png").exists()
+
+
+@pytest.mark.skipif(not os.getenv("S3_TEST_ENDPOINT_URL"), reason="S3_TEST_ENDPOINT_URL is not set")
+class TestS3StorageDriver:
+    """S3互換ストレージ（MinIOなど）への保存のテストクラス"""
+
+    def test_put_get_delete(self):
+        """オブジェクトを保存・取得・削除できる"""
+        pytest.importorskip("boto3")
+        driver = S3StorageDriver(
+            bucket=os.getenv("S3_TEST_BUCKET", "test-images"),
+            public_url=os.getenv("S3_TEST_ENDPOINT_URL"),
+            endpoint_url=os.getenv("S3_TEST_ENDPOINT_URL"),
+            prefix=f"test-{uuid.uuid4().hex}",
+            region=os.getenv("S3_REGION", "us-east-1"),
+            access_key_id=os.getenv("S3_ACCESS_KEY_ID"),
+            secret_access_key=os.getenv("S3_SECRET_ACCESS_KEY"),
+        )
+
+        driver.put("ab/cd/test.png", b"image-bytes", content_type="image/png")
+        try:
+            assert driver.exists("ab/cd/test.png")
+            assert driver.get("ab/cd/test.png") == b"image-bytes"
+        finally:
+            driver.delete("ab/cd/test.png")
+        assert not driver.exists("ab/cd/test.png")
@@ -0,0 +1,126 @@
+import asyncio
+import pytest
+from io import BytesIO
+from PIL import Image
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import crud
+import models
+import schemas
+from services.event_bus import EventBus
+from services.image_storage import ImageStore, LocalStorageDriver
+from services.image_variants import (
+    AGENT_IMAGE, MESSAGE_IMAGE, ImageVariantWorker, render_variants, request_variants, variant_urls,
+)
+
+
+def _png(size=(400, 300)) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", size, (0, 128, 255)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class TestImageVariants:
+    """画像の縮小版とぼかしプレースホルダーの作成のテストクラス"""
+
+    @pytest.fixture(autouse=True)
+    def setup_db(self, tmp_path):
+        engine = create_engine(
+            "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+        )
+        models.Base.metadata.create_all(engine)
+        self.session_factory = sessionmaker(bind=engine)
+        self.db = self.session_factory()
+        user = models.User(email="user@example.com", hashed_password="x")
+        self.db.add(user)
+        self.db.commit()
+        self.agent = models.Agent(name="A", owner_id=user.id)
+        self.db.add(self.agent)
+        self.db.commit()
+        self.chat = models.Chat(user_id=user.id, agent_id=self.agent.id)
+        self.db.add(self.chat)
+        self.db.commit()
+        self.store = ImageStore(LocalStorageDriver(tmp_path / "images"), legacy_dir=tmp_path / "agent_images")
+        self.worker = ImageVariantWorker(
+            self.store, widths=[160, 320, 640], session_factory=self.session_factory
+        )
+        yield
+        self.db.close()
+
+    def test_render_variants(self):
+        """元の幅より小さい幅と元の幅のWebP、縦横比を保った小さなプレースホルダーを作る"""
+        size, outputs, placeholder = render_variants(_png(), [160, 320, 640])
+
+        assert size == (400, 300)
+        assert sorted(outputs) == [160, 320, 400]
+        with Image.open(BytesIO(outputs[160])) as image:
+            assert (image.format, image.size) == ("WEBP", (160, 120))
+        with Image.open(BytesIO(placeholder)) as image:
+            assert image.size == (16, 12)
+
+    @pytest.mark.asyncio
+    async def test_process_records_variants_once(self):
+        """縮小版を保存して記録し、処理済みの画像は作り直さない"""
+        image_url = await self.store.save_async(self.db, _png())
+        db_image = crud.create_agent_image(self.db, agent_id=self.agent.id, image_url=image_url)
+
+        variants = await self.worker.process(self.db, AGENT_IMAGE, db_image.id)
+
+        self.db.refresh(db_image)
+        assert db_image.variants == variants
+        assert (variants["width"], variants["height"]) == (400, 300)
+        assert list(variants["srcset"]) == ["160", "320", "400"]
+        assert all(url.endswith(".webp") for url in variant_urls(variants))
+        assert variants["placeholder"].startswith("data:image/webp;base64,")
+        assert schemas.AgentImage.model_validate(db_image).variants["srcset"]["160"] == variants["srcset"]["160"]
+        assert await self.worker.process(self.db, AGENT_IMAGE, db_image.id) is None
+
+    @pytest.mark.asyncio
+    async def test_missing_source_is_recorded_as_failed(self):
+        """元の画像が読めない場合は失敗を記録し、繰り返し処理しない"""
+        db_image = crud.create_agent_image(self.db, agent_id=self.agent.id, image_url="https://example.com/a.png")
+
+        variants = await self.worker.process(self.db, AGENT_IMAGE, db_image.id)
+
+        assert "error" in variants and self.worker.failed == 1
+        assert crud.get_image_ids_without_variants(self.db, AGENT_IMAGE) == []
+
+    @pytest.mark.asyncio
+    async def test_backfill_covers_agent_and_message_images(self):
+        """縮小版がまだないギャラリー画像とチャット画像をまとめて処理する"""
+        image_url = await self.store.save_async(self.db, _png())
+        crud.create_agent_image(self.db, agent_id=self.agent.id, image_url=image_url)
+        message = crud.create_message(
+            self.db, schemas.MessageCreate(content="どうぞ"), chat_id=self.chat.id, sender="ai", image_url=image_url
+        )
+        crud.create_message(self.db, schemas.MessageCreate(content="こんにちは"), chat_id=self.chat.id, sender="user")
+
+        assert await self.worker.backfill(self.db, batch_size=1) == 2
+
+        self.db.refresh(message)
+        assert message.variants["srcset"]["160"].endswith(".webp")
+        assert crud.get_image_ids_without_variants(self.db, MESSAGE_IMAGE) == []
+
+    @pytest.mark.asyncio
+    async def test_worker_handles_requests_from_event_bus(self):
+        """保存時の依頼を受け取り、バックグラウンドで縮小版を作る"""
+        event_bus = EventBus()
+        self.worker.event_bus = event_bus
+        image_url = await self.store.save_async(self.db, _png())
+        db_image = crud.create_agent_image(self.db, agent_id=self.agent.id, image_url=image_url)
+
+        self.worker.start()
+        try:
+            await asyncio.sleep(0)
+            request_variants(event_bus, AGENT_IMAGE, db_image.id)
+            for _ in range(100):
+                self.db.refresh(db_image)
+                if db_image.variants and "srcset" in db_image.variants:
+                    break
+                await asyncio.sleep(0.02)
+        finally:
+            await self.worker.stop()
+
+        assert self.worker.processed == 1
+        assert list(db_image.variants["srcset"]) == ["160", "320", "400"]
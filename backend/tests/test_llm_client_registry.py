@@ -0,0 +1,43 @@
+import pytest
+from unittest.mock import Mock
+from services.llm_clients.registry import LLMClientRegistry
+
+
+class TestLLMClientRegistry:
+    """LLMClientRegistryのテストクラス"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される"""
+        self.registry = LLMClientRegistry(default_provider="stub", default_model="stub-model")
+        self.factory = Mock(side_effect=lambda model: Mock(name=f"client-{model}"))
+        self.registry.register_factory("stub", self.factory)
+
+    def test_get_returns_shared_instance(self):
+        """同じプロバイダー/モデルでは同一インスタンスが返されることのテスト"""
+        first = self.registry.get()
+        second = self.registry.get("stub", "stub-model")
+
+        assert first is second
+        self.factory.assert_called_once_with("stub-model")
+
+    def test_get_creates_client_per_model(self):
+        """モデルごとに別のクライアントが生成されることのテスト"""
+        default_client = self.registry.get()
+        other_client = self.registry.get("stub", "other-model")
+
+        assert default_client is not other_client
+        assert self.factory.call_count == 2
+
+    def test_unknown_provider(self):
+        """未知のプロバイダーでエラーになることのテスト"""
+        with pytest.raises(ValueError):
+            self.registry.get("unknown")
+
+    @pytest.mark.asyncio
+    async def test_aclose_clears_clients(self):
+        """aclose後にクライアントが再生成されることのテスト"""
+        self.registry.get()
+        await self.registry.aclose()
+        self.registry.get()
+
+        assert self.factory.call_count == 2
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import pytest
+from services.llm_clients.base import LLMClientInterface
+from services.llm_clients.governor import ConcurrencyGovernor, GovernedLLMClient, LLMRateLimitedError
+from services.llm_clients.routing_client import RoutingLLMClient
+from services.error_handler import ErrorHandler, ErrorType
+
+
+class SlowClient(LLMClientInterface):
+    """呼び出し順と同時実行数を記録するテスト用クライアント"""
+
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.order = []
+        self.active = 0
+        self.max_active = 0
+
+    async def generate(self, prompt, **kwargs):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.active -= 1
+        self.order.append(prompt)
+        return {"content": prompt}
+
+    async def validate_response(self, response):
+        return bool(response.get("content"))
+
+
+class TestConcurrencyGovernor:
+    """ConcurrencyGovernorのテストクラス"""
+
+    @pytest.mark.asyncio
+    async def test_limits_in_flight_calls(self):
+        """同時実行数が上限を超えないことのテスト"""
+        client = SlowClient()
+        governed = GovernedLLMClient(client, ConcurrencyGovernor("test", max_in_flight=2))
+
+        await asyncio.gather(*(governed.generate(f"p{i}", call_type="chat") for i in range(6)))
+
+        assert client.max_active == 2
+        assert len(client.order) == 6
+
+    @pytest.mark.asyncio
+    async def test_chat_served_before_background_calls(self):
+        """待ち行列でチャット応答が他の呼び出しより優先されることのテスト"""
+        client = SlowClient()
+        governed = GovernedLLMClient(client, ConcurrencyGovernor("test", max_in_flight=1))
+
+        first = asyncio.create_task(governed.generate("first", call_type="chat"))
+        await asyncio.sleep(0)
+        summary = asyncio.create_task(governed.generate("summary", call_type="summary"))
+        feedback = asyncio.create_task(governed.generate("feedback", call_type="feedback"))
+        chat = asyncio.create_task(governed.generate("chat", call_type="chat"))
+        await asyncio.gather(first, summary, feedback, chat)
+
+        assert client.order == ["first", "chat", "feedback", "summary"]
+
+    @pytest.mark.asyncio
+    async def test_priority_through_router(self):
+        """ルーター経由の呼び出しでも呼び出し種別の優先度が使われることのテスト"""
+        client = SlowClient()
+        governor = ConcurrencyGovernor("test", max_in_flight=1)
+        router = RoutingLLMClient(
+            {"primary": GovernedLLMClient(client, governor), "secondary": GovernedLLMClient(SlowClient(), governor)},
+            ["primary", "secondary"],
+        )
+
+        first = asyncio.create_task(router.generate("first", call_type="chat"))
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        summary = asyncio.create_task(router.generate("summary", call_type="summary"))
+        feedback = asyncio.create_task(router.generate("feedback", call_type="feedback"))
+        chat = asyncio.create_task(router.generate("chat", call_type="chat"))
+        await asyncio.sleep(0.001)
+        assert governor.stats()["queue_depth_by_call_type"] == {"summary": 1, "feedback": 1, "chat": 1}
+        await asyncio.gather(first, summary, feedback, chat)
+
+        assert client.order == ["first", "chat", "feedback", "summary"]
+
+    @pytest.mark.asyncio
+    async def test_queue_deadline(self):
+        """デッドラインまでに枠が取れない場合はレート制限エラーになることのテスト"""
+        client = SlowClient(delay=0.5)
+        governor = ConcurrencyGovernor("test", max_in_flight=1, queue_timeouts={"feedback": 0.05})
+        governed = GovernedLLMClient(client, governor)
+
+        running = asyncio.create_task(governed.generate("chat", call_type="chat"))
+        await asyncio.sleep(0)
+        with pytest.raises(LLMRateLimitedError):
+            await governed.generate("feedback", call_type="feedback")
+        running.cancel()
+
+        stats = governor.stats()
+        assert stats["timed_out"] == 1
+        assert stats["queue_depth"] == 0
+
+    @pytest.mark.asyncio
+    async def test_queue_full_rejects(self):
+        """待ち行列が満杯の場合は即座に拒否されることのテスト"""
+        governor = ConcurrencyGovernor("test", max_in_flight=1, max_queue=1)
+        governed = GovernedLLMClient(SlowClient(delay=0.2), governor)
+
+        running = asyncio.create_task(governed.generate("a", call_type="chat"))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(governed.generate("b", call_type="chat"))
+        await asyncio.sleep(0)
+        with pytest.raises(LLMRateLimitedError):
+            await governed.generate("c", call_type="chat")
+
+        await asyncio.gather(running, queued)
+        assert governor.stats()["rejected"] == 1
+
+    @pytest.mark.asyncio
+    async def test_token_bucket_rate(self):
+        """トークンバケットで呼び出しレートが制限されることのテスト"""
+        governor = ConcurrencyGovernor("test", max_in_flight=10, rate_per_second=20, burst=1)
+        governed = GovernedLLMClient(SlowClient(delay=0), governor)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await asyncio.gather(*(governed.generate(f"p{i}", call_type="chat") for i in range(4)))
+
+        # 1件目はバースト分、残り3件は1/20秒ごと
+        assert loop.time() - started >= 0.14
+
+    def test_rate_limited_error_classification(self):
+        """レート制限エラーが専用のフォールバックになることのテスト"""
+        handler = ErrorHandler(logger=logging.getLogger(__name__))
+
+        result = handler.handle(LLMRateLimitedError("LLM rate limited: queue is full"))
+
+        assert result["error_type"] == ErrorType.RATE_LIMITED.value
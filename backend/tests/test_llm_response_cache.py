@@ -0,0 +1,92 @@
+import pytest
+from unittest.mock import Mock, AsyncMock, patch
+from services.llm_clients.response_cache import (
+    CachingLLMClient,
+    InMemoryResponseCache,
+    make_cache_key,
+)
+
+
+class TestInMemoryResponseCache:
+    """InMemoryResponseCacheのテストクラス"""
+
+    def test_hit_and_miss_counters(self):
+        """ヒット/ミスが計数されることのテスト"""
+        cache = InMemoryResponseCache(max_entries=10, ttl_seconds=60)
+
+        assert cache.get("key") is None
+        cache.set("key", {"content": "value"})
+        assert cache.get("key") == {"content": "value"}
+
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.5
+
+    def test_lru_eviction(self):
+        """上限を超えた場合に最も古いエントリが削除されることのテスト"""
+        cache = InMemoryResponseCache(max_entries=2, ttl_seconds=60)
+        cache.set("a", {"content": "a"})
+        cache.set("b", {"content": "b"})
+        cache.get("a")  # aを最近使用にする
+        cache.set("c", {"content": "c"})
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("c") is not None
+        assert cache.stats()["evictions"] == 1
+
+    def test_ttl_expiry(self):
+        """TTLを過ぎたエントリが返されないことのテスト"""
+        cache = InMemoryResponseCache(max_entries=10, ttl_seconds=5)
+        with patch("services.llm_clients.response_cache.time.monotonic", return_value=100.0):
+            cache.set("key", {"content": "value"})
+        with patch("services.llm_clients.response_cache.time.monotonic", return_value=106.0):
+            assert cache.get("key") is None
+
+    def test_make_cache_key_normalizes_input(self):
+        """表記揺れが同じキーに正規化されることのテスト"""
+        key1 = make_cache_key("extract_second_person.j2", "  先生って　呼んで ")
+        key2 = make_cache_key("extract_second_person.j2", "先生って 呼んで")
+
+        assert key1 == key2
+
+
+class TestCachingLLMClient:
+    """CachingLLMClientのテストクラス"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される"""
+        self.inner = Mock()
+        self.inner.generate = AsyncMock(return_value={"content": "{\"second_person\": null}"})
+        self.inner.validate_response = AsyncMock(return_value=True)
+        self.cache = InMemoryResponseCache()
+        self.client = CachingLLMClient(self.inner, self.cache)
+
+    @pytest.mark.asyncio
+    async def test_opt_in_cache(self):
+        """cache_key指定時のみキャッシュされることのテスト"""
+        await self.client.generate("prompt", cache_key="k")
+        result = await self.client.generate("prompt", cache_key="k")
+
+        assert result["cached"] is True
+        assert self.inner.generate.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_without_cache_key(self):
+        """cache_key未指定の場合は毎回生成されることのテスト"""
+        await self.client.generate("prompt")
+        await self.client.generate("prompt")
+
+        assert self.inner.generate.call_count == 2
+        assert self.cache.stats()["hits"] == 0
+
+    @pytest.mark.asyncio
+    async def test_invalid_response_not_cached(self):
+        """不正な応答はキャッシュされないことのテスト"""
+        self.inner.validate_response = AsyncMock(return_value=False)
+
+        await self.client.generate("prompt", cache_key="k")
+        await self.client.generate("prompt", cache_key="k")
+
+        assert self.inner.generate.call_count == 2
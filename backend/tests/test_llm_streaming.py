@@ -0,0 +1,141 @@
+import pytest
+from unittest.mock import Mock, AsyncMock, patch
+from services.llm_service import LLMService
+from services.llm_clients.base import LLMClientInterface
+from services.prompt_builder import PromptBuilder
+from services.error_handler import ErrorHandler
+from models import Agent
+
+
+class StreamingStubClient(LLMClientInterface):
+    """デルタを順に返すテスト用クライアント"""
+
+    def __init__(self, deltas):
+        self.deltas = deltas
+        self.model = "stub-model"
+
+    async def generate(self, prompt, **kwargs):
+        return {"content": "".join(self.deltas), "model": self.model}
+
+    async def generate_stream(self, prompt, **kwargs):
+        for delta in self.deltas:
+            yield delta
+
+    async def validate_response(self, response):
+        return bool(response.get("content"))
+
+
+class UsageReportingStubClient(StreamingStubClient):
+    """ストリーム終了時にトークン数を報告するテスト用クライアント"""
+
+    async def generate_stream(self, prompt, **kwargs):
+        async for delta in super().generate_stream(prompt, **kwargs):
+            yield delta
+        kwargs["usage_sink"].update({"prompt_tokens": 42, "completion_tokens": 7, "total_tokens": 49})
+
+
+class NonStreamingStubClient(LLMClientInterface):
+    """generate_streamを実装しないテスト用クライアント"""
+
+    async def generate(self, prompt, **kwargs):
+        return {"content": "まとめて返します", "model": "stub-model"}
+
+    async def validate_response(self, response):
+        return bool(response.get("content"))
+
+
+class TestLLMStreaming:
+    """LLM応答のストリーミングのテストクラス"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される"""
+        self.mock_prompt_builder = Mock(spec=PromptBuilder)
+        self.mock_prompt_builder.build = AsyncMock(return_value="test prompt")
+        self.mock_error_handler = Mock(spec=ErrorHandler)
+        self.test_agent = Agent(id=1, name="テストエージェント")
+        self.websocket = Mock()
+        self.websocket.send_json = AsyncMock()
+
+    @pytest.mark.asyncio
+    async def test_generate_response_sends_delta_frames(self):
+        """WebSocket接続時にdeltaフレームが送信されることのテスト"""
+        llm_service = LLMService(
+            prompt_builder=self.mock_prompt_builder,
+            llm_client=StreamingStubClient(["こんに", "ちは", "！"]),
+            error_handler=self.mock_error_handler,
+        )
+
+        with patch('crud.get_recent_messages', return_value=[]), \
+             patch('crud.get_chat_summary', return_value=(None, None)):
+            result = await llm_service.generate_response(
+                db=Mock(),
+                message="やあ",
+                agent=self.test_agent,
+                chat_id=1,
+                user_message_id=10,
+                websocket=self.websocket,
+            )
+
+        assert result["content"] == "こんにちは！"
+        frames = [call.args[0] for call in self.websocket.send_json.call_args_list]
+        deltas = [frame for frame in frames if frame.get("type") == "delta"]
+        assert [frame["content"] for frame in deltas] == ["こんに", "ちは", "！"]
+        assert all(frame["reply_to"] == 10 for frame in deltas)
+
+    @pytest.mark.asyncio
+    async def test_send_failure_does_not_abort_generation(self):
+        """deltaの送信に失敗しても応答全体が返されることのテスト"""
+        self.websocket.send_json = AsyncMock(side_effect=RuntimeError("disconnected"))
+        llm_service = LLMService(
+            prompt_builder=self.mock_prompt_builder,
+            llm_client=StreamingStubClient(["a", "b", "c"]),
+            error_handler=self.mock_error_handler,
+        )
+
+        with patch('crud.get_recent_messages', return_value=[]), \
+             patch('crud.get_chat_summary', return_value=(None, None)):
+            result = await llm_service.generate_response(
+                db=Mock(),
+                message="やあ",
+                agent=self.test_agent,
+                chat_id=1,
+                user_message_id=10,
+                websocket=self.websocket,
+            )
+
+        assert result["content"] == "abc"
+        assert self.websocket.send_json.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_default_generate_stream_falls_back_to_generate(self):
+        """generate_stream未実装のクライアントは全文を1デルタで返すことのテスト"""
+        client = NonStreamingStubClient()
+
+        deltas = [delta async for delta in client.generate_stream("prompt")]
+
+        assert deltas == ["まとめて返します"]
+
+    @pytest.mark.asyncio
+    async def test_streamed_usage_and_timings_in_metadata(self):
+        """ストリーム終了時に報告されたトークン数と段階ごとの所要時間がmetadataに入ることのテスト"""
+        llm_service = LLMService(
+            prompt_builder=self.mock_prompt_builder,
+            llm_client=UsageReportingStubClient(["こんに", "ちは"]),
+            error_handler=self.mock_error_handler,
+        )
+
+        with patch('crud.get_recent_messages', return_value=[]), \
+             patch('crud.get_chat_summary', return_value=(None, None)):
+            result = await llm_service.generate_response(
+                db=Mock(),
+                message="やあ",
+                agent=self.test_agent,
+                chat_id=1,
+                user_message_id=10,
+                websocket=self.websocket,
+            )
+
+        metadata = result["metadata"]
+        assert metadata["model"] == "stub-model"
+        assert metadata["usage"] == {"prompt_tokens": 42, "completion_tokens": 7, "total_tokens": 49, "estimated": False}
+        assert {"context", "prompt", "llm", "first_token", "total"} <= set(metadata["timings"])
@@ -0,0 +1,91 @@
+import pytest
+from unittest.mock import patch
+from services.prompt_builder import PromptBuilder
+from services.prompt_template_engine import PromptTemplateEngine
+from models import Agent, Personality, Role, Tone
+
+
+class TestPromptBuilderPersonaCache:
+    """ペルソナ部分のキャッシュのテストクラス"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される"""
+        self.builder = PromptBuilder(PromptTemplateEngine())
+        self.agent = Agent(
+            id=1,
+            name="テストエージェント",
+            description="明るい案内役",
+            first_person="わたし",
+            revision=0,
+            personalities=[Personality(name="明るい")],
+            roles=[Role(name="友達")],
+            tones=[Tone(name="タメ口")],
+        )
+
+    @pytest.mark.asyncio
+    async def test_prompt_contains_persona_and_turn(self):
+        """ペルソナ部分・会話履歴・発話がプロンプトに含まれることのテスト"""
+        prompt = await self.builder.build(
+            message="元気？",
+            agent=self.agent,
+            context=[{"sender": "user", "content": "こんにちは"}],
+        )
+
+        _, prefix = self.builder.build_persona_prefix(self.agent)
+        assert prompt.startswith(prefix)
+        assert "- 明るい" in prefix
+        assert "- タメ口" in prefix
+        assert "ユーザー: こんにちは" in prompt
+        assert prompt.rstrip().endswith("ユーザー: 元気？\n\nテストエージェント:")
+
+    @pytest.mark.asyncio
+    async def test_persona_rendered_once_per_revision(self):
+        """同じリビジョンではタグを再走査せずキャッシュが使われることのテスト"""
+        with patch.object(self.builder, '_extract_personality_info', wraps=self.builder._extract_personality_info) as spy:
+            await self.builder.build(message="1", agent=self.agent)
+            await self.builder.build(message="2", agent=self.agent)
+
+        assert spy.call_count == 1
+        assert self.builder.prefix_cache.stats()["hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_revision_bump_invalidates_prefix(self):
+        """リビジョンが上がると新しいプロフィールで描画されることのテスト"""
+        await self.builder.build(message="1", agent=self.agent)
+
+        self.agent.second_person = "先輩"
+        self.agent.revision = 1
+        prompt = await self.builder.build(message="2", agent=self.agent)
+
+        assert "- ユーザーの呼び方: 先輩" in prompt
+
+    @pytest.mark.asyncio
+    async def test_unsaved_agent_is_not_cached(self):
+        """リビジョンのないエージェントはキャッシュされないことのテスト"""
+        agent = Agent(name="一時エージェント")
+
+        await self.builder.build(message="1", agent=agent)
+
+        assert self.builder.prefix_cache.stats()["entries"] == 0
+
+
+class TestAnthropicCacheablePrefix:
+    """Anthropicのプロンプトキャッシュ指定のテストクラス"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される"""
+        pytest.importorskip("anthropic")
+
+    def test_prefix_block_is_marked_cacheable(self):
+        """共通の先頭部分にcache_controlが付与されることのテスト"""
+        from services.llm_clients.anthropic_client import AnthropicClient
+        content = AnthropicClient._build_content("ペルソナ\n\nユーザー: こんにちは", "ペルソナ")
+
+        assert content[0] == {"type": "text", "text": "ペルソナ", "cache_control": {"type": "ephemeral"}}
+        assert content[1]["text"] == "\n\nユーザー: こんにちは"
+
+    def test_plain_prompt_without_prefix(self):
+        """先頭部分が一致しない場合はそのまま送ることのテスト"""
+        from services.llm_clients.anthropic_client import AnthropicClient
+        assert AnthropicClient._build_content("こんにちは", "ペルソナ") == "こんにちは"
+        assert AnthropicClient._build_content("こんにちは", None) == "こんにちは"
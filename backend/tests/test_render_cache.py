@@ -0,0 +1,139 @@
+import os
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import models
+from models import Agent
+from services.event_bus import EventBus
+from services.image_generation_service import ImageGenerationService
+from services.image_job_queue import ImageJobQueue
+from services.render_cache import RenderResultCache, render_cache_key
+
+
+class CountingImageClient:
+    """呼び出し回数を数えるテスト用の画像生成クライアント"""
+
+    model = "stub-model"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def generate_image_async(self, prompt, negative_prompt="", progress_callback=None, seed=None, **kwargs):
+        self.calls += 1
+        return f"{prompt}:{seed}".encode("utf-8"), seed
+
+
+class TestRenderResultCache:
+    """描画結果キャッシュのテストクラス"""
+
+    def test_key_is_canonical(self):
+        """パラメータの順序によらず同じキーになり、値が違えば別のキーになる"""
+        assert render_cache_key({"prompt": "a", "seed": 1}) == render_cache_key({"seed": 1, "prompt": "a"})
+        assert render_cache_key({"prompt": "a", "seed": 1}) != render_cache_key({"prompt": "a", "seed": 2})
+
+    def test_evicts_least_recently_used_by_total_bytes(self, tmp_path):
+        """合計バイト数が上限を超えると、最後に使われたのが古いものから削除する"""
+        cache = RenderResultCache(tmp_path, max_bytes=25)
+        cache.set("aa01", b"x" * 10)
+        cache.set("bb02", b"y" * 10)
+        assert cache.get("aa01") == b"x" * 10
+        cache.set("cc03", b"z" * 10)
+
+        assert cache.get("bb02") is None
+        assert cache.get("aa01") is not None and cache.get("cc03") is not None
+        stats = cache.stats()
+        assert (stats["entries"], stats["bytes"], stats["evictions"]) == (2, 20, 1)
+        assert not (tmp_path / "bb" / "bb02.png").exists()
+
+    def test_index_is_restored_from_disk(self, tmp_path):
+        """再起動後もディスク上のエントリと使用順を引き継ぐ"""
+        cache = RenderResultCache(tmp_path, max_bytes=100)
+        cache.set("aa01", b"x" * 10)
+        cache.set("bb02", b"y" * 10)
+        os.utime(tmp_path / "aa" / "aa01.png", (1, 1))
+
+        restored = RenderResultCache(tmp_path, max_bytes=15)
+
+        assert restored.stats()["entries"] == 1
+        assert restored.get("bb02") == b"y" * 10
+        assert restored.get("aa01") is None
+
+    def test_disabled_when_max_bytes_is_zero(self, tmp_path):
+        """上限が0の場合は何も保存しない"""
+        cache = RenderResultCache(tmp_path / "cache", max_bytes=0)
+        cache.set("aa01", b"x")
+        assert cache.get("aa01") is None
+        assert not (tmp_path / "cache").exists()
+
+
+class TestImageGenerationWithRenderCache:
+    """画像生成サービスでの描画結果キャッシュの利用のテストクラス"""
+
+    @pytest.fixture(autouse=True)
+    def setup_service(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        self.service = ImageGenerationService()
+        self.client = CountingImageClient()
+        self.service.client = self.client
+        self.service.render_cache = RenderResultCache(tmp_path / "render_cache", max_bytes=10_000)
+        engine = create_engine(
+            "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+        )
+        models.Base.metadata.create_all(engine)
+        self.session_factory = sessionmaker(bind=engine)
+        self.db = self.session_factory()
+        yield
+        self.db.close()
+
+    async def _generate(self, agent, force_regenerate=False):
+        return await self.service._generate_and_save_image_internal(
+            db=self.db, agent=agent, prompt="portrait", force_regenerate=force_regenerate
+        )
+
+    @pytest.mark.asyncio
+    async def test_repeat_render_with_fixed_seed_is_served_from_cache(self):
+        """固定シードで同じパラメータの描画はプロバイダーを呼ばずに済ませる"""
+        first_url, first_seed = await self._generate(Agent(id=1, name="A", image_seed=42))
+        second_url, second_seed = await self._generate(Agent(id=1, name="A", image_seed=42))
+
+        assert self.client.calls == 1
+        assert first_seed == second_seed == 42
+        # 同じ画像は保存先のファイルも共有する
+        assert first_url == second_url
+        assert self.db.query(models.ImageBlob).one().ref_count == 2
+        assert self.service.render_cache.stats()["hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_random_seed_is_not_cached(self):
+        """シードを固定しない描画（再生成）はキャッシュしない"""
+        await self._generate(Agent(id=1, name="A", image_seed=42), force_regenerate=True)
+        await self._generate(Agent(id=1, name="A", image_seed=42), force_regenerate=True)
+
+        assert self.client.calls == 2
+        assert self.service.render_cache.stats()["entries"] == 0
+
+    @pytest.mark.asyncio
+    async def test_regenerate_job_pins_seed_without_cache(self):
+        """再生成ジョブは登録時に決めたシードで再試行され、別の再生成の依頼は新しい画像になる"""
+        self.service.job_queue = ImageJobQueue(
+            self.service, workers=1, session_factory=self.session_factory, event_bus=EventBus()
+        )
+        user = models.User(email="user@example.com", hashed_password="x")
+        self.db.add(user)
+        self.db.commit()
+        agent = models.Agent(name="A", owner_id=user.id)
+        self.db.add(agent)
+        self.db.commit()
+
+        first = self.service.enqueue_profile_image(self.db, agent.id, user.id, force_regenerate=True)
+        first_url, first_seed = await self.service.run_job(self.db, first)
+        retry_url, retry_seed = await self.service.run_job(self.db, first)
+        second = self.service.enqueue_profile_image(self.db, agent.id, user.id, force_regenerate=True)
+        second_url, second_seed = await self.service.run_job(self.db, second)
+
+        assert first.payload["seed"] == first_seed == retry_seed and retry_url == first_url
+        assert second.payload["seed"] == second_seed != first_seed and second_url != first_url
+        # ジョブで決めたシードは描画結果のキャッシュに使わない
+        assert self.client.calls == 3
+        assert self.service.render_cache.stats()["entries"] == 0
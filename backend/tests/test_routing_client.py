@@ -0,0 +1,131 @@
+import asyncio
+import pytest
+from services.llm_clients.base import LLMClientInterface
+from services.llm_clients.routing_client import RoutingLLMClient
+
+
+class StubProvider(LLMClientInterface):
+    """遅延やエラーを設定できるテスト用プロバイダー"""
+
+    def __init__(self, name, delay=0.0, error=None):
+        self.name = name
+        self.model = f"{name}-model"
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.cancelled = False
+
+    async def generate(self, prompt, **kwargs):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error:
+            raise self.error
+        return {"content": f"{self.name}: {prompt}", "model": self.model}
+
+    async def generate_stream(self, prompt, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        for delta in [self.name, ":", " ok"]:
+            yield delta
+
+    async def validate_response(self, response):
+        return bool(response.get("content"))
+
+
+class TestRoutingLLMClient:
+    """RoutingLLMClientのテストクラス"""
+
+    @pytest.mark.asyncio
+    async def test_uses_first_provider(self):
+        """優先順位の先頭のプロバイダーが使われることのテスト"""
+        primary, secondary = StubProvider("primary"), StubProvider("secondary")
+        router = RoutingLLMClient({"primary": primary, "secondary": secondary}, ["primary", "secondary"])
+
+        result = await router.generate("hello")
+
+        assert result["provider"] == "primary"
+        assert secondary.calls == 0
+
+    @pytest.mark.asyncio
+    async def test_failover_on_error(self):
+        """エラー時に次のプロバイダーへフェイルオーバーすることのテスト"""
+        primary = StubProvider("primary", error=Exception("Gemini API error: 503"))
+        secondary = StubProvider("secondary")
+        router = RoutingLLMClient({"primary": primary, "secondary": secondary}, ["primary", "secondary"])
+
+        result = await router.generate("hello")
+
+        assert result["provider"] == "secondary"
+
+    @pytest.mark.asyncio
+    async def test_failover_on_timeout(self):
+        """タイムアウト時に次のプロバイダーへフェイルオーバーすることのテスト"""
+        primary = StubProvider("primary", delay=1.0)
+        secondary = StubProvider("secondary")
+        router = RoutingLLMClient(
+            {"primary": primary, "secondary": secondary}, ["primary", "secondary"], attempt_timeout=0.05
+        )
+
+        result = await router.generate("hello")
+
+        assert result["provider"] == "secondary"
+
+    @pytest.mark.asyncio
+    async def test_hedged_request_takes_fastest(self):
+        """ヘッジリクエストで先に返った応答が採用されることのテスト"""
+        primary = StubProvider("primary", delay=1.0)
+        secondary = StubProvider("secondary", delay=0.01)
+        router = RoutingLLMClient(
+            {"primary": primary, "secondary": secondary}, ["primary", "secondary"], hedge_after=0.05
+        )
+
+        result = await router.generate("hello")
+        await asyncio.sleep(0)
+
+        assert result["provider"] == "secondary"
+        assert primary.calls == 1
+        assert primary.cancelled
+
+    @pytest.mark.asyncio
+    async def test_call_type_priority(self):
+        """呼び出し種別ごとの優先順位が適用されることのテスト"""
+        primary, secondary = StubProvider("primary"), StubProvider("secondary")
+        router = RoutingLLMClient(
+            {"primary": primary, "secondary": secondary},
+            ["primary", "secondary"],
+            priorities={"feedback": ["secondary", "primary"]},
+        )
+
+        chat = await router.generate("hello", call_type="chat")
+        feedback = await router.generate("hello", call_type="feedback")
+
+        assert chat["provider"] == "primary"
+        assert feedback["provider"] == "secondary"
+
+    @pytest.mark.asyncio
+    async def test_all_providers_fail(self):
+        """全プロバイダーが失敗した場合にAPIエラーとなることのテスト"""
+        router = RoutingLLMClient(
+            {"a": StubProvider("a", error=Exception("boom")), "b": StubProvider("b", error=Exception("bang"))},
+            ["a", "b"],
+        )
+
+        with pytest.raises(Exception, match="api error|API error"):
+            await router.generate("hello")
+
+    @pytest.mark.asyncio
+    async def test_stream_failover_before_first_delta(self):
+        """最初のデルタ前に失敗した場合はストリーミングもフェイルオーバーすることのテスト"""
+        primary = StubProvider("primary", error=Exception("down"))
+        secondary = StubProvider("secondary")
+        router = RoutingLLMClient({"primary": primary, "secondary": secondary}, ["primary", "secondary"])
+
+        deltas = [delta async for delta in router.generate_stream("hello")]
+
+        assert "".join(deltas) == "secondary: ok"
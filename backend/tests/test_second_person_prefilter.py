@@ -0,0 +1,86 @@
+import pytest
+from pathlib import Path
+from unittest.mock import Mock, AsyncMock
+from services.second_person_prefilter import SecondPersonPrefilter
+from services.feedback_service import FeedbackService
+from services.prompt_builder import PromptBuilder
+from services.error_handler import ErrorHandler
+
+CORPUS_PATH = Path(__file__).parent / "data" / "second_person_corpus.tsv"
+
+# 取りこぼし（偽陰性）はLLMでの抽出漏れに直結するため厳しく、
+# 誤検出（偽陽性）はLLMを呼ぶだけなので緩めに許容する
+MAX_FALSE_NEGATIVE_RATE = 0.02
+MAX_FALSE_POSITIVE_RATE = 0.10
+
+
+def load_corpus():
+    """バンドルされた評価用コーパスを読み込む"""
+    samples = []
+    for line in CORPUS_PATH.read_text(encoding="utf-8").splitlines():
+        if not line.strip() or line.startswith("#"):
+            continue
+        label, message = line.split("\t", 1)
+        samples.append((label == "1", message))
+    return samples
+
+
+class TestSecondPersonPrefilter:
+    """SecondPersonPrefilterのテストクラス"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される"""
+        self.prefilter = SecondPersonPrefilter()
+        self.samples = load_corpus()
+
+    def test_false_negative_rate_on_corpus(self):
+        """コーパスでの偽陰性率が閾値以下であることのテスト"""
+        positives = [message for label, message in self.samples if label]
+        missed = [message for message in positives if not self.prefilter.may_contain_naming(message)]
+        rate = len(missed) / len(positives)
+
+        assert rate <= MAX_FALSE_NEGATIVE_RATE, f"False negative rate {rate:.3f}, missed: {missed}"
+
+    def test_false_positive_rate_on_corpus(self):
+        """コーパスでの偽陽性率が閾値以下であることのテスト"""
+        negatives = [message for label, message in self.samples if not label]
+        flagged = [message for message in negatives if self.prefilter.may_contain_naming(message)]
+        rate = len(flagged) / len(negatives)
+
+        assert rate <= MAX_FALSE_POSITIVE_RATE, f"False positive rate {rate:.3f}, flagged: {flagged}"
+
+    def test_empty_message(self):
+        """空メッセージの判定テスト"""
+        assert not self.prefilter.may_contain_naming("")
+
+
+class TestFeedbackServicePrefilter:
+    """FeedbackServiceでのプレフィルタ適用のテストクラス"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される"""
+        self.mock_prompt_builder = Mock(spec=PromptBuilder)
+        self.mock_prompt_builder.build = AsyncMock(return_value="test prompt")
+        self.mock_llm_client = Mock()
+        self.mock_llm_client.generate = AsyncMock(return_value={
+            "content": "```json\n{\"second_person\": \"先生\"}\n```"
+        })
+        self.feedback_service = FeedbackService(
+            self.mock_prompt_builder, self.mock_llm_client, Mock(spec=ErrorHandler)
+        )
+
+    @pytest.mark.asyncio
+    async def test_skips_llm_without_naming_cue(self):
+        """呼び方の手がかりがない場合はLLMを呼ばないことのテスト"""
+        result = await self.feedback_service.extract_second_person("今日の天気はどう？")
+
+        assert result is None
+        self.mock_llm_client.generate.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_calls_llm_with_naming_cue(self):
+        """呼び方の手がかりがある場合はLLMで抽出することのテスト"""
+        result = await self.feedback_service.extract_second_person("先生って呼んでください")
+
+        assert result == "先生"
+        self.mock_llm_client.generate.assert_called_once()
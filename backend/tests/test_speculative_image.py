@@ -0,0 +1,145 @@
+import asyncio
+import pytest
+from unittest.mock import Mock, AsyncMock, patch
+from services.llm_service import LLMService
+from services.prompt_builder import PromptBuilder
+from services.error_handler import ErrorHandler
+from services.image_request_detector import ImageRequestDetector
+from services.image_prompt_analyzer import ImagePromptAnalyzer
+from services.image_generation_service import ImageGenerationService
+from models import Agent
+
+
+class GatedLLMClient:
+    """releaseされるまで応答を返さないテスト用クライアント"""
+
+    def __init__(self, content, fail=False):
+        self.content = content
+        self.fail = fail
+        self.release = asyncio.Event()
+        self.model = "stub-model"
+
+    async def generate(self, prompt, **kwargs):
+        await self.release.wait()
+        if self.fail:
+            raise Exception("LLM API error: boom")
+        return {"content": self.content, "model": self.model}
+
+    async def validate_response(self, response):
+        return bool(response.get("content"))
+
+
+class TestSpeculativeImageGeneration:
+    """応答と並行した投機的な画像生成のテストクラス"""
+
+    def setup_method(self):
+        """各テストメソッドの前に実行される"""
+        self.mock_prompt_builder = Mock(spec=PromptBuilder)
+        self.mock_prompt_builder.build = AsyncMock(return_value="test prompt")
+        self.mock_error_handler = Mock(spec=ErrorHandler)
+        self.mock_error_handler.handle.return_value = {"content": "error", "error": True}
+        self.detector = Mock(spec=ImageRequestDetector)
+        self.detector.detect_image_request.return_value = True
+        self.detector.extract_image_context.return_value = None
+        self.detector.get_image_type_hint.return_value = "portrait"
+        self.analyzer = Mock(spec=ImagePromptAnalyzer)
+        # 応答に「公園」が含まれる場合だけプロンプトが変わる
+        self.analyzer.analyze_and_build_prompt = AsyncMock(
+            side_effect=lambda agent_response, **kwargs: {
+                "prompt": "portrait, park" if "公園" in agent_response else "portrait",
+                "negative_prompt": "",
+                "metadata": {},
+            }
+        )
+        self.image_service = Mock(spec=ImageGenerationService)
+        self.generation_started = asyncio.Event()
+        self.started_prompts = []
+        self.cancelled_prompts = []
+        self.finish_generation = asyncio.Event()
+
+        async def generate_image_in_chat(prompt, **kwargs):
+            self.started_prompts.append(prompt)
+            self.generation_started.set()
+            try:
+                await self.finish_generation.wait()
+            except asyncio.CancelledError:
+                self.cancelled_prompts.append(prompt)
+                raise
+            return f"/static/{len(self.started_prompts)}.png", 1
+
+        self.image_service.generate_image_in_chat = AsyncMock(side_effect=generate_image_in_chat)
+        self.test_agent = Agent(id=1, name="テストエージェント")
+
+    def _service(self, llm_client):
+        return LLMService(
+            prompt_builder=self.mock_prompt_builder,
+            llm_client=llm_client,
+            error_handler=self.mock_error_handler,
+            image_request_detector=self.detector,
+            image_prompt_analyzer=self.analyzer,
+            image_generation_service=self.image_service,
+            speculative_image=True,
+        )
+
+    async def _run(self, service, llm_client, finish_image_first=False):
+        with patch('crud.get_recent_messages', return_value=[]), \
+             patch('crud.get_chat_summary', return_value=(None, None)):
+            response_task = asyncio.create_task(service.generate_response(
+                db=Mock(), message="写真を見せて", agent=self.test_agent, chat_id=1, user_message_id=5
+            ))
+            # 応答が返る前に画像生成が始まっていること
+            await asyncio.wait_for(self.generation_started.wait(), timeout=1)
+            if finish_image_first:
+                self.finish_generation.set()
+                await asyncio.sleep(0)
+            llm_client.release.set()
+            await asyncio.sleep(0.01)
+            self.finish_generation.set()
+            return await asyncio.wait_for(response_task, timeout=1)
+
+    @pytest.mark.asyncio
+    async def test_image_generation_starts_before_reply(self):
+        """応答でシーンが変わらなければ投機的な生成結果をそのまま使う"""
+        llm_client = GatedLLMClient("どうぞ、お見せしますね。")
+        result = await self._run(self._service(llm_client), llm_client)
+
+        assert result["image_url"] == "/static/1.png"
+        assert self.started_prompts == ["portrait"]
+        assert self.cancelled_prompts == []
+
+    @pytest.mark.asyncio
+    async def test_restarts_when_reply_changes_scene(self):
+        """応答でプロンプトが変わった場合は実行中の生成を取り消してやり直す"""
+        llm_client = GatedLLMClient("公園で撮った写真だよ。")
+        result = await self._run(self._service(llm_client), llm_client)
+
+        assert self.started_prompts == ["portrait", "portrait, park"]
+        assert self.cancelled_prompts == ["portrait"]
+        assert result["image_url"] == "/static/2.png"
+
+    @pytest.mark.asyncio
+    async def test_keeps_finished_image_even_if_scene_changes(self):
+        """応答より先に生成が終わっていた場合はその画像を採用する"""
+        llm_client = GatedLLMClient("公園で撮った写真だよ。")
+        result = await self._run(self._service(llm_client), llm_client, finish_image_first=True)
+
+        assert self.started_prompts == ["portrait"]
+        assert result["image_url"] == "/static/1.png"
+
+    @pytest.mark.asyncio
+    async def test_llm_failure_cancels_speculative_image(self):
+        """応答の生成に失敗した場合は投機的な画像生成も取り消す"""
+        llm_client = GatedLLMClient("", fail=True)
+        service = self._service(llm_client)
+        with patch('crud.get_recent_messages', return_value=[]), \
+             patch('crud.get_chat_summary', return_value=(None, None)):
+            response_task = asyncio.create_task(service.generate_response(
+                db=Mock(), message="写真を見せて", agent=self.test_agent, chat_id=1, user_message_id=5
+            ))
+            await asyncio.wait_for(self.generation_started.wait(), timeout=1)
+            llm_client.release.set()
+            result = await asyncio.wait_for(response_task, timeout=1)
+            await asyncio.sleep(0)
+
+        assert result["error"] is True
+        assert self.cancelled_prompts == ["portrait"]
@@ -0,0 +1,123 @@
+import asyncio
+import base64
+import json
+import pytest
+from io import BytesIO
+from unittest.mock import AsyncMock, patch
+import httpx
+from PIL import Image
+from services.llm_clients import stable_diffusion_webui_client as webui
+from services.llm_clients.stable_diffusion_webui_client import (
+    ImageGenerationInterruptedError, StableDiffusionWebUIClient,
+)
+
+
+def _png_b64() -> str:
+    buffer = BytesIO()
+    Image.new("RGB", (8, 8)).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+class FakeWebUI:
+    """txt2img・進捗・中断だけを返すテスト用のWebUI"""
+
+    def __init__(self):
+        self.task_id = None
+        self.current_task = None
+        self.interrupted = False
+        self.interrupts = 0
+        self.started = asyncio.Event()
+        self.finish = asyncio.Event()
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path == "/sdapi/v1/txt2img":
+            self.task_id = json.loads(request.content)["force_task_id"]
+            if self.current_task is None:
+                self.current_task = self.task_id
+            self.started.set()
+            await self.finish.wait()
+            return httpx.Response(200, json={"images": [_png_b64()], "info": json.dumps({"seed": 7})})
+        if path == "/sdapi/v1/progress":
+            return httpx.Response(200, json={
+                "progress": 0.5,
+                "current_task": self.current_task,
+                "state": {"interrupted": self.interrupted},
+            })
+        if path == "/sdapi/v1/interrupt":
+            self.interrupts += 1
+            self.interrupted = True
+            self.finish.set()
+            return httpx.Response(200, json={})
+        return httpx.Response(404)
+
+
+class TestStableDiffusionWebUIClient:
+    """WebUIクライアントの生成の取り消しのテストクラス"""
+
+    @pytest.fixture(autouse=True)
+    def setup_client(self):
+        self.webui = FakeWebUI()
+        transport = httpx.MockTransport(self.webui.handle)
+        real_client = httpx.AsyncClient
+
+        def client_factory(*args, **kwargs):
+            kwargs["transport"] = transport
+            return real_client(*args, **kwargs)
+
+        self.client = StableDiffusionWebUIClient()
+        self.client.base_url = "http://webui"
+        self.client._check_api_health = AsyncMock(return_value=True)
+        self.client._get_models = AsyncMock(return_value=[])
+        self.client.poll_interval = 0.01
+        with patch.object(webui.httpx, "AsyncClient", side_effect=client_factory):
+            yield
+
+    async def _start(self):
+        task = asyncio.create_task(self.client.generate_image_async("a cat"))
+        await asyncio.wait_for(self.webui.started.wait(), timeout=1)
+        return task
+
+    @pytest.mark.asyncio
+    async def test_cancel_interrupts_own_render(self):
+        """取り消すと、実行中のこの依頼の生成をWebUI側でも中断する"""
+        task = await self._start()
+
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        assert self.webui.interrupts == 1
+
+    @pytest.mark.asyncio
+    async def test_cancel_does_not_interrupt_other_render(self):
+        """WebUIが別の依頼を生成中の場合は中断しない"""
+        self.webui.current_task = "task(other)"
+        task = await self._start()
+
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        assert self.webui.interrupts == 0
+
+    @pytest.mark.asyncio
+    async def test_interrupted_render_is_not_a_result(self):
+        """WebUI側で中断された生成は、途中の画像を返さずに取り消しとして扱う"""
+        task = await self._start()
+
+        self.webui.interrupted = True
+        self.webui.finish.set()
+        with pytest.raises(ImageGenerationInterruptedError):
+            await task
+
+    @pytest.mark.asyncio
+    async def test_completed_render_returns_image(self):
+        """中断されなかった生成は画像とシードを返す"""
+        task = await self._start()
+
+        self.webui.current_task = None
+        self.webui.finish.set()
+        image_data, seed = await task
+
+        assert image_data.startswith(b"\x89PNG") and seed == 7
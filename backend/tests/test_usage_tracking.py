@@ -0,0 +1,154 @@
+import pytest
+from datetime import date, datetime
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import crud
+import models
+from services.usage_tracker import StageTimer, resolve_usage
+
+
+class TestResolveUsage:
+    """トークン使用量の解決のテスト"""
+
+    def test_provider_usage_is_used_as_is(self):
+        """プロバイダーが返したトークン数はそのまま使う"""
+        usage = resolve_usage(
+            {"prompt_tokens": 120, "completion_tokens": 30, "total_tokens": 150}, "プロンプト", "応答"
+        )
+        assert usage == {"prompt_tokens": 120, "completion_tokens": 30, "total_tokens": 150, "estimated": False}
+
+    def test_missing_usage_is_estimated(self):
+        """トークン数がない場合はローカルの概算で補い、estimatedを立てる"""
+        usage = resolve_usage(None, "あ" * 40, "い" * 20)
+        assert usage["estimated"] is True
+        assert usage["prompt_tokens"] > 0
+        assert usage["completion_tokens"] > 0
+        assert usage["total_tokens"] == usage["prompt_tokens"] + usage["completion_tokens"]
+
+    def test_partial_usage_is_completed(self):
+        """一部だけ返された場合は欠けた値のみ概算する"""
+        usage = resolve_usage({"prompt_tokens": 100, "completion_tokens": None}, "プロンプト", "応答")
+        assert usage["prompt_tokens"] == 100
+        assert usage["estimated"] is True
+        assert usage["total_tokens"] == 100 + usage["completion_tokens"]
+
+
+class TestStageTimer:
+    """処理段階ごとの計測のテスト"""
+
+    def test_records_stages_and_first_token(self):
+        """各段階と最初のトークンまでの時間を記録する"""
+        timer = StageTimer()
+        with timer.stage("context"):
+            pass
+        with timer.stage("llm"):
+            timer.mark_first_token()
+            timer.mark_first_token()
+
+        timings = timer.as_dict()
+        assert set(timings) == {"context", "llm", "first_token", "total"}
+        assert timings["first_token"] <= timings["llm"] <= timings["total"]
+
+    def test_first_token_requires_llm_stage(self):
+        """LLM呼び出しが始まる前は最初のトークンを記録しない"""
+        timer = StageTimer()
+        timer.mark_first_token()
+        assert "first_token" not in timer.as_dict()
+
+
+class TestUsageSummary:
+    """使用量の保存と集計のテスト"""
+
+    def setup_method(self):
+        engine = create_engine("sqlite://")
+        models.Base.metadata.create_all(engine)
+        self.db = sessionmaker(bind=engine)()
+        self.user = models.User(email="user@example.com", hashed_password="x")
+        self.other_user = models.User(email="other@example.com", hashed_password="x")
+        self.db.add_all([self.user, self.other_user])
+        self.db.commit()
+        self.agent_a = models.Agent(name="A", owner_id=self.user.id)
+        self.agent_b = models.Agent(name="B", owner_id=self.user.id)
+        self.other_agent = models.Agent(name="C", owner_id=self.other_user.id)
+        self.db.add_all([self.agent_a, self.agent_b, self.other_agent])
+        self.db.commit()
+
+    def teardown_method(self):
+        self.db.close()
+
+    def _record(self, agent, user, prompt_tokens, completion_tokens, created_at, estimated=False, llm_ms=100):
+        chat = models.Chat(user_id=user.id, agent_id=agent.id)
+        self.db.add(chat)
+        self.db.commit()
+        message = models.Message(chat_id=chat.id, content="応答", sender="ai")
+        self.db.add(message)
+        self.db.commit()
+        usage = crud.create_message_usage(
+            self.db, message, agent_id=agent.id, user_id=user.id,
+            metadata={
+                "model": "gemini-pro",
+                "provider": "gemini",
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                    "estimated": estimated,
+                },
+                "timings": {"context": 5, "prompt": 2, "llm": llm_ms, "first_token": 40, "total": llm_ms + 10},
+            },
+        )
+        usage.created_at = created_at
+        self.db.commit()
+        return usage
+
+    def test_create_message_usage_persists_metadata(self):
+        """モデル名・トークン数・段階ごとの所要時間を保存する"""
+        usage = self._record(self.agent_a, self.user, 100, 20, datetime(2026, 10, 1, 12))
+        assert usage.message.usage is usage
+        assert usage.model == "gemini-pro"
+        assert usage.provider == "gemini"
+        assert (usage.prompt_tokens, usage.completion_tokens, usage.total_tokens) == (100, 20, 120)
+        assert (usage.context_ms, usage.llm_ms, usage.first_token_ms, usage.image_ms) == (5, 100, 40, None)
+
+    def test_summary_by_agent(self):
+        """エージェントごとに集計し、他のユーザーの分は含めない"""
+        self._record(self.agent_a, self.user, 100, 20, datetime(2026, 10, 1, 12), llm_ms=100)
+        self._record(self.agent_a, self.user, 50, 10, datetime(2026, 10, 2, 12), estimated=True, llm_ms=300)
+        self._record(self.agent_b, self.user, 10, 5, datetime(2026, 10, 2, 12))
+        self._record(self.other_agent, self.other_user, 999, 999, datetime(2026, 10, 2, 12))
+
+        rows = {row["key"]: row for row in crud.get_usage_summary(self.db, user_id=self.user.id, group_by="agent")}
+
+        assert set(rows) == {str(self.agent_a.id), str(self.agent_b.id)}
+        assert rows[str(self.agent_a.id)]["messages"] == 2
+        assert rows[str(self.agent_a.id)]["total_tokens"] == 180
+        assert rows[str(self.agent_a.id)]["estimated_messages"] == 1
+        assert rows[str(self.agent_a.id)]["avg_llm_ms"] == 200
+
+    def test_summary_by_day_with_range(self):
+        """日ごとに集計し、期間とエージェントで絞り込める"""
+        self._record(self.agent_a, self.user, 100, 20, datetime(2026, 10, 1, 23, 59))
+        self._record(self.agent_a, self.user, 50, 10, datetime(2026, 10, 2, 0, 1))
+        self._record(self.agent_b, self.user, 10, 5, datetime(2026, 10, 2, 12))
+        self._record(self.agent_a, self.user, 70, 7, datetime(2026, 10, 3, 12))
+
+        rows = crud.get_usage_summary(
+            self.db, user_id=self.user.id, group_by="day", agent_id=self.agent_a.id,
+            start=date(2026, 10, 1), end=date(2026, 10, 2),
+        )
+
+        assert [(row["key"], row["total_tokens"]) for row in rows] == [("2026-10-01", 120), ("2026-10-02", 60)]
+
+    def test_summary_by_user_across_users(self):
+        """ユーザーを指定しない場合はユーザーごとに全体を集計できる"""
+        self._record(self.agent_a, self.user, 100, 20, datetime(2026, 10, 1, 12))
+        self._record(self.other_agent, self.other_user, 10, 5, datetime(2026, 10, 1, 12))
+
+        rows = {row["key"]: row["total_tokens"] for row in crud.get_usage_summary(self.db, group_by="user")}
+
+        assert rows == {str(self.user.id): 120, str(self.other_user.id): 15}
+
+    def test_unknown_group_by(self):
+        """未知の集計単位はエラーにする"""
+        with pytest.raises(ValueError):
+            crud.get_usage_summary(self.db, user_id=self.user.id, group_by="month")
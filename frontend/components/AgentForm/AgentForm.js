@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { useAuth } from "../../contexts/AuthContext";
 import { GENDER_SPECIFIC_OPTIONS, HAIR_COLORS } from "../../constants";
 import TabNavigation from "./TabNavigation";
@@ -8,7 +8,7 @@ import PersonalityTab from "./PersonalityTab";
 import { normalizeImageUrl } from "../../utils";
 
 export default function AgentForm({ agentId, onSave, onCancel, onDelete, onAgentUpdate }) {
-	const { fetchWithAuth } = useAuth();
+	const { fetchWithAuth, token } = useAuth();
 	const [name, setName] = useState("");
 	const [description, setDescription] = useState("");
 	const [gender, setGender] = useState("");
@@ -42,6 +42,9 @@ export default function AgentForm({ agentId, onSave, onCancel, onDelete, onAgent
 	const [isLoadingLog, setIsLoadingLog] = useState(false);
 	const [progress, setProgress] = useState(0);
 	const [pollingIntervalId, setPollingIntervalId] = useState(null);
+	const [queuePosition, setQueuePosition] = useState(null);
+	const [eta, setEta] = useState(null);
+	const progressSource = useRef(null);
 	const [hairStyleOptions, setHairStyleOptions] = useState(GENDER_SPECIFIC_OPTIONS[""].hairStyles);
 	const [bodyTypeOptions, setBodyTypeOptions] = useState(GENDER_SPECIFIC_OPTIONS[""].bodyTypes);
 	const [clothingOptions, setClothingOptions] = useState(GENDER_SPECIFIC_OPTIONS[""].clothings);
@@ -241,9 +244,10 @@ export default function AgentForm({ agentId, onSave, onCancel, onDelete, onAgent
 		}
 	};
 
-	const pollGenerationStatus = async () => {
+	const pollGenerationStatus = async (jobId) => {
 		try {
-			const response = await fetchWithAuth(`/api/v1/agents/${agentId}/generation-log`);
+			const query = jobId ? `?job_id=${jobId}` : "";
+			const response = await fetchWithAuth(`/api/v1/agents/${agentId}/generation-log${query}`);
 
 			if (!response.ok) {
 				console.error("Failed to fetch generation log");
@@ -286,6 +290,46 @@ export default function AgentForm({ agentId, onSave, onCancel, onDelete, onAgent
 		}
 	};
 
+	useEffect(() => {
+		return () => progressSource.current?.close();
+	}, []);
+
+	const startPolling = (jobId) => {
+		const intervalId = setInterval(() => pollGenerationStatus(jobId), 2000);
+		setPollingIntervalId(intervalId);
+	};
+
+	// Progress is pushed over SSE; polling is only used if the stream cannot be opened.
+	const watchGenerationProgress = (jobId) => {
+		if (!jobId || !token || typeof EventSource === "undefined") {
+			startPolling(jobId);
+			return;
+		}
+		const baseUrl = process.env.NEXT_PUBLIC_API_URL || "";
+		const source = new EventSource(`${baseUrl}/api/v1/agents/${agentId}/image-jobs/${jobId}/events?token=${token}`);
+		progressSource.current = source;
+
+		source.addEventListener("image_progress", (event) => {
+			const data = JSON.parse(event.data);
+			setQueuePosition(data.status === "queued" ? data.queue_position : null);
+			setEta(data.status === "running" ? data.eta : null);
+			if (data.progress) {
+				setProgress(parseFloat(data.progress));
+			}
+			if (data.status !== "queued" && data.status !== "running") {
+				source.close();
+				progressSource.current = null;
+				// Fetch the final log once to pick up the image, seed or error.
+				pollGenerationStatus(jobId);
+			}
+		});
+		source.onerror = () => {
+			source.close();
+			progressSource.current = null;
+			startPolling(jobId);
+		};
+	};
+
 	const handleGenerateImage = async () => {
 		if (!isEditMode) {
 			setError("エージェントを保存してから画像を生成してください。");
@@ -295,6 +339,8 @@ export default function AgentForm({ agentId, onSave, onCancel, onDelete, onAgent
 		setIsGeneratingImage(true);
 		setError(null);
 		setProgress(0);
+		setQueuePosition(null);
+		setEta(null);
 		setGenerationLog(null);
 
 		try {
@@ -308,8 +354,8 @@ export default function AgentForm({ agentId, onSave, onCancel, onDelete, onAgent
 				throw new Error(errorData.detail || "画像生成の開始に失敗しました");
 			}
 
-			const intervalId = setInterval(pollGenerationStatus, 2000);
-			setPollingIntervalId(intervalId);
+			const { job_id: jobId } = await response.json();
+			watchGenerationProgress(jobId);
 
 		} catch (err) {
 			setError(err.message);
@@ -393,7 +439,7 @@ export default function AgentForm({ agentId, onSave, onCancel, onDelete, onAgent
 			case 'basic':
 				return <BasicInfoTab {...{ name, setName, description, setDescription, relationshipStatus, setRelationshipStatus, relationshipOptions, firstPerson, setFirstPerson, firstPersonOther, setFirstPersonOther, firstPersonOptions, background, setBackground, imageUrl, openModal }} />;
 			case 'appearance':
-				return <AppearanceTab {...{ gender, setGender, age, setAge, ethnicity, setEthnicity, bodyType, setBodyType, bodyTypeOptions, hairStyle, setHairStyle, hairStyleOptions, hairColor, setHairColor, eyeColor, setEyeColor, clothing, setClothing, clothingOptions, isEditMode, handleGenerateImage, isGeneratingImage, isDeletingImage, progress, imageUrl, handleDeleteImage, imageSeed, setImageSeed, openModal, generationLog }} />;
+				return <AppearanceTab {...{ gender, setGender, age, setAge, ethnicity, setEthnicity, bodyType, setBodyType, bodyTypeOptions, hairStyle, setHairStyle, hairStyleOptions, hairColor, setHairColor, eyeColor, setEyeColor, clothing, setClothing, clothingOptions, isEditMode, handleGenerateImage, isGeneratingImage, isDeletingImage, progress, queuePosition, eta, imageUrl, handleDeleteImage, imageSeed, setImageSeed, openModal, generationLog }} />;
 			case 'personality':
 				return <PersonalityTab {...{ personalities, selectedPersonalities, handleTagChange, setSelectedPersonalities, roles, selectedRoles, setSelectedRoles, tones, selectedTones, setSelectedTones }} />;
 			default:
@@ -98,6 +98,8 @@ const AppearanceTab = ({
   isGeneratingImage,
   isDeletingImage,
   progress,
+  queuePosition,
+  eta,
   imageUrl,
   handleDeleteImage,
   imageSeed,
@@ -162,7 +164,10 @@ const AppearanceTab = ({
             {isGeneratingImage && (
               <div className="mt-4 w-full bg-gray-600 rounded-full h-2.5">
                 <div className="bg-blue-600 h-2.5 rounded-full" style={{ width: `${progress}%` }}></div>
-                <p className="text-sm text-white text-center mt-1">{progress.toFixed(1)}%</p>
+                <p className="text-sm text-white text-center mt-1">
+                  {queuePosition ? `順番待ち（${queuePosition}番目）` : `${progress.toFixed(1)}%`}
+                  {!queuePosition && eta != null && `（残り約${Math.ceil(eta)}秒）`}
+                </p>
               </div>
             )}
             {imageUrl && (
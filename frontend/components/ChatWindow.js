@@ -1,5 +1,18 @@
 import { useEffect, useState, useCallback, useRef } from "react";
 import { useAuth } from "../contexts/AuthContext";
+import { imageSrcSet, placeholderStyle } from "../utils";
+
+// Label for an image that is still being generated, from the latest image_progress event.
+const imageProgressLabel = (imageProgress) => {
+	if (imageProgress?.status === "queued" && imageProgress.queue_position) {
+		return `画像の生成を待っています（${imageProgress.queue_position}番目）...`;
+	}
+	if (imageProgress?.status === "running" && imageProgress.progress > 0) {
+		const eta = imageProgress.eta != null ? `（残り約${Math.ceil(imageProgress.eta)}秒）` : "";
+		return `画像を生成しています... ${Math.round(imageProgress.progress)}%${eta}`;
+	}
+	return "画像を生成しています...";
+};
 
 const ChatWindow = ({ chat, agent, onChatCreated, initialMessage }) => {
 	const { fetchWithAuth, token } = useAuth();
@@ -61,6 +74,37 @@ const ChatWindow = ({ chat, agent, onChatCreated, initialMessage }) => {
 		}
 	}, [chat, initialMessage, fetchMessages]);
 
+	// Poll messages whose image is still being generated, in case the message_updated frame was missed.
+	useEffect(() => {
+		const pendingIds = messages
+			.filter((msg) => msg.image_status === "pending" && typeof msg.id === "number")
+			.map((msg) => msg.id);
+		if (!currentChat?.id || pendingIds.length === 0) return;
+
+		const timer = setInterval(async () => {
+			const baseUrl = process.env.NEXT_PUBLIC_API_URL || "";
+			for (const messageId of pendingIds) {
+				try {
+					const response = await fetchWithAuth(`${baseUrl}/api/v1/chats/${currentChat.id}/messages/${messageId}`);
+					if (!response.ok) continue;
+					const updated = await response.json();
+					if (updated.image_status !== "pending") {
+						setMessages((prevMessages) =>
+							prevMessages.map((msg) =>
+								msg.id === updated.id
+									? { ...msg, image_url: updated.image_url, image_status: updated.image_status }
+									: msg
+							)
+						);
+					}
+				} catch (error) {
+					console.error("Failed to poll message image:", error);
+				}
+			}
+		}, 5000);
+		return () => clearInterval(timer);
+	}, [messages, currentChat?.id, fetchWithAuth]);
+
 	const connectWebSocket = useCallback((chatId, authToken) => {
 		if (!chatId || !authToken) {
 			return;
@@ -132,7 +176,50 @@ const ChatWindow = ({ chat, agent, onChatCreated, initialMessage }) => {
 				const data = JSON.parse(event.data);
 				console.log("Received WebSocket message:", data);
 
-				if (data.type === "status") {
+				if (data.type === "delta") {
+					// Append streamed tokens to a temporary message until the final message arrives.
+					const streamId = `stream_${data.reply_to}`;
+					setStatusMessage(null);
+					setMessages((prevMessages) => {
+						const index = prevMessages.findIndex((msg) => msg.id === streamId);
+						if (index === -1) {
+							return [...prevMessages, { id: streamId, content: data.content, sender: "ai", streaming: true }];
+						}
+						const updated = [...prevMessages];
+						updated[index] = { ...updated[index], content: updated[index].content + data.content };
+						return updated;
+					});
+				} else if (data.type === "message_updated") {
+					// The image generated after the reply was sent is attached to the saved message.
+					setMessages((prevMessages) =>
+						prevMessages.map((msg) =>
+							msg.id === data.id
+								? { ...msg, image_url: data.image_url || msg.image_url, image_status: data.image_status }
+								: msg
+						)
+					);
+				} else if (data.type === "image_cancel") {
+					// The message itself is updated by the following message_updated event.
+					if (data.cancelled === 0) {
+						console.log("No image generation to cancel:", data.message_id);
+					}
+				} else if (data.type === "image_progress") {
+					// Progress of the image for the reply to message `reply_to`.
+					if (data.status !== "queued" && data.status !== "running") return;
+					setMessages((prevMessages) => {
+						const index = prevMessages.findIndex(
+							(msg) =>
+								msg.sender === "ai" &&
+								msg.image_status === "pending" &&
+								typeof msg.id === "number" &&
+								msg.id > data.reply_to
+						);
+						if (index === -1) return prevMessages;
+						const updated = [...prevMessages];
+						updated[index] = { ...updated[index], image_progress: data };
+						return updated;
+					});
+				} else if (data.type === "status") {
 					if (data.status === "image_generation_r18_score" && data.r18_score !== undefined) {
 						setR18Score(data.r18_score);
 						setStatusMessage(`R18スコアを計算しました: ${data.r18_score}`);
@@ -143,14 +230,19 @@ const ChatWindow = ({ chat, agent, onChatCreated, initialMessage }) => {
 					setError(data.content || "エラーが発生しました。");
 					setStatusMessage(null);
 					setR18Score(null);
+					setMessages((prevMessages) => prevMessages.filter((msg) => !msg.streaming));
 				} else {
 					setStatusMessage(null);
 					setError(null);
 					setR18Score(null);
 					setMessages((prevMessages) => {
-						const exists = prevMessages.some((msg) => msg.id === data.id);
-						if (exists) return prevMessages;
-						return [...prevMessages, data];
+						// The final message replaces the streamed placeholder.
+						const withoutStream = data.reply_to
+							? prevMessages.filter((msg) => msg.id !== `stream_${data.reply_to}`)
+							: prevMessages;
+						const exists = withoutStream.some((msg) => msg.id === data.id);
+						if (exists) return withoutStream;
+						return [...withoutStream, data];
 					});
 				}
 			} catch (error) {
@@ -226,6 +318,13 @@ const ChatWindow = ({ chat, agent, onChatCreated, initialMessage }) => {
 		}
 	};
 
+	const handleCancelImage = (messageId) => {
+		// Stop the image generation for the reply (the backend also interrupts the WebUI).
+		if (ws.current?.readyState === WebSocket.OPEN) {
+			ws.current.send(JSON.stringify({ type: "cancel_image", message_id: messageId }));
+		}
+	};
+
 	const handleKeyDown = (e) => {
 		if (e.key === "Enter" && !e.shiftKey) {
 			e.preventDefault();
@@ -279,6 +378,10 @@ const ChatWindow = ({ chat, agent, onChatCreated, initialMessage }) => {
 								<div className="mt-2">
 									<img
 										src={msg.image_url}
+										srcSet={imageSrcSet(msg.variants)}
+										sizes="384px"
+										loading="lazy"
+										style={placeholderStyle(msg.variants)}
 										alt="Generated image"
 										className="max-w-sm rounded-lg shadow-lg cursor-pointer hover:opacity-90 transition-opacity"
 										onClick={() => window.open(msg.image_url, "_blank")}
@@ -289,6 +392,30 @@ const ChatWindow = ({ chat, agent, onChatCreated, initialMessage }) => {
 									/>
 								</div>
 							)}
+							{msg.image_status === "pending" && msg.sender === "ai" && (
+								<div className="mt-2 flex items-center gap-2 text-sm">
+									<span className="text-gray-400 italic animate-pulse">
+										{imageProgressLabel(msg.image_progress)}
+									</span>
+									<button
+										type="button"
+										onClick={() => handleCancelImage(msg.id)}
+										className="text-xs text-gray-400 underline hover:text-gray-200"
+									>
+										キャンセル
+									</button>
+								</div>
+							)}
+							{msg.image_status === "cancelled" && msg.sender === "ai" && (
+								<div className="mt-2 text-sm text-gray-500">
+									画像の生成をキャンセルしました。
+								</div>
+							)}
+							{msg.image_status === "failed" && msg.sender === "ai" && (
+								<div className="mt-2 text-sm text-gray-500">
+									画像を生成できませんでした。
+								</div>
+							)}
 							{msg.timestamp && (
 								<div className="text-xs text-gray-500 mt-1">
 									{new Date(msg.timestamp).toLocaleTimeString('ja-JP')}
@@ -1,6 +1,6 @@
 import { useState, useEffect } from "react";
 import { useAuth } from "../contexts/AuthContext";
-import { normalizeImageUrl } from "../utils";
+import { imageSrcSet, normalizeImageUrl, placeholderStyle } from "../utils";
 
 const PhotoGalleryModal = ({ agent, isOpen, onClose }) => {
 	const { fetchWithAuth } = useAuth();
@@ -129,6 +129,8 @@ const PhotoGalleryModal = ({ agent, isOpen, onClose }) => {
 										<div className="relative bg-gray-900 rounded-lg overflow-hidden">
 											<img
 												src={normalizeImageUrl(selectedImage.image_url)}
+												srcSet={imageSrcSet(selectedImage.variants)}
+												sizes="(min-width: 768px) 50vw, 100vw"
 												alt={agent.name}
 												className="w-full h-96 object-contain"
 											/>
@@ -171,6 +173,10 @@ const PhotoGalleryModal = ({ agent, isOpen, onClose }) => {
 										>
 											<img
 												src={normalizeImageUrl(image.image_url)}
+												srcSet={imageSrcSet(image.variants)}
+												sizes="160px"
+												loading="lazy"
+												style={placeholderStyle(image.variants)}
 												alt=""
 												className="w-full h-24 object-cover hover:opacity-80 transition-opacity"
 											/>
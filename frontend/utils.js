@@ -16,4 +16,32 @@ export const normalizeImageUrl = (url) => {
     return url;
   }
   return `${API_BASE_URL}${url}`;
-};
\ No newline at end of file
+};
+
+/**
+ * 画像の縮小版（variants.srcset の {幅: URL}）から img の srcSet 属性の値を作ります。
+ * - 縮小版がまだない場合は undefined を返し、元の画像だけを使います。
+ * @param {{ srcset?: Object<string, string> } | null | undefined} variants - 画像の縮小版
+ * @returns {string | undefined} srcSet 属性の値
+ */
+export const imageSrcSet = (variants) => {
+  const srcset = variants?.srcset;
+  if (!srcset || Object.keys(srcset).length === 0) {
+    return undefined;
+  }
+  return Object.entries(srcset)
+    .map(([width, url]) => `${normalizeImageUrl(url)} ${width}w`)
+    .join(', ');
+};
+
+/**
+ * 読み込み中に表示するぼかしプレースホルダーのスタイルを返します。
+ * @param {{ placeholder?: string } | null | undefined} variants - 画像の縮小版
+ * @returns {Object | undefined} img の style に渡す値
+ */
+export const placeholderStyle = (variants) => {
+  if (!variants?.placeholder) {
+    return undefined;
+  }
+  return { backgroundImage: `url(${variants.placeholder})`, backgroundSize: 'cover' };
+};